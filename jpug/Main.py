@@ -1,22 +1,738 @@
+import os
 import sys
-from view import UI
+import time
+
+import numpy as np
 
 import controller.Util as Util
 import controller.Controller as Controller
+from model.serialization.Entropy_Coder import Entropy_Coder
+from model.serialization.Chunk_Coder import Chunk_Coder
+from model.serialization.Jpug_YCbCr import Jpug_YCbCr
+from model.encoder.Encoder import Encoder
+from model.Parser import Parser
+from model.Profiler import Profiler
+
+def calibrate(args:list[str]) -> None:
+    '''
+    Calibrate the DCT backends for the parameters in args, each one a block size F or F:d (default Util.DEFAULT_F, and d
+    Util.DEFAULT_D), and persist the results.
+    '''
+    try:
+        params_list = [tuple(int(value) for value in arg.split(':')) for arg in args] if len(args) > 0 else [(Util.DEFAULT_F,)]
+        params_list = [params if len(params) == 2 else (params[0], min(Util.DEFAULT_D, 2 * params[0] - 1)) for params in params_list]
+    except ValueError:
+        print(f'Invalid parameters: {args}')
+        return
+
+    if any(len(params) != 2 or params[0] <= 0 or not 0 <= params[1] <= 2 * params[0] - 1 for params in params_list):
+        print(f'Invalid parameters: {args}')
+        return
+
+    for F, d in params_list:
+        for n_blocks in Util.CALIBRATION_BLOCKS:
+            fastest = Encoder.calibrate_dct_backends(F, d, Util.DEFAULT_FLOAT_DTYPE, n_blocks)
+            print(f'F={F}, d={d}, blocks={n_blocks}: {fastest}')
+
+    print(f'Calibration saved at \'{Encoder.DCT_CALIBRATION.get_file()}\'')
+
+def parse_settings(options:dict) -> dict:
+    '''
+    Parse the options shared by the single file and the batch mode into the settings of the controller.
+
+    @return: The settings (see Controller.configure), or None if an option is not valid.
+    '''
+    settings = {}
+
+    if Util.WORKERS_OPTION in options:
+        workers = options[Util.WORKERS_OPTION]
+        try:
+            workers = (os.cpu_count() or 1) if workers is None else int(workers)
+        except ValueError:
+            print(f'Invalid number of workers: {workers}')
+            return None
+        if workers <= 0:
+            print(f'Invalid number of workers: {workers}')
+            return None
+        settings['workers'] = workers
+
+    if Util.DCT_OPTION in options:
+        dct_backend = options[Util.DCT_OPTION]
+        if dct_backend != Encoder.AUTO_DCT_BACKEND and dct_backend not in Encoder.DCT_BACKENDS:
+            print(f'Invalid DCT backend: {dct_backend}')
+            return None
+        settings['dct_backend'] = dct_backend
+
+    if Util.STREAM_OPTION in options:
+        for option in [Util.ENTROPY_OPTION, Util.CODEC_OPTION]:
+            if option in options:
+                print(f'The option {Util.STREAM_OPTION} cannot be used with {option}')
+                return None
+
+        memory_budget = options[Util.STREAM_OPTION]
+        try:
+            memory_budget = Util.DEFAULT_STREAM_MEMORY_BUDGET_MB if memory_budget is None else int(memory_budget)
+        except ValueError:
+            print(f'Invalid memory budget: {memory_budget}')
+            return None
+        if memory_budget <= 0:
+            print(f'Invalid memory budget: {memory_budget}')
+            return None
+        settings['memory_budget'] = memory_budget * 2 ** 20
+
+    if Util.SCALE_OPTION in options:
+        if Util.STREAM_OPTION in options:
+            print(f'The option {Util.STREAM_OPTION} cannot be used with {Util.SCALE_OPTION}')
+            return None
+
+        scale = options[Util.SCALE_OPTION]
+        try:
+            scale = int(scale)
+        except (TypeError, ValueError):
+            print(f'Invalid scale: {scale}')
+            return None
+        if scale <= 0:
+            print(f'Invalid scale: {scale}')
+            return None
+        settings['scale'] = scale
+
+    if Util.REGION_OPTION in options:
+        for option in [Util.STREAM_OPTION, Util.SCALE_OPTION]:
+            if option in options:
+                print(f'The option {option} cannot be used with {Util.REGION_OPTION}')
+                return None
+
+        region = options[Util.REGION_OPTION]
+        try:
+            region = tuple(int(value) for value in region.split(','))
+        except (AttributeError, ValueError):
+            print(f'Invalid region: {region}')
+            return None
+        if len(region) != 4 or region[0] < 0 or region[1] < 0 or region[2] <= 0 or region[3] <= 0:
+            print(f'Invalid region: {options[Util.REGION_OPTION]}')
+            return None
+        settings['region'] = region
+
+    return settings
+
+def parse_codec(value:str) -> tuple:
+    '''
+    Parse a codec of the chunk coder, name[:level] (see Chunk_Coder.CODECS), raising an error if it is not valid.
+
+    @return: A tuple (name, level), with the default level of the codec if it is not given.
+    '''
+    name, _, level = (value or Chunk_Coder.DEFAULT_CODEC).partition(':')
+    if name not in Chunk_Coder.CODECS:
+        raise ValueError(f'Invalid codec: {name}')
+
+    _, default_level, levels = Chunk_Coder.CODECS[name]
+    level = default_level if level == '' else int(level)
+    if level not in levels:
+        raise ValueError(f'Invalid level of {name}: {level}')
+
+    return (name, level)
+
+def parse_dtype(value:str) -> type:
+    '''
+    Parse a dtype of the coefficients, a floating point type or one of Encoder.FIXED_DTYPES, raising an error if it is not valid.
+
+    @return: The numpy type.
+    '''
+    try:
+        dtype = np.dtype(value or '').type
+    except TypeError:
+        raise ValueError(f'Invalid dtype: {value}')
+
+    if not (np.issubdtype(dtype, np.floating) or dtype in Encoder.FIXED_DTYPES):
+        raise ValueError(f'Invalid dtype: {value}')
+
+    return dtype
+
+def parse_encode_settings(args:list[str], options:dict, settings:dict) -> dict:
+    '''
+    Parse the parameters of the encoding ([F d] [mode]) and the entropy, codec and dtype options, adding them to the settings.
+
+    @return: The settings, or None if a parameter is not valid.
+    '''
+    F = Util.DEFAULT_F
+    d = Util.DEFAULT_D
+    mode = Util.DEFAULT_MODE
+
+    if len(args) == 1:
+        mode = Util.get_enum_from_value(args[0].upper(), Util.Mode)
+        if mode is None:
+            print(f"Invalid mode: {args[0]}")
+            return None
+        
+    elif len(args) > 1:
+        try:
+            F = int(args[0])
+        except ValueError:
+            print(f"Invalid parameter F: {args[0]}")
+            return None
+        if F <= 0:
+            print(f"Invalid parameter F: {F}")
+            return None
+        try:
+            d = int(args[1])
+        except ValueError:
+            print(f"Invalid parameter d: {args[1]}")
+            return None
+        if d <= 0 or d > 2 * F - 1:
+            print(f"Invalid parameter d: {d}")
+            return None
+        if len(args) > 2:
+            mode = Util.get_enum_from_value(args[2].upper(), Util.Mode)
+            if mode is None:
+                print(f"Invalid mode: {args[2]}")
+                return None
+
+    settings['mode'] = mode
+    settings['params'] = (F, d)
+
+    if mode == Util.Mode.YCBCR:
+        if Util.STREAM_OPTION in options:
+            print(f'The option {Util.STREAM_OPTION} cannot be used with the mode {mode.value}')
+            return None
+
+        chroma_d = options.get(Util.CHROMA_D_OPTION)
+        try:
+            chroma_d = min(Util.DEFAULT_CHROMA_D, 2 * F - 1) if chroma_d is None else int(chroma_d)
+        except ValueError:
+            print(f'Invalid parameter chroma d: {chroma_d}')
+            return None
+        if chroma_d <= 0 or chroma_d > 2 * F - 1:
+            print(f'Invalid parameter chroma d: {chroma_d}')
+            return None
+
+        subsampling = options.get(Util.SUBSAMPLING_OPTION) or Util.DEFAULT_SUBSAMPLING
+        if subsampling not in Jpug_YCbCr.SUBSAMPLINGS:
+            print(f'Invalid subsampling: {subsampling}')
+            return None
+
+        settings['chroma_params'] = (chroma_d, subsampling)
+
+    elif Util.CHROMA_D_OPTION in options or Util.SUBSAMPLING_OPTION in options:
+        print(f'The options {Util.CHROMA_D_OPTION} and {Util.SUBSAMPLING_OPTION} can only be used with the mode {Util.Mode.YCBCR.value}')
+        return None
+
+    if Util.ADAPTIVE_OPTION in options:
+        for option in [Util.STREAM_OPTION, Util.ENTROPY_OPTION, Util.CODEC_OPTION]:
+            if option in options:
+                print(f'The option {option} cannot be used with {Util.ADAPTIVE_OPTION}')
+                return None
+        if mode == Util.Mode.YCBCR:
+            print(f'The option {Util.ADAPTIVE_OPTION} cannot be used with the mode {mode.value}')
+            return None
+
+        max_mse = options[Util.ADAPTIVE_OPTION]
+        try:
+            max_mse = Util.DEFAULT_ADAPTIVE_MSE if max_mse is None else float(max_mse)
+        except ValueError:
+            print(f'Invalid maximum error: {max_mse}')
+            return None
+        if not max_mse >= 0:
+            print(f'Invalid maximum error: {max_mse}')
+            return None
+        settings['max_mse'] = max_mse
+
+    if Util.TARGET_PSNR_OPTION in options or Util.TARGET_SIZE_OPTION in options:
+        if Util.TARGET_PSNR_OPTION in options and Util.TARGET_SIZE_OPTION in options:
+            print(f'The option {Util.TARGET_PSNR_OPTION} cannot be used with {Util.TARGET_SIZE_OPTION}')
+            return None
+        if len(args) > 1:
+            print(f'The parameters F and d cannot be given with {Util.TARGET_PSNR_OPTION} or {Util.TARGET_SIZE_OPTION}')
+            return None
+        if Util.STREAM_OPTION in options:
+            print(f'The option {Util.STREAM_OPTION} cannot be used with {Util.TARGET_PSNR_OPTION} or {Util.TARGET_SIZE_OPTION}')
+            return None
+        if mode == Util.Mode.YCBCR:
+            print(f'The options {Util.TARGET_PSNR_OPTION} and {Util.TARGET_SIZE_OPTION} cannot be used with the mode {mode.value}')
+            return None
+
+        if Util.TARGET_PSNR_OPTION in options:
+            target_psnr = options[Util.TARGET_PSNR_OPTION]
+            try:
+                target_psnr = float(target_psnr)
+            except (TypeError, ValueError):
+                print(f'Invalid target PSNR: {target_psnr}')
+                return None
+            if not target_psnr > 0:
+                print(f'Invalid target PSNR: {target_psnr}')
+                return None
+            settings['target_psnr'] = target_psnr
+        else:
+            target_bytes = options[Util.TARGET_SIZE_OPTION]
+            try:
+                target_bytes = int(target_bytes)
+            except (TypeError, ValueError):
+                print(f'Invalid target size: {target_bytes}')
+                return None
+            if target_bytes <= 0:
+                print(f'Invalid target size: {target_bytes}')
+                return None
+            settings['target_bytes'] = target_bytes
+
+    if Util.ENTROPY_OPTION in options:
+        quality = options[Util.ENTROPY_OPTION]
+        try:
+            quality = Entropy_Coder.DEFAULT_QUALITY if quality is None else int(quality)
+        except ValueError:
+            print(f'Invalid quality: {quality}')
+            return None
+        if quality < 1 or quality > 100:
+            print(f'Invalid quality: {quality}')
+            return None
+
+        settings['quality'] = quality
+
+    if Util.CODEC_OPTION in options:
+        if Util.ENTROPY_OPTION in options:
+            print(f'The option {Util.CODEC_OPTION} cannot be used with {Util.ENTROPY_OPTION}')
+            return None
+
+        try:
+            settings['codec'] = parse_codec(options[Util.CODEC_OPTION])
+        except ValueError as e:
+            print(e)
+            return None
+
+    if Util.DTYPE_OPTION in options:
+        # The fixed point planes are saved as they are, with the scales of their frequencies
+        for option in [Util.STREAM_OPTION, Util.ENTROPY_OPTION, Util.CODEC_OPTION, Util.ADAPTIVE_OPTION]:
+            if option in options:
+                print(f'The option {option} cannot be used with {Util.DTYPE_OPTION}')
+                return None
+
+        try:
+            settings['float_dtype'] = parse_dtype(options[Util.DTYPE_OPTION])
+        except ValueError as e:
+            print(e)
+            return None
+
+    return settings
+
+def batch(args:list[str], options:dict, settings:dict) -> None:
+    '''
+    Encode (--batch or --batch=encode) or decode (--batch=decode) all the files matching the directories or glob patterns
+    in args on a pool of --jobs processes, followed by the parameters of the encoding.
+    '''
+    from controller.Batch_Controller import Batch_Controller
+
+    operation = options[Util.BATCH_OPTION] or Util.Operation.ENCODE.name.lower()
+    if operation not in [Util.Operation.ENCODE.name.lower(), Util.Operation.DECODE.name.lower()]:
+        print(f'Invalid batch operation: {operation}')
+        return
+    operation = Util.Operation[operation.upper()]
+
+    jobs = options.get(Util.JOBS_OPTION)
+    try:
+        jobs = None if jobs is None else int(jobs)
+    except ValueError:
+        print(f'Invalid number of jobs: {jobs}')
+        return
+    if jobs is not None and jobs <= 0:
+        print(f'Invalid number of jobs: {jobs}')
+        return
+
+    # The sources are the arguments before the parameters of the encoding
+    try:
+        sources, args = Batch_Controller.split_sources(args)
+    except ValueError as e:
+        print(e)
+        return
+
+    if operation == Util.Operation.ENCODE:
+        settings = parse_encode_settings(args, options, settings)
+        if settings is None:
+            return
+    elif len(args) > 0:
+        print(f'Invalid source: {args[0]}')
+        return
+
+    extension = Util.IMAGE_EXTENSION if operation == Util.Operation.ENCODE else Util.JPUG_EXTENSION
+    paths = Batch_Controller.collect_files(sources, extension)
+
+    batch_controller = Batch_Controller(settings, jobs)
+    results = []
+    start = time.perf_counter()
+
+    for result in batch_controller.run(operation, paths):
+        results.append(result)
+        if result['error'] is None:
+            print(Util.BATCH_RESULT_MSG.format(len(results), len(paths), result['path'], result['output'], result['seconds']))
+        else:
+            print(Util.BATCH_FAILURE_MSG.format(result['path'], result['error']))
+
+    print(Batch_Controller.compute_summary(results, time.perf_counter() - start))
+
+def serve(args:list[str], options:dict, settings:dict) -> None:
+    '''
+    Run the encode/decode service (--serve[=address], --max-pending) until it is interrupted, with the parameters of the encoding
+    in args used by the requests without their own.
+    '''
+    from controller.Service_Controller import Service_Controller
+
+    address = options[Util.SERVE_OPTION] or Util.DEFAULT_SERVICE_ADDRESS
+
+    max_pending = options.get(Util.MAX_PENDING_OPTION)
+    try:
+        max_pending = Service_Controller.DEFAULT_MAX_PENDING if max_pending is None else int(max_pending)
+    except ValueError:
+        print(f'Invalid number of pending requests: {max_pending}')
+        return
+    if max_pending <= 0:
+        print(f'Invalid number of pending requests: {max_pending}')
+        return
+
+    settings = parse_encode_settings(args, options, settings)
+    if settings is None:
+        return
+
+    service_controller = Service_Controller(settings, max_pending)
+    service_controller.run(address, lambda address: print(Util.SERVICE_MSG.format(address, max_pending, Service_Controller.DEFAULT_MAX_BATCH,
+                                                                                   Service_Controller.DEFAULT_BATCH_WINDOW * 1000), flush=True))
+
+def sequence(args:list[str], options:dict, settings:dict) -> None:
+    '''
+    Encode the frames found in the sources in args (directories, glob patterns or files, sorted by name) in a sequence file
+    (--sequence[=keyframe interval], --skip-mse, --output), followed by the parameters of the encoding,
+    or decode the frames of a sequence file (path.jpugs [--frames=start[:end]]).
+    '''
+    from controller.Batch_Controller import Batch_Controller
+
+    if len(args) > 0 and args[0].endswith(Util.SEQUENCE_EXTENSION):
+        if len(args) > 1:
+            print(Util.INVALID_ARGS_MSG)
+            return
+
+        # --frames=i decodes the frame i, --frames=start:end the frames [start, end) and --frames=start: the frames from start
+        frames = options.get(Util.FRAMES_OPTION)
+        start, end = 0, None
+        if frames is not None:
+            try:
+                start, separator, end = frames.partition(':')
+                start = int(start)
+                end = start + 1 if separator == '' else (int(end) if end != '' else None)
+            except ValueError:
+                print(f'Invalid frames: {frames}')
+                return
+            if start < 0 or (end is not None and end <= start):
+                print(f'Invalid frames: {frames}')
+                return
+
+        controller = Controller.Controller()
+        controller.configure(settings)
+
+        try:
+            paths = controller.decode_sequence(args[0], start, end)
+        except FileNotFoundError:
+            print(Util.FILE_NOT_FOUND_MSG.format(args[0]))
+            return
+        except ValueError as e:
+            print(e)
+            return
+
+        if len(paths) == 0:
+            print(f'No frames decoded from \'{args[0]}\'')
+        else:
+            print(Util.SEQUENCE_DECODE_MSG.format(len(paths), args[0], paths[0], paths[-1]))
+        return
+
+    keyframe_interval = options.get(Util.SEQUENCE_OPTION)
+    try:
+        keyframe_interval = Util.DEFAULT_KEYFRAME_INTERVAL if keyframe_interval is None else int(keyframe_interval)
+    except ValueError:
+        print(f'Invalid keyframe interval: {keyframe_interval}')
+        return
+    if keyframe_interval <= 0:
+        print(f'Invalid keyframe interval: {keyframe_interval}')
+        return
+
+    max_mse = options.get(Util.SKIP_MSE_OPTION)
+    try:
+        max_mse = 0.0 if max_mse is None else float(max_mse)
+    except ValueError:
+        print(f'Invalid maximum error: {max_mse}')
+        return
+    if not max_mse >= 0:
+        print(f'Invalid maximum error: {max_mse}')
+        return
+
+    # The sources are the arguments before the parameters of the encoding
+    try:
+        sources, args = Batch_Controller.split_sources(args)
+    except ValueError as e:
+        print(e)
+        return
+
+    settings = parse_encode_settings(args, options, settings)
+    if settings is None:
+        return
+    if settings['mode'] == Util.Mode.YCBCR:
+        print(f'The option {Util.SEQUENCE_OPTION} cannot be used with the mode {Util.Mode.YCBCR.value}')
+        return
+    settings['sequence'] = (keyframe_interval, max_mse)
+
+    paths = Batch_Controller.collect_files(sources, Util.IMAGE_EXTENSION, by_size=False)
+    if len(paths) == 0:
+        print('No frames found')
+        return
+
+    output = options.get(Util.OUTPUT_OPTION) or Util.compute_sequence_path(sources[0] if os.path.isdir(sources[0]) else paths[0])
+
+    controller = Controller.Controller()
+    controller.configure(settings)
+
+    try:
+        stats = controller.encode_sequence(paths, output)
+    except FileNotFoundError as e:
+        print(Util.FILE_NOT_FOUND_MSG.format(e.filename))
+        return
+    except ValueError as e:
+        print(e)
+        return
+
+    print(Util.SEQUENCE_ENCODE_MSG.format(stats['frames'], output, stats['keyframes'], stats['stored_blocks'], stats['blocks'],
+                                          stats['stored_blocks'] / stats['blocks'], stats['bytes']))
+
+def parse_list(options:dict, option:str, parse, default:list) -> list:
+    '''
+    Parse an option with a comma separated list of values.
+
+    @return: The parsed values, default if the option is not given, or None if a value is not valid.
+    '''
+    if option not in options:
+        return default
+
+    try:
+        values = [parse(value) for value in (options[option] or '').split(',')]
+    except (KeyError, TypeError, ValueError, AssertionError):
+        values = []
+
+    if len(values) == 0:
+        print(f'Invalid values of {option}: {options[option]}')
+        return None
+
+    return values
+
+def benchmark(args:list[str], options:dict, settings:dict) -> None:
+    '''
+    Run the benchmark (--benchmark) over the grid of the options and the images in args and save the JSON report,
+    or compare two reports (--benchmark=compare baseline.json current.json), exiting with 1 on regressions.
+    '''
+    from controller.Benchmark_Controller import Benchmark_Controller
+
+    operation = options[Util.BENCHMARK_OPTION] or 'run'
+
+    if operation == 'compare':
+        if len(args) != 2:
+            print(Util.INVALID_ARGS_MSG)
+            return
+
+        threshold = options.get(Util.THRESHOLD_OPTION)
+        try:
+            threshold = Benchmark_Controller.DEFAULT_THRESHOLD if threshold is None else float(threshold) / 100
+        except ValueError:
+            print(f'Invalid threshold: {threshold}')
+            return
+        if threshold < 0:
+            print(f'Invalid threshold: {options[Util.THRESHOLD_OPTION]}')
+            return
+
+        try:
+            baseline, current = (Benchmark_Controller.load_report(path) for path in args)
+        except FileNotFoundError as e:
+            print(Util.FILE_NOT_FOUND_MSG.format(e.filename))
+            return
+        except ValueError as e:
+            print(e)
+            return
+
+        comparisons, regressions = Benchmark_Controller.compare(baseline, current, threshold)
+        for regression in regressions:
+            print(Util.BENCHMARK_REGRESSION_MSG.format(regression['case'], regression['metric'], regression['baseline'], regression['current'], regression['change']))
+        print(Util.BENCHMARK_COMPARE_MSG.format(len(comparisons), len({comparison['case'] for comparison in comparisons}), len(regressions), threshold))
+
+        if len(regressions) > 0:
+            sys.exit(1)
+        return
+
+    if operation != 'run':
+        print(f'Invalid benchmark operation: {operation}')
+        return
+
+    for path in args:
+        if not os.path.isfile(path):
+            print(Util.FILE_NOT_FOUND_MSG.format(path))
+            return
+
+    def parse_size(value:str) -> tuple[int]:
+        width, height = (int(n) for n in value.lower().split('x'))
+        assert width > 0 and height > 0
+        return (width, height)
+
+    def parse_params(value:str) -> tuple[int]:
+        F, d = (int(n) for n in value.split(':'))
+        assert F > 0 and 0 < d <= 2 * F - 1
+        return (F, d)
+
+    sizes = parse_list(options, Util.SIZES_OPTION, parse_size, [] if len(args) > 0 else Benchmark_Controller.DEFAULT_SIZES)
+    params = parse_list(options, Util.PARAMS_OPTION, parse_params, Benchmark_Controller.DEFAULT_PARAMS)
+    dtypes = parse_list(options, Util.DTYPES_OPTION, lambda value: np.dtype(parse_dtype(value)).name, Benchmark_Controller.DEFAULT_DTYPES)
+    modes = parse_list(options, Util.MODES_OPTION, lambda value: Util.Mode[value.upper()], Benchmark_Controller.DEFAULT_MODES)
+    if None in (sizes, params, dtypes, modes):
+        return
+
+    repeat = options.get(Util.REPEAT_OPTION)
+    try:
+        repeat = Benchmark_Controller.DEFAULT_REPEAT if repeat is None else int(repeat)
+    except ValueError:
+        print(f'Invalid number of runs: {repeat}')
+        return
+    if repeat <= 0:
+        print(f'Invalid number of runs: {repeat}')
+        return
+
+    if Util.ENTROPY_OPTION in options or Util.CODEC_OPTION in options:
+        settings = parse_encode_settings([], options, settings)
+        if settings is None:
+            return
+
+    if Util.CODECS_OPTION in options:
+        for option in [Util.ENTROPY_OPTION, Util.CODEC_OPTION]:
+            if option in options:
+                print(f'The option {Util.CODECS_OPTION} cannot be used with {option}')
+                return
+
+    # The raw planes are given as 'raw', to compare the codecs with them
+    codecs = parse_list(options, Util.CODECS_OPTION, lambda value: None if value == Parser.RAW_CODEC else parse_codec(value), [settings.get('codec')])
+    if codecs is None:
+        return
+
+    benchmark_controller = Benchmark_Controller(sizes, params, dtypes, modes, args, settings.get('dct_backend', Util.DEFAULT_DCT_BACKEND),
+                                                settings.get('workers', Util.DEFAULT_WORKERS), settings.get('quality'), repeat, codecs=codecs)
+
+    results = []
+    for result in benchmark_controller.run():
+        results.append(result)
+        print(Benchmark_Controller.format_result(result))
+
+    startup = Benchmark_Controller.measure_startup(repeat)
+    print(Benchmark_Controller.format_startup(startup))
+
+    output = options.get(Util.OUTPUT_OPTION) or Util.DEFAULT_BENCHMARK_OUTPUT
+    Benchmark_Controller.save_report(Benchmark_Controller.create_report(results, startup), output)
+    print(Util.BENCHMARK_SAVED_MSG.format(output))
+
+def print_profile(options:dict) -> None:
+    '''
+    Print the stages recorded with --profile, and export them to the file given with --profile=file.
+    '''
+    if Util.PROFILE_OPTION not in options:
+        return
+
+    profiler = Profiler.get_instance()
+    print(Util.format_profile(profiler.get_summary()))
+
+    if options[Util.PROFILE_OPTION] is not None:
+        profiler.export(options[Util.PROFILE_OPTION])
+        print(Util.PROFILE_SAVED_MSG.format(options[Util.PROFILE_OPTION]))
 
 def main():
-    args = sys.argv[1:]
+    args, options = Util.parse_options(sys.argv[1:])
+
+    for option in options:
+        if option not in [Util.ENTROPY_OPTION, Util.CODEC_OPTION, Util.DTYPE_OPTION, Util.DCT_OPTION, Util.CALIBRATE_OPTION, Util.STREAM_OPTION, Util.WORKERS_OPTION,
+                          Util.BATCH_OPTION, Util.JOBS_OPTION, Util.CHROMA_D_OPTION, Util.SUBSAMPLING_OPTION, Util.SCALE_OPTION,
+                          Util.REGION_OPTION, Util.PROFILE_OPTION, Util.TARGET_PSNR_OPTION,
+                          Util.TARGET_SIZE_OPTION, Util.ADAPTIVE_OPTION, Util.BENCHMARK_OPTION, Util.SEQUENCE_OPTION, Util.SKIP_MSE_OPTION,
+                          Util.FRAMES_OPTION, Util.SERVE_OPTION, Util.MAX_PENDING_OPTION] + Util.BENCHMARK_OPTIONS:
+            print(f'Invalid option: {option}')
+            return
+
+    if Util.JOBS_OPTION in options and Util.BATCH_OPTION not in options:
+        print(f'The option {Util.JOBS_OPTION} can only be used with {Util.BATCH_OPTION}')
+        return
+
+    for option in [Util.BATCH_OPTION, Util.BENCHMARK_OPTION, Util.CALIBRATE_OPTION]:
+        if Util.PROFILE_OPTION in options and option in options:
+            print(f'The option {Util.PROFILE_OPTION} cannot be used with {option}')
+            return
+
+    if Util.MAX_PENDING_OPTION in options and Util.SERVE_OPTION not in options:
+        print(f'The option {Util.MAX_PENDING_OPTION} can only be used with {Util.SERVE_OPTION}')
+        return
+
+    if Util.SERVE_OPTION in options:
+        for option in [Util.BATCH_OPTION, Util.BENCHMARK_OPTION, Util.CALIBRATE_OPTION, Util.SEQUENCE_OPTION, Util.TARGET_PSNR_OPTION,
+                       Util.TARGET_SIZE_OPTION]:
+            if option in options:
+                print(f'The option {option} cannot be used with {Util.SERVE_OPTION}')
+                return
+
+    is_sequence = Util.SEQUENCE_OPTION in options or (len(args) > 0 and args[0].endswith(Util.SEQUENCE_EXTENSION))
+
+    for option in Util.BENCHMARK_OPTIONS:
+        if option in options and Util.BENCHMARK_OPTION not in options and not (option == Util.OUTPUT_OPTION and Util.SEQUENCE_OPTION in options):
+            print(f'The option {option} can only be used with {Util.BENCHMARK_OPTION}')
+            return
+
+    for option in [Util.SKIP_MSE_OPTION, Util.FRAMES_OPTION]:
+        if option in options and not is_sequence:
+            print(f'The option {option} can only be used with {Util.SEQUENCE_OPTION} or a {Util.SEQUENCE_EXTENSION} file')
+            return
+
+    if is_sequence:
+        for option in [Util.BATCH_OPTION, Util.BENCHMARK_OPTION, Util.CALIBRATE_OPTION, Util.STREAM_OPTION, Util.ENTROPY_OPTION,
+                       Util.CODEC_OPTION, Util.DTYPE_OPTION, Util.ADAPTIVE_OPTION, Util.TARGET_PSNR_OPTION, Util.TARGET_SIZE_OPTION, Util.SCALE_OPTION,
+                       Util.REGION_OPTION]:
+            if option in options:
+                print(f'The option {option} cannot be used with the sequences')
+                return
+
+    if Util.CALIBRATE_OPTION in options:
+        calibrate(args)
+
+    elif Util.BENCHMARK_OPTION in options:
+        settings = parse_settings(options)
+        if settings is None:
+            return
+        benchmark(args, options, settings)
+
+    elif Util.SERVE_OPTION in options:
+        settings = parse_settings(options)
+        if settings is None:
+            return
+        if Util.PROFILE_OPTION in options:
+            settings['profile'] = True
+        serve(args, options, settings)
+
+    elif len(args) == 0:
+        # The interactive program (and matplotlib, used by its viewer) is imported only when it is started
+        from view import UI
 
-    if len(args) == 0:
         ui = UI.UI()
         ui.start_ui()
 
     else:
+        settings = parse_settings(options)
+        if settings is None:
+            return
+
+        if Util.BATCH_OPTION in options:
+            batch(args, options, settings)
+            return
+
+        if is_sequence:
+            if Util.PROFILE_OPTION in options:
+                settings['profile'] = True
+            sequence(args, options, settings)
+            print_profile(options)
+            return
+
         controller = Controller.Controller()
         path = args[0]
-        F = Util.DEFAULT_F
-        d = Util.DEFAULT_D
-        mode = Util.DEFAULT_MODE
 
         if path.rfind('.') == -1:
             print(f'Invalid file format: \'\'')
@@ -31,42 +747,19 @@ def main():
             return
         
         if operation == Util.Operation.ENCODE:
-            if len(args) == 2:
-                mode = Util.get_enum_from_value(args[1].upper(), Util.Mode)
-                if mode is None:
-                    print(f"Invalid mode: {args[1]}")
-                    return
-                
-            elif len(args) > 2:
-                try:
-                    F = int(args[1])
-                except ValueError:
-                    print(f"Invalid parameter F: {args[1]}")
-                    return
-                if F <= 0:
-                    print(f"Invalid parameter F: {F}")
-                    return
-                try:
-                    d = int(args[2])
-                except ValueError:
-                    print(f"Invalid parameter d: {args[2]}")
-                    return
-                if d <= 0 or d > 2 * F - 1:
-                    print(f"Invalid parameter d: {d}")
-                    return
-                if len(args) > 3:
-                    mode = Util.get_enum_from_value(args[3].upper(), Util.Mode)
-                    if mode is None:
-                        print(f"Invalid mode: {args[3]}")
-                        return
-                    
-            if controller.get_active_mode() != mode:
-                controller.execute(Util.Operation.SWITCH_MODE, [mode])
-
-            controller.execute(Util.Operation.CHANGE_PARAMS, [F, d])    
+            settings = parse_encode_settings(args[1:], options, settings)
+            if settings is None:
+                return
+
+        if Util.PROFILE_OPTION in options:
+            settings['profile'] = True
+
+        controller.configure(settings)
             
         result = controller.execute(operation, [path])    
         print(result)
 
+        print_profile(options)
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,218 @@
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import controller.Util as Util
+from controller.Controller import Controller
+from controller.LRU_Cache import LRU_Cache
+
+_controller = None
+
+def _initialize(settings:dict) -> None:
+    '''
+    Initialize the controller of a worker process with the settings of the batch.
+    '''
+    global _controller
+
+    _controller = Controller()
+    _controller.configure(settings)
+
+    # Every file of a batch is converted once, so nothing is worth caching
+    _controller.set_cache(LRU_Cache(0))
+
+def _convert(operation:Util.Operation, path:str) -> dict:
+    '''
+    Encode or decode a file with the controller of the worker process.
+
+    @return: A dictionary with the path, the output path (None on failure), the error message (None on success),
+    the bytes read and written and the seconds spent.
+    '''
+    start = time.perf_counter()
+    output, error, bytes_out = None, None, 0
+
+    try:
+        output = _controller.convert(operation, path)
+        bytes_out = os.path.getsize(output)
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}' if str(e) != '' else type(e).__name__
+
+    try:
+        bytes_in = os.path.getsize(path)
+    except OSError:
+        bytes_in = 0
+
+    return {
+        'path': path,
+        'output': output,
+        'error': error,
+        'bytes_in': bytes_in,
+        'bytes_out': bytes_out,
+        'seconds': time.perf_counter() - start
+    }
+
+class Batch_Controller():
+    '''
+    Controller encoding or decoding many files on a pool of processes.
+
+    The files are submitted one by one, the largest first, so that a huge file is started early and the other processes
+    keep taking the small ones meanwhile. At most queue_depth files per process are submitted and not completed yet,
+    and the results are returned in completion order.
+    '''
+
+    DEFAULT_QUEUE_DEPTH = 2
+
+    def __init__(self, settings:dict, jobs:int=None, queue_depth:int=DEFAULT_QUEUE_DEPTH) -> None:
+        '''
+        Constructor of the Batch_Controller class.
+
+        Parameters:
+        @param settings: The settings applied to the controller of each process (see Controller.configure).
+        @param jobs: The number of processes. Default is None (the number of CPUs).
+        @param queue_depth: The maximum number of files submitted per process. Default is DEFAULT_QUEUE_DEPTH.
+        '''
+        jobs = (os.cpu_count() or 1) if jobs is None else jobs
+
+        assert type(jobs) == int and jobs > 0, 'The number of jobs must be a positive integer.'
+        assert type(queue_depth) == int and queue_depth > 0, 'The queue depth must be a positive integer.'
+
+        self._settings = settings
+        self._jobs = jobs
+        self._queue_depth = queue_depth
+
+    def get_jobs(self) -> int:
+        return self._jobs
+
+    @staticmethod
+    def split_sources(args:list[str]) -> tuple[list[str]]:
+        '''
+        Split the arguments in the sources (the leading directories, glob patterns or files) and the arguments that follow them.
+
+        Parameters:
+        @param args: The arguments, the sources followed by e.g. the parameters of the encoding.
+
+        @return: A tuple (sources, rest of the arguments).
+        '''
+
+        n_sources = 0
+        while n_sources < len(args) and (glob.has_magic(args[n_sources]) or os.path.exists(args[n_sources])):
+            n_sources += 1
+
+        if n_sources == 0:
+            raise ValueError(Util.NO_SOURCES_MSG)
+
+        return args[:n_sources], args[n_sources:]
+
+    @staticmethod
+    def collect_files(sources:list[str], extension:str, by_size:bool=True) -> list[str]:
+        '''
+        Collect the files with the given extension from directories (recursively), glob patterns or files.
+
+        Parameters:
+        @param sources: The list of directories, glob patterns (** matches any subdirectory) or files.
+        @param extension: The extension of the files to collect.
+        @param by_size: If True, the paths are sorted by decreasing size, otherwise by name (e.g. the frames of a sequence). Default is True.
+
+        @return: The list of paths, without duplicates, sorted by decreasing size or by name.
+        '''
+        sizes = {}
+
+        def add(path:str) -> None:
+            # Each file is stated once, skipping the ones removed since they were listed
+            if path not in sizes:
+                try:
+                    sizes[path] = os.path.getsize(path)
+                except OSError:
+                    pass
+
+        for source in sources:
+            matches = glob.glob(source, recursive=True) if glob.has_magic(source) else [source]
+
+            for match in matches:
+                if os.path.isdir(match):
+                    for root, _, files in os.walk(match):
+                        for file in sorted(files):
+                            if file.endswith(extension):
+                                add(os.path.join(root, file))
+
+                elif match.endswith(extension) and os.path.isfile(match):
+                    add(match)
+
+        if not by_size:
+            return sorted(sizes)
+
+        return sorted(sizes, key=lambda path: sizes[path], reverse=True)
+
+    def run(self, operation:Util.Operation, paths:list[str]):
+        '''
+        Encode or decode the files, yielding the result of each file as soon as it is completed.
+
+        Parameters:
+        @param operation: Util.Operation.ENCODE or Util.Operation.DECODE.
+        @param paths: The paths of the files.
+
+        @return: A generator of dictionaries (see _convert), in completion order.
+        '''
+        if self._jobs == 1:
+            _initialize(self._settings)
+            for path in paths:
+                yield _convert(operation, path)
+            return
+
+        max_pending = self._jobs * self._queue_depth
+        remaining = iter(paths)
+        pending = {}
+
+        with ProcessPoolExecutor(max_workers=self._jobs, initializer=_initialize, initargs=(self._settings,)) as executor:
+            try:
+                while True:
+                    for path in remaining:
+                        pending[executor.submit(_convert, operation, path)] = path
+                        if len(pending) >= max_pending:
+                            break
+
+                    if len(pending) == 0:
+                        break
+
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path = pending.pop(future)
+                        try:
+                            yield future.result()
+                        except Exception as e:
+                            yield {'path': path, 'output': None, 'error': f'{type(e).__name__}: {e}', 'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0}
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    @staticmethod
+    def compute_summary(results:list[dict], seconds:float) -> str:
+        '''
+        Compute the summary of a batch.
+
+        Parameters:
+        @param results: The results of the files.
+        @param seconds: The elapsed time of the batch.
+
+        @return: The summary message, with the throughput, the bytes read and written and the failures.
+        '''
+        completed = [result for result in results if result['error'] is None]
+        failed = [result for result in results if result['error'] is not None]
+
+        bytes_in = sum(result['bytes_in'] for result in completed)
+        bytes_out = sum(result['bytes_out'] for result in completed)
+        seconds = max(seconds, 1e-9)
+
+        summary = Util.BATCH_SUMMARY_MSG.format(len(completed), len(results), seconds, len(completed) / seconds,
+                                                bytes_in / 2 ** 20 / seconds, bytes_in, bytes_out)
+
+        for result in failed:
+            summary += '\n' + Util.BATCH_FAILURE_MSG.format(result['path'], result['error'])
+
+        return summary
+
+    def __str__(self) -> str:
+        return f'Batch_Controller(jobs={self._jobs}, queue_depth={self._queue_depth})'
+
+    def __repr__(self) -> str:
+        return self.__str__()
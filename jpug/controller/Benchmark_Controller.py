@@ -0,0 +1,476 @@
+import gc
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import numpy as np
+from PIL import Image
+
+import controller.Util as Util
+from model.Parser import Parser
+from model.serialization.Entropy_Coder import Entropy_Coder
+from model.serialization.Chunk_Coder import Chunk_Coder
+from model.serialization.Fixed_Plane import Fixed_Plane
+from model.encoder.L_Encoder import L_Encoder
+from model.encoder.RGB_Encoder import RGB_Encoder
+from model.encoder.YCbCr_Encoder import YCbCr_Encoder
+
+ENCODER_CLASSES = {
+    Util.Mode.L: L_Encoder,
+    Util.Mode.RGB: RGB_Encoder,
+    Util.Mode.YCBCR: YCbCr_Encoder
+}
+
+def _compute_peak_rss() -> int:
+    '''
+    Get the peak resident set size of the process in bytes, or None if it cannot be measured on this platform.
+    '''
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # The peak is in bytes on macOS and in kilobytes on the other systems
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _measure(function, repeat:int, warmup:int) -> tuple:
+    '''
+    Run a function warmup times and then repeat times, collecting the garbage before each run.
+
+    @return: A tuple (seconds of each timed run, result of the last run).
+    '''
+    for _ in range(warmup):
+        result = function()
+
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+
+    return seconds, result
+
+def _summarize(seconds:list[float], pixels:int, nbytes:int=None) -> dict:
+    '''
+    Summarize the timed runs of a stage with the latency percentiles and the throughput of the median run, in megapixels per
+    second and, if the bytes processed are given, in megabytes per second.
+    '''
+    p50, p90, p99 = np.percentile(seconds, [50, 90, 99])
+
+    summary = {
+        'runs': len(seconds),
+        'min': min(seconds),
+        'mean': float(np.mean(seconds)),
+        'p50': float(p50),
+        'p90': float(p90),
+        'p99': float(p99),
+        'mp_per_s': pixels / 1e6 / max(float(p50), 1e-12)
+    }
+    if nbytes is not None:
+        summary['mb_per_s'] = nbytes / 2 ** 20 / max(float(p50), 1e-12)
+
+    return summary
+
+def _parse_importtime(output:str) -> dict:
+    '''
+    Parse the output of python -X importtime.
+
+    @return: A dictionary with the cumulative seconds of the import of each module.
+    '''
+    modules = {}
+
+    for line in output.splitlines():
+        fields = line.split('|')
+        if len(fields) != 3 or not line.startswith('import time:'):
+            continue
+
+        try:
+            modules[fields[2].strip()] = int(fields[1]) / 1e6
+        except ValueError:
+            continue
+
+    return modules
+
+def run_case(case:dict) -> dict:
+    '''
+    Run a case of the benchmark: encode, decode, save and load an image with the parameters of the case.
+
+    Parameters:
+    @param case: The case, as returned by Benchmark_Controller.compute_cases.
+
+    @return: The result of the case: the case, the summary of each stage, the bytes of the coefficients and of the saved file,
+    their ratio and the peak RSS. The throughput of the saving and of the loading is measured also on the bytes of the coefficients.
+    '''
+    baseline_rss = _compute_peak_rss()
+
+    if case['image'] is None:
+        image = Benchmark_Controller.create_image(case['width'], case['height'], case['mode'])
+    else:
+        image = Parser.load_image(case['image'])
+        image.load()
+
+    mode = Util.Mode[case['mode']]
+    image = image.convert('L' if mode == Util.Mode.L else 'RGB')
+    pixels = image.width * image.height
+
+    encoder = ENCODER_CLASSES[mode].get_instance(case['F'], case['d'], np.dtype(case['dtype']).type, case['dct_backend'], case['workers'])
+    entropy_coder = None if case['quality'] is None else Entropy_Coder(case['quality'], workers=case['workers'])
+    chunk_coder = None if case.get('codec') is None else Chunk_Coder(*case['codec'], workers=case['workers'])
+
+    stages = {}
+    repeat, warmup = case['repeat'], case['warmup']
+
+    seconds, jpug = _measure(lambda: encoder.encode(image), repeat, warmup)
+    stages['encode'] = _summarize(seconds, pixels)
+
+    seconds, _ = _measure(lambda: encoder.decode(jpug), repeat, warmup)
+    stages['decode'] = _summarize(seconds, pixels)
+
+    raw_bytes = sum(plane.nbytes for plane in jpug.get_planes())
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'benchmark' + Util.JPUG_EXTENSION)
+
+        seconds, _ = _measure(lambda: Parser.save_jpug(jpug, path, entropy_coder, chunk_coder), repeat, warmup)
+        stages['save'] = _summarize(seconds, pixels, raw_bytes)
+        nbytes = os.path.getsize(path)
+
+        # The memory-mapped planes are read in full, so that the loading is measured also for the raw planes, and the fixed point ones are dequantized
+        read = lambda plane: plane.to_dense() if isinstance(plane, Fixed_Plane) else np.array(plane)
+        seconds, _ = _measure(lambda: [read(plane) for plane in Parser.load_jpug(path, workers=case['workers']).get_planes()], repeat, warmup)
+        stages['load'] = _summarize(seconds, pixels, raw_bytes)
+
+    return {
+        'case': case,
+        'pixels': pixels,
+        'raw_bytes': raw_bytes,
+        'bytes': nbytes,
+        'ratio': raw_bytes / nbytes,
+        'bits_per_pixel': 8 * nbytes / pixels,
+        'stages': stages,
+        'baseline_rss': baseline_rss,
+        'peak_rss': _compute_peak_rss()
+    }
+
+class Benchmark_Controller():
+    '''
+    Controller running a reproducible benchmark of the encoders and of the Parser over a grid of cases.
+
+    Each case encodes, decodes, saves and loads a synthetic image (generated with a fixed seed) or a real image, with a mode,
+    the parameters F and d and a float dtype. Each stage is run warmup times and then timed repeat times: the latency
+    percentiles and the throughput in megapixels per second of the median run are reported. By default each case runs in a new
+    process, so that the peak RSS of a case is not hidden by the previous ones. The files are saved with each of the codecs
+    (raw planes, or compressed with Chunk_Coder), reporting the compression ratio against the MB/s of the saving and the loading. The report is a JSON document, and compare
+    flags the stages slower (or the files larger) than a stored baseline by more than a threshold.
+    '''
+
+    FORMAT_VERSION = 1
+    SEED = 0
+
+    DEFAULT_SIZES = [(512, 512), (2048, 2048)]
+    DEFAULT_PARAMS = [(8, 8), (16, 8)]
+    DEFAULT_DTYPES = ['float16', 'float32']
+    DEFAULT_MODES = [Util.Mode.L, Util.Mode.RGB]
+    DEFAULT_REPEAT = 5
+    DEFAULT_WARMUP = 1
+    DEFAULT_THRESHOLD = 0.1
+
+    STAGES = ('encode', 'decode', 'save', 'load')
+
+    STARTUP_CASE = 'startup'
+    STARTUP_STAGES = ('import', 'encode_cli')
+    STARTUP_BUDGET = 0.25
+    STARTUP_SIZE = (64, 64)
+    HEAVY_MODULES = ('matplotlib', 'scipy', 'asyncio', 'multiprocessing')
+
+    def __init__(self, sizes:list[tuple[int]]=DEFAULT_SIZES, params:list[tuple[int]]=DEFAULT_PARAMS, dtypes:list[str]=DEFAULT_DTYPES,
+                 modes:list[Util.Mode]=DEFAULT_MODES, images:list[str]=[], dct_backend:str=Util.DEFAULT_DCT_BACKEND,
+                 workers:int=Util.DEFAULT_WORKERS, quality:int=None, repeat:int=DEFAULT_REPEAT, warmup:int=DEFAULT_WARMUP, isolate:bool=True,
+                 codecs:list[tuple]=[None]) -> None:
+        '''
+        Constructor of the Benchmark_Controller class.
+
+        Parameters:
+        @param sizes: The (width, height) of the synthetic images. Default is DEFAULT_SIZES.
+        @param params: The (F, d) parameters. Default is DEFAULT_PARAMS.
+        @param dtypes: The names of the float dtypes, or of Encoder.FIXED_DTYPES. Default is DEFAULT_DTYPES.
+        @param modes: The modes. Default is DEFAULT_MODES.
+        @param images: The paths of the real images. Default is no image.
+        @param dct_backend: The name of the DCT backend. Default is Util.DEFAULT_DCT_BACKEND.
+        @param workers: The number of threads used to encode and decode. Default is 1.
+        @param quality: The quality of the entropy coder used to save the files. Default is None (raw planes).
+        @param repeat: The number of timed runs of each stage. Default is DEFAULT_REPEAT.
+        @param warmup: The number of runs of each stage before the timed ones. Default is DEFAULT_WARMUP.
+        @param isolate: If True, each case runs in a new process. Default is True.
+        @param codecs: The (codec, level) of the Chunk_Coder used to save the files, None for the raw planes. Default is only the raw planes.
+        '''
+        assert type(repeat) == int and repeat > 0, 'The number of runs must be a positive integer.'
+        assert type(warmup) == int and warmup >= 0, 'The number of warmup runs must be a non negative integer.'
+
+        self._sizes = list(sizes)
+        self._params = list(params)
+        self._dtypes = list(dtypes)
+        self._modes = list(modes)
+        self._images = list(images)
+        self._dct_backend = dct_backend
+        self._workers = workers
+        self._quality = quality
+        self._repeat = repeat
+        self._warmup = warmup
+        self._isolate = isolate
+        self._codecs = list(codecs)
+
+    @staticmethod
+    def create_image(width:int, height:int, mode:str, seed:int=SEED) -> Image.Image:
+        '''
+        Create a synthetic image, the same for the same arguments: smooth gradients and waves with some noise, so that
+        the blocks are neither constant nor random.
+
+        Parameters:
+        @param width: The width of the image.
+        @param height: The height of the image.
+        @param mode: The name of the mode (Util.Mode): a gray-scaled image for L, a RGB image otherwise.
+        @param seed: The seed of the noise. Default is SEED.
+
+        @return: The image.
+        '''
+        rng = np.random.default_rng(seed)
+        y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+
+        channels = []
+        for phase in range(1 if mode == Util.Mode.L.name else 3):
+            wave = np.sin(x / (17 + 5 * phase) + phase) * np.cos(y / (23 + 3 * phase))
+            channels.append(127 + 60 * wave + 40 * (x / max(width, 1) - y / max(height, 1)) + rng.normal(0, 8, (height, width)))
+
+        pixels = np.clip(np.stack(channels, axis=-1), 0, 255).astype(np.uint8)
+
+        return Image.fromarray(pixels[:, :, 0] if pixels.shape[2] == 1 else pixels)
+
+    def compute_cases(self) -> list[dict]:
+        '''
+        Compute the cases of the grid: every image (synthetic or real) with every mode, parameters, dtype and codec.
+
+        @return: The list of cases.
+        '''
+        sources = [(None, width, height) for width, height in self._sizes]
+
+        for path in self._images:
+            with Image.open(path) as image:
+                sources.append((os.path.abspath(path), image.width, image.height))
+
+        cases = []
+        for image, width, height in sources:
+            for mode in self._modes:
+                for F, d in self._params:
+                    for dtype, codec in itertools.product(self._dtypes, self._codecs):
+                        # The fixed point planes are saved as they are (see Parser.save_jpug)
+                        if np.dtype(dtype).kind == 'i' and (codec is not None or self._quality is not None):
+                            continue
+
+                        cases.append({
+                            'image': image,
+                            'width': width,
+                            'height': height,
+                            'mode': mode.name,
+                            'F': F,
+                            'd': d,
+                            'dtype': dtype,
+                            'dct_backend': self._dct_backend,
+                            'workers': self._workers,
+                            'quality': self._quality,
+                            'codec': None if codec is None else list(codec),
+                            'repeat': self._repeat,
+                            'warmup': self._warmup
+                        })
+
+        return cases
+
+    @staticmethod
+    def compute_case_id(case:dict) -> str:
+        '''
+        Compute the identifier of a case, used to match the cases of two reports.
+        '''
+        image = f'synthetic:{case["width"]}x{case["height"]}' if case['image'] is None else os.path.basename(case['image'])
+        if case.get('codec') is not None:
+            codec = '{}:{}'.format(*case['codec'])
+        else:
+            codec = Parser.RAW_CODEC if case['quality'] is None else f'{Parser.ENTROPY_CODEC}:{case["quality"]}'
+
+        return f'{image}/{case["mode"]}/F={case["F"]}/d={case["d"]}/{case["dtype"]}/{case["dct_backend"]}/workers={case["workers"]}/{codec}'
+
+    def run(self):
+        '''
+        Run the cases of the grid, yielding the result of each case as soon as it is completed.
+
+        @return: A generator of results (see run_case).
+        '''
+        for case in self.compute_cases():
+            if not self._isolate:
+                yield run_case(case)
+                continue
+
+            # A new process for each case, so that the peak RSS is the one of the case
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                yield executor.submit(run_case, case).result()
+
+    @staticmethod
+    def measure_startup(repeat:int=DEFAULT_REPEAT, warmup:int=DEFAULT_WARMUP, budget:float=STARTUP_BUDGET) -> dict:
+        '''
+        Measure the start-up of the CLI, each run in a new interpreter: the import of Main (with python -X importtime) and the
+        wall time of a one-shot encoding of a small synthetic image (Main.py image.bmp), which for small images is mostly start-up.
+
+        Parameters:
+        @param repeat: The number of timed runs. Default is DEFAULT_REPEAT.
+        @param warmup: The number of runs before the timed ones (e.g. to fill the cache of the files of the modules). Default is DEFAULT_WARMUP.
+        @param budget: The seconds allowed to the median import of Main. Default is STARTUP_BUDGET.
+
+        @return: A dictionary with the summary of each stage, the budget, whether the median import exceeds it and the heavy
+        modules (HEAVY_MODULES) imported by Main, which the CLI imports only when they are used.
+        '''
+        directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        modules = {}
+
+        def import_main() -> float:
+            nonlocal modules
+            completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import Main'], cwd=directory, capture_output=True, text=True, check=True)
+            modules = _parse_importtime(completed.stderr)
+            return modules['Main']
+
+        for _ in range(warmup):
+            import_main()
+        import_seconds = [import_main() for _ in range(repeat)]
+
+        width, height = Benchmark_Controller.STARTUP_SIZE
+        with tempfile.TemporaryDirectory() as image_directory:
+            path = os.path.join(image_directory, 'startup' + Util.IMAGE_EXTENSION)
+            Benchmark_Controller.create_image(width, height, Util.Mode.RGB.name).save(path)
+
+            command = [sys.executable, os.path.join(directory, 'Main.py'), path]
+            encode_seconds, _ = _measure(lambda: subprocess.run(command, capture_output=True, check=True), repeat, warmup)
+
+        stages = {'import': _summarize(import_seconds, 0), 'encode_cli': _summarize(encode_seconds, width * height)}
+
+        return {
+            'stages': stages,
+            'budget': budget,
+            'over_budget': stages['import']['p50'] > budget,
+            'heavy_modules': sorted(name for name in modules if name in Benchmark_Controller.HEAVY_MODULES)
+        }
+
+    @staticmethod
+    def create_report(results:list[dict], startup:dict=None) -> dict:
+        '''
+        Create the JSON report of a benchmark, with the environment it ran in and the start-up measures, if any (see measure_startup).
+        '''
+        import scipy
+
+        return {
+            'version': Benchmark_Controller.FORMAT_VERSION,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'environment': {
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'scipy': scipy.__version__,
+                'platform': platform.platform(),
+                'machine': platform.machine(),
+                'cpus': os.cpu_count()
+            },
+            'results': results,
+            'startup': startup
+        }
+
+    @staticmethod
+    def save_report(report:dict, file:str) -> None:
+        with open(file, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    @staticmethod
+    def load_report(file:str) -> dict:
+        with open(file, 'r') as f:
+            report = json.load(f)
+
+        if report.get('version') != Benchmark_Controller.FORMAT_VERSION:
+            raise ValueError(f'Unsupported benchmark report version {report.get("version")}.')
+
+        return report
+
+    @staticmethod
+    def compare(baseline:dict, current:dict, threshold:float=DEFAULT_THRESHOLD) -> tuple[list[dict], list[dict]]:
+        '''
+        Compare two reports, case by case: the median latency of each stage and the bytes of the saved files.
+
+        Parameters:
+        @param baseline: The report of the baseline.
+        @param current: The report to compare.
+        @param threshold: The relative increase considered a regression. Default is DEFAULT_THRESHOLD (10%).
+
+        @return: A tuple (comparisons, regressions) of dictionaries with the case, the metric, the baseline and current values and the relative change.
+        The cases missing from one of the reports are not compared.
+        '''
+        baseline_results = {Benchmark_Controller.compute_case_id(result['case']): result for result in baseline['results']}
+
+        comparisons = []
+        for result in current['results']:
+            case_id = Benchmark_Controller.compute_case_id(result['case'])
+            if case_id not in baseline_results:
+                continue
+            baseline_result = baseline_results[case_id]
+
+            metrics = [(stage, baseline_result['stages'][stage]['p50'], result['stages'][stage]['p50'])
+                       for stage in Benchmark_Controller.STAGES if stage in baseline_result['stages'] and stage in result['stages']]
+            metrics.append(('bytes', baseline_result['bytes'], result['bytes']))
+
+            for metric, before, after in metrics:
+                change = (after - before) / before if before > 0 else 0.0
+                comparisons.append({'case': case_id, 'metric': metric, 'baseline': before, 'current': after,
+                                    'change': change, 'regression': change > threshold})
+
+        # The start-up is compared as a case of its own, when both reports measured it
+        if baseline.get('startup') is not None and current.get('startup') is not None:
+            for stage in Benchmark_Controller.STARTUP_STAGES:
+                before, after = baseline['startup']['stages'][stage]['p50'], current['startup']['stages'][stage]['p50']
+                change = (after - before) / before if before > 0 else 0.0
+                comparisons.append({'case': Benchmark_Controller.STARTUP_CASE, 'metric': stage, 'baseline': before, 'current': after,
+                                    'change': change, 'regression': change > threshold})
+
+        return comparisons, [comparison for comparison in comparisons if comparison['regression']]
+
+    @staticmethod
+    def format_result(result:dict) -> str:
+        '''
+        Format the result of a case in a line: the median latency and the throughput of each stage, the bytes, the compression ratio
+        with the MB/s of the saving and the loading, and the peak RSS.
+        '''
+        stages = ', '.join(Util.BENCHMARK_STAGE_MSG.format(stage, summary['p50'] * 1000, summary['mp_per_s']) for stage, summary in result['stages'].items())
+        peak_rss = 'n/a' if result['peak_rss'] is None else f'{result["peak_rss"] / 2 ** 20:.0f} MB'
+        ratio = Util.BENCHMARK_RATIO_MSG.format(result['ratio'], result['stages']['save']['mb_per_s'], result['stages']['load']['mb_per_s'])
+
+        return Util.BENCHMARK_RESULT_MSG.format(Benchmark_Controller.compute_case_id(result['case']), stages, result['bytes'], ratio, peak_rss)
+
+    @staticmethod
+    def format_startup(startup:dict) -> str:
+        '''
+        Format the start-up measures in a line: the median import and one-shot encoding, the budget and the heavy modules imported.
+        '''
+        return Util.BENCHMARK_STARTUP_MSG.format(startup['stages']['import']['p50'] * 1000, startup['budget'] * 1000,
+                                                 Util.BENCHMARK_OVER_BUDGET_MSG if startup['over_budget'] else '',
+                                                 startup['stages']['encode_cli']['p50'] * 1000, ', '.join(startup['heavy_modules']) or 'none')
+
+    def __str__(self) -> str:
+        return f'Benchmark_Controller(sizes={self._sizes}, params={self._params}, dtypes={self._dtypes}, modes={[mode.name for mode in self._modes]}, images={self._images}, repeat={self._repeat})'
+
+    def __repr__(self) -> str:
+        return self.__str__()
@@ -1,10 +1,26 @@
+import os
+
+import numpy as np
+
 import controller.Util as Util
 from controller.Encoder_Controller import Encoder_Controller
+from controller.LRU_Cache import LRU_Cache
 
 from model.serialization.Jpug_RGB import Jpug_RGB
 from model.serialization.Jpug_L import Jpug_L
+from model.serialization.Jpug_YCbCr import Jpug_YCbCr
 
 from model.Parser import Parser
+from model.Profiler import Profiler
+from model.serialization.Entropy_Coder import Entropy_Coder
+from model.serialization.Chunk_Coder import Chunk_Coder
+from model.encoder.Stream_Encoder import Stream_Encoder
+from model.encoder.Sequence_Encoder import Sequence_Encoder
+from model.encoder.Param_Selector import Param_Selector
+from model.encoder.Encoder import Encoder
+from model.encoder.L_Encoder import L_Encoder
+from model.encoder.RGB_Encoder import RGB_Encoder
+from model.encoder.YCbCr_Encoder import YCbCr_Encoder
 
 from PIL import Image
 
@@ -20,6 +36,15 @@ class Controller():
     
     def __init__(self) -> None:
         self._encoder_controller = Encoder_Controller.get_instance()
+        self._entropy_coder = None
+        self._chunk_coder = None
+        self._stream_encoder = None
+        self._sequence_encoder = Sequence_Encoder()
+        self._scale = None
+        self._region = None
+        self._target = None
+        self._cache = LRU_Cache(Util.DEFAULT_CACHE_MB * 2 ** 20)
+        self._profiler = Profiler.get_instance()
 
     def get_active_params(self) -> tuple[int]:
         return self._encoder_controller.get_active_params()
@@ -27,6 +52,293 @@ class Controller():
     def get_active_mode(self) -> Util.Mode:
         return self._encoder_controller.get_active_mode()
 
+    def set_dct_backend(self, name:str) -> None:
+        self._encoder_controller.set_dct_backend(name)
+
+    def set_workers(self, workers:int) -> None:
+        self._encoder_controller.set_workers(workers)
+
+    def get_scale(self) -> int:
+        return self._scale
+
+    def set_scale(self, scale:int) -> None:
+        '''
+        Set the scale of the decoded images.
+
+        Parameters:
+        @param scale: The images are decoded at scale / F of their size (see Encoder.decode), or None to decode them at full size.
+        '''
+        assert scale is None or (type(scale) == int and scale > 0), 'The scale must be a positive integer.'
+
+        self._scale = scale
+
+    def get_region(self) -> tuple[int]:
+        return self._region
+
+    def set_region(self, region:tuple[int]) -> None:
+        '''
+        Set the region of the decoded images.
+
+        Parameters:
+        @param region: The (x, y, width, height) region to decode, or None to decode the whole images.
+        '''
+        assert region is None or len(region) == 4, 'The region must be a (x, y, width, height) tuple.'
+
+        self._region = None if region is None else tuple(region)
+
+    def get_target(self) -> dict:
+        return self._target
+
+    def set_target(self, target_psnr:float=None, max_bytes:int=None) -> None:
+        '''
+        Set the target of the encoded images: the parameters (F, d) of each image are then selected to reach the PSNR,
+        or to fit in the bytes, before encoding it (see Param_Selector.select_params).
+
+        Parameters:
+        @param target_psnr: The minimum PSNR in dB. Default is None.
+        @param max_bytes: The maximum bytes of the coefficients. Default is None.
+        If both are None, the parameters set with CHANGE_PARAMS are used.
+        '''
+        assert target_psnr is None or max_bytes is None, 'Only one of the target PSNR and the maximum bytes can be given.'
+        assert target_psnr is None or target_psnr > 0, 'The target PSNR must be positive.'
+        assert max_bytes is None or (type(max_bytes) == int and max_bytes > 0), 'The maximum bytes must be a positive integer.'
+
+        self._target = None if target_psnr is None and max_bytes is None else {'target_psnr': target_psnr, 'max_bytes': max_bytes}
+
+    def get_cache(self) -> LRU_Cache:
+        return self._cache
+
+    def set_cache(self, cache:LRU_Cache) -> None:
+        '''
+        Set the cache of the loaded jpug files, of the decoded images and of the encoded results.
+
+        Parameters:
+        @param cache: The LRU_Cache to use.
+        '''
+        assert isinstance(cache, LRU_Cache), 'The cache must be a LRU_Cache object.'
+
+        self._cache = cache
+
+    def get_profiler(self) -> Profiler:
+        return self._profiler
+
+    def set_profiling(self, enabled:bool, memory:bool=True) -> None:
+        '''
+        Enable or disable the instrumentation of the stages of the encoding and decoding (see Profiler).
+        When enabled, the STATS operation reports the time, the bytes and the allocation peak of each stage.
+
+        Parameters:
+        @param enabled: If True, the stages are recorded from now on.
+        @param memory: If True, the allocation peaks are traced too. Default is True.
+        '''
+        if enabled:
+            self._profiler.enable(memory)
+        else:
+            self._profiler.disable()
+
+    def configure(self, settings:dict) -> None:
+        '''
+        Apply the settings given from the command line.
+
+        Parameters:
+        @param settings: A dictionary with the optional keys 'dct_backend', 'workers', 'memory_budget' (bytes of the stream encoder),
+        'mode', 'params' (F, d), 'chroma_params' (chroma d, subsampling), 'quality' (of the entropy coder), 'codec' (name and level of the chunk coder),
+        'float_dtype' (of the coefficients, see Encoder.set_float_dtype), 'scale' and 'region' (of the decoded images),
+        'cache_budget' (bytes of the cache), 'profile' (True to record the stages, see set_profiling), 'max_mse' (of the adaptive truncation,
+        see Encoder.set_max_mse), 'target_psnr' or 'target_bytes' (of the encoded images, see set_target) and 'sequence'
+        (keyframe interval, maximum error of the blocks skipped, see Sequence_Encoder).
+        '''
+        if 'dct_backend' in settings:
+            self.set_dct_backend(settings['dct_backend'])
+
+        if 'workers' in settings:
+            self.set_workers(settings['workers'])
+
+        if 'memory_budget' in settings:
+            self.set_stream_encoder(Stream_Encoder(settings['memory_budget']))
+
+        if 'float_dtype' in settings:
+            self._encoder_controller.set_float_dtype(settings['float_dtype'])
+
+        if 'mode' in settings and self.get_active_mode() != settings['mode']:
+            self.execute(Util.Operation.SWITCH_MODE, [settings['mode']])
+
+        if 'params' in settings:
+            self.execute(Util.Operation.CHANGE_PARAMS, list(settings['params']))
+
+        if 'chroma_params' in settings:
+            self._encoder_controller.change_chroma_params(*settings['chroma_params'])
+
+        if 'quality' in settings:
+            self.set_entropy_coder(Entropy_Coder(settings['quality'], workers=self._encoder_controller.get_workers()))
+
+        if 'codec' in settings:
+            self.set_chunk_coder(Chunk_Coder(*settings['codec'], workers=self._encoder_controller.get_workers()))
+
+        if 'scale' in settings:
+            self.set_scale(settings['scale'])
+
+        if 'region' in settings:
+            self.set_region(settings['region'])
+
+        if 'cache_budget' in settings:
+            self.set_cache(LRU_Cache(settings['cache_budget']))
+
+        if 'profile' in settings:
+            self.set_profiling(settings['profile'])
+
+        if 'max_mse' in settings:
+            self._encoder_controller.set_max_mse(settings['max_mse'])
+
+        if 'target_psnr' in settings or 'target_bytes' in settings:
+            self.set_target(settings.get('target_psnr'), settings.get('target_bytes'))
+
+        if 'sequence' in settings:
+            self.set_sequence_encoder(Sequence_Encoder(*settings['sequence']))
+
+    def get_entropy_coder(self) -> Entropy_Coder:
+        return self._entropy_coder
+
+    def set_entropy_coder(self, entropy_coder:Entropy_Coder) -> None:
+        '''
+        Set the entropy coder used to save the encoded images.
+
+        Parameters:
+        @param entropy_coder: The Entropy_Coder to use, or None to save the raw coefficients.
+        '''
+        assert entropy_coder is None or self._stream_encoder is None, 'The streaming mode does not support the entropy coding.'
+        assert entropy_coder is None or self._chunk_coder is None, 'The planes cannot be both entropy coded and compressed.'
+
+        self._entropy_coder = entropy_coder
+
+    def get_chunk_coder(self) -> Chunk_Coder:
+        return self._chunk_coder
+
+    def set_chunk_coder(self, chunk_coder:Chunk_Coder) -> None:
+        '''
+        Set the chunk coder used to compress the planes of the encoded images.
+
+        Parameters:
+        @param chunk_coder: The Chunk_Coder to use, or None to save the raw coefficients.
+        '''
+        assert chunk_coder is None or self._stream_encoder is None, 'The streaming mode does not support the compression of the planes.'
+        assert chunk_coder is None or self._entropy_coder is None, 'The planes cannot be both entropy coded and compressed.'
+
+        self._chunk_coder = chunk_coder
+
+    def get_stream_encoder(self) -> Stream_Encoder:
+        return self._stream_encoder
+
+    def set_stream_encoder(self, stream_encoder:Stream_Encoder) -> None:
+        '''
+        Set the stream encoder used to encode and decode the images stripe by stripe.
+
+        Parameters:
+        @param stream_encoder: The Stream_Encoder to use, or None to process the whole images in memory.
+        '''
+        assert stream_encoder is None or self._entropy_coder is None, 'The streaming mode does not support the entropy coding.'
+        assert stream_encoder is None or self._chunk_coder is None, 'The streaming mode does not support the compression of the planes.'
+
+        self._stream_encoder = stream_encoder
+
+    def get_sequence_encoder(self) -> Sequence_Encoder:
+        return self._sequence_encoder
+
+    def set_sequence_encoder(self, sequence_encoder:Sequence_Encoder) -> None:
+        '''
+        Set the encoder of the sequences of frames (see encode_sequence).
+
+        Parameters:
+        @param sequence_encoder: The Sequence_Encoder to use.
+        '''
+        self._sequence_encoder = sequence_encoder
+
+    def encode_sequence(self, paths:list[str], sequence_path:str) -> dict:
+        '''
+        Encode the frames in a sequence file with the active mode and parameters, raising the errors.
+
+        Parameters:
+        @param paths: The paths of the frames, in order.
+        @param sequence_path: The path of the sequence file to create.
+
+        @return: The statistics of the encoding (see Sequence_Encoder.encode), with the bytes of the file.
+        '''
+        mode = self._encoder_controller.get_active_mode()
+        if mode == Util.Mode.YCBCR:
+            raise ValueError('The sequences do not support the YCbCr mode.')
+        encoder = self._encoder_controller.get_l_encoder() if mode == Util.Mode.L else self._encoder_controller.get_active_encoder()
+
+        with self._profiler.stage('encode', sum(os.path.getsize(path) for path in paths)):
+            stats = self._sequence_encoder.encode(encoder, mode.value, paths, sequence_path)
+        stats['bytes'] = os.path.getsize(sequence_path)
+
+        return stats
+
+    def decode_sequence(self, path:str, start:int=0, end:int=None) -> list[str]:
+        '''
+        Decode the frames [start, end) of a sequence file in images, raising the errors.
+
+        Parameters:
+        @param path: The path of the sequence file.
+        @param start: The index of the first frame. Default is 0.
+        @param end: The index after the last frame. Default is None (the end of the sequence).
+
+        @return: The paths of the images created.
+        '''
+        with self._profiler.stage('decode', os.path.getsize(path)):
+            return self._sequence_encoder.decode(path, Util.compute_frame_path_format(path), start, end,
+                                                 self._encoder_controller.get_dct_backend(), self._encoder_controller.get_workers())
+
+    def _compute_cache_key(self, kind:str, path:str, params:tuple) -> tuple:
+        '''
+        Compute the key of a result in the cache: (kind, path, modification time, size, *params).
+        '''
+        stat = os.stat(path)
+        return (kind, os.path.abspath(path), stat.st_mtime_ns, stat.st_size) + params
+
+    def _cached(self, kind:str, path:str, params:tuple, compute) -> any:
+        '''
+        Get a result from the cache, or compute and cache it.
+        The key is (kind, path, modification time, size, *params), so a file modified on disk is never served from the cache.
+
+        Parameters:
+        @param kind: The kind of the result.
+        @param path: The path of the file the result is computed from.
+        @param params: The parameters the result depends on.
+        @param compute: The function computing the result.
+
+        @return: The result.
+        '''
+        key = self._compute_cache_key(kind, path, params)
+
+        value = self._cache.get(key)
+        if value is None:
+            value = compute()
+            self._cache.put(key, value)
+
+        return value
+
+    def _compute_encoder_params(self, encoder:Encoder) -> tuple:
+        '''
+        Compute the parameters of an encoder the encoded results depend on.
+        '''
+        params = (type(encoder).__name__, *encoder.get_params(), np.dtype(encoder.get_float_dtype()).name, encoder.get_dct_backend(), encoder.get_max_mse())
+
+        if isinstance(encoder, YCbCr_Encoder):
+            params += encoder.get_chroma_params()
+
+        return params
+
+    def _load_jpug(self, path:str, rows:tuple[int]=None):
+        return self._cached('jpug', path, (rows,), lambda: Parser.load_jpug(path, workers=self._encoder_controller.get_workers(), rows=rows))
+
+    def _save(self, save, value:any, path:str) -> None:
+        '''
+        Save a result to a file, removing the cached results of the previous content of the file.
+        '''
+        self._cache.invalidate(os.path.abspath(path))
+        save(value, path)
+
     def _retrieve_image(self, path:str) -> Image.Image:
         img = Parser.load_image(path)
 
@@ -36,31 +348,406 @@ class Controller():
         return img
     
     def _encode(self, path:str) -> None:
-        img = self._retrieve_image(path)
+        with self._profiler.stage('encode', os.path.getsize(path)):
+            return self._encode_file(path)
+
+    def _encode_file(self, path:str) -> str:
+        if self._stream_encoder is not None:
+            return self._encode_stream(path)
+
+        # The image is opened lazily, its pixels are read only if the result is not cached. The pixels of a large BMP are
+        # memory-mapped and transformed without decoding and copying them with PIL
+        img = Parser.map_bmp(path) if os.path.getsize(path) >= Parser.BMP_MAP_MIN_BYTES else None
+        if img is None:
+            img = Parser.load_image(path)
 
-        if img.mode == 'L':
-            jpug = self._encoder_controller.get_l_encoder().encode(img)
+        gray = img.ndim == 2 if isinstance(img, np.ndarray) else img.mode == 'L'
+        if self._encoder_controller.get_active_mode() == Util.Mode.L or gray:
+            encoder = self._encoder_controller.get_l_encoder()
         else:
-            jpug = self._encoder_controller.get_active_encoder().encode(img)
-        
+            encoder = self._encoder_controller.get_active_encoder()
+
+        return self._encode_with(encoder, img, path)
+
+    def _encode_with(self, encoder:Encoder, img, path:str) -> str:
+        '''
+        Encode an image with the given encoder and save it next to the image.
+
+        Parameters:
+        @param encoder: The encoder.
+        @param img: The image, or its memory-mapped pixels.
+        @param path: The path of the image.
+
+        @return: The path of the encoded file.
+        '''
+        jpug = self._cached('encoded', path, self._compute_encoder_params(encoder), lambda: encoder.encode(img))
+
         encoded_path = Util.compute_encoded_path(path, self._encoder_controller.get_active_mode())
-        Parser.save_jpug(jpug, encoded_path)
+        self._save(lambda jpug, file: Parser.save_jpug(jpug, file, self._entropy_coder, self._chunk_coder), jpug, encoded_path)
 
         return encoded_path
     
-    def _decode(self, path:str) -> None:
-        jpug = Parser.load_jpug(path)
+    def _encode_target(self, path:str) -> tuple:
+        '''
+        Encode an image with the parameters selected for the target set with set_target, and measure the result.
+
+        Parameters:
+        @param path: The path of the image.
+
+        @return: A tuple (encoded path, selection, achieved PSNR, bytes of the file), where the selection is the estimate of the
+        selected parameters (see Param_Selector.select_params). The achieved PSNR is measured decoding the saved file.
+        The image is encoded by a shared encoder with the selected parameters: the parameters of the encoder controller are not changed.
+        '''
+        mode = self._encoder_controller.get_active_mode()
+        if self._stream_encoder is not None:
+            raise ValueError('The streaming mode does not support the target PSNR or size.')
+        if mode == Util.Mode.YCBCR:
+            raise ValueError('The YCbCr mode does not support the target PSNR or size.')
+
+        img = Parser.load_image(path)
+        # The gray-scaled images are encoded by the L encoder also in the RGB mode (see _encode)
+        if mode == Util.Mode.L or img.mode == 'L':
+            mode, img = Util.Mode.L, img.convert('L')
+        else:
+            img = img.convert('RGB')
+
+        v = np.asarray(img)
+        float_dtype, dct_backend, workers = self._encoder_controller.get_float_dtype(), self._encoder_controller.get_dct_backend(), self._encoder_controller.get_workers()
+        selection = Param_Selector.select_params(v, **self._target, float_dtype=float_dtype, dct_backend=dct_backend, workers=workers)
+
+        encoder_class = L_Encoder if mode == Util.Mode.L else RGB_Encoder
+        encoder = encoder_class.get_instance(selection['F'], selection['d'], float_dtype, dct_backend, workers, max_mse=self._encoder_controller.get_max_mse())
+
+        with self._profiler.stage('encode', os.path.getsize(path)):
+            encoded_path = self._encode_with(encoder, img, path)
+
+        decoded = np.asarray(self._decode_jpug(Parser.load_jpug(encoded_path, workers=self._encoder_controller.get_workers())))
+        original = v[:decoded.shape[0], :decoded.shape[1]]
+        mse = np.mean(np.square(decoded.astype(np.float64) - original))
+
+        return encoded_path, selection, Param_Selector.compute_psnr(mse), os.path.getsize(encoded_path)
+
+    def _encode_stream(self, path:str) -> str:
+        mode = self._encoder_controller.get_active_mode()
+        if mode == Util.Mode.YCBCR:
+            raise ValueError('The streaming mode does not support the YCbCr mode.')
+        encoder = self._encoder_controller.get_l_encoder() if mode == Util.Mode.L else self._encoder_controller.get_active_encoder()
+
+        encoded_path = Util.compute_encoded_path(path, mode)
+        self._stream_encoder.encode(encoder, mode.value, path, encoded_path)
+
+        return encoded_path
+
+    def _decode_stream(self, path:str) -> str:
+        decoded_path = Util.compute_decoded_path(path)
+        self._stream_encoder.decode(path, decoded_path, self._encoder_controller.get_dct_backend(), self._encoder_controller.get_workers())
+
+        return decoded_path
+
+    def _decode_jpug(self, jpug, scale:int=None) -> Image.Image:
+        '''
+        Decode a loaded jpug with the encoder of its mode.
+
+        Parameters:
+        @param jpug: The Jpug object to decode.
+        @param scale: The image is decoded at scale / F of its size (at full size if scale >= F). Default is None (full size).
+
+        @return: The decoded image.
+        '''
+        if scale is not None and scale >= jpug.get_F():
+            scale = None
 
         if isinstance(jpug, Jpug_RGB):
-            img = self._encoder_controller.get_rgb_encoder().decode(jpug)
+            return self._encoder_controller.get_rgb_encoder().decode(jpug, scale)
         elif isinstance(jpug, Jpug_L):
-            img = self._encoder_controller.get_l_encoder().decode(jpug)
+            return self._encoder_controller.get_l_encoder().decode(jpug, scale)
+        elif isinstance(jpug, Jpug_YCbCr):
+            return self._encoder_controller.get_ycbcr_encoder().decode(jpug, scale)
+
+    def _decode(self, path:str) -> None:
+        with self._profiler.stage('decode', os.path.getsize(path)):
+            return self._decode_file(path)
+
+    def _decode_file(self, path:str) -> str:
+        if self._stream_encoder is not None:
+            if self._scale is not None:
+                raise ValueError('The streaming mode does not support the reduced-resolution decoding.')
+            if self._region is not None:
+                raise ValueError('The streaming mode does not support the region decoding.')
+            return self._decode_stream(path)
+
+        if self._region is not None:
+            return self._decode_region(path)
 
         decoded_path = Util.compute_decoded_path(path)
-        Parser.save_image(img, decoded_path)
+        params = (self._scale, self._encoder_controller.get_dct_backend())
+
+        # A large image not cached is decoded straight into the memory-mapped pixels of the BMP, instead of building a PIL image.
+        # These decodings bypass the cache of the decoded images, since their pixels are only written in the BMP
+        if self._scale is None and decoded_path.endswith(Util.IMAGE_EXTENSION) and not self._cache.contains(self._compute_cache_key('decoded', path, params)):
+            jpug = self._load_jpug(path)
+            if isinstance(jpug, (Jpug_L, Jpug_RGB)):
+                blocks_x, blocks_y = jpug.get_v().shape[-3:-1]
+                height, width = blocks_x * jpug.get_F(), blocks_y * jpug.get_F()
+                channels = 1 if isinstance(jpug, Jpug_L) else 3
+
+                if height * width * channels >= Parser.BMP_MAP_MIN_BYTES:
+                    self._decode_mapped(jpug, decoded_path, width, height)
+                    return decoded_path
+
+        img = self._cached('decoded', path, params, lambda: self._decode_jpug(self._load_jpug(path), self._scale))
+        self._save(Parser.save_image, img, decoded_path)
 
         return decoded_path
 
+    def _decode_mapped(self, jpug, path:str, width:int, height:int) -> None:
+        '''
+        Decode a loaded L or RGB jpug straight into a new memory-mapped BMP. The decoded image is not cached.
+        '''
+        self._cache.invalidate(os.path.abspath(path))
+
+        with Parser.create_mapped_bmp(path, width, height, 'L' if isinstance(jpug, Jpug_L) else 'RGB') as out:
+            if isinstance(jpug, Jpug_L):
+                self._encoder_controller.get_l_encoder().decode_into(jpug, out)
+            else:
+                self._encoder_controller.get_rgb_encoder().decode_into(jpug, out)
+
+    def _decode_region(self, path:str) -> str:
+        '''
+        Decode only the region of the image set with set_region: only the rows of blocks intersecting the region are loaded
+        (and only their segments are entropy decoded), and only the blocks intersecting it are transformed.
+        '''
+        if self._scale is not None:
+            raise ValueError('The region decoding does not support the reduced-resolution decoding.')
+
+        x, y, width, height = self._region
+
+        try:
+            header = Parser.read_header(path)
+        except ValueError:
+            # The legacy (pickle based) files are loaded whole
+            header = None
+
+        rows, offset = None, 0
+        if header is not None:
+            if header['mode'] == Jpug_YCbCr.MODE:
+                raise ValueError('The region decoding does not support the YCbCr mode.')
+
+            F, blocks_x = header['F'], header['planes'][0]['shape'][0]
+            rows = (min(y // F, blocks_x), min(-(-(y + height) // F), blocks_x))
+            offset = rows[0] * F
+
+        def decode_region() -> Image.Image:
+            jpug = self._load_jpug(path, rows)
+
+            if isinstance(jpug, Jpug_RGB):
+                return self._encoder_controller.get_rgb_encoder().decode_region(jpug, x, y - offset, width, height)
+            elif isinstance(jpug, Jpug_L):
+                return self._encoder_controller.get_l_encoder().decode_region(jpug, x, y - offset, width, height)
+
+            raise ValueError('The region decoding does not support the YCbCr mode.')
+
+        img = self._cached('region', path, (self._region, self._encoder_controller.get_dct_backend()), decode_region)
+
+        decoded_path = Util.compute_decoded_path(path)
+        self._save(Parser.save_image, img, decoded_path)
+
+        return decoded_path
+
+    def _preview(self, path:str, max_pixels:int=None) -> Image.Image:
+        '''
+        Load an image to show. A jpug file is decoded straight from the coefficients at the largest scale with at most max_pixels pixels,
+        so that a large image is previewed without decoding it at full size.
+
+        Parameters:
+        @param path: The path of the image or of the jpug file.
+        @param max_pixels: The maximum number of pixels of a decoded jpug file. Default is None (full size).
+
+        @return: The image to show.
+        '''
+        with self._profiler.stage('show', os.path.getsize(path)):
+            return self._preview_file(path, max_pixels)
+
+    def _preview_file(self, path:str, max_pixels:int=None) -> Image.Image:
+        if not path.endswith(Util.JPUG_EXTENSION):
+            mode = self._encoder_controller.get_active_mode()
+            return self._cached('image', path, (mode == Util.Mode.L,), lambda: self._retrieve_image(path).copy())
+
+        def preview() -> Image.Image:
+            jpug = self._load_jpug(path)
+
+            scale = None
+            if max_pixels is not None:
+                scale = Encoder.compute_preview_scale(jpug.get_F(), jpug.get_shape(), max_pixels)
+
+            return self._decode_jpug(jpug, scale)
+
+        return self._cached('preview', path, (max_pixels, self._encoder_controller.get_dct_backend()), preview)
+
+    def convert(self, operation:Util.Operation, path:str) -> str:
+        '''
+        Encode or decode a file, raising the errors instead of returning a message (used by the batch mode).
+
+        Parameters:
+        @param operation: Util.Operation.ENCODE or Util.Operation.DECODE.
+        @param path: The path of the file.
+
+        @return: The path of the file created.
+        '''
+        assert operation in [Util.Operation.ENCODE, Util.Operation.DECODE], 'Only the encode and decode operations convert files.'
+
+        if operation == Util.Operation.ENCODE:
+            return self._encode(path) if self._target is None else self._encode_target(path)[0]
+
+        return self._decode(path)
+
+    def convert_batch(self, operation:Util.Operation, paths:list[str]) -> list:
+        '''
+        Encode or decode several files, transforming the L and RGB images together (see Encoder.encode_batch), e.g. the small
+        images of concurrent requests. The images encoded with the same encoder, or the files decoded with the same parameters,
+        share a single transform; the files not supported by the batches (streaming, target, region, scale, YCbCr, adaptive
+        truncation) are converted one by one. The results are cached and saved as with convert.
+
+        Parameters:
+        @param operation: Util.Operation.ENCODE or Util.Operation.DECODE.
+        @param paths: The paths of the files.
+
+        @return: The list of the results, in the order of the paths: the path of the file created, or the exception raised.
+        '''
+        assert operation in [Util.Operation.ENCODE, Util.Operation.DECODE], 'Only the encode and decode operations convert files.'
+
+        total = 0
+        for path in paths:
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+
+        with self._profiler.stage(operation.name.lower(), total):
+            if operation == Util.Operation.ENCODE:
+                return self._encode_batch(paths)
+
+            return self._decode_batch(paths)
+
+    def _convert_each(self, operation:Util.Operation, paths:list[str], results:list, indices:list[int]) -> None:
+        '''
+        Convert the files at the given indices one by one, storing the results.
+        '''
+        for i in indices:
+            try:
+                results[i] = self._encode_file(paths[i]) if operation == Util.Operation.ENCODE else self._decode_file(paths[i])
+            except Exception as e:
+                results[i] = e
+
+    def _encode_batch(self, paths:list[str]) -> list:
+        results = [None] * len(paths)
+
+        if self._stream_encoder is not None or self._target is not None or self._encoder_controller.get_active_mode() == Util.Mode.YCBCR \
+           or self._encoder_controller.get_max_mse() is not None:
+            self._convert_each(Util.Operation.ENCODE, paths, results, range(len(paths)))
+            return results
+
+        # The images are grouped by encoder: the gray-scaled ones are encoded by the L encoder also in the RGB mode (see _encode_file)
+        groups, single = {}, []
+        for i, path in enumerate(paths):
+            try:
+                img = Parser.load_image(path)
+                if self._encoder_controller.get_active_mode() == Util.Mode.L or img.mode == 'L':
+                    encoder, jpug_class, img = self._encoder_controller.get_l_encoder(), Jpug_L, img.convert('L')
+                elif img.mode == 'RGB':
+                    encoder, jpug_class = self._encoder_controller.get_active_encoder(), Jpug_RGB
+                else:
+                    single.append(i)
+                    continue
+
+                key = self._compute_cache_key('encoded', path, self._compute_encoder_params(encoder))
+                groups.setdefault(jpug_class, (encoder, []))[1].append((i, key, img))
+            except Exception as e:
+                results[i] = e
+
+        for jpug_class, (encoder, items) in groups.items():
+            jpugs = {i: self._cache.get(key) for i, key, _ in items}
+            missing = [(i, key, img) for i, key, img in items if jpugs[i] is None]
+
+            if len(missing) > 0:
+                try:
+                    vs = []
+                    for _, _, img in missing:
+                        with Encoder.PROFILER.stage('pixels', img.width * img.height * len(img.mode)):
+                            vs.append(np.asarray(img))
+
+                    for (i, key, _), v, compressed_v in zip(missing, vs, encoder.encode_batch(vs)):
+                        jpugs[i] = jpug_class(encoder.get_F(), encoder.get_d(), v=compressed_v, shape=v.shape[:2])
+                        self._cache.put(key, jpugs[i])
+                except Exception as e:
+                    for i, _, _ in missing:
+                        results[i] = e
+                    continue
+
+            for i, _, _ in items:
+                try:
+                    encoded_path = Util.compute_encoded_path(paths[i], self._encoder_controller.get_active_mode())
+                    self._save(lambda jpug, file: Parser.save_jpug(jpug, file, self._entropy_coder, self._chunk_coder), jpugs[i], encoded_path)
+                    results[i] = encoded_path
+                except Exception as e:
+                    results[i] = e
+
+        self._convert_each(Util.Operation.ENCODE, paths, results, single)
+
+        return results
+
+    def _decode_batch(self, paths:list[str]) -> list:
+        results = [None] * len(paths)
+
+        if self._stream_encoder is not None or self._region is not None or self._scale is not None:
+            self._convert_each(Util.Operation.DECODE, paths, results, range(len(paths)))
+            return results
+
+        # The files are grouped by the parameters of their coefficients, decoded by the same shared encoder
+        groups, single = {}, []
+        for i, path in enumerate(paths):
+            try:
+                key = self._compute_cache_key('decoded', path, (self._scale, self._encoder_controller.get_dct_backend()))
+                img = self._cache.get(key)
+                if img is not None:
+                    groups.setdefault(None, []).append((i, key, img))
+                    continue
+
+                jpug = self._load_jpug(path)
+                if isinstance(jpug, (Jpug_L, Jpug_RGB)) and isinstance(jpug.get_v(), np.ndarray):
+                    groups.setdefault((type(jpug), jpug.get_F(), jpug.get_d(), jpug.get_v().dtype), []).append((i, key, jpug))
+                else:
+                    single.append(i)
+            except Exception as e:
+                results[i] = e
+
+        for params, items in groups.items():
+            if params is not None:
+                jpug_class, F, d, dtype = params
+                try:
+                    decoder = Encoder.get_instance(F, d, dtype, self._encoder_controller.get_dct_backend(), self._encoder_controller.get_workers())
+                    vs = decoder.decode_batch([jpug.get_v() for _, _, jpug in items])
+                except Exception as e:
+                    for i, _, _ in items:
+                        results[i] = e
+                    continue
+
+                items = [(i, key, Image.fromarray(v, mode='RGB' if jpug_class == Jpug_RGB else 'L')) for (i, key, _), v in zip(items, vs)]
+                for _, key, img in items:
+                    self._cache.put(key, img)
+
+            for i, _, img in items:
+                try:
+                    decoded_path = Util.compute_decoded_path(paths[i])
+                    self._save(Parser.save_image, img, decoded_path)
+                    results[i] = decoded_path
+                except Exception as e:
+                    results[i] = e
+
+        self._convert_each(Util.Operation.DECODE, paths, results, single)
+
+        return results
+
     def _get_result_msg(self, operation:Util.Operation, args:list) -> str:
         '''
         Get the result message of the operation.
@@ -80,13 +767,25 @@ class Controller():
             return args
         
         elif operation == Util.Operation.ENCODE:
+            if isinstance(args, tuple):
+                path, selection, psnr, nbytes = args
+                return Util.ENCODE_MSG.format(path) + '\n' + Util.TARGET_MSG.format(
+                    selection['F'], selection['d'], selection['psnr'], selection['bytes'], psnr, nbytes,
+                    '' if selection['met'] else Util.TARGET_NOT_MET_MSG)
+
             return Util.ENCODE_MSG.format(args)
         
         elif operation == Util.Operation.DECODE:
             return Util.DECODE_MSG.format(args)
         
         elif operation == Util.Operation.STATS:
-            return Util.STATS_MSG.format(args)
+            stats, cache_stats, profile = args
+            msg = Util.STATS_MSG.format(stats) + '\n' + Util.CACHE_STATS_MSG.format(**cache_stats, max_bytes=self._cache.get_max_bytes())
+
+            if profile is not None:
+                msg += '\n' + Util.format_profile(profile)
+
+            return msg
         
         elif operation == Util.Operation.EXIT:
             return Util.EXIT_MSG
@@ -100,7 +799,7 @@ class Controller():
         '''
 
         if operation == Util.Operation.SWITCH_MODE:
-            self._encoder_controller.change_mode()
+            self._encoder_controller.change_mode(args[0] if len(args) > 0 else None)
             result = self._encoder_controller.get_active_mode().name
 
         elif operation == Util.Operation.CHANGE_PARAMS:
@@ -115,11 +814,11 @@ class Controller():
                 return Util.INVALID_PARAMS_MSG.format(F, d)        
         
         elif operation == Util.Operation.SHOW:
-            assert len(args) == 1, Util.INVALID_ARGS_MSG
+            assert len(args) in (1, 2), Util.INVALID_ARGS_MSG
             path = args[0]
             
             try:
-                result = self._retrieve_image(path)
+                result = self._preview(path, args[1] if len(args) > 1 else None)
             except FileNotFoundError:
                 return Util.FILE_NOT_FOUND_MSG.format(path)
             except:
@@ -130,7 +829,7 @@ class Controller():
             path = args[0]
 
             try:
-                result = self._encode(path)
+                result = self._encode(path) if self._target is None else self._encode_target(path)
             except FileNotFoundError:
                 return Util.FILE_NOT_FOUND_MSG.format(path)
             except:
@@ -148,7 +847,8 @@ class Controller():
                 return Util.INVALID_FORMAT_MSG
 
         elif operation == Util.Operation.STATS:
-            result = self._encoder_controller.get_active_encoder().get_stats()
+            profile = self._profiler.get_summary() if self._profiler.is_enabled() else None
+            result = (self._encoder_controller.get_active_encoder().get_stats(), self._cache.get_stats(), profile)
 
         elif operation == Util.Operation.EXIT:
             result = None
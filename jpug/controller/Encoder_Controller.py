@@ -1,8 +1,11 @@
+import numpy as np
+
 import controller.Util as Util
 
 from model.encoder.Encoder import Encoder
 from model.encoder.L_Encoder import L_Encoder
 from model.encoder.RGB_Encoder import RGB_Encoder
+from model.encoder.YCbCr_Encoder import YCbCr_Encoder
 
 class Encoder_Controller:
     instance = None
@@ -17,29 +20,42 @@ class Encoder_Controller:
         '''
         Constructor of the Encoder_Controller class.
 
+        The controller holds only the settings of the encoders: the encoders are the shared, frozen ones returned by
+        get_instance, so changing a setting never modifies an encoder used by another thread.
+
         Parameters:
         @param default_mode: The default mode of the active encoder.
         '''
-        self._rgb_encoder = None
-        self._l_encoder = None
+        self._params = {mode: (Util.DEFAULT_F, Util.DEFAULT_D) for mode in Util.Mode}
+        self._float_dtype = Util.DEFAULT_FLOAT_DTYPE
+        self._dct_backend = Util.DEFAULT_DCT_BACKEND
+        self._workers = Util.DEFAULT_WORKERS
+        self._chroma_params = (Util.DEFAULT_CHROMA_D, Util.DEFAULT_SUBSAMPLING)
+        self._max_mse = None
 
-        self._active_encoder = None
-        
         self._set_mode(default_mode)
 
-    def _initialize_rgb_encoder(self) -> None:
-        '''
-        Initialize the RGB encoder.
+    def _get_encoder(self, mode:Util.Mode, F:int, d:int) -> Encoder:
         '''
+        Get the shared encoder of a mode with the given parameters and the current settings.
 
-        self._rgb_encoder = RGB_Encoder(Util.DEFAULT_F, Util.DEFAULT_D, Util.DEFAULT_FLOAT_DTYPE)
+        Parameters:
+        @param mode: The mode of the encoder.
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal of the block to delete (0-indexed).
 
-    def _initialize_l_encoder(self) -> None:
-        '''
-        Initialize the L encoder.
+        @return: The encoder.
         '''
+        if mode == Util.Mode.L:
+            return L_Encoder.get_instance(F, d, self._float_dtype, self._dct_backend, self._workers, max_mse=self._max_mse)
+
+        elif mode == Util.Mode.RGB:
+            return RGB_Encoder.get_instance(F, d, self._float_dtype, self._dct_backend, self._workers, max_mse=self._max_mse)
 
-        self._l_encoder = L_Encoder(Util.DEFAULT_F, Util.DEFAULT_D, Util.DEFAULT_FLOAT_DTYPE)
+        elif mode == Util.Mode.YCBCR:
+            chroma_d, subsampling = self._chroma_params
+            return YCbCr_Encoder.get_instance(F, d, self._float_dtype, self._dct_backend, self._workers,
+                                              chroma_d=min(chroma_d, 2 * F - 1), subsampling=subsampling)
 
     def _set_mode(self, mode:Util.Mode) -> None:
         '''
@@ -48,31 +64,22 @@ class Encoder_Controller:
         Parameters:
         @param mode: The mode to set.
         '''
-        self._mode = mode
-        self._set_active_encoder()
-
-    def _set_active_encoder(self) -> None:
-        '''
-        Update the active encoder according to self._mode.
-        '''
-        if self._mode == Util.Mode.L:
-            if self._l_encoder is None:
-                self._initialize_l_encoder()
-            self._active_encoder = self._l_encoder
+        assert mode in self._params, f'Unknown mode {mode}.'
 
-        elif self._mode == Util.Mode.RGB:
-            if self._rgb_encoder is None:
-                self._initialize_rgb_encoder()
-            self._active_encoder = self._rgb_encoder
+        self._mode = mode
 
-    def change_mode(self) -> None:
+    def change_mode(self, mode:Util.Mode=None) -> None:
         '''
         Switch the mode of the encoder.
+
+        Parameters:
+        @param mode: The mode to set. Default is None (the next mode, in the order of Util.Mode).
         '''
-        if self._mode == Util.Mode.L:
-            self._set_mode(Util.Mode.RGB)
-        else:
-            self._set_mode(Util.Mode.L)
+        if mode is None:
+            modes = list(Util.Mode)
+            mode = modes[(modes.index(self._mode) + 1) % len(modes)]
+
+        self._set_mode(mode)
 
     def get_active_params(self) -> tuple[int]:
         '''
@@ -80,7 +87,7 @@ class Encoder_Controller:
 
         @return: A tuple with the active parameters of the encoder.
         '''
-        return self._active_encoder.get_params()
+        return self._params[self._mode]
     
     def change_active_params(self, F:int, d:int) -> None:
         '''
@@ -90,8 +97,94 @@ class Encoder_Controller:
         @param F: The size of the blocks.
         @param d: The first antidiagonal of the block to delete (0-indexed).
         '''
-        self._active_encoder.set_params(F, d)
+        self.change_params(self._mode, F, d)
+
+    def change_params(self, mode:Util.Mode, F:int, d:int) -> None:
+        '''
+        Change the parameters of the encoder of a mode.
+
+        Parameters:
+        @param mode: The mode of the encoder.
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal of the block to delete (0-indexed).
+        '''
+        # Getting the encoder validates the parameters before they are stored
+        self._get_encoder(mode, F, d)
+
+        self._params[mode] = (F, d)
     
+    def set_dct_backend(self, name:str) -> None:
+        '''
+        Set the DCT backend of all the encoders.
+
+        Parameters:
+        @param name: The name of a registered backend, or Encoder.AUTO_DCT_BACKEND.
+        '''
+        assert name == Encoder.AUTO_DCT_BACKEND or name in Encoder.DCT_BACKENDS, f'Unknown DCT backend \'{name}\'.'
+
+        self._dct_backend = name
+
+    def get_dct_backend(self) -> str:
+        return self._dct_backend
+
+    def set_float_dtype(self, float_dtype:type) -> None:
+        '''
+        Set the dtype of the coefficients of all the encoders.
+
+        Parameters:
+        @param float_dtype: A floating point type, or one of Encoder.FIXED_DTYPES to store the coefficients in fixed point.
+        '''
+        assert np.issubdtype(float_dtype, np.floating) or float_dtype in Encoder.FIXED_DTYPES, 'The float dtype must be a floating point type, int8 or int16.'
+
+        self._float_dtype = float_dtype
+
+    def get_float_dtype(self) -> type:
+        return self._float_dtype
+
+    def set_workers(self, workers:int) -> None:
+        '''
+        Set the number of threads of all the encoders.
+
+        Parameters:
+        @param workers: The number of threads used to encode and decode.
+        '''
+        assert type(workers) == int and workers > 0, 'The number of workers must be a positive integer.'
+
+        self._workers = workers
+
+    def get_workers(self) -> int:
+        return self._workers
+
+    def change_chroma_params(self, chroma_d:int, subsampling:str) -> None:
+        '''
+        Change the chroma parameters of the YCbCr encoder.
+
+        Parameters:
+        @param chroma_d: The first antidiagonal of the chroma blocks to delete (0-indexed).
+        @param subsampling: The chroma subsampling, '4:4:4', '4:2:2' or '4:2:0'.
+        '''
+        F, d = self._params[Util.Mode.YCBCR]
+        YCbCr_Encoder.get_instance(F, d, self._float_dtype, self._dct_backend, self._workers, chroma_d=chroma_d, subsampling=subsampling)
+
+        self._chroma_params = (chroma_d, subsampling)
+
+    def set_max_mse(self, max_mse:float) -> None:
+        '''
+        Set the adaptive truncation of the L and RGB encoders (see Encoder.set_max_mse).
+
+        Parameters:
+        @param max_mse: The mean squared error allowed to each block, or None to keep d antidiagonals in every block.
+        '''
+        assert max_mse is None or max_mse >= 0, 'The maximum error must be non negative.'
+
+        self._max_mse = max_mse
+
+    def get_max_mse(self) -> float:
+        return self._max_mse
+
+    def get_chroma_params(self) -> tuple:
+        return self._chroma_params
+
     def get_active_mode(self) -> Util.Mode:
         '''
         Get the active mode of the encoder.
@@ -106,7 +199,7 @@ class Encoder_Controller:
 
         @return: The active encoder.
         '''
-        return self._active_encoder
+        return self._get_encoder(self._mode, *self._params[self._mode])
     
     def get_rgb_encoder(self) -> RGB_Encoder:
         '''
@@ -114,11 +207,7 @@ class Encoder_Controller:
 
         @return: The RGB encoder.
         '''
-
-        if self._rgb_encoder is None:
-            self._initialize_rgb_encoder()
-
-        return self._rgb_encoder
+        return self._get_encoder(Util.Mode.RGB, *self._params[Util.Mode.RGB])
     
     def get_l_encoder(self) -> L_Encoder:
         '''
@@ -126,8 +215,12 @@ class Encoder_Controller:
 
         @return: The L encoder.
         '''
+        return self._get_encoder(Util.Mode.L, *self._params[Util.Mode.L])
+    
+    def get_ycbcr_encoder(self) -> YCbCr_Encoder:
+        '''
+        Get the YCbCr encoder.
 
-        if self._l_encoder is None:
-            self._initialize_l_encoder()
-        
-        return self._l_encoder
\ No newline at end of file
+        @return: The YCbCr encoder.
+        '''
+        return self._get_encoder(Util.Mode.YCBCR, *self._params[Util.Mode.YCBCR])
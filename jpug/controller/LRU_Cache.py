@@ -0,0 +1,175 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from model.serialization.Jpug import Jpug
+from model.serialization.Ragged_Plane import Ragged_Plane
+from model.serialization.Fixed_Plane import Fixed_Plane
+
+class LRU_Cache():
+    '''
+    Least recently used cache bounded by the bytes of its values.
+
+    The size of a value is estimated with compute_nbytes: the memory-mapped arrays are not counted, since their pages
+    belong to the page cache of the system and not to the process. When the bytes exceed the budget, or the entries exceed
+    max_entries, the least recently used entries are evicted. The cache can be used by many threads.
+    '''
+
+    DEFAULT_MAX_ENTRIES = 256
+
+    def __init__(self, max_bytes:int, max_entries:int=DEFAULT_MAX_ENTRIES) -> None:
+        '''
+        Constructor of the LRU_Cache class.
+
+        Parameters:
+        @param max_bytes: The maximum number of bytes of the cached values. With 0 nothing is cached.
+        @param max_entries: The maximum number of entries. Default is DEFAULT_MAX_ENTRIES.
+        '''
+
+        assert type(max_bytes) == int and max_bytes >= 0, 'The maximum number of bytes must be a non negative integer.'
+        assert type(max_entries) == int and max_entries > 0, 'The maximum number of entries must be a positive integer.'
+
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def compute_nbytes(value:any) -> int:
+        '''
+        Estimate the memory held by a cached value.
+
+        Parameters:
+        @param value: A numpy array, a PIL Image, a Jpug object, a Ragged_Plane, a Fixed_Plane or a tuple of them.
+
+        @return: The number of bytes.
+        '''
+
+        if isinstance(value, np.memmap):
+            return 0
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, Image.Image):
+            return value.width * value.height * len(value.getbands())
+        if isinstance(value, Ragged_Plane):
+            return LRU_Cache.compute_nbytes((value.get_d_map(), value.get_row_offsets(), value.get_data()))
+        if isinstance(value, Fixed_Plane):
+            return LRU_Cache.compute_nbytes((value.get_scales(), value.get_wide(), value.get_narrow()))
+        if isinstance(value, Jpug):
+            return sum(LRU_Cache.compute_nbytes(plane) for plane in value.get_planes())
+        if isinstance(value, tuple):
+            return sum(LRU_Cache.compute_nbytes(item) for item in value)
+
+        return 0
+
+    def get(self, key:tuple) -> any:
+        '''
+        Get a value, marking it as the most recently used.
+
+        Parameters:
+        @param key: The key of the value.
+
+        @return: The value, or None if it is not cached.
+        '''
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self._misses += 1
+                return None
+
+            self._hits += 1
+            self._entries.move_to_end(key)
+
+            return entry[0]
+
+    def contains(self, key:tuple) -> bool:
+        '''
+        Check if a value is cached, without marking it as the most recently used nor counting a hit or a miss.
+
+        Parameters:
+        @param key: The key of the value.
+
+        @return: True if the value is cached.
+        '''
+
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key:tuple, value:any) -> None:
+        '''
+        Cache a value, evicting the least recently used entries if needed.
+        A value larger than the whole budget is not cached.
+
+        Parameters:
+        @param key: The key of the value.
+        @param value: The value to cache.
+        '''
+
+        nbytes = LRU_Cache.compute_nbytes(value)
+
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+
+            if self._max_bytes == 0 or nbytes > self._max_bytes:
+                return
+
+            self._entries[key] = (value, nbytes)
+            self._bytes += nbytes
+
+            while self._bytes > self._max_bytes or len(self._entries) > self._max_entries:
+                _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                self._bytes -= evicted_nbytes
+                self._evictions += 1
+
+    def invalidate(self, path:str) -> None:
+        '''
+        Remove all the entries of a file, i.e. the keys whose second element is the path.
+
+        Parameters:
+        @param path: The path of the file.
+        '''
+
+        with self._lock:
+            for key in [key for key in self._entries if len(key) > 1 and key[1] == path]:
+                self._bytes -= self._entries.pop(key)[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_max_bytes(self) -> int:
+        return self._max_bytes
+
+    def get_stats(self) -> dict:
+        '''
+        Get the counters of the cache.
+
+        @return: A dictionary with the hits, the misses, the evictions, the entries and the bytes of the cache.
+        '''
+
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes
+            }
+
+    def __str__(self) -> str:
+        return f'LRU_Cache(max_bytes={self._max_bytes}, max_entries={self._max_entries}, entries={len(self._entries)}, bytes={self._bytes})'
+
+    def __repr__(self) -> str:
+        return self.__str__()
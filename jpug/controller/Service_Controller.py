@@ -0,0 +1,347 @@
+import asyncio
+import collections
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import controller.Util as Util
+from controller.Controller import Controller
+
+class Service_Controller():
+    '''
+    Long-running service encoding and decoding files for other processes (e.g. web backends), which share the warm
+    controller (loaded modules, shared encoders, DCT matrices, cache) instead of starting a new program for each file.
+
+    The service listens on a Unix socket or a TCP address and speaks newline-delimited JSON: each request is an object
+    {"id": any, "operation": "encode" | "decode" | "stats", "path": str, "F": int, "d": int, "mode": "L" | "RGB" | "YCbCr"}
+    (the parameters are optional, the configured ones are used by default) and each response an object {"id", "ok", "output",
+    "message", "error", "ms"}, written as soon as the request is completed, so the responses of a connection can be out of order.
+
+    The controller is not thread safe, so it runs on a single thread of an executor (the transforms themselves use the threads
+    set by the workers setting). The small files waiting with the same operation and parameters are coalesced in a batch,
+    transformed at once (see Controller.convert_batch): a batch is flushed after batch_window seconds from its first request,
+    or when it has max_batch requests, and the next batches fill up while one is running. At most max_pending requests are
+    accepted and not completed yet: the connections are not read meanwhile, so the clients are slowed down by their sockets.
+    '''
+
+    DEFAULT_MAX_PENDING = 64
+    DEFAULT_BATCH_WINDOW = 0.002
+    DEFAULT_MAX_BATCH = 32
+    DEFAULT_MAX_BATCH_BYTES = 2 ** 20
+    LATENCY_SAMPLES = 4096
+
+    OPERATIONS = {'encode': Util.Operation.ENCODE, 'decode': Util.Operation.DECODE, 'stats': Util.Operation.STATS}
+
+    def __init__(self, settings:dict, max_pending:int=DEFAULT_MAX_PENDING, batch_window:float=DEFAULT_BATCH_WINDOW,
+                 max_batch:int=DEFAULT_MAX_BATCH, max_batch_bytes:int=DEFAULT_MAX_BATCH_BYTES) -> None:
+        '''
+        Constructor of the Service_Controller class.
+
+        Parameters:
+        @param settings: The settings of the controller (see Controller.configure).
+        @param max_pending: The maximum number of requests accepted and not completed yet. Default is DEFAULT_MAX_PENDING.
+        @param batch_window: The seconds a batch waits for other requests after its first one. Default is DEFAULT_BATCH_WINDOW.
+        @param max_batch: The maximum number of requests of a batch. Default is DEFAULT_MAX_BATCH.
+        @param max_batch_bytes: The size of the largest file coalesced in a batch: the larger ones are converted alone. Default is 1 MB.
+        '''
+        assert type(max_pending) == int and max_pending > 0, 'The maximum number of pending requests must be a positive integer.'
+        assert batch_window >= 0, 'The batch window must be non negative.'
+        assert type(max_batch) == int and max_batch > 0, 'The maximum size of a batch must be a positive integer.'
+
+        self._settings = settings
+        self._max_pending = max_pending
+        self._batch_window = batch_window
+        self._max_batch = max_batch
+        self._max_batch_bytes = max_batch_bytes
+
+        self._controller = Controller()
+        self._controller.configure(settings)
+        self._default_mode = self._controller.get_active_mode()
+        self._default_params = self._controller.get_active_params()
+
+        self._executor = None
+        self._batches = {}
+        self._jobs = None
+        self._slots = None
+
+        self._queued = 0
+        self._running = 0
+        self._pending = 0
+        self._max_queued = 0
+        self._counters = {'requests': 0, 'completed': 0, 'failed': 0, 'batches': 0, 'batched_requests': 0}
+        self._latencies = collections.deque(maxlen=Service_Controller.LATENCY_SAMPLES)
+
+    def get_controller(self) -> Controller:
+        return self._controller
+
+    def get_metrics(self) -> dict:
+        '''
+        Get the metrics of the service.
+
+        @return: A dictionary with the requests queued (waiting for a batch or for the executor), running and accepted and not
+        completed yet, the largest queue seen, the counters of the requests and of the batches, the mean size of the batches
+        and the p50/p90/p99 latencies in milliseconds of the last LATENCY_SAMPLES requests.
+        '''
+        metrics = {
+            'queued': self._queued,
+            'running': self._running,
+            'pending': self._pending,
+            'max_queued': self._max_queued,
+            **self._counters,
+            'mean_batch': self._counters['batched_requests'] / max(self._counters['batches'], 1)
+        }
+
+        latencies = np.array(self._latencies) * 1000
+        for percentile in (50, 90, 99):
+            metrics[f'p{percentile}_ms'] = float(np.percentile(latencies, percentile)) if len(latencies) > 0 else 0.0
+
+        return metrics
+
+    def _compute_key(self, request:dict) -> tuple:
+        '''
+        Compute the key of the batch of a request, validating it.
+
+        @return: (operation, mode, F, d) for an encoding, (operation,) for a decoding (the parameters are read from the file),
+        followed by None for a large file, converted alone, or None for the stats.
+        '''
+        operation = Service_Controller.OPERATIONS.get(request.get('operation'))
+        if operation is None:
+            raise ValueError(f'Invalid operation: {request.get("operation")}')
+        if operation == Util.Operation.STATS:
+            return None
+
+        path = request.get('path')
+        if not isinstance(path, str):
+            raise ValueError('The request must have a path.')
+
+        if operation == Util.Operation.DECODE:
+            key = (operation,)
+        else:
+            try:
+                mode = self._default_mode if request.get('mode') is None else Util.Mode[str(request['mode']).upper()]
+            except KeyError:
+                raise ValueError(f'Invalid mode: {request["mode"]}')
+
+            F, d = request.get('F', self._default_params[0]), request.get('d', self._default_params[1])
+            if type(F) != int or type(d) != int or F <= 0 or not 0 < d <= 2 * F - 1:
+                raise ValueError(Util.INVALID_PARAMS_MSG.format(F, d))
+
+            key = (operation, mode, F, d)
+
+        try:
+            small = os.path.getsize(path) <= self._max_batch_bytes
+        except OSError:
+            small = True
+
+        return key if small else key + (None,)
+
+    def _run_batch(self, key:tuple, requests:list[dict]) -> list:
+        '''
+        Execute a batch of requests on the thread of the executor.
+
+        @return: The list of the results of the requests: a tuple (output, message), or the exception raised.
+        '''
+        if key is None:
+            metrics = self.get_metrics()
+            message = self._controller.execute(Util.Operation.STATS, []) + '\n' + Util.SERVICE_STATS_MSG.format(**metrics)
+            return [(metrics, message)]
+
+        operation = key[0]
+        if operation == Util.Operation.ENCODE:
+            _, mode, F, d = key[:4]
+            self._controller.execute(Util.Operation.SWITCH_MODE, [mode])
+            self._controller.execute(Util.Operation.CHANGE_PARAMS, [F, d])
+
+        paths = [request['path'] for request in requests]
+        try:
+            results = self._controller.convert_batch(operation, paths)
+        except Exception as e:
+            results = [e] * len(paths)
+
+        msg = Util.ENCODE_MSG if operation == Util.Operation.ENCODE else Util.DECODE_MSG
+        return [result if isinstance(result, Exception) else (result, msg.format(result)) for result in results]
+
+    async def _dispatch(self) -> None:
+        '''
+        Execute the batches in order on the executor, resolving the futures of their requests.
+        '''
+        loop = asyncio.get_running_loop()
+
+        while True:
+            key, items = await self._jobs.get()
+            self._queued -= len(items)
+            self._running = len(items)
+            self._counters['batches'] += 1
+            self._counters['batched_requests'] += len(items)
+
+            try:
+                results = await loop.run_in_executor(self._executor, self._run_batch, key, [request for request, _ in items])
+            except Exception as e:
+                results = [e] * len(items)
+
+            self._running = 0
+            for (_, future), result in zip(items, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def _flush(self, key:tuple) -> None:
+        '''
+        Move the batch with the given key to the queue of the executor.
+        '''
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+
+        handle, items = batch
+        if handle is not None:
+            handle.cancel()
+        self._jobs.put_nowait((key, items))
+
+    def _submit(self, request:dict, key:tuple) -> asyncio.Future:
+        '''
+        Add a request to the batch with its key, creating the batch if needed.
+        '''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        self._queued += 1
+        self._max_queued = max(self._max_queued, self._queued)
+
+        # The requests of the stats and the large files are executed alone
+        if key is None or key[-1] is None:
+            self._jobs.put_nowait((key, [(request, future)]))
+            return future
+
+        if key not in self._batches:
+            self._batches[key] = (loop.call_later(self._batch_window, self._flush, key), [])
+
+        items = self._batches[key][1]
+        items.append((request, future))
+        if len(items) >= self._max_batch:
+            self._flush(key)
+
+        return future
+
+    async def _handle_request(self, line:bytes, write) -> None:
+        '''
+        Execute a request and write its response, releasing its slot.
+        '''
+        start = time.perf_counter()
+        self._counters['requests'] += 1
+        request = {}
+        response = {'ok': False, 'output': None, 'message': None, 'error': None}
+
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                request = {}
+                raise ValueError('The request must be a JSON object.')
+
+            key = self._compute_key(request)
+            result = await self._submit(request, key)
+
+            if isinstance(result, Exception):
+                raise result
+
+            output, message = result
+            response.update(ok=True, output=output, message=message)
+        except FileNotFoundError as e:
+            response['error'] = Util.FILE_NOT_FOUND_MSG.format(e.filename if e.filename is not None else request.get('path'))
+        except Exception as e:
+            response['error'] = f'{type(e).__name__}: {e}' if str(e) != '' else type(e).__name__
+        finally:
+            self._pending -= 1
+            self._slots.release()
+
+        seconds = time.perf_counter() - start
+        self._latencies.append(seconds)
+        self._counters['completed' if response['ok'] else 'failed'] += 1
+
+        response['id'] = request.get('id')
+        response['ms'] = seconds * 1000
+        await write(response)
+
+    async def _handle_connection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> None:
+        '''
+        Read the requests of a connection, one line each, while there are free slots.
+        '''
+        lock = asyncio.Lock()
+        tasks = set()
+
+        async def write(response:dict) -> None:
+            async with lock:
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+
+        try:
+            while True:
+                await self._slots.acquire()
+
+                try:
+                    line = await reader.readline()
+                except (ConnectionError, ValueError):
+                    line = b''
+
+                if line.strip() == b'':
+                    self._slots.release()
+                    if line == b'':
+                        break
+                    continue
+
+                self._pending += 1
+                task = asyncio.create_task(self._handle_request(line, write))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            if len(tasks) > 0:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+
+    async def serve(self, address:str, started=None) -> None:
+        '''
+        Run the service until it is cancelled.
+
+        Parameters:
+        @param address: The path of a Unix socket, or host:port of a TCP address.
+        @param started: A function called with the address once the service listens. Default is None.
+        '''
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._jobs = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self._max_pending)
+        dispatcher = asyncio.create_task(self._dispatch())
+
+        host, _, port = address.rpartition(':')
+        if port.isdigit() and os.sep not in address:
+            server = await asyncio.start_server(self._handle_connection, host or None, int(port))
+        else:
+            server = await asyncio.start_unix_server(self._handle_connection, address)
+
+        try:
+            async with server:
+                if started is not None:
+                    started(address)
+                await server.serve_forever()
+        finally:
+            dispatcher.cancel()
+            self._executor.shutdown(wait=True)
+            if not (port.isdigit() and os.sep not in address) and os.path.exists(address):
+                os.remove(address)
+
+    def run(self, address:str, started=None) -> None:
+        '''
+        Run the service until it is interrupted (see serve).
+        '''
+        try:
+            asyncio.run(self.serve(address, started))
+        except KeyboardInterrupt:
+            pass
+
+    def __str__(self) -> str:
+        return f'Service_Controller(max_pending={self._max_pending}, batch_window={self._batch_window}, max_batch={self._max_batch})'
+
+    def __repr__(self) -> str:
+        return self.__str__()
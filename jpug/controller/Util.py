@@ -1,3 +1,4 @@
+import os
 from enum import Enum
 import numpy as np
 
@@ -22,25 +23,136 @@ CHANGE_PARAMS_MSG = 'Parameters changed to F={} and d={}'
 ENCODE_MSG = 'Image encoded at \'{}\' successfully'
 DECODE_MSG = 'Image decoded at \'{}\' successfully'
 STATS_MSG = 'The percentage of elements saved is {}'
+CACHE_STATS_MSG = 'Cache: {hits} hits, {misses} misses, {evictions} evictions, {entries} entries, {bytes} of {max_bytes} bytes'
 EXIT_MSG = 'Exiting...'
+TARGET_MSG = 'Selected F={} and d={}: estimated PSNR {:.2f} dB and {} bytes of coefficients, achieved PSNR {:.2f} dB and {} bytes of file{}'
+TARGET_NOT_MET_MSG = ' (no parameters meet the target, the closest ones were selected)'
+PROFILE_HEADER_MSG = '{:<16}{:>8}{:>12}{:>14}{:>10}{:>14}'
+PROFILE_STAGE_MSG = '{:<16}{:>8}{:>12.2f}{:>14}{:>10.1f}{:>14}'
+PROFILE_SAVED_MSG = 'Profile saved at \'{}\''
 
 INVALID_PARAMS_MSG = 'Invalid parameters: F={} and D={}'
 FILE_NOT_FOUND_MSG = 'File \'{}\' not found'
 INVALID_FORMAT_MSG = 'File format not valid'
 INVALID_ARGS_MSG = 'Invalid number of arguments'
 
+NO_SOURCES_MSG = 'No directory or pattern given'
+BATCH_RESULT_MSG = '[{}/{}] \'{}\' -> \'{}\' ({:.3f} s)'
+BATCH_FAILURE_MSG = 'Failed \'{}\': {}'
+BATCH_SUMMARY_MSG = '{} of {} files completed in {:.3f} s: {:.2f} files/s, {:.2f} MB/s, {} bytes in, {} bytes out'
+
+SEQUENCE_ENCODE_MSG = 'Sequence of {} frames encoded at \'{}\' successfully: {} keyframes, {} of {} blocks stored ({:.1%}), {} bytes'
+SEQUENCE_DECODE_MSG = '{} frames decoded from \'{}\' successfully, from \'{}\' to \'{}\''
+SERVICE_MSG = 'Service listening on \'{}\' (at most {} pending requests, batches of at most {} files within {} ms)'
+SERVICE_STATS_MSG = 'Service: {pending} pending, {queued} queued, {running} running (max queued {max_queued}), {requests} requests, {failed} failed, {batches} batches (mean size {mean_batch:.1f}), latency p50 {p50_ms:.1f} ms, p90 {p90_ms:.1f} ms, p99 {p99_ms:.1f} ms'
+
+BENCHMARK_STAGE_MSG = '{} {:.1f} ms ({:.1f} MP/s)'
+BENCHMARK_RESULT_MSG = '{}: {}, {} bytes ({}), peak RSS {}'
+BENCHMARK_RATIO_MSG = 'ratio {:.2f} at {:.1f} MB/s saving, {:.1f} MB/s loading'
+BENCHMARK_SAVED_MSG = 'Benchmark report saved at \'{}\''
+BENCHMARK_REGRESSION_MSG = 'REGRESSION {}: {} {:.6g} -> {:.6g} ({:+.1%})'
+BENCHMARK_COMPARE_MSG = '{} metrics compared over {} cases, {} regressions above {:.0%}'
+BENCHMARK_STARTUP_MSG = 'startup: import {:.1f} ms (budget {:.0f} ms{}), one-shot encode {:.1f} ms, heavy modules imported: {}'
+BENCHMARK_OVER_BUDGET_MSG = ', OVER BUDGET'
+
 class Mode(Enum):
     L = 'L'
     RGB = 'RGB'
+    YCBCR = 'YCBCR'
 
 DEFAULT_MODE = Mode.RGB
 DEFAULT_F = 8
 DEFAULT_D = 8
+DEFAULT_CHROMA_D = 4
+DEFAULT_SUBSAMPLING = '4:2:0'
 DEFAULT_FLOAT_DTYPE = np.float16
+DEFAULT_DCT_BACKEND = 'fftpack'
+DEFAULT_WORKERS = 1
+DEFAULT_CACHE_MB = 512
+DEFAULT_ADAPTIVE_MSE = 2.0
+DEFAULT_KEYFRAME_INTERVAL = 30
+# The larger images use the calibration of 2^14 blocks (see DCT_Calibration.MAX_BUCKET)
+CALIBRATION_BLOCKS = [1 << k for k in range(8, 15, 2)]
+
+ENTROPY_OPTION = '--entropy'
+CODEC_OPTION = '--codec'
+DTYPE_OPTION = '--dtype'
+DCT_OPTION = '--dct'
+CALIBRATE_OPTION = '--calibrate'
+STREAM_OPTION = '--stream'
+WORKERS_OPTION = '--workers'
+CHROMA_D_OPTION = '--chroma-d'
+SUBSAMPLING_OPTION = '--subsampling'
+BATCH_OPTION = '--batch'
+JOBS_OPTION = '--jobs'
+SCALE_OPTION = '--scale'
+REGION_OPTION = '--region'
+PROFILE_OPTION = '--profile'
+TARGET_PSNR_OPTION = '--target-psnr'
+TARGET_SIZE_OPTION = '--target-size'
+ADAPTIVE_OPTION = '--adaptive'
+BENCHMARK_OPTION = '--benchmark'
+OUTPUT_OPTION = '--output'
+SIZES_OPTION = '--sizes'
+PARAMS_OPTION = '--params'
+DTYPES_OPTION = '--dtypes'
+MODES_OPTION = '--modes'
+REPEAT_OPTION = '--repeat'
+THRESHOLD_OPTION = '--threshold'
+CODECS_OPTION = '--codecs'
+BENCHMARK_OPTIONS = [OUTPUT_OPTION, SIZES_OPTION, PARAMS_OPTION, DTYPES_OPTION, MODES_OPTION, REPEAT_OPTION, THRESHOLD_OPTION, CODECS_OPTION]
+DEFAULT_BENCHMARK_OUTPUT = 'benchmark.json'
+SEQUENCE_OPTION = '--sequence'
+SKIP_MSE_OPTION = '--skip-mse'
+FRAMES_OPTION = '--frames'
+SERVE_OPTION = '--serve'
+MAX_PENDING_OPTION = '--max-pending'
+DEFAULT_SERVICE_ADDRESS = '127.0.0.1:8765'
+DEFAULT_STREAM_MEMORY_BUDGET_MB = 256
 
 JPUG_EXTENSION = '.jpug'
+SEQUENCE_EXTENSION = '.jpugs'
 IMAGE_EXTENSION = '.bmp'
 
+def parse_options(args:list[str]) -> tuple[list[str], dict]:
+    '''
+    Split the command line arguments in positional arguments and options.
+
+    Parameters:
+    @param args: The command line arguments. The options have the form --name or --name=value.
+
+    @return: A tuple (positional arguments, options), where options maps each option name to its value (None if not given).
+    '''
+
+    positional = []
+    options = {}
+
+    for arg in args:
+        if arg.startswith('--'):
+            name, _, value = arg.partition('=')
+            options[name] = value if value != '' else None
+        else:
+            positional.append(arg)
+
+    return positional, options
+
+def format_profile(summary:dict) -> str:
+    '''
+    Format the summary of the stages recorded by the profiler in a table.
+
+    Parameters:
+    @param summary: The summary, as returned by Profiler.get_summary.
+
+    @return: The table, with a row for each stage.
+    '''
+
+    lines = [PROFILE_HEADER_MSG.format('stage', 'count', 'ms', 'bytes', 'MB/s', 'peak bytes')]
+    for name, stage in summary.items():
+        lines.append(PROFILE_STAGE_MSG.format(name, stage['count'], stage['seconds'] * 1000, stage['bytes'], stage['mb_per_s'],
+                                              'n/a' if stage['peak'] is None else stage['peak']))
+
+    return '\n'.join(lines)
+
 def compute_encoded_path(path:str, mode:Mode=None) -> str:
     '''
     Compute the path for a new encoded image.
@@ -69,3 +181,30 @@ def compute_decoded_path(path:str) -> str:
 
     return path[:path.rfind(JPUG_EXTENSION)] + IMAGE_EXTENSION
 
+def compute_sequence_path(source:str) -> str:
+    '''
+    Compute the path for a new sequence file.
+
+    Parameters:
+    @param source: The directory of the frames, or the path of the first frame.
+
+    @return: The path of the new sequence file, next to the directory or the first frame.
+    '''
+
+    source = os.path.normpath(source)
+    if os.path.isdir(source):
+        return source + SEQUENCE_EXTENSION
+
+    return source[:source.rfind(IMAGE_EXTENSION)] + SEQUENCE_EXTENSION
+
+def compute_frame_path_format(path:str) -> str:
+    '''
+    Compute the format of the paths of the frames decoded from a sequence file, to be formatted with the index of the frame.
+
+    Parameters:
+    @param path: The path of the sequence file.
+
+    @return: The format of the paths of the new images decoded.
+    '''
+
+    return path[:path.rfind(SEQUENCE_EXTENSION)].replace('{', '{{').replace('}', '}}') + '_{:05d}' + IMAGE_EXTENSION
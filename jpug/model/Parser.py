@@ -1,13 +1,131 @@
+import os
 import pickle
+import secrets
+import struct
+from contextlib import contextmanager
+import numpy as np
 from PIL import Image
 
 from model.serialization.Jpug import Jpug
+from model.serialization.Jpug_L import Jpug_L
+from model.serialization.Jpug_RGB import Jpug_RGB
+from model.serialization.Jpug_YCbCr import Jpug_YCbCr
+from model.serialization.Entropy_Coder import Entropy_Coder
+from model.serialization.Chunk_Coder import Chunk_Coder
+from model.serialization.Ragged_Plane import Ragged_Plane
+from model.serialization.Fixed_Plane import Fixed_Plane
+from model.Profiler import Profiler
+
+class _Legacy_Unpickler(pickle.Unpickler):
+    '''
+    Unpickler restricted to the classes needed by the legacy (pickle based) jpug files.
+    '''
+
+    ALLOWED_NUMPY_NAMES = {'_reconstruct', 'ndarray', 'dtype', 'scalar', '_frombuffer'}
+    ALLOWED_JPUG_CLASSES = {Jpug_L.__name__: Jpug_L, Jpug_RGB.__name__: Jpug_RGB}
+
+    def find_class(self, module:str, name:str) -> type:
+        if module.split('.')[0] == 'numpy' and name in _Legacy_Unpickler.ALLOWED_NUMPY_NAMES:
+            return super().find_class(module, name)
+
+        if module.startswith('model.serialization.') and name in _Legacy_Unpickler.ALLOWED_JPUG_CLASSES:
+            return _Legacy_Unpickler.ALLOWED_JPUG_CLASSES[name]
+
+        raise pickle.UnpicklingError(f'Forbidden class in legacy jpug file: {module}.{name}')
 
 class Parser():
     '''
     Static class to load and save the Jpug objects.
+
+    The jpug files are saved in a versioned binary container:
+    - a fixed header with the format version, the mode, F, d, the dtype of the coefficients,
+      the block-grid shape and the original image size;
+    - a table describing each coefficient plane (name, dtype, codec, shape, d, chroma subsampling, offset, size);
+    - the coefficient planes, the first one aligned to PLANE_ALIGNMENT bytes.
+      The planes are either raw (RAW_CODEC), entropy coded (ENTROPY_CODEC, see Entropy_Coder), compressed in chunks of rows
+      of blocks with a general-purpose codec (the name of the codec, one of Chunk_Coder.CODECS, see Chunk_Coder), ragged, with
+      a different d for each block (RAGGED_CODEC, see Ragged_Plane.to_buffers) or fixed point, with the scale of each frequency in
+      the header of the plane (FIXED_CODEC, see Fixed_Plane.to_buffers). The raw planes follow each other with no padding, so that
+      the planes of a RGB image are memory-mapped as a single planar array; each other plane is aligned to PLANE_ALIGNMENT bytes.
+
+    The sequences of frames (see Sequence_Encoder) are saved in a sequence container:
+    - a fixed header with the format version, the mode, the number of channels, F, d, the dtype of the coefficients, the block-grid
+      shape, the frame size, the keyframe interval, the error allowed to the blocks not stored, the number of frames and the offset of the index;
+    - the frames, each one aligned to PLANE_ALIGNMENT bytes: a keyframe is the raw (channels, blocks_x, blocks_y, n) coefficients,
+      a delta frame the bitmap of its changed blocks (packed, row-major, padded to 8 bytes) followed by the raw (channels, changed, n)
+      coefficients of the changed blocks;
+    - the index of the frames (offset, bytes, number of blocks stored, keyframe flag), written when the sequence is closed.
     '''
 
+    MAGIC = b'JPUG'
+    VERSION = 3
+
+    HEADER_FORMAT = '<4sHH8s8sIIIIIII'
+    PLANE_FORMATS = {1: '<8s8sB7x4QQQ', 2: '<8s8s8sB7x4QQQ', 3: '<8s8s8sBBBxH2x4QQQ'}
+    PLANE_FORMAT = PLANE_FORMATS[VERSION]
+    PLANE_MAX_NDIM = 4
+    PLANE_ALIGNMENT = 64
+
+    RAW_CODEC = 'raw'
+    ENTROPY_CODEC = 'huffman'
+    RAGGED_CODEC = 'ragged'
+    FIXED_CODEC = 'fixed'
+
+    JPUG_CLASSES = {Jpug_L.MODE: Jpug_L, Jpug_RGB.MODE: Jpug_RGB, Jpug_YCbCr.MODE: Jpug_YCbCr}
+
+    BMP_HEADER_FORMAT = '<2sI4xIIiiHHIIiiII'
+    BMP_FILE_HEADER_SIZE = 14
+    BMP_INFO_HEADER_SIZE = 40
+    BMP_RGB_COMPRESSION = 0
+    BMP_RESOLUTION = 3780
+    BMP_MAP_MIN_BYTES = 2 ** 20
+
+    SEQUENCE_MAGIC = b'JPGS'
+    SEQUENCE_VERSION = 1
+    SEQUENCE_HEADER_FORMAT = '<4sHH8s8sIIIIIIIIdQQ'
+    SEQUENCE_INDEX_DTYPE = np.dtype([('offset', '<u8'), ('nbytes', '<u8'), ('blocks', '<u4'), ('keyframe', 'u1'), ('padding', 'V3')])
+    BITMAP_ALIGNMENT = 8
+
+    PROFILER = Profiler.get_instance()
+
+    # The permissions of the files written, as if created by open: the umask of the process is applied by the system
+    FILE_MODE = 0o666
+
+    @staticmethod
+    @contextmanager
+    def open_atomic(file:str, mode:str='wb'):
+        '''
+        Open a file to write it atomically: the content is written in a temporary file of the same directory, which replaces
+        the file only when it is closed without errors. The readers of the previous content (e.g. through a memory map,
+        also of another thread) keep reading it instead of a truncated file.
+
+        Parameters:
+        @param file: The file to write.
+        @param mode: The mode of the temporary file, 'wb' or 'w+b' (e.g. to memory-map it). Default is 'wb'.
+
+        Returns:
+        A context manager giving the binary file object to write.
+        '''
+
+        directory, name = os.path.split(os.path.abspath(file))
+
+        # Unlike tempfile.mkstemp, which creates the file readable only by the owner, the file has the permissions of open
+        while True:
+            temporary = os.path.join(directory, f'.{name}.{secrets.token_hex(4)}.tmp')
+            try:
+                descriptor = os.open(temporary, os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), Parser.FILE_MODE)
+                break
+            except FileExistsError:
+                pass
+
+        try:
+            with os.fdopen(descriptor, mode) as f:
+                yield f
+            os.replace(temporary, file)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
     @staticmethod
     def load_image(file:str) -> Image.Image:
         '''
@@ -19,7 +137,7 @@ class Parser():
         Returns:
         The Image object representing the image.
         '''
-        
+
         return Image.open(file)
 
     @staticmethod
@@ -31,34 +149,807 @@ class Parser():
         @param image: The image object to save.
         @param file: The file to save the object to.
         '''
-        
-        image.save(file)
+
+        with Parser.PROFILER.stage('save_image', image.width * image.height * len(image.getbands())), Parser.open_atomic(file) as f:
+            image.save(f, format=Image.registered_extensions().get(os.path.splitext(file)[1].lower()))
+
+    @staticmethod
+    def read_bmp_header(file:str) -> dict:
+        '''
+        Read the header of an uncompressed BMP file (8 bits with palette, 24 or 32 bits).
+
+        Parameters:
+        @param file: The BMP file.
+
+        Returns:
+        A dictionary with the width, height, bits per pixel, row size, pixel data offset, orientation,
+        palette and mode ('L' for a gray ramp palette, as PIL does, 'RGB' otherwise) of the image.
+        '''
+
+        with open(file, 'rb') as f:
+            raw = f.read(Parser.BMP_FILE_HEADER_SIZE + Parser.BMP_INFO_HEADER_SIZE)
+            if len(raw) < Parser.BMP_FILE_HEADER_SIZE + Parser.BMP_INFO_HEADER_SIZE or raw[:2] != b'BM':
+                raise ValueError(f'\'{file}\' is not a BMP file.')
+
+            _, _, data_offset, dib_size, width, height, _, bpp, compression, _, _, _, colors, _ = struct.unpack(Parser.BMP_HEADER_FORMAT, raw)
+
+            if dib_size < Parser.BMP_INFO_HEADER_SIZE or compression != Parser.BMP_RGB_COMPRESSION or bpp not in [8, 24, 32]:
+                raise ValueError(f'Unsupported BMP format in \'{file}\'.')
+
+            palette = None
+            if bpp == 8:
+                f.seek(Parser.BMP_FILE_HEADER_SIZE + dib_size)
+                colors = colors if colors > 0 else 256
+                palette = np.frombuffer(f.read(4 * colors), dtype=np.uint8).reshape(colors, 4)[:, 2::-1]
+
+        gray = palette is not None and len(palette) > 1 and np.all(palette == (np.arange(len(palette)) * 255 // (len(palette) - 1))[:, None])
+
+        return {
+            'width': width,
+            'height': abs(height),
+            'bpp': bpp,
+            'row_size': (bpp * width + 31) // 32 * 4,
+            'offset': data_offset,
+            'bottom_up': height > 0,
+            'palette': palette,
+            'mode': 'L' if gray else 'RGB'
+        }
+
+    @staticmethod
+    def read_bmp_rows(f, header:dict, start:int, count:int) -> np.ndarray:
+        '''
+        Read some consecutive rows of pixels of a BMP file.
+
+        Parameters:
+        @param f: The binary file object of the BMP.
+        @param header: The header of the BMP, as returned by read_bmp_header.
+        @param start: The index of the first row (from the top of the image).
+        @param count: The number of rows to read.
+
+        Returns:
+        The (count, width) array of uint8 for the 'L' images, the (count, width, 3) array of uint8 for the 'RGB' ones.
+        '''
+
+        width, height, row_size = header['width'], header['height'], header['row_size']
+
+        first = height - start - count if header['bottom_up'] else start
+        f.seek(header['offset'] + first * row_size)
+        rows = np.frombuffer(f.read(count * row_size), dtype=np.uint8).reshape(count, row_size)
+
+        if header['bottom_up']:
+            rows = rows[::-1]
+
+        if header['bpp'] == 8:
+            indices = rows[:, :width]
+            return header['palette'][indices, 0] if header['mode'] == 'L' else header['palette'][indices]
+
+        channels = header['bpp'] // 8
+        return rows[:, :width * channels].reshape(count, width, channels)[:, :, 2::-1]
+
+    @staticmethod
+    def _view_bmp_rows(rows:np.ndarray, header:dict) -> np.ndarray:
+        '''
+        View the padded rows of a BMP as its pixels, from the top row and with the channels in RGB order, without copying them.
+        The rows of an 8 bits image are returned as the indices of the palette.
+        '''
+
+        width = header['width']
+
+        if header['bottom_up']:
+            rows = rows[::-1]
+
+        if header['bpp'] == 8:
+            return rows[:, :width]
+
+        # Only the last axis is split, so the reshape is a view also of the reversed and padded rows
+        channels = header['bpp'] // 8
+        return rows[:, :width * channels].reshape(rows.shape[0], width, channels)[:, :, 2::-1]
+
+    @staticmethod
+    def map_bmp(file:str) -> np.ndarray:
+        '''
+        Memory-map the pixels of an uncompressed BMP file, without decoding or copying them: the padding of the rows,
+        the bottom-up order and the BGR(X) order of the channels are handled by the strides of the view.
+
+        Parameters:
+        @param file: The BMP file.
+
+        Returns:
+        A read-only (height, width) array of uint8 for a gray-scaled image (8 bits with the 256 gray levels) or (height, width, 3)
+        for a 24 or 32 bits image, or None if the pixels of the file cannot be mapped (not a BMP, compressed, with another palette, ...):
+        it must then be loaded with load_image.
+        '''
+
+        try:
+            header = Parser.read_bmp_header(file)
+        except ValueError:
+            return None
+
+        if header['bpp'] == 8 and (header['mode'] != 'L' or len(header['palette']) != 256):
+            return None
+        if header['width'] <= 0 or header['height'] == 0 or header['offset'] + header['row_size'] * header['height'] > os.path.getsize(file):
+            return None
+
+        rows = np.memmap(file, dtype=np.uint8, mode='r', offset=header['offset'], shape=(header['height'], header['row_size']))
+
+        return Parser._view_bmp_rows(rows, header)
+
+    @staticmethod
+    @contextmanager
+    def create_mapped_bmp(file:str, width:int, height:int, mode:str):
+        '''
+        Create an uncompressed BMP file whose pixels are written through a memory map, e.g. decoded straight into it.
+        The file is written atomically (see open_atomic): it replaces the previous one once the context is closed without errors.
+
+        Parameters:
+        @param file: The BMP file to create.
+        @param width: The width of the image.
+        @param height: The height of the image.
+        @param mode: 'L' for a gray-scaled image, 'RGB' for a colored one (see create_bmp).
+
+        Returns:
+        A context manager giving the writable (height, width) or (height, width, 3) array of the pixels, in the layout of map_bmp.
+        '''
+
+        assert width > 0 and height > 0, 'The image must have at least one pixel.'
+
+        with Parser.open_atomic(file, 'w+b') as f:
+            header = Parser.create_bmp(f, width, height, mode)
+            f.flush()
+
+            rows = np.memmap(f, dtype=np.uint8, mode='r+', offset=header['offset'], shape=(height, header['row_size']))
+            yield Parser._view_bmp_rows(rows, header)
+
+            with Parser.PROFILER.stage('save_image', rows.nbytes):
+                rows.flush()
+            del rows
+
+    @staticmethod
+    def convert_to_l(pixels:np.ndarray) -> np.ndarray:
+        '''
+        Convert RGB pixels to gray-scale, with the same ITU-R 601-2 luma transform of PIL.
+
+        Parameters:
+        @param pixels: The (..., 3) array of uint8 RGB pixels.
+
+        Returns:
+        The (...) array of uint8 gray-scaled pixels.
+        '''
+
+        rgb = pixels.astype(np.uint32)
+
+        return ((rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 + 0x8000) >> 16).astype(np.uint8)
+
+    @staticmethod
+    def create_bmp(f, width:int, height:int, mode:str) -> dict:
+        '''
+        Create an uncompressed bottom-up BMP file, to be filled later with write_bmp_rows.
+
+        Parameters:
+        @param f: The binary file object, opened for writing and positioned at its beginning.
+        @param width: The width of the image.
+        @param height: The height of the image.
+        @param mode: 'L' for a gray-scaled image (8 bits with palette), 'RGB' for a colored one (24 bits).
+
+        Returns:
+        The header of the BMP, as returned by read_bmp_header.
+        '''
+
+        bpp = 8 if mode == 'L' else 24
+        palette = np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1) if mode == 'L' else None
+
+        palette_size = 4 * 256 if mode == 'L' else 0
+        data_offset = Parser.BMP_FILE_HEADER_SIZE + Parser.BMP_INFO_HEADER_SIZE + palette_size
+        row_size = (bpp * width + 31) // 32 * 4
+
+        f.write(struct.pack(Parser.BMP_HEADER_FORMAT,
+            b'BM', data_offset + row_size * height, data_offset, Parser.BMP_INFO_HEADER_SIZE, width, height, 1, bpp,
+            Parser.BMP_RGB_COMPRESSION, row_size * height, Parser.BMP_RESOLUTION, Parser.BMP_RESOLUTION, 256 if mode == 'L' else 0, 256 if mode == 'L' else 0))
+
+        if mode == 'L':
+            f.write(np.concatenate((palette, np.zeros((256, 1), dtype=np.uint8)), axis=1).tobytes())
+
+        f.truncate(data_offset + row_size * height)
+
+        return {
+            'width': width,
+            'height': height,
+            'bpp': bpp,
+            'row_size': row_size,
+            'offset': data_offset,
+            'bottom_up': True,
+            'palette': palette,
+            'mode': mode
+        }
+
+    @staticmethod
+    def write_bmp_rows(f, header:dict, start:int, rows:np.ndarray) -> None:
+        '''
+        Write some consecutive rows of pixels of a BMP file created with create_bmp.
+
+        Parameters:
+        @param f: The binary file object of the BMP.
+        @param header: The header of the BMP, as returned by create_bmp.
+        @param start: The index of the first row (from the top of the image).
+        @param rows: The (count, width) or (count, width, 3) array of uint8 to write.
+        '''
+
+        count = rows.shape[0]
+        width, height, row_size = header['width'], header['height'], header['row_size']
+
+        padded_rows = np.zeros((count, row_size), dtype=np.uint8)
+        if rows.ndim == 2:
+            padded_rows[:, :width] = rows
+        else:
+            padded_rows[:, :width * 3] = rows[:, :, ::-1].reshape(count, width * 3)
+
+        if header['bottom_up']:
+            padded_rows = padded_rows[::-1]
+
+        first = height - start - count if header['bottom_up'] else start
+        f.seek(header['offset'] + first * row_size)
+        f.write(padded_rows.tobytes())
+
+    @staticmethod
+    def _align(offset:int) -> int:
+        '''
+        Round an offset up to the next multiple of PLANE_ALIGNMENT.
+        '''
+
+        return -(-offset // Parser.PLANE_ALIGNMENT) * Parser.PLANE_ALIGNMENT
+
+    @staticmethod
+    def _pack_str(s:str, size:int) -> bytes:
+        encoded = s.encode('ascii')
+        assert len(encoded) <= size, f'The string \'{s}\' is longer than {size} bytes.'
+
+        return encoded
+
+    @staticmethod
+    def _unpack_str(b:bytes) -> str:
+        return b.rstrip(b'\0').decode('ascii')
+
+    @staticmethod
+    def read_header(file:str) -> dict:
+        '''
+        Read only the header and the plane table of a jpug file.
+
+        Parameters:
+        @param file: The file to read the header from.
+
+        Returns:
+        A dictionary with the fields of the header; the planes are described in the 'planes' list.
+        '''
+
+        header_size = struct.calcsize(Parser.HEADER_FORMAT)
+
+        with open(file, 'rb') as f:
+            raw = f.read(header_size)
+            if len(raw) < header_size or raw[:len(Parser.MAGIC)] != Parser.MAGIC:
+                raise ValueError(f'\'{file}\' is not a binary jpug file.')
+
+            magic, version, n_planes, mode, dtype, F, d, blocks_x, blocks_y, n, height, width = struct.unpack(Parser.HEADER_FORMAT, raw)
+
+            if version not in Parser.PLANE_FORMATS:
+                raise ValueError(f'Unsupported jpug version {version}.')
+
+            plane_format = Parser.PLANE_FORMATS[version]
+            plane_size = struct.calcsize(plane_format)
+
+            planes = []
+            for _ in range(n_planes):
+                # Before version 3 all the planes use the d of the header and are not subsampled
+                plane_d, scale_y, scale_x = d, 1, 1
+
+                if version == 1:
+                    name, plane_dtype, ndim, *shape, offset, nbytes = struct.unpack(plane_format, f.read(plane_size))
+                    codec = Parser.RAW_CODEC.encode('ascii')
+                elif version == 2:
+                    name, plane_dtype, codec, ndim, *shape, offset, nbytes = struct.unpack(plane_format, f.read(plane_size))
+                else:
+                    name, plane_dtype, codec, ndim, scale_y, scale_x, plane_d, *shape, offset, nbytes = struct.unpack(plane_format, f.read(plane_size))
+
+                planes.append({
+                    'name': Parser._unpack_str(name),
+                    'dtype': np.dtype(Parser._unpack_str(plane_dtype)),
+                    'codec': Parser._unpack_str(codec),
+                    'shape': tuple(shape[:ndim]),
+                    'd': plane_d,
+                    'scale': (scale_y, scale_x),
+                    'offset': offset,
+                    'nbytes': nbytes
+                })
+
+        return {
+            'version': version,
+            'mode': Parser._unpack_str(mode),
+            'dtype': np.dtype(Parser._unpack_str(dtype)),
+            'F': F,
+            'd': d,
+            'blocks': (blocks_x, blocks_y),
+            'n': n,
+            'shape': (height, width),
+            'planes': planes
+        }
+
+    @staticmethod
+    def _load_legacy_jpug(file:str) -> Jpug:
+        '''
+        Load a Jpug object from a legacy, pickle based, file.
+        Only the Jpug classes and numpy arrays are allowed to be unpickled.
+
+        Parameters:
+        @param file: The file to load the object from.
+
+        Returns:
+        The Jpug object.
+        '''
+
+        with Parser.PROFILER.stage('unpickle', os.path.getsize(file)), open(file, 'rb') as f:
+            jpug = _Legacy_Unpickler(f).load()
+
+        if not hasattr(jpug, '_shape'):
+            blocks_x, blocks_y, _ = jpug.get_planes()[0].shape
+            jpug._set_shape((blocks_x * jpug.get_F(), blocks_y * jpug.get_F()))
+
+        return jpug
 
     @staticmethod
-    def load_jpug(file:str) -> Jpug:
+    def load_jpug(file:str, mmap:bool=True, workers:int=1, rows:tuple[int]=None) -> Jpug:
         '''
         Load a Jpug object from a file.
 
         Parameters:
         @param file: The file to load the object from.
+        @param mmap: If True, the raw coefficient planes are memory-mapped instead of being read in memory. Default is True.
+        @param workers: The number of threads used to decode the entropy coded and the compressed planes. Default is 1.
+        @param rows: The rows of blocks [start, end) to load, for the planes that are not subsampled. The Jpug object holds only
+        the band of the image starting at the pixel row start * F: the raw planes are sliced and only the segments of the entropy
+        coded planes and the chunks of the compressed planes intersecting the rows are decoded. Default is None (the whole image).
 
         Returns:
         The Jpug object.
         '''
-        
+
         with open(file, 'rb') as f:
-            return pickle.load(f)
-        
+            magic = f.read(len(Parser.MAGIC))
+
+        if magic != Parser.MAGIC:
+            jpug = Parser._load_legacy_jpug(file)
+            if rows is None:
+                return jpug
+
+            planes = [plane[rows[0] : rows[1]] for plane in jpug.get_planes()]
+            return type(jpug).from_planes(jpug.get_F(), jpug.get_d(), planes, jpug.get_plane_params(),
+                shape=Parser._compute_band_shape(jpug.get_shape(), jpug.get_F(), rows))
+
+        header = Parser.read_header(file)
+
+        if header['mode'] not in Parser.JPUG_CLASSES:
+            raise ValueError(f'Unsupported jpug mode \'{header["mode"]}\'.')
+        jpug_class = Parser.JPUG_CLASSES[header['mode']]
+
+        if rows is not None:
+            if any(plane['scale'] != (1, 1) for plane in header['planes']):
+                raise ValueError('The rows of blocks cannot be loaded from subsampled planes.')
+
+            blocks_x = header['planes'][0]['shape'][0]
+            assert 0 <= rows[0] <= rows[1] <= blocks_x, f'The rows must be between 0 and {blocks_x}.'
+
+        with Parser.PROFILER.stage('read', 0 if mmap else os.path.getsize(file)):
+            if mmap:
+                buffer = np.memmap(file, dtype=np.uint8, mode='r')
+            else:
+                with open(file, 'rb') as f:
+                    buffer = np.frombuffer(f.read(), dtype=np.uint8)
+
+        planes = {}
+        for plane in header['planes']:
+            data = buffer[plane['offset'] : plane['offset'] + plane['nbytes']]
+
+            if plane['codec'] == Parser.RAW_CODEC:
+                planes[plane['name']] = data.view(plane['dtype']).reshape(plane['shape'])
+                if rows is not None:
+                    planes[plane['name']] = planes[plane['name']][rows[0] : rows[1]]
+            elif plane['codec'] == Parser.RAGGED_CODEC:
+                planes[plane['name']] = Ragged_Plane.from_buffer(data, header['F'], plane['d'], plane['shape'], plane['dtype'], rows=rows)
+            elif plane['codec'] == Parser.FIXED_CODEC:
+                planes[plane['name']] = Fixed_Plane.from_buffer(data, plane['shape'], plane['dtype'], rows=rows)
+            elif plane['codec'] == Parser.ENTROPY_CODEC:
+                with Parser.PROFILER.stage('entropy_decode', plane['nbytes']):
+                    planes[plane['name']] = Entropy_Coder(workers=workers).decode(data, header['F'], plane['d'], plane['dtype'], rows=rows)
+            elif plane['codec'] in Chunk_Coder.CODECS:
+                with Parser.PROFILER.stage('chunk_decode', plane['nbytes']):
+                    planes[plane['name']] = Chunk_Coder(workers=workers).decode(data, plane['dtype'], rows=rows)
+            else:
+                raise ValueError(f'Unsupported codec \'{plane["codec"]}\'.')
+
+        plane_params = {plane['name']: (plane['d'],) + plane['scale'] for plane in header['planes']}
+
+        store = Parser._compute_planar_store(buffer, header)
+        shape = header['shape']
+        if rows is not None:
+            store = None if store is None else store[:, rows[0] : rows[1]]
+            shape = Parser._compute_band_shape(shape, header['F'], rows)
+
+        return jpug_class.from_planes(header['F'], header['d'], [planes[name] for name in jpug_class.PLANES],
+            [plane_params[name] for name in jpug_class.PLANES], shape=shape, store=store)
 
     @staticmethod
-    def save_jpug(jpug:Jpug, file:str) -> None:
+    def _compute_band_shape(shape:tuple[int], F:int, rows:tuple[int]) -> tuple[int]:
+        '''
+        Compute the (height, width) of the band of an image covered by the rows of blocks [start, end).
+        '''
+
+        height, width = shape
+
+        return (max(0, min(height - rows[0] * F, (rows[1] - rows[0]) * F)), width)
+
+    @staticmethod
+    def _compute_planar_store(buffer:np.ndarray, header:dict) -> np.ndarray:
+        '''
+        View the raw planes of a file as a single planar array, if they follow each other with the same dtype and shape.
+
+        Parameters:
+        @param buffer: The content of the file (memory-mapped or in memory).
+        @param header: The header of the file, as returned by read_header.
+
+        Returns:
+        The (planes, blocks_x, blocks_y, n) array, or None if the planes are not contiguous raw planes.
+        '''
+
+        planes = header['planes']
+        first = planes[0]
+
+        if len(planes) == 1:
+            return None
+
+        for previous, plane in zip(planes, planes[1:]):
+            if plane['offset'] != previous['offset'] + previous['nbytes'] or plane['dtype'] != first['dtype'] or plane['shape'] != first['shape']:
+                return None
+
+        if any(plane['codec'] != Parser.RAW_CODEC for plane in planes):
+            return None
+
+        nbytes = sum(plane['nbytes'] for plane in planes)
+
+        return buffer[first['offset'] : first['offset'] + nbytes].view(first['dtype']).reshape((len(planes),) + first['shape'])
+
+    @staticmethod
+    def save_jpug(jpug:Jpug, file:str, entropy_coder:Entropy_Coder=None, chunk_coder:Chunk_Coder=None) -> None:
         '''
         Save a Jpug object to a file.
 
         Parameters:
         @param jpug: The object to save.
         @param file: The file to save the object to.
+        @param entropy_coder: The Entropy_Coder used to code the planes. Default is None (raw planes).
+        @param chunk_coder: The Chunk_Coder used to compress the planes, losslessly, instead of entropy coding them. Default is None (raw planes).
+        The Ragged_Plane and the Fixed_Plane planes are saved as they are, and cannot be entropy coded or compressed.
+        '''
+
+        if entropy_coder is not None and chunk_coder is not None:
+            raise ValueError('The planes cannot be both entropy coded and compressed.')
+
+        if isinstance(jpug.get_planes()[0], Ragged_Plane):
+            if entropy_coder is not None or chunk_coder is not None:
+                raise ValueError('The planes with a different d for each block cannot be entropy coded or compressed.')
+            return Parser._save_plane_objects(jpug, file, Parser.RAGGED_CODEC)
+
+        if isinstance(jpug.get_planes()[0], Fixed_Plane):
+            if entropy_coder is not None or chunk_coder is not None:
+                raise ValueError('The planes stored in fixed point cannot be entropy coded or compressed.')
+            return Parser._save_plane_objects(jpug, file, Parser.FIXED_CODEC)
+
+        with Parser.PROFILER.stage('serialize', sum(plane.nbytes for plane in jpug.get_planes())):
+            planes = [np.ascontiguousarray(plane, dtype=plane.dtype.newbyteorder('<')) for plane in jpug.get_planes()]
+        blocks_x, blocks_y, n = planes[0].shape
+
+        if chunk_coder is not None:
+            codec = chunk_coder.get_codec()
+            with Parser.PROFILER.stage('chunk_encode', sum(plane.nbytes for plane in planes)):
+                data = [memoryview(chunk_coder.encode(plane)) for plane in planes]
+        elif entropy_coder is None:
+            codec = Parser.RAW_CODEC
+            data = [plane.data for plane in planes]
+        else:
+            codec = Parser.ENTROPY_CODEC
+            with Parser.PROFILER.stage('entropy_encode', sum(plane.nbytes for plane in planes)):
+                data = [memoryview(entropy_coder.encode(plane, jpug.get_F(), plane_d)) for plane, (plane_d, _, _) in zip(planes, jpug.get_plane_params())]
+
+        shape = jpug.get_shape()
+        if shape is None:
+            shape = (blocks_x * jpug.get_F(), blocks_y * jpug.get_F())
+
+        with Parser.PROFILER.stage('write', sum(plane_data.nbytes for plane_data in data)), Parser.open_atomic(file) as f:
+            offsets = Parser._write_jpug_header(f, type(jpug), jpug.get_F(), jpug.get_d(), shape,
+                [(plane.dtype, codec, plane.shape, plane_data.nbytes, params) for plane, plane_data, params in zip(planes, data, jpug.get_plane_params())])
+
+            for plane_data, plane_offset in zip(data, offsets):
+                f.write(b'\0' * (plane_offset - f.tell()))
+                f.write(plane_data)
+
+    @staticmethod
+    def _save_plane_objects(jpug:Jpug, file:str, codec:str) -> None:
+        '''
+        Save a Jpug object whose planes are Ragged_Plane objects, each one in a RAGGED_CODEC plane,
+        or Fixed_Plane objects, each one in a FIXED_CODEC plane.
+        '''
+
+        planes = jpug.get_planes()
+
+        with Parser.PROFILER.stage('serialize', sum(plane.nbytes for plane in planes)):
+            data = [plane.to_buffers() for plane in planes]
+        nbytes = [sum(buffer.nbytes for buffer in plane_data) for plane_data in data]
+
+        shape = jpug.get_shape()
+        if shape is None:
+            shape = (planes[0].shape[0] * jpug.get_F(), planes[0].shape[1] * jpug.get_F())
+
+        with Parser.PROFILER.stage('write', sum(nbytes)), Parser.open_atomic(file) as f:
+            offsets = Parser._write_jpug_header(f, type(jpug), jpug.get_F(), jpug.get_d(), shape,
+                [(plane.dtype, codec, plane.shape, plane_nbytes, params) for plane, plane_nbytes, params in zip(planes, nbytes, jpug.get_plane_params())])
+
+            for plane_data, plane_offset in zip(data, offsets):
+                f.write(b'\0' * (plane_offset - f.tell()))
+                for buffer in plane_data:
+                    f.write(buffer)
+
+    @staticmethod
+    def _write_jpug_header(f, jpug_class:type, F:int, d:int, shape:tuple[int], planes:list[tuple]) -> list[int]:
+        '''
+        Write the header and the plane table of a jpug file.
+
+        Parameters:
+        @param f: The binary file object, positioned at its beginning.
+        @param jpug_class: The Jpug class of the file.
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal of the block deleted (0-indexed).
+        @param shape: The (height, width) of the original image.
+        @param planes: A (dtype, codec, shape, nbytes, (d, vertical subsampling, horizontal subsampling)) tuple for each plane,
+        in the order given by jpug_class.PLANES.
+
+        Returns:
+        The offset of each plane in the file.
+        '''
+
+        offset = Parser._align(struct.calcsize(Parser.HEADER_FORMAT) + len(planes) * struct.calcsize(Parser.PLANE_FORMAT))
+        offsets = []
+        for _, codec, _, nbytes, _ in planes:
+            if codec != Parser.RAW_CODEC:
+                offset = Parser._align(offset)
+            offsets.append(offset)
+            offset += nbytes
+
+        dtype, _, (blocks_x, blocks_y, n), _, _ = planes[0]
+        f.write(struct.pack(Parser.HEADER_FORMAT,
+            Parser.MAGIC, Parser.VERSION, len(planes),
+            Parser._pack_str(jpug_class.MODE, 8), Parser._pack_str(np.dtype(dtype).str, 8),
+            F, d, blocks_x, blocks_y, n, shape[0], shape[1]))
+
+        for name, (plane_dtype, codec, plane_shape, nbytes, (plane_d, scale_y, scale_x)), plane_offset in zip(jpug_class.PLANES, planes, offsets):
+            dims = tuple(plane_shape) + (0,) * (Parser.PLANE_MAX_NDIM - len(plane_shape))
+            f.write(struct.pack(Parser.PLANE_FORMAT,
+                Parser._pack_str(name, 8), Parser._pack_str(np.dtype(plane_dtype).str, 8), Parser._pack_str(codec, 8), len(plane_shape),
+                scale_y, scale_x, plane_d, *dims, plane_offset, nbytes))
+
+        return offsets
+
+    @staticmethod
+    def create_jpug(f, jpug_class:type, F:int, d:int, shape:tuple[int], plane_shape:tuple[int], dtype:np.dtype) -> list[int]:
         '''
-        
-        with open(file, 'wb') as f:
-            pickle.dump(jpug, f)
\ No newline at end of file
+        Create a jpug file with raw planes of known shape, to be filled later with write_jpug_rows.
+
+        Parameters:
+        @param f: The binary file object, opened for writing and positioned at its beginning.
+        @param jpug_class: The Jpug class of the file.
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal of the block deleted (0-indexed).
+        @param shape: The (height, width) of the original image.
+        @param plane_shape: The (blocks_x, blocks_y, n) shape of each plane.
+        @param dtype: The dtype of the coefficients.
+
+        Returns:
+        The offset of each plane in the file.
+        '''
+
+        dtype = np.dtype(dtype).newbyteorder('<')
+        nbytes = int(np.prod(plane_shape)) * dtype.itemsize
+
+        offsets = Parser._write_jpug_header(f, jpug_class, F, d, shape, [(dtype, Parser.RAW_CODEC, plane_shape, nbytes, (d, 1, 1))] * len(jpug_class.PLANES))
+        f.truncate(offsets[-1] + nbytes)
+
+        return offsets
+
+    @staticmethod
+    def write_jpug_rows(f, plane_offset:int, rows:np.ndarray, row_start:int) -> None:
+        '''
+        Write some consecutive rows of blocks of a raw plane created with create_jpug.
+
+        Parameters:
+        @param f: The binary file object.
+        @param plane_offset: The offset of the plane in the file.
+        @param rows: The (rows, blocks_y, n) coefficients to write.
+        @param row_start: The index of the first row of blocks to write.
+        '''
+
+        if len(rows) == 0:
+            return
+
+        rows = np.ascontiguousarray(rows, dtype=rows.dtype.newbyteorder('<'))
+
+        f.seek(plane_offset + row_start * rows[0].nbytes)
+        f.write(rows.data)
+
+    @staticmethod
+    def _pack_sequence_header(header:dict) -> bytes:
+        blocks_x, blocks_y = header['blocks']
+        height, width = header['shape']
+
+        return struct.pack(Parser.SEQUENCE_HEADER_FORMAT,
+            Parser.SEQUENCE_MAGIC, Parser.SEQUENCE_VERSION, header['channels'],
+            Parser._pack_str(header['mode'], 8), Parser._pack_str(header['dtype'].str, 8),
+            header['F'], header['d'], blocks_x, blocks_y, header['n'], height, width,
+            header['keyframe_interval'], header['max_mse'], header['frames'], header['index_offset'])
+
+    @staticmethod
+    def create_sequence(f, mode:str, channels:int, F:int, d:int, shape:tuple[int], plane_shape:tuple[int], dtype:np.dtype,
+                        keyframe_interval:int, max_mse:float) -> dict:
+        '''
+        Create a sequence file, to be filled with write_sequence_frame and closed with finish_sequence.
+
+        Parameters:
+        @param f: The binary file object, opened for writing and positioned at its beginning.
+        @param mode: The mode of the frames, 'L' or 'RGB'.
+        @param channels: The number of channels of the frames.
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal of the block deleted (0-indexed).
+        @param shape: The (height, width) of the frames.
+        @param plane_shape: The (blocks_x, blocks_y, n) shape of each plane of the keyframes.
+        @param dtype: The dtype of the coefficients.
+        @param keyframe_interval: The number of frames between two keyframes.
+        @param max_mse: The error allowed to the blocks not stored by the delta frames.
+
+        Returns:
+        The header of the sequence, with the index of the frames written so far in the 'index' list.
+        '''
+
+        header = {
+            'version': Parser.SEQUENCE_VERSION,
+            'mode': mode,
+            'channels': channels,
+            'dtype': np.dtype(dtype).newbyteorder('<'),
+            'F': F,
+            'd': d,
+            'blocks': tuple(plane_shape[:2]),
+            'n': plane_shape[2],
+            'shape': tuple(shape),
+            'keyframe_interval': keyframe_interval,
+            'max_mse': float(max_mse),
+            'frames': 0,
+            'index_offset': 0,
+            'index': []
+        }
+
+        f.write(Parser._pack_sequence_header(header))
+
+        return header
+
+    @staticmethod
+    def write_sequence_frame(f, header:dict, coefficients:np.ndarray, changed:np.ndarray=None) -> None:
+        '''
+        Append a frame to a sequence file created with create_sequence.
+
+        Parameters:
+        @param f: The binary file object, positioned at the end of the previous frame.
+        @param header: The header of the sequence, as returned by create_sequence.
+        @param coefficients: The (channels, blocks_x, blocks_y, n) coefficients of a keyframe, or the (channels, changed, n) coefficients
+        of the changed blocks of a delta frame, in row-major order.
+        @param changed: The (blocks_x, blocks_y) boolean map of the changed blocks of a delta frame. Default is None (a keyframe).
+        '''
+
+        offset = Parser._align(f.tell())
+        f.write(b'\0' * (offset - f.tell()))
+
+        if changed is not None:
+            bitmap = np.packbits(changed, axis=None)
+            f.write(bitmap.tobytes() + b'\0' * (-len(bitmap) % Parser.BITMAP_ALIGNMENT))
+
+        coefficients = np.ascontiguousarray(coefficients, dtype=header['dtype'])
+        f.write(coefficients.data)
+
+        blocks = coefficients.shape[-2] if changed is not None else coefficients.shape[-3] * coefficients.shape[-2]
+        header['index'].append((offset, f.tell() - offset, blocks, changed is None, b''))
+        header['frames'] += 1
+
+    @staticmethod
+    def finish_sequence(f, header:dict) -> None:
+        '''
+        Write the index of the frames of a sequence file and complete its header.
+
+        Parameters:
+        @param f: The binary file object, positioned at the end of the last frame.
+        @param header: The header of the sequence, as returned by create_sequence and updated by write_sequence_frame.
+        '''
+
+        header['index_offset'] = Parser._align(f.tell())
+        f.write(b'\0' * (header['index_offset'] - f.tell()))
+        f.write(np.array(header['index'], dtype=Parser.SEQUENCE_INDEX_DTYPE).tobytes())
+
+        f.seek(0)
+        f.write(Parser._pack_sequence_header(header))
+
+    @staticmethod
+    def read_sequence_header(file:str) -> dict:
+        '''
+        Read the header and the index of a sequence file.
+
+        Parameters:
+        @param file: The file to read the header from.
+
+        Returns:
+        A dictionary with the fields of the header; the frames are described by the 'index' array (see SEQUENCE_INDEX_DTYPE).
+        '''
+
+        header_size = struct.calcsize(Parser.SEQUENCE_HEADER_FORMAT)
+
+        with open(file, 'rb') as f:
+            raw = f.read(header_size)
+            if len(raw) < header_size or raw[:len(Parser.SEQUENCE_MAGIC)] != Parser.SEQUENCE_MAGIC:
+                raise ValueError(f'\'{file}\' is not a jpug sequence file.')
+
+            (_, version, channels, mode, dtype, F, d, blocks_x, blocks_y, n, height, width,
+             keyframe_interval, max_mse, frames, index_offset) = struct.unpack(Parser.SEQUENCE_HEADER_FORMAT, raw)
+
+            if version != Parser.SEQUENCE_VERSION:
+                raise ValueError(f'Unsupported jpug sequence version {version}.')
+            if index_offset == 0:
+                raise ValueError(f'The jpug sequence \'{file}\' was not completed.')
+
+            f.seek(index_offset)
+            index = np.frombuffer(f.read(frames * Parser.SEQUENCE_INDEX_DTYPE.itemsize), dtype=Parser.SEQUENCE_INDEX_DTYPE)
+
+        return {
+            'version': version,
+            'mode': Parser._unpack_str(mode),
+            'channels': channels,
+            'dtype': np.dtype(Parser._unpack_str(dtype)),
+            'F': F,
+            'd': d,
+            'blocks': (blocks_x, blocks_y),
+            'n': n,
+            'shape': (height, width),
+            'keyframe_interval': keyframe_interval,
+            'max_mse': max_mse,
+            'frames': frames,
+            'index_offset': index_offset,
+            'index': index
+        }
+
+    @staticmethod
+    def read_sequence_frame(buffer:np.ndarray, header:dict, frame:int) -> tuple:
+        '''
+        Read a frame of a sequence file, as views of its content.
+
+        Parameters:
+        @param buffer: The content of the file (memory-mapped or in memory), as an array of uint8.
+        @param header: The header of the sequence, as returned by read_sequence_header.
+        @param frame: The index of the frame.
+
+        Returns:
+        A tuple (coefficients, changed): the coefficients of the frame (see write_sequence_frame) and the (blocks_x, blocks_y) boolean
+        map of its changed blocks, None for a keyframe.
+        '''
+
+        entry = header['index'][frame]
+        data = buffer[entry['offset'] : entry['offset'] + entry['nbytes']]
+        channels, (blocks_x, blocks_y), n = header['channels'], header['blocks'], header['n']
+
+        if entry['keyframe']:
+            return data.view(header['dtype']).reshape(channels, blocks_x, blocks_y, n), None
+
+        bitmap_size = -(-blocks_x * blocks_y // 8)
+        changed = np.unpackbits(data[:bitmap_size], count=blocks_x * blocks_y).reshape(blocks_x, blocks_y).astype(bool)
+        coefficients_start = bitmap_size + (-bitmap_size % Parser.BITMAP_ALIGNMENT)
+
+        return data[coefficients_start:].view(header['dtype']).reshape(channels, int(entry['blocks']), n), changed
@@ -0,0 +1,230 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+class Profiler():
+    '''
+    Opt-in instrumentation of the stages of the encoding and decoding pipelines.
+
+    The encoders, the Parser and the Controller wrap each stage in stage(name, nbytes): when the profiler is disabled (the default)
+    it returns a shared no-op context, so the hooks cost only a call. When it is enabled, each stage records an event with its wall
+    time, the bytes it processed and the thread running it and, with the memory profiling, the peak of the memory allocated (traced
+    with tracemalloc) during the stage over the memory allocated at its start. The peaks are measured process-wide, so with many
+    workers the peak of a stage includes the allocations of the stages running at the same time on other threads.
+
+    The events can be summarized by stage (see get_summary) or exported in the Chrome trace format (see export), which can be
+    opened with chrome://tracing or https://ui.perfetto.dev.
+    '''
+
+    instance = None
+
+    MAX_EVENTS = 1 << 20
+    _NO_STAGE = nullcontext()
+
+    @staticmethod
+    def get_instance() -> 'Profiler':
+        if Profiler.instance is None:
+            Profiler.instance = Profiler()
+        return Profiler.instance
+
+    def __init__(self) -> None:
+        self._enabled = False
+        self._memory = False
+        self._events = []
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._open_frames = []
+        self._epoch = time.perf_counter_ns()
+        self._started_tracemalloc = False
+
+    def enable(self, memory:bool=True) -> None:
+        '''
+        Start recording the stages.
+
+        Parameters:
+        @param memory: If True, the allocation peaks are traced with tracemalloc, which slows down the allocations. Default is True.
+        '''
+
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+        self._memory = memory
+        self._enabled = True
+
+    def disable(self) -> None:
+        '''
+        Stop recording the stages, keeping the events recorded so far.
+        '''
+
+        self._enabled = False
+
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def is_enabled(self) -> bool:
+        return self._enabled
+
+    def reset(self) -> None:
+        '''
+        Remove the events recorded so far.
+        '''
+
+        with self._lock:
+            self._events = []
+            self._dropped = 0
+            self._epoch = time.perf_counter_ns()
+
+    def stage(self, name:str, nbytes:int=0):
+        '''
+        Get the context manager recording a stage.
+
+        Parameters:
+        @param name: The name of the stage.
+        @param nbytes: The bytes processed by the stage. Default is 0.
+
+        Returns:
+        A context manager to wrap the stage in.
+        '''
+
+        if not self._enabled:
+            return Profiler._NO_STAGE
+
+        return self._record(name, nbytes)
+
+    @contextmanager
+    def _record(self, name:str, nbytes:int):
+        # The depth of the stage in the stages open on its thread
+        depth = self._local.__dict__.get('depth', 0)
+        self._local.depth = depth + 1
+
+        memory = self._memory and tracemalloc.is_tracing()
+
+        # The memory at the start of the stage and the peak reached so far: since the peak is reset for the new stage,
+        # it is first carried to all the open stages, also of the other threads
+        frame = [0, 0]
+        if memory:
+            with self._lock:
+                current, peak = tracemalloc.get_traced_memory()
+                for open_frame in self._open_frames:
+                    open_frame[1] = max(open_frame[1], peak)
+                tracemalloc.reset_peak()
+
+                frame = [current, current]
+                self._open_frames.append(frame)
+
+        start = time.perf_counter_ns()
+
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            self._local.depth = depth
+
+            peak = None
+            if memory:
+                with self._lock:
+                    if tracemalloc.is_tracing():
+                        frame[1] = max(frame[1], tracemalloc.get_traced_memory()[1])
+                    self._open_frames.remove(frame)
+                peak = frame[1] - frame[0]
+
+            event = {
+                'name': name,
+                'start': (start - self._epoch) / 1e3,
+                'duration': (end - start) / 1e3,
+                'bytes': nbytes,
+                'peak': peak,
+                'depth': depth,
+                'thread': threading.get_ident()
+            }
+
+            with self._lock:
+                if len(self._events) < Profiler.MAX_EVENTS:
+                    self._events.append(event)
+                else:
+                    self._dropped += 1
+
+    def get_events(self) -> list[dict]:
+        '''
+        Get the events recorded, with the start and the duration in microseconds.
+        '''
+
+        with self._lock:
+            return list(self._events)
+
+    def get_summary(self) -> dict:
+        '''
+        Summarize the events by stage.
+
+        @return: A dictionary mapping each stage, in the order of the first event, to the number of events, the total seconds,
+        the total bytes, the throughput in MB/s and the largest allocation peak (None without the memory profiling).
+        '''
+
+        summary = {}
+        for event in self.get_events():
+            stage = summary.setdefault(event['name'], {'count': 0, 'seconds': 0.0, 'bytes': 0, 'peak': None})
+
+            stage['count'] += 1
+            stage['seconds'] += event['duration'] / 1e6
+            stage['bytes'] += event['bytes']
+            if event['peak'] is not None:
+                stage['peak'] = max(stage['peak'] or 0, event['peak'])
+
+        for stage in summary.values():
+            stage['mb_per_s'] = stage['bytes'] / 2 ** 20 / stage['seconds'] if stage['seconds'] > 0 else 0.0
+
+        return summary
+
+    def create_trace(self) -> dict:
+        '''
+        Create the Chrome trace of the events, with the summary of the stages (see get_summary) under 'stages'.
+
+        @return: The trace, in the JSON object format of the Chrome trace events.
+        '''
+
+        pid = os.getpid()
+        threads = {}
+
+        trace_events = []
+        for event in self.get_events():
+            tid = threads.setdefault(event['thread'], len(threads))
+            trace_events.append({
+                'name': event['name'],
+                'cat': 'jpug',
+                'ph': 'X',
+                'ts': event['start'],
+                'dur': event['duration'],
+                'pid': pid,
+                'tid': tid,
+                'args': {'bytes': event['bytes'], 'peak': event['peak']}
+            })
+
+        return {
+            'traceEvents': trace_events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'dropped': self._dropped},
+            'stages': self.get_summary()
+        }
+
+    def export(self, file:str) -> None:
+        '''
+        Export the Chrome trace of the events (see create_trace) to a JSON file.
+
+        Parameters:
+        @param file: The file to write.
+        '''
+
+        with open(file, 'w') as f:
+            json.dump(self.create_trace(), f)
+
+    def __str__(self) -> str:
+        return f'Profiler(enabled={self._enabled}, memory={self._memory}, events={len(self._events)})'
+
+    def __repr__(self) -> str:
+        return self.__str__()
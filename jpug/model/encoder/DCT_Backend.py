@@ -0,0 +1,588 @@
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+
+import numpy as np
+
+from model.encoder.Workspace import Workspace
+
+class DCT_Backend(ABC):
+    '''
+    Abstract class of an engine computing the orthonormal DCT-II (and its inverse) of F x F blocks.
+    The blocks are given in a (blocks_x, blocks_y, F, F) array, or (blocks_x, blocks_y, channels, F, F) for the
+    multi-channel images, and transformed over the last two axes.
+
+    The truncated transforms compute (or use) only the top-left k x k coefficients of each block.
+    By default they compute the full transform; backends able to skip the discarded frequencies override them.
+    The kept transforms compute (or use) only the coefficients kept by the encoder, given by their (rows, cols) indices, on the last axis.
+    By default they go through the k x k corner containing them; backends able to skip the rest of the corner override them.
+
+    The workers argument is the number of threads the backend may use internally; backends without native threading ignore it.
+
+    With a workspace (see Workspace), the truncated transforms write their intermediate and output arrays in its buffers instead of
+    allocating them: the result is a buffer of the workspace, overwritten by the next call with the same workspace.
+
+    The backends based on scipy import it at their first transform, so that the programs not using them (e.g. the CLI rejecting its
+    arguments, or transforming with the matmul backend) do not pay its import.
+    '''
+
+    NAME = None
+    PRECISION = np.float64
+
+    @abstractmethod
+    def forward(self, blocks:np.ndarray, workers:int=1, overwrite:bool=False) -> np.ndarray:
+        '''
+        Compute the DCT2 of each block.
+
+        Parameters:
+        @param blocks: The array of blocks.
+        @param workers: The number of threads. Default is 1.
+        @param overwrite: If True, the blocks may be overwritten, e.g. by the result computed in place. Default is False.
+
+        @return: The transformed blocks, an array of float.
+        '''
+        pass
+
+    @abstractmethod
+    def inverse(self, blocks:np.ndarray, workers:int=1, overwrite:bool=False) -> np.ndarray:
+        '''
+        Compute the inverse DCT2 of each block.
+
+        Parameters:
+        @param blocks: The array of transformed blocks.
+        @param workers: The number of threads. Default is 1.
+        @param overwrite: If True, the blocks may be overwritten, e.g. by the result computed in place. Default is False.
+
+        @return: The blocks, an array of float.
+        '''
+        pass
+
+    @staticmethod
+    def compute_dtype(dtype:np.dtype) -> np.dtype:
+        '''
+        Compute the dtype in which the transforms of scipy compute blocks of the given dtype: float16 is computed in float32,
+        the other floats in their own precision and the integers in float64.
+        '''
+
+        dtype = np.dtype(dtype)
+        if dtype == np.float16:
+            return np.dtype(np.float32)
+
+        return dtype if dtype.kind == 'f' else np.dtype(np.float64)
+
+    def forward_truncated(self, blocks:np.ndarray, k:int, workers:int=1, workspace:Workspace=None) -> np.ndarray:
+        '''
+        Compute the top-left k x k coefficients of the DCT2 of each block.
+        With a workspace, the blocks are copied in one of its float buffers and transformed in place.
+
+        Parameters:
+        @param blocks: The array of F x F blocks.
+        @param k: The number of rows and columns of coefficients to compute.
+        @param workers: The number of threads. Default is 1.
+        @param workspace: The workspace of the buffers. Default is None (the arrays are allocated).
+
+        @return: The transformed blocks, an array of k x k float blocks.
+        '''
+
+        if workspace is None:
+            return self.forward(blocks, workers)[..., :k, :k]
+
+        transformed_blocks = workspace.get('forward', blocks.shape, DCT_Backend.compute_dtype(blocks.dtype))
+        np.copyto(transformed_blocks, blocks)
+
+        return self.forward(transformed_blocks, workers, overwrite=True)[..., :k, :k]
+
+    def inverse_truncated(self, blocks:np.ndarray, F:int, workers:int=1, workspace:Workspace=None) -> np.ndarray:
+        '''
+        Compute the inverse DCT2 of each block, knowing that only its top-left k x k coefficients are not zero.
+        With a workspace, the blocks are padded in one of its float buffers and transformed in place.
+
+        Parameters:
+        @param blocks: The array of the k x k top-left coefficients of the blocks.
+        @param F: The size of the blocks.
+        @param workers: The number of threads. Default is 1.
+        @param workspace: The workspace of the buffers. Default is None (the arrays are allocated).
+
+        @return: The blocks, an array of F x F float blocks.
+        '''
+
+        k = blocks.shape[-1]
+        if workspace is None:
+            if k == F:
+                return self.inverse(blocks, workers)
+
+            padded_blocks = np.zeros(blocks.shape[:-2] + (F, F), dtype=blocks.dtype)
+            padded_blocks[..., :k, :k] = blocks
+
+            return self.inverse(padded_blocks, workers)
+
+        # The buffer is overwritten by the transform, so the frequencies discarded are zeroed again at each call
+        padded_blocks = workspace.get('inverse', blocks.shape[:-2] + (F, F), DCT_Backend.compute_dtype(blocks.dtype))
+        if k < F:
+            padded_blocks.fill(0)
+        np.copyto(padded_blocks[..., :k, :k], blocks)
+
+        return self.inverse(padded_blocks, workers, overwrite=True)
+
+    def forward_kept(self, blocks:np.ndarray, rows:np.ndarray, cols:np.ndarray, workers:int=1, workspace:Workspace=None) -> np.ndarray:
+        '''
+        Compute the coefficients (rows, cols) of the DCT2 of each block.
+        By default the k x k corner containing them is computed with forward_truncated and they are gathered from it.
+
+        Parameters:
+        @param blocks: The array of F x F blocks.
+        @param rows: The rows of the coefficients to compute.
+        @param cols: The columns of the coefficients to compute.
+        @param workers: The number of threads. Default is 1.
+        @param workspace: The workspace of the buffers. Default is None (the arrays are allocated).
+
+        @return: The coefficients of each block on the last axis, an array of float.
+        '''
+
+        k = DCT_Backend.compute_corner_size(rows, cols)
+        corners = self.forward_truncated(blocks, k, workers, workspace)
+
+        if workspace is None:
+            return corners[..., rows, cols]
+
+        # np.take writes in its output without temporaries only from a C-contiguous array, so the corners are made contiguous first
+        if not corners.flags.c_contiguous:
+            contiguous_corners = workspace.get('corners', corners.shape, corners.dtype)
+            np.copyto(contiguous_corners, corners)
+            corners = contiguous_corners
+
+        gathered = workspace.get('gathered', corners.shape[:-2] + (len(rows),), corners.dtype)
+        np.take(corners.reshape(corners.shape[:-2] + (k * k,)), rows * k + cols, axis=-1, out=gathered, mode='clip')
+
+        return gathered
+
+    def inverse_kept(self, coefficients:np.ndarray, rows:np.ndarray, cols:np.ndarray, F:int, workers:int=1, workspace:Workspace=None) -> np.ndarray:
+        '''
+        Compute the inverse DCT2 of each block, knowing that only its coefficients (rows, cols) are not zero.
+        By default they are scattered in the k x k corner containing them, which is transformed with inverse_truncated.
+
+        Parameters:
+        @param coefficients: The coefficients of each block on the last axis.
+        @param rows: The rows of the coefficients.
+        @param cols: The columns of the coefficients.
+        @param F: The size of the blocks.
+        @param workers: The number of threads. Default is 1.
+        @param workspace: The workspace of the buffers. Default is None (the arrays are allocated).
+
+        @return: The blocks, an array of F x F float blocks.
+        '''
+
+        k = DCT_Backend.compute_corner_size(rows, cols)
+
+        # The same entries are written at each call, so the entries of a reused buffer not kept are still zeros
+        shape = coefficients.shape[:-1] + (k, k)
+        dtype = DCT_Backend.compute_dtype(coefficients.dtype)
+        if workspace is None:
+            corners = np.zeros(shape, dtype=dtype)
+        else:
+            corners = workspace.get(f'scattered{k}/{len(rows)}', shape, dtype, zeros=True)
+
+        corners[..., rows, cols] = coefficients
+
+        return self.inverse_truncated(corners, F, workers, workspace)
+
+    @staticmethod
+    def compute_corner_size(rows:np.ndarray, cols:np.ndarray) -> int:
+        '''
+        Compute the size k of the top-left corner of a block containing the coefficients (rows, cols), at least 1.
+        '''
+
+        return int(max(rows.max(initial=0), cols.max(initial=0))) + 1
+
+    def __str__(self) -> str:
+        return f'{type(self).__name__}()'
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+class Scipy_Backend(DCT_Backend):
+    '''
+    Abstract class of the backends computing the DCT2 with the transforms of scipy, over any of the two axes of the blocks.
+
+    The truncated transforms are separable: the forward transform computes the DCT of the rows, keeps their first k frequencies and
+    computes the DCT of only these k columns; the inverse transform computes the inverse DCT of the k columns and then of the rows.
+    So a block costs F + k transforms of size F instead of 2F.
+    '''
+
+    @abstractmethod
+    def transform(self, blocks:np.ndarray, axes:tuple[int], inverse:bool=False, workers:int=1, overwrite:bool=False) -> np.ndarray:
+        '''
+        Compute the DCT2 (or its inverse) of the blocks over the given axes.
+
+        Parameters:
+        @param blocks: The array of blocks.
+        @param axes: The axes to transform, among -2 and -1.
+        @param inverse: If True, the inverse DCT2 is computed. Default is False.
+        @param workers: The number of threads. Default is 1.
+        @param overwrite: If True, the blocks may be overwritten, e.g. by the result computed in place. Default is False.
+
+        @return: The transformed blocks, an array of float.
+        '''
+        pass
+
+    def forward(self, blocks:np.ndarray, workers:int=1, overwrite:bool=False) -> np.ndarray:
+        return self.transform(blocks, (-2, -1), workers=workers, overwrite=overwrite)
+
+    def inverse(self, blocks:np.ndarray, workers:int=1, overwrite:bool=False) -> np.ndarray:
+        return self.transform(blocks, (-2, -1), inverse=True, workers=workers, overwrite=overwrite)
+
+    def forward_truncated(self, blocks:np.ndarray, k:int, workers:int=1, workspace:Workspace=None) -> np.ndarray:
+        F = blocks.shape[-1]
+        if k == F:
+            return super().forward_truncated(blocks, k, workers, workspace)
+
+        if workspace is None:
+            rows_v = self.transform(blocks, (-1,), workers=workers)[..., :k]
+            return self.transform(rows_v, (-2,), workers=workers, overwrite=True)[..., :k, :]
+
+        rows_v = workspace.get('forward', blocks.shape, DCT_Backend.compute_dtype(blocks.dtype))
+        np.copyto(rows_v, blocks)
+        rows_v = self.transform(rows_v, (-1,), workers=workers, overwrite=True)
+
+        columns_v = workspace.get('forward_columns', blocks.shape[:-1] + (k,), rows_v.dtype)
+        np.copyto(columns_v, rows_v[..., :k])
+
+        return self.transform(columns_v, (-2,), workers=workers, overwrite=True)[..., :k, :]
+
+    def inverse_truncated(self, blocks:np.ndarray, F:int, workers:int=1, workspace:Workspace=None) -> np.ndarray:
+        k = blocks.shape[-1]
+        if k == F:
+            return super().inverse_truncated(blocks, F, workers, workspace)
+
+        # The buffers are overwritten by the transforms, so the frequencies discarded are zeroed again at each call
+        dtype = DCT_Backend.compute_dtype(blocks.dtype)
+        if workspace is None:
+            columns_v = np.zeros(blocks.shape[:-2] + (F, k), dtype=dtype)
+            rows_v = np.zeros(blocks.shape[:-2] + (F, F), dtype=dtype)
+        else:
+            columns_v = workspace.get('inverse_columns', blocks.shape[:-2] + (F, k), dtype)
+            columns_v[..., k:, :] = 0
+            rows_v = workspace.get('inverse', blocks.shape[:-2] + (F, F), dtype)
+            rows_v[..., k:] = 0
+
+        np.copyto(columns_v[..., :k, :], blocks)
+        np.copyto(rows_v[..., :k], self.transform(columns_v, (-2,), inverse=True, workers=workers, overwrite=True))
+
+        return self.transform(rows_v, (-1,), inverse=True, workers=workers, overwrite=True)
+
+class Fftpack_Backend(Scipy_Backend):
+    '''
+    DCT2 computed with scipy.fftpack.
+    '''
+
+    NAME = 'fftpack'
+
+    def transform(self, blocks:np.ndarray, axes:tuple[int], inverse:bool=False, workers:int=1, overwrite:bool=False) -> np.ndarray:
+        import scipy.fftpack
+        transform = scipy.fftpack.idctn if inverse else scipy.fftpack.dctn
+        return transform(blocks, axes=axes, type=2, norm='ortho', overwrite_x=overwrite)
+
+class Scipy_Fft_Backend(Scipy_Backend):
+    '''
+    DCT2 computed with scipy.fft (pocketfft), which splits the blocks over its native worker threads.
+    '''
+
+    NAME = 'scipy.fft'
+
+    def transform(self, blocks:np.ndarray, axes:tuple[int], inverse:bool=False, workers:int=1, overwrite:bool=False) -> np.ndarray:
+        import scipy.fft
+        transform = scipy.fft.idctn if inverse else scipy.fft.dctn
+        return transform(blocks, axes=axes, type=2, norm='ortho', workers=workers, overwrite_x=overwrite)
+
+class Matmul_Backend(DCT_Backend):
+    '''
+    DCT2 computed as C @ B @ C.T with the precomputed orthonormal DCT matrix C.
+    Both products are computed over all the blocks at once, as two large matrix products.
+
+    The truncated transforms use only the first k rows of C, so their cost is O(k F^2) per block instead of O(F^3).
+    With a workspace, the products and the transpositions between them are written in its buffers.
+
+    The kept transforms compute the n coefficients of each block in a single product with the basis of the kept frequencies, a
+    F^2 x n matrix, so their cost is O(n F^2) per block and follows the number of coefficients kept. It has more operations than the
+    separable products but no transposition, so it is used up to KEPT_BASIS_RATIO times their operations (measured), and the
+    truncated transforms beyond.
+    '''
+
+    NAME = 'matmul'
+    KEPT_BASIS_RATIO = 5
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def compute_dct_matrix(F:int, dtype:np.dtype=np.float64) -> np.ndarray:
+        '''
+        Compute the orthonormal DCT-II matrix of size F x F.
+
+        Parameters:
+        @param F: The size of the blocks.
+        @param dtype: The dtype of the matrix. Default is np.float64.
+
+        @return: The matrix C, such that C @ x is the DCT of x.
+        '''
+
+        k = np.arange(F)[:, None]
+        n = np.arange(F)[None, :]
+
+        C = np.sqrt(2 / F) * np.cos(np.pi * (2 * n + 1) * k / (2 * F))
+        C[0] /= np.sqrt(2)
+
+        C = C.astype(dtype)
+        C.setflags(write=False)
+
+        return C
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _compute_kept_basis(F:int, rows:bytes, cols:bytes, dtype:np.dtype=np.float64) -> np.ndarray:
+        '''
+        Compute the basis of the kept frequencies, given by the bytes of their int64 (rows, cols) indices so that it is cached.
+
+        Parameters:
+        @param F: The size of the blocks.
+        @param rows: The rows of the kept frequencies.
+        @param cols: The columns of the kept frequencies.
+        @param dtype: The dtype of the basis. Default is np.float64.
+
+        @return: The F^2 x n matrix B, such that block.ravel() @ B are the kept coefficients of the block.
+        '''
+
+        C = Matmul_Backend.compute_dct_matrix(F, dtype)
+        rows, cols = np.frombuffer(rows, dtype=np.int64), np.frombuffer(cols, dtype=np.int64)
+
+        B = np.ascontiguousarray((C[rows][:, :, None] * C[cols][:, None, :]).reshape(len(rows), F * F).T)
+        B.setflags(write=False)
+
+        return B
+
+    @staticmethod
+    def _get_kept_basis(F:int, rows:np.ndarray, cols:np.ndarray, dtype:np.dtype) -> np.ndarray:
+        '''
+        Get the basis of the kept frequencies (see _compute_kept_basis), or None when the truncated transforms cost less
+        (or when no frequency is kept).
+        '''
+
+        k = DCT_Backend.compute_corner_size(rows, cols)
+        if len(rows) == 0 or len(rows) * F * F > Matmul_Backend.KEPT_BASIS_RATIO * (k * F * F + k * k * F):
+            return None
+
+        return Matmul_Backend._compute_kept_basis(F, rows.astype(np.int64).tobytes(), cols.astype(np.int64).tobytes(), np.dtype(dtype))
+
+    @staticmethod
+    def _transform(blocks:np.ndarray, left:np.ndarray, right:np.ndarray, workspace:Workspace=None) -> np.ndarray:
+        '''
+        Compute left @ block @ right for each block with two matrix products over all the blocks.
+        '''
+
+        lead_shape = blocks.shape[:-2]
+        rows_in, cols_in = blocks.shape[-2:]
+        rows_out, cols_out = left.shape[0], right.shape[1]
+
+        if workspace is None:
+            v = np.ascontiguousarray(blocks, dtype=left.dtype).reshape(-1, cols_in) @ right
+            v = v.reshape(-1, rows_in, cols_out).swapaxes(1, 2).reshape(-1, rows_in) @ left.T
+
+            return v.reshape(-1, cols_out, rows_out).swapaxes(1, 2).reshape(lead_shape + (rows_out, cols_out))
+
+        # The same steps, with each intermediate array in a buffer named after its role and shape, so that the buffers of the forward
+        # and of the inverse transforms are both kept when a workspace is used to encode and decode
+        n_blocks = blocks.size // (rows_in * cols_in)
+        get = lambda role, shape: workspace.get(f'matmul_{role}{shape}', shape, left.dtype)
+
+        x = get('input', blocks.shape)
+        np.copyto(x, blocks)
+
+        v = np.matmul(x.reshape(-1, cols_in), right, out=get('right', (n_blocks * rows_in, cols_out)))
+
+        transposed = get('transposed', (n_blocks, cols_out, rows_in))
+        np.copyto(transposed, v.reshape(-1, rows_in, cols_out).swapaxes(1, 2))
+        v = np.matmul(transposed.reshape(-1, rows_in), left.T, out=get('left', (n_blocks * cols_out, rows_out)))
+
+        out = get('output', lead_shape + (rows_out, cols_out))
+        np.copyto(out.reshape(-1, rows_out, cols_out), v.reshape(-1, cols_out, rows_out).swapaxes(1, 2))
+
+        return out
+
+    def forward(self, blocks:np.ndarray, workers:int=1, overwrite:bool=False) -> np.ndarray:
+        return self.forward_truncated(blocks, blocks.shape[-1])
+
+    def inverse(self, blocks:np.ndarray, workers:int=1, overwrite:bool=False) -> np.ndarray:
+        return self.inverse_truncated(blocks, blocks.shape[-1])
+
+    def forward_truncated(self, blocks:np.ndarray, k:int, workers:int=1, workspace:Workspace=None) -> np.ndarray:
+        C = Matmul_Backend.compute_dct_matrix(blocks.shape[-1], self.PRECISION)[:k]
+        return Matmul_Backend._transform(blocks, C, C.T, workspace)
+
+    def inverse_truncated(self, blocks:np.ndarray, F:int, workers:int=1, workspace:Workspace=None) -> np.ndarray:
+        C = Matmul_Backend.compute_dct_matrix(F, self.PRECISION)[:blocks.shape[-1]]
+        return Matmul_Backend._transform(blocks, C.T, C, workspace)
+
+    def forward_kept(self, blocks:np.ndarray, rows:np.ndarray, cols:np.ndarray, workers:int=1, workspace:Workspace=None) -> np.ndarray:
+        F = blocks.shape[-1]
+        B = Matmul_Backend._get_kept_basis(F, rows, cols, self.PRECISION)
+        if B is None:
+            return super().forward_kept(blocks, rows, cols, workers, workspace)
+
+        if workspace is None:
+            x = np.ascontiguousarray(blocks, dtype=B.dtype).reshape(-1, F * F)
+            return (x @ B).reshape(blocks.shape[:-2] + (len(rows),))
+
+        x = workspace.get(f'matmul_input{blocks.shape}', blocks.shape, B.dtype)
+        np.copyto(x, blocks)
+        out = workspace.get(f'matmul_kept{blocks.shape[:-2]}/{len(rows)}', blocks.shape[:-2] + (len(rows),), B.dtype)
+        np.matmul(x.reshape(-1, F * F), B, out=out.reshape(-1, len(rows)))
+
+        return out
+
+    def inverse_kept(self, coefficients:np.ndarray, rows:np.ndarray, cols:np.ndarray, F:int, workers:int=1, workspace:Workspace=None) -> np.ndarray:
+        B = Matmul_Backend._get_kept_basis(F, rows, cols, self.PRECISION)
+        if B is None:
+            return super().inverse_kept(coefficients, rows, cols, F, workers, workspace)
+
+        shape = coefficients.shape[:-1] + (F, F)
+        if workspace is None:
+            x = np.ascontiguousarray(coefficients, dtype=B.dtype).reshape(-1, len(rows))
+            return (x @ B.T).reshape(shape)
+
+        x = workspace.get(f'matmul_kept{coefficients.shape}', coefficients.shape, B.dtype)
+        np.copyto(x, coefficients)
+        out = workspace.get(f'matmul_output{shape}', shape, B.dtype)
+        np.matmul(x.reshape(-1, len(rows)), B.T, out=out.reshape(-1, F * F))
+
+        return out
+
+class Matmul_F32_Backend(Matmul_Backend):
+    '''
+    DCT2 computed as C @ B @ C.T in single precision. Only used for the low precision dtypes.
+    '''
+
+    NAME = 'matmul_f32'
+    PRECISION = np.float32
+
+class DCT_Calibration():
+    '''
+    Table with the fastest DCT backend for each (F, d, dtype, image size), persisted in a json file.
+    d is the first antidiagonal deleted, i.e. the coefficients kept are the ones of the first d antidiagonals.
+    The image size is bucketed by the base 2 logarithm of the number of blocks, and each bucket is measured on its smallest size.
+    The buckets stop at MAX_BUCKET: beyond it the time of the backends grows linearly with the number of blocks, so the choice
+    measured at 2^MAX_BUCKET blocks is extrapolated to the larger images, under the same key.
+    '''
+
+    DEFAULT_FILE = os.path.join(os.path.expanduser('~'), '.jpug', 'dct_calibration.json')
+    MAX_BUCKET = 14
+    REPEAT = 3
+
+    def __init__(self, file:str=DEFAULT_FILE) -> None:
+        '''
+        Constructor of the DCT_Calibration class.
+
+        Parameters:
+        @param file: The file where the table is persisted. Default is DEFAULT_FILE.
+        '''
+
+        self._file = file
+        self._table = None
+
+    def get_file(self) -> str:
+        return self._file
+
+    def get_table(self) -> dict:
+        '''
+        Get the calibration table, loading it from the file the first time.
+
+        @return: A dictionary mapping each key to the name of the fastest backend.
+        '''
+
+        if self._table is None:
+            try:
+                with open(self._file, 'r') as f:
+                    self._table = json.load(f)
+            except (OSError, ValueError):
+                self._table = {}
+
+        return self._table
+
+    def save(self) -> None:
+        '''
+        Persist the calibration table. Errors (e.g. a read-only home) are ignored, the table stays in memory.
+        '''
+
+        try:
+            os.makedirs(os.path.dirname(self._file), exist_ok=True)
+            with open(self._file, 'w') as f:
+                json.dump(self.get_table(), f, indent=4, sort_keys=True)
+        except OSError:
+            pass
+
+    @staticmethod
+    def compute_bucket(n_blocks:int) -> int:
+        return min(max(n_blocks, 1).bit_length() - 1, DCT_Calibration.MAX_BUCKET)
+
+    @staticmethod
+    def compute_key(F:int, d:int, float_dtype:np.dtype, n_blocks:int) -> str:
+        return f'{F}/{d}/{np.dtype(float_dtype).name}/{DCT_Calibration.compute_bucket(n_blocks)}'
+
+    @staticmethod
+    def is_eligible(backend:DCT_Backend, float_dtype:np.dtype) -> bool:
+        '''
+        Check if the precision of the backend is enough for the float dtype of the encoder.
+        '''
+
+        if not np.issubdtype(float_dtype, np.floating):
+            return True
+
+        return np.finfo(backend.PRECISION).resolution <= np.finfo(float_dtype).resolution
+
+    def lookup(self, F:int, d:int, float_dtype:np.dtype, n_blocks:int) -> str:
+        '''
+        Get the fastest backend for the given parameters.
+
+        @return: The name of the backend, or None if the parameters have not been calibrated.
+        '''
+
+        return self.get_table().get(DCT_Calibration.compute_key(F, d, float_dtype, n_blocks))
+
+    def calibrate(self, backends:list[DCT_Backend], F:int, d:int, float_dtype:np.dtype, n_blocks:int, save:bool=True) -> str:
+        '''
+        Measure the encode and decode time of each eligible backend and store the fastest one.
+        The measure uses the number of random blocks of the bucket of n_blocks (see compute_bucket), the best of REPEAT runs is considered.
+
+        Parameters:
+        @param backends: The backends to compare.
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal of the block to delete (0-indexed).
+        @param float_dtype: The float dtype of the encoder.
+        @param n_blocks: The number of blocks of the images.
+        @param save: If True, the table is persisted. Default is True.
+
+        @return: The name of the fastest backend.
+        '''
+
+        n = 1 << DCT_Calibration.compute_bucket(n_blocks)
+        blocks = np.random.default_rng(0).integers(0, 256, (n, 1, F, F), dtype=np.uint8)
+        rows, cols = np.nonzero(np.add.outer(np.arange(F), np.arange(F)) < d)
+
+        timings = {}
+        for backend in backends:
+            if not DCT_Calibration.is_eligible(backend, float_dtype):
+                continue
+
+            best = float('inf')
+            for _ in range(DCT_Calibration.REPEAT):
+                start = time.perf_counter()
+                backend.inverse_kept(backend.forward_kept(blocks, rows, cols).astype(float_dtype), rows, cols, F)
+                best = min(best, time.perf_counter() - start)
+            timings[backend.NAME] = best
+
+        fastest = min(timings, key=timings.get)
+        self.get_table()[DCT_Calibration.compute_key(F, d, float_dtype, n_blocks)] = fastest
+
+        if save:
+            self.save()
+
+        return fastest
@@ -1,25 +1,148 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
 import numpy as np
-from scipy.fftpack import dctn, idctn
+
+from model.Profiler import Profiler
+from model.serialization.Ragged_Plane import Ragged_Plane
+from model.serialization.Fixed_Plane import Fixed_Plane
+from model.encoder.DCT_Backend import DCT_Backend, DCT_Calibration, Fftpack_Backend, Scipy_Fft_Backend, Matmul_Backend, Matmul_F32_Backend
+from model.encoder.Encoder_Session import Encoder_Session
+from model.encoder.Workspace import Workspace
 
 class Encoder():
     '''
     Encoder class for encoding and decoding vectors according to the format.
+
+    The encoding and the decoding do not modify the encoder, so an encoder can be used by many threads at once.
+    get_instance returns shared encoders, which are frozen: their parameters cannot be changed, so that a new
+    encoder is requested instead of modifying one used by other threads.
+
+    The repeated encodings and decodings of vectors of the same shape (e.g. the frames of a video) can reuse all their buffers
+    through a session (see create_session).
+
+    With an integer dtype (one of FIXED_DTYPES) the coefficients are stored in fixed point (see Fixed_Plane): they are computed
+    in float32, quantized with a scale for each frequency at the end of the encoding and dequantized by _decompress.
     '''
 
     DEFAULT_FLOAT_DTYPE = np.float16
+    FIXED_DTYPES = (np.int8, np.int16)
+    FIXED_WORK_DTYPE = np.float32
+    FIXED_MAX_STEP = 2.0
 
-    def __init__(self, F:int=8, d:int=8, float_dtype:np.dtype=DEFAULT_FLOAT_DTYPE) -> None:
+    DCT_BACKENDS = {}
+    DEFAULT_DCT_BACKEND = Fftpack_Backend.NAME
+    AUTO_DCT_BACKEND = 'auto'
+    DCT_CALIBRATION = DCT_Calibration()
+    CALIBRATE_ON_FIRST_USE = False
+    PROFILER = Profiler.get_instance()
+
+    DEFAULT_WORKERS = 1
+    BAND_BLOCKS = 2048
+
+    MAX_INSTANCES = 64
+
+    def __init__(self, F:int=8, d:int=8, float_dtype:np.dtype=DEFAULT_FLOAT_DTYPE, dct_backend:str=DEFAULT_DCT_BACKEND, workers:int=DEFAULT_WORKERS,
+                 max_mse:float=None) -> None:
         ''' 
         Constructor of the Encoder class.
 
         Parameters:
         @param F: The size of the blocks.
         @param d: The first antidiagonal of the block to delete (0-indexed).
-        @param float_dtype: The float dtype of the encoder. Default is np.float32.
+        @param float_dtype: The float dtype of the encoder. Default is DEFAULT_FLOAT_DTYPE.
+        @param dct_backend: The name of the DCT backend, or AUTO_DCT_BACKEND to use the calibrated one. Default is DEFAULT_DCT_BACKEND.
+        @param workers: The number of threads used to encode and decode. Default is 1.
+        @param max_mse: The error allowed to each block to keep fewer antidiagonals than d (see set_max_mse). Default is None (every block keeps d antidiagonals).
         '''
 
+        self._frozen = False
+
         self.set_params(F, d)
         self.set_float_dtype(float_dtype)
+        self.set_dct_backend(dct_backend)
+        self.set_workers(workers)
+        self.set_max_mse(max_mse)
+
+    @classmethod
+    def get_instance(cls, F:int, d:int, float_dtype:np.dtype=DEFAULT_FLOAT_DTYPE, dct_backend:str=DEFAULT_DCT_BACKEND,
+                     workers:int=DEFAULT_WORKERS, **params) -> 'Encoder':
+        '''
+        Get a shared, frozen encoder of this class with the given parameters.
+        The encoders are cached (the MAX_INSTANCES most recently used ones), together with their precomputed tables.
+
+        Parameters:
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal of the block to delete (0-indexed).
+        @param float_dtype: The float dtype of the encoder. Default is DEFAULT_FLOAT_DTYPE.
+        @param dct_backend: The name of the DCT backend, or AUTO_DCT_BACKEND. Default is DEFAULT_DCT_BACKEND.
+        @param workers: The number of threads used to encode and decode. Default is 1.
+        @param params: The other parameters of the constructor of the class.
+
+        @return: The shared encoder.
+        '''
+
+        return Encoder._get_instance(cls, F, d, np.dtype(float_dtype).type, dct_backend, workers, tuple(sorted(params.items())))
+
+    @staticmethod
+    @lru_cache(maxsize=MAX_INSTANCES)
+    def _get_instance(cls:type, F:int, d:int, float_dtype:type, dct_backend:str, workers:int, params:tuple) -> 'Encoder':
+        encoder = cls(F, d, float_dtype=float_dtype, dct_backend=dct_backend, workers=workers, **dict(params))
+        encoder._frozen = True
+
+        return encoder
+
+    def _get_decoder(self, F:int, d:int, float_dtype:np.dtype) -> 'Encoder':
+        '''
+        Get the shared encoder of vectors with the parameters of an encoded image, and the DCT backend and the workers of this encoder.
+
+        Parameters:
+        @param F: The size of the blocks of the encoded image.
+        @param d: The first antidiagonal deleted from the blocks of the encoded image.
+        @param float_dtype: The dtype of the coefficients of the encoded image.
+
+        @return: The shared Encoder.
+        '''
+
+        return Encoder.get_instance(F, d, float_dtype, self._dct_backend, self._workers)
+
+    def is_frozen(self) -> bool:
+
+        return self._frozen
+
+    def _assert_not_frozen(self) -> None:
+        assert not self._frozen, 'The encoder is shared and cannot be modified: use get_instance with the new parameters.'
+
+    @staticmethod
+    def register_dct_backend(backend:DCT_Backend) -> None:
+        '''
+        Register a DCT backend, making it available to all the encoders by its name.
+
+        Parameters:
+        @param backend: The backend to register.
+        '''
+
+        assert isinstance(backend, DCT_Backend), 'The backend must be a DCT_Backend object.'
+        assert backend.NAME != Encoder.AUTO_DCT_BACKEND, f'The name \'{Encoder.AUTO_DCT_BACKEND}\' is reserved.'
+
+        Encoder.DCT_BACKENDS[backend.NAME] = backend
+
+    @staticmethod
+    def calibrate_dct_backends(F:int, d:int, float_dtype:np.dtype, n_blocks:int, save:bool=True) -> str:
+        '''
+        Find the fastest registered DCT backend for the given parameters and store it in DCT_CALIBRATION.
+
+        Parameters:
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal of the block to delete (0-indexed).
+        @param float_dtype: The float dtype of the encoder.
+        @param n_blocks: The number of blocks of the images.
+        @param save: If True, the calibration is persisted. Default is True.
+
+        @return: The name of the fastest backend.
+        '''
+
+        return Encoder.DCT_CALIBRATION.calibrate(list(Encoder.DCT_BACKENDS.values()), F, d, float_dtype, n_blocks, save=save)
 
     def set_params(self, F:int, d:int) -> None:
         '''
@@ -35,22 +158,120 @@ class Encoder():
         
         assert type(F) == int, 'The size of the blocks must be an integer.'
         assert type(d) == int, 'The first antidiagonal to delete must be an integer.'
+        self._assert_not_frozen()
 
         self._F = F
         self._d = d
 
+        # The tables used by every encoding and decoding
+        self._n = self._compute_compressed_n()
+        self._k = Encoder._compute_truncation_size(F, d)
+        self._kept_indices = Encoder._compute_kept_indices(F, d)
+
     def set_float_dtype(self, float_dtype:np.dtype) -> None:
         '''
         Set the float dtype of the encoder.
 
         Parameters:
-        @param float_dtype: The float dtype of the encoder.
+        @param float_dtype: The float dtype of the encoder, or one of FIXED_DTYPES to store the coefficients in fixed point.
         '''
 
-        assert np.issubdtype(float_dtype, np.floating) or float_dtype==np.int8, 'The float dtype must be a floating point type or int8.'
+        assert np.issubdtype(float_dtype, np.floating) or float_dtype in Encoder.FIXED_DTYPES, 'The float dtype must be a floating point type, int8 or int16.'
+        self._assert_not_frozen()
 
         self._float_dtype = float_dtype
 
+    def is_fixed(self) -> bool:
+        '''
+        Check if the coefficients are stored in fixed point, as Fixed_Plane objects.
+        '''
+
+        return self._float_dtype in Encoder.FIXED_DTYPES
+
+    def _get_work_dtype(self) -> np.dtype:
+        '''
+        Get the dtype of the coefficients while they are computed: the float dtype, or FIXED_WORK_DTYPE before their quantization.
+        '''
+
+        return Encoder.FIXED_WORK_DTYPE if self.is_fixed() else self._float_dtype
+
+    def set_dct_backend(self, name:str) -> None:
+        '''
+        Set the DCT backend of the encoder.
+
+        Parameters:
+        @param name: The name of a registered backend, or AUTO_DCT_BACKEND to use the fastest one according to the calibration.
+        '''
+
+        assert name == Encoder.AUTO_DCT_BACKEND or name in Encoder.DCT_BACKENDS, f'Unknown DCT backend \'{name}\'.'
+        self._assert_not_frozen()
+
+        self._dct_backend = name
+
+    def get_dct_backend(self) -> str:
+
+        return self._dct_backend
+
+    def set_workers(self, workers:int) -> None:
+        '''
+        Set the number of threads used to encode and decode.
+        The block grid is split in bands of rows of blocks, processed as independent tasks on a thread pool.
+
+        Parameters:
+        @param workers: The number of threads.
+        '''
+
+        assert type(workers) == int and workers > 0, 'The number of workers must be a positive integer.'
+        self._assert_not_frozen()
+
+        self._workers = workers
+
+    def get_workers(self) -> int:
+
+        return self._workers
+
+    def set_max_mse(self, max_mse:float) -> None:
+        '''
+        Set the adaptive truncation of the blocks: each block keeps the fewest antidiagonals (at least one, at most d) such that the
+        mean squared error added over keeping d antidiagonals is at most max_mse. The encoded vectors are then Ragged_Plane objects,
+        with the d of each block in a d map.
+
+        Parameters:
+        @param max_mse: The mean squared error allowed to each block, in squared pixel values, or None to keep d antidiagonals in every block.
+        '''
+
+        assert max_mse is None or max_mse >= 0, 'The maximum error must be non negative.'
+        self._assert_not_frozen()
+
+        self._max_mse = None if max_mse is None else float(max_mse)
+
+    def get_max_mse(self) -> float:
+
+        return self._max_mse
+
+    def _resolve_dct_backend(self, n_blocks:int) -> DCT_Backend:
+        '''
+        Get the DCT backend to use for an image of n_blocks blocks.
+        With AUTO_DCT_BACKEND, the parameters not calibrated yet (see calibrate_dct_backends) use DEFAULT_DCT_BACKEND, or
+        with CALIBRATE_ON_FIRST_USE they are calibrated on first use, keeping the result in memory without persisting it.
+
+        Parameters:
+        @param n_blocks: The number of blocks of the image.
+
+        @return: The DCT backend.
+        '''
+
+        if self._dct_backend != Encoder.AUTO_DCT_BACKEND:
+            return Encoder.DCT_BACKENDS[self._dct_backend]
+
+        name = Encoder.DCT_CALIBRATION.lookup(self._F, self._d, self._get_work_dtype(), n_blocks)
+        if name not in Encoder.DCT_BACKENDS and Encoder.CALIBRATE_ON_FIRST_USE:
+            name = Encoder.calibrate_dct_backends(self._F, self._d, self._get_work_dtype(), n_blocks, save=False)
+        elif name not in Encoder.DCT_BACKENDS:
+            name = Encoder.DEFAULT_DCT_BACKEND
+
+        return Encoder.DCT_BACKENDS[name]
+
     def get_F(self) -> int:
 
         return self._F
@@ -85,31 +306,34 @@ class Encoder():
         Rearrange the vector to a shape divisible for F.
 
         Parameters:
-        @param v: The input vector to rearrange.
+        @param v: The input vector to rearrange, two dimensional or three dimensional with the channels on the last axis.
 
         @return: The rearranged vector.
         '''
 
-        assert v.ndim == 2, 'The input vector must be two dimensional.'
+        assert v.ndim in (2, 3), 'The input vector must be two or three dimensional.'
 
-        blocks_x, blocks_y = self._compute_rearranged_shape(v.shape)
+        blocks_x, blocks_y = self._compute_rearranged_shape(v.shape[:2])
         return v[:blocks_x, :blocks_y]
 
 
-    def _compute_blocks_vector(self, v:np.ndarray) -> np.ndarray:
+    def _compute_blocks_vector(self, v:np.ndarray, size:int=None) -> np.ndarray:
         '''
         Return the original array divided in blocks of F x F bytes.
+        A three dimensional planar vector (channels, height, width) is divided in a (channels, blocks_x, blocks_y, F, F) view.
 
         Parameters:
         @param v: The input vector to divide in blocks.
+        @param size: The size of the blocks. Default is None (F).
 
         @return: A new vector representing the input vector divided in blocks.
         '''
-        
-        blocks_x = v.shape[0] // self._F
-        blocks_y = v.shape[1] // self._F
 
-        return v.reshape((blocks_x, self._F, blocks_y, self._F)).swapaxes(1, 2)
+        size = self._F if size is None else size
+        blocks_x = v.shape[-2] // size
+        blocks_y = v.shape[-1] // size
+
+        return v.reshape(v.shape[:-2] + (blocks_x, size, blocks_y, size)).swapaxes(-3, -2)
 
     def _compute_vector_from_blocks(self, blocks_v:np.ndarray) -> np.ndarray:
         '''
@@ -142,108 +366,617 @@ class Encoder():
             return int(2 * self._F * self._d - 1/2 * self._d * self._d - self._F * self._F - 1/2 * self._d + self._F)
 
 
-    def _compress(self, v:np.ndarray) -> np.ndarray:
+    @staticmethod
+    def _compute_truncation_size(F:int, d:int) -> int:
         '''
-        Compress the image performing the cut of the frequncies according to d.
+        Compute the number k of rows (and columns) of a block containing kept coefficients.
+        The coefficients in the first d antidiagonals are all in the top-left k x k corner of the block.
 
         Parameters:
-        @param v: The input vector to compress. It must be a four dimensional numpy array of float.
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal of the block to delete (0-indexed).
 
-        @return: The compressed vector. It is a three dimensional array of float.
+        @return: k = min(d, F), at least 1.
         '''
 
-        assert v.ndim == 4, 'The input vector must be four dimensional.'
+        return max(1, min(d, F))
 
-        n = self._compute_compressed_n()
-        compressed_v = np.zeros((v.shape[0], v.shape[1], n), dtype=self.get_float_dtype())
-        mask = np.rot90(np.triu(np.ones((self._F, self._F), dtype=bool), k = self._F - self._d), k=1)
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _compute_kept_indices(F:int, d:int) -> tuple[np.ndarray]:
+        '''
+        Compute the indices of the coefficients kept in a block, i.e. the ones above the d-th antidiagonal.
+        The tables are computed once for each (F, d) and cached.
 
-        for i, row_block in enumerate(v):
-            for j, block in enumerate(row_block):
-                compressed_v[i, j] = block[mask]
+        Parameters:
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal of the block to delete (0-indexed).
 
-        return compressed_v
-    
-    def _triu_secondary_mask(self, matrix, k):
-        matrix[:] = 0
+        @return: A tuple (rows, cols) with the indices of the kept coefficients, in row-major order.
+        '''
+
+        antidiagonals = np.add.outer(np.arange(F), np.arange(F))
+        rows, cols = np.nonzero(antidiagonals < d)
 
-        N = len(matrix)
-        for i in range(min(N, k)):
-            matrix[i, : min(N, k - i)] = 1
+        rows.setflags(write=False)
+        cols.setflags(write=False)
 
-        return matrix
+        return rows, cols
 
-    def _decompress(self, compressed_v:np.ndarray) -> np.ndarray:
+    def _decompress_map(self, size:int=None) -> np.ndarray:
         '''
-        Decompress the image, filling the empty entries with zeros.
+        Compute the boolean map of the kept coefficients in the top-left size x size corner of a block.
 
         Parameters:
-        @param compressed_v: The input vector to decompress. It must be a three dimensional numpy array of float.
+        @param size: The size of the corner. Default is None (the whole block).
 
-        @return: The decompressed vector. It is a four dimensional array of float.
+        @return: The map, or None if all the kept coefficients are in the corner.
         '''
 
-        assert compressed_v.ndim == 3, 'The input vector must be three dimensional.'
+        if size is None or size >= self._k:
+            return None
 
-        v = np.zeros((compressed_v.shape[0], compressed_v.shape[1], self._F, self._F), dtype=self.get_float_dtype())
-        triu_secondary_idx = np.mask_indices(self._F, self._triu_secondary_mask, k = self._d)
+        rows, cols = self._kept_indices
 
-        for i, row_block in enumerate(v):
-            for j, block in enumerate(row_block):
-                block[triu_secondary_idx[0], triu_secondary_idx[1]] = compressed_v[i, j]
+        return (rows < size) & (cols < size)
 
-        return v
- 
+    def _decompress(self, compressed_v:np.ndarray, size:int=None) -> tuple:
+        '''
+        Get the kept coefficients of the blocks in their top-left size x size corner, as a dense array of float, with their indices in the block.
+        The zeros of the other coefficients are not built: the DCT backend writes the coefficients in the blocks (see DCT_Backend.inverse_kept).
+        A Fixed_Plane is dequantized, in one vectorized step for each width of its integers.
 
-    def encode(self, v:np.ndarray) -> np.ndarray:
+        Parameters:
+        @param compressed_v: The input vector to decompress. It must be a numpy array of float, with the coefficients of each block on the last axis, or a Fixed_Plane.
+        @param size: The size of the corner, if smaller than k. Default is None (k).
+
+        @return: A tuple (v, rows, cols) with the coefficients of each block on the last axis and their rows and columns in the block.
         '''
-        Perform the encoding of the input vector v.
+
+        assert compressed_v.ndim >= 3, 'The input vector must be at least three dimensional.'
+
+        rows, cols = self._kept_indices
+        kept = self._decompress_map(size)
+
+        if isinstance(compressed_v, Fixed_Plane):
+            v = compressed_v.to_dense(kept)
+        elif kept is None:
+            v = compressed_v
+        else:
+            v = compressed_v[..., kept]
+
+        if kept is not None:
+            rows, cols = rows[kept], cols[kept]
+
+        return v, rows, cols
+
+    def _compute_bands(self, blocks_x:int, blocks_y:int, channels:int=1) -> list[slice]:
+        '''
+        Split the rows of blocks in bands of about BAND_BLOCKS blocks (over all the channels), small enough to stay in cache.
+        The bands do not depend on the number of workers, so the result is the same for any number of threads.
+
+        Parameters:
+        @param blocks_x: The number of rows of blocks.
+        @param blocks_y: The number of columns of blocks.
+        @param channels: The number of channels transformed together. Default is 1.
+
+        @return: A list of slices over the rows of blocks.
+        '''
+
+        band_rows = max(1, Encoder.BAND_BLOCKS // max(blocks_y * channels, 1))
+
+        return [slice(start, min(start + band_rows, blocks_x)) for start in range(0, blocks_x, band_rows)]
+
+    def _run_tasks(self, tasks:list) -> None:
+        '''
+        Run the tasks, on a thread pool if more than one worker is used.
+        Each task receives the number of threads it can use internally (e.g. the native workers of scipy.fft).
+
+        Parameters:
+        @param tasks: The list of tasks, functions taking the number of threads as argument.
+        '''
+
+        if self._workers == 1 or len(tasks) <= 1:
+            for task in tasks:
+                task(self._workers)
+            return
+
+        task_workers = max(1, self._workers // len(tasks))
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            for future in [executor.submit(task, task_workers) for task in tasks]:
+                future.result()
+
+    def _compute_planar_blocks(self, v:np.ndarray, workspace:Workspace=None) -> np.ndarray:
+        '''
+        Divide the input vector in blocks, cropping it to a shape divisible for F.
 
         Parameters:
-        @param v: The input vector to encode. It must be a two dimensional numpy array of uint8.
+        @param v: The input vector. It must be a numpy array of uint8, two dimensional or three dimensional with the channels on the last axis.
+        @param workspace: The workspace of the buffer of the planar copy of the channels. Default is None (it is allocated).
 
-        @return: The encoded vector. It is a three dimensional array of float.
+        @return: The (blocks_x, blocks_y, F, F) blocks, or the (channels, blocks_x, blocks_y, F, F) blocks of a three dimensional vector.
         '''
 
-        assert v.ndim == 2, 'The input vector must be two dimensional.'
+        assert v.ndim in (2, 3), 'The input vector must be two or three dimensional.'
         assert v.dtype == np.uint8, 'The input vector must be of type uint8.'
-        
-        rearranged_v = self._rearrange_vector(v)
 
-        blocks_v = self._compute_blocks_vector(rearranged_v)
+        with Encoder.PROFILER.stage('rearrange', v.nbytes):
+            rearranged_v = self._rearrange_vector(v)
 
-        transformed_blocks_v = dctn(blocks_v, axes=(2, 3), type=2, norm='ortho')
+            # The channels are split once in a planar copy, so that the blocks of each channel are read contiguously
+            # and the coefficients are written in the same planar order of the compressed vector
+            if rearranged_v.ndim == 3 and workspace is None:
+                rearranged_v = np.ascontiguousarray(rearranged_v.transpose(2, 0, 1))
+            elif rearranged_v.ndim == 3:
+                planar_v = workspace.get('planar', (rearranged_v.shape[2],) + rearranged_v.shape[:2], np.uint8)
+                np.copyto(planar_v, rearranged_v.transpose(2, 0, 1))
+                rearranged_v = planar_v
 
-        if self.get_float_dtype() == np.int8:
-            transformed_blocks_v = np.round(np.clip(transformed_blocks_v, -128, 127)).astype(np.int8)
+            return self._compute_blocks_vector(rearranged_v)
 
-        compressed_blocks_v = self._compress(transformed_blocks_v)
+    def compute_compressed_shape(self, shape:tuple[int]) -> tuple[int]:
+        '''
+        Compute the shape of the encoded vector of a vector.
 
-        return compressed_blocks_v
+        Parameters:
+        @param shape: The shape of the vector, (height, width) or (height, width, channels).
 
-    def decode(self, compressed_v:np.ndarray) -> np.ndarray:
+        @return: The (blocks_x, blocks_y, n) shape, or (channels, blocks_x, blocks_y, n) for a multi-channel vector.
         '''
-        Perform the decoding of the input vector v.
+
+        assert len(shape) in (2, 3), 'The vector must be two or three dimensional.'
+
+        return tuple(shape[2:]) + (shape[0] // self._F, shape[1] // self._F, self._n)
+
+    def _encode_tasks(self, v:np.ndarray, out:np.ndarray=None, workspace:Workspace=None) -> tuple:
+        '''
+        Prepare the encoding of the input vector v, split in independent tasks over bands of rows of blocks.
+        The channels of a three dimensional vector are transformed together, as a (channels, blocks_x, blocks_y, F, F) tensor.
+
+        Parameters:
+        @param v: The input vector to encode. It must be a numpy array of uint8, two dimensional or three dimensional with the channels on the last axis.
+        @param out: The array where the encoded vector is written. Default is None (a new array is allocated).
+        @param workspace: The workspace of the intermediate buffers, each band using its own child workspace. Default is None (they are allocated).
+
+        @return: A tuple (compressed_v, tasks): running all the tasks fills the encoded vector compressed_v.
+        '''
+
+        return self._encode_blocks_tasks(self._compute_planar_blocks(v, workspace), out, workspace)
+
+    def _encode_blocks_tasks(self, blocks_v:np.ndarray, out:np.ndarray=None, workspace:Workspace=None) -> tuple:
+        '''
+        Prepare the encoding of a grid of blocks, split in independent tasks over bands of rows of blocks (see _encode_tasks).
 
         Parameters:
-        @param v: The input vector to decode. It must be a three dimensional numpy array of float.
+        @param blocks_v: The (blocks_x, blocks_y, F, F) or (channels, blocks_x, blocks_y, F, F) blocks of uint8.
+        @param out: The array where the encoded vector is written. Default is None (a new array is allocated).
+        @param workspace: The workspace of the intermediate buffers. Default is None (they are allocated).
 
-        @return: The decoded vector. It is a two dimensional array of uint8.
+        @return: A tuple (compressed_v, tasks): running all the tasks fills the encoded vector compressed_v.
         '''
 
-        assert compressed_v.ndim == 3, 'The input vector must be three dimensional.'
+        blocks_x, blocks_y = blocks_v.shape[-4:-2]
+
+        rows, cols = self._kept_indices
+        backend = self._resolve_dct_backend(blocks_x * blocks_y)
+
+        compressed_shape = blocks_v.shape[:-2] + (self._n,)
+        if out is None:
+            compressed_blocks_v = np.empty(compressed_shape, dtype=self._get_work_dtype())
+        else:
+            assert out.shape == compressed_shape and out.dtype == self._get_work_dtype(), f'The output must be a {compressed_shape} array of {self._get_work_dtype()}.'
+            compressed_blocks_v = out
+
+        channels = 1 if blocks_v.ndim == 4 else blocks_v.shape[0]
+        bands = self._compute_bands(blocks_x, blocks_y, channels)
+
+        # The child workspaces are created here, since the bands run on different threads
+        band_workspaces = {band.start: (None if workspace is None else workspace.get_child(band.start)) for band in bands}
+
+        def encode_band(band:slice, workers:int) -> None:
+            band_blocks_v = blocks_v[..., band, :, :, :]
+            band_workspace = band_workspaces[band.start]
+
+            with Encoder.PROFILER.stage('dct', band_blocks_v.nbytes):
+                kept_blocks_v = backend.forward_kept(band_blocks_v, rows, cols, workers=workers, workspace=band_workspace)
+
+            with Encoder.PROFILER.stage('compress', kept_blocks_v.nbytes):
+                np.copyto(compressed_blocks_v[..., band, :, :], kept_blocks_v, casting='unsafe')
+
+        tasks = [lambda workers, band=band: encode_band(band, workers) for band in bands]
+
+        return compressed_blocks_v, tasks
+
+    @staticmethod
+    def compute_preview_scale(F:int, shape:tuple[int], max_pixels:int) -> int:
+        '''
+        Compute the largest scale such that an image decoded at scale / F of its size has at most max_pixels pixels.
+
+        Parameters:
+        @param F: The size of the blocks.
+        @param shape: The (height, width) of the image.
+        @param max_pixels: The maximum number of pixels of the decoded image.
+
+        @return: The scale, between 1 (one pixel per block) and F (full size).
+        '''
+
+        height, width = shape
+        for scale in range(F, 1, -1):
+            if (height * scale // F) * (width * scale // F) <= max_pixels:
+                return scale
+
+        return 1
+
+    def _decode_tasks(self, compressed_v:np.ndarray, scale:int=None, out:np.ndarray=None, workspace:Workspace=None) -> tuple:
+        '''
+        Prepare the decoding of the input vector, split in independent tasks over bands of rows of blocks.
+
+        With a scale smaller than F, each block is decoded in scale x scale pixels with the inverse DCT of its top-left scale x scale
+        coefficients, multiplied by scale / F to keep the range of the pixels (with the orthonormal DCT the block of size scale has
+        the same mean value). At scale 1 each pixel is the DC coefficient divided by F, i.e. the mean of the block, and no inverse DCT is computed.
+
+        Parameters:
+        @param compressed_v: The input vector to decode. It must be a numpy array of float, three dimensional (blocks_x, blocks_y, n)
+        or four dimensional (channels, blocks_x, blocks_y, n) for the planar multi-channel coefficients, or a Ragged_Plane of the same shape
+        (each band is scattered to the dense coefficients before being transformed), or a Fixed_Plane with the integer dtype of the encoder.
+        @param scale: The size of the decoded blocks, between 1 and F: the image is decoded at scale / F of its size. Default is None (F).
+        @param out: The array of uint8 where the decoded vector is written, with the channels on the last axis if any. Default is None (a new array is allocated).
+        @param workspace: The workspace of the intermediate buffers, each band using its own child workspace. Default is None (they are allocated).
+
+        @return: A tuple (v, tasks): running all the tasks fills the decoded vector v, with the channels on the last axis if any.
+        '''
+
+        assert compressed_v.ndim in (3, 4), 'The input vector must be three or four dimensional.'
         assert compressed_v.dtype == self.get_float_dtype(), f'The input vector must be of type {self.get_float_dtype()}.'
+        assert isinstance(compressed_v, Fixed_Plane) == self.is_fixed(), 'The coefficients stored in fixed point must be a Fixed_Plane.'
+        assert scale is None or (type(scale) == int and 1 <= scale <= self._F), f'The scale must be an integer between 1 and F = {self._F}.'
+
+        scale = self._F if scale is None else scale
+        blocks_x, blocks_y = compressed_v.shape[-3:-1]
+
+        # The channels are decoded in a planar vector and interleaved through a transposed view
+        planar_shape = compressed_v.shape[:-3] + (blocks_x * scale, blocks_y * scale)
+        if out is None:
+            v = np.empty(planar_shape, dtype=np.uint8)
+        else:
+            v = out if out.ndim == 2 else out.transpose(2, 0, 1)
+            assert v.shape == planar_shape and v.dtype == np.uint8, f'The output must be a {planar_shape[-2:] + planar_shape[:-2]} array of uint8.'
+
+        blocks_out = self._compute_blocks_vector(v, scale)
+        assert np.may_share_memory(blocks_out, v), 'The output cannot be divided in blocks without a copy.'
+
+        tasks = self._decode_blocks_tasks(compressed_v, blocks_out, scale, workspace)
+
+        return (v if v.ndim == 2 else v.transpose(1, 2, 0)), tasks
+
+    def _decode_blocks_tasks(self, compressed_v:np.ndarray, blocks_out:np.ndarray, scale:int, workspace:Workspace=None) -> list:
+        '''
+        Prepare the decoding of a grid of encoded blocks, split in independent tasks over bands of rows of blocks (see _decode_tasks).
+
+        Parameters:
+        @param compressed_v: The (blocks_x, blocks_y, n) or (channels, blocks_x, blocks_y, n) encoded blocks, or a Ragged_Plane or a Fixed_Plane.
+        @param blocks_out: The (..., blocks_x, blocks_y, scale, scale) array of uint8 where the decoded blocks are written.
+        @param scale: The size of the decoded blocks, between 1 and F.
+        @param workspace: The workspace of the intermediate buffers. Default is None (they are allocated).
+
+        @return: The tasks: running all of them fills blocks_out.
+        '''
+
+        F = self._F
+        blocks_x, blocks_y = compressed_v.shape[-3:-1]
+        backend = self._resolve_dct_backend(blocks_x * blocks_y)
+
+        channels = 1 if compressed_v.ndim == 3 else compressed_v.shape[0]
+        bands = self._compute_bands(blocks_x, blocks_y, channels)
+        band_workspaces = {band.start: (None if workspace is None else workspace.get_child(band.start)) for band in bands}
+
+        def decode_band(band:slice, workers:int) -> None:
+            band_workspace = band_workspaces[band.start]
+
+            if isinstance(compressed_v, Ragged_Plane):
+                with Encoder.PROFILER.stage('scatter', compressed_v.nbytes * (band.stop - band.start) // max(blocks_x, 1)):
+                    band_compressed_v = compressed_v.to_dense(band)
+            elif isinstance(compressed_v, Fixed_Plane):
+                band_compressed_v = compressed_v.crop(band)
+            else:
+                band_compressed_v = compressed_v[..., band, :, :]
+
+            if scale == 1 and self._d > 0 and isinstance(band_compressed_v, Fixed_Plane):
+                blocks_v = band_compressed_v.to_dense(self._decompress_map(1))[..., np.newaxis] / F
+            elif scale == 1 and self._d > 0:
+                # The DC coefficient is the first kept one
+                blocks_v = band_compressed_v[..., :1, np.newaxis].astype(np.float32) / F
+            else:
+                with Encoder.PROFILER.stage('decompress', band_compressed_v.nbytes):
+                    kept_blocks_v, rows, cols = self._decompress(band_compressed_v, scale)
+
+                with Encoder.PROFILER.stage('idct', kept_blocks_v.nbytes):
+                    blocks_v = backend.inverse_kept(kept_blocks_v, rows, cols, scale, workers=workers, workspace=band_workspace)
+
+                    if scale < F:
+                        blocks_v *= scale / F
+
+            # The blocks are a new array or a buffer of the workspace, so they are rounded in place
+            with Encoder.PROFILER.stage('clip', blocks_v.nbytes):
+                np.clip(blocks_v, 0, 255, out=blocks_v)
+                np.round(blocks_v, out=blocks_v)
+                np.copyto(blocks_out[..., band, :, :, :], blocks_v, casting='unsafe')
+
+        return [lambda workers, band=band: decode_band(band, workers) for band in bands]
+
+    def encode(self, v:np.ndarray, out:np.ndarray=None) -> np.ndarray:
+        '''
+        Perform the encoding of the input vector v.
+
+        Parameters:
+        @param v: The input vector to encode. It must be a numpy array of uint8, two dimensional or three dimensional with the channels on the last axis.
+        @param out: The array where the encoded vector is written (see compute_compressed_shape). With the adaptive truncation, it receives
+        the coefficients before they are packed. Default is None (a new array is allocated).
+
+        @return: The encoded vector. It is a three dimensional array of float, or a four dimensional (channels, blocks_x, blocks_y, n) array for a multi-channel vector.
+        With the adaptive truncation (see set_max_mse), it is a Ragged_Plane of the same shape, and with an integer dtype a Fixed_Plane.
+        '''
+
+        assert self._max_mse is None or not self.is_fixed(), 'The adaptive truncation is not supported by the fixed point coefficients.'
+
+        compressed_blocks_v, tasks = self._encode_tasks(v, out)
+        self._run_tasks(tasks)
 
-        decompressed_blocks_v = self._decompress(compressed_v)
+        if self.is_fixed():
+            return self._quantize(compressed_blocks_v)
 
-        blocks_v = idctn(decompressed_blocks_v, axes=(2, 3), type=2, norm='ortho')
+        if self._max_mse is None:
+            return compressed_blocks_v
 
-        blocks_v = np.round(np.clip(blocks_v, 0, 255)).astype(np.uint8)
+        d_map = self._compute_d_map(compressed_blocks_v)
+        with Encoder.PROFILER.stage('pack', compressed_blocks_v.nbytes):
+            return Ragged_Plane.from_dense(self._F, self._d, compressed_blocks_v, d_map)
 
-        v = self._compute_vector_from_blocks(blocks_v)
+    def _quantize(self, compressed_v:np.ndarray) -> Fixed_Plane:
+        '''
+        Quantize the coefficients computed in FIXED_WORK_DTYPE to the integer dtype of the encoder (see Fixed_Plane.from_dense).
+        '''
+
+        with Encoder.PROFILER.stage('quantize', compressed_v.nbytes):
+            return Fixed_Plane.from_dense(compressed_v, self._float_dtype, Encoder.FIXED_MAX_STEP)
+
+    def _compute_d_map(self, compressed_v:np.ndarray) -> np.ndarray:
+        '''
+        Compute the first antidiagonal to delete from each block with the adaptive truncation: the smallest d_block between 1 and d
+        such that the energy of the antidiagonals from d_block to d - 1 is at most max_mse * F^2. Since the orthonormal DCT preserves
+        the energy, it is the squared error added to the block by deleting them.
+
+        Parameters:
+        @param compressed_v: The encoded vector, with the kept coefficients of each block on the last axis.
+
+        @return: The d map, an array of uint8 with the shape of the blocks.
+        '''
+
+        F, d = self._F, self._d
+        rows, cols = self._kept_indices
+        threshold = self._max_mse * F * F
+
+        # The matrix summing the squares of the coefficients of each antidiagonal
+        antidiagonals = (np.add(rows, cols)[:, np.newaxis] == np.arange(d)).astype(np.float32)
+
+        blocks_x, blocks_y = compressed_v.shape[-3:-1]
+        channels = 1 if compressed_v.ndim == 3 else compressed_v.shape[0]
+        d_map = np.empty(compressed_v.shape[:-1], dtype=np.uint8)
+
+        def d_map_band(band:slice, workers:int) -> None:
+            energy = np.square(compressed_v[..., band, :, :], dtype=np.float32) @ antidiagonals
+
+            # The energy deleted with d_block is the one of the antidiagonals from d_block on
+            deleted = np.cumsum(energy[..., ::-1], axis=-1)[..., ::-1]
+            d_map[..., band, :] = np.minimum(1 + np.count_nonzero(deleted[..., 1:] > threshold, axis=-1), d)
+
+        self._run_tasks([lambda workers, band=band: d_map_band(band, workers) for band in self._compute_bands(blocks_x, blocks_y, channels)])
+
+        return d_map
+
+    def decode(self, compressed_v:np.ndarray, scale:int=None, out:np.ndarray=None) -> np.ndarray:
+        '''
+        Perform the decoding of the input vector v.
+
+        Parameters:
+        @param v: The input vector to decode. It must be a three dimensional numpy array of float, or a four dimensional (channels, blocks_x, blocks_y, n) array.
+        @param scale: The size of the decoded blocks, between 1 and F: the image is decoded at scale / F of its size. Default is None (F).
+        @param out: The array of uint8 where the decoded vector is written, with the shape of the result. Default is None (a new array is allocated).
+
+        @return: The decoded vector. It is a two dimensional array of uint8, or three dimensional with the channels on the last axis.
+        '''
+
+        v, tasks = self._decode_tasks(compressed_v, scale, out)
+        self._run_tasks(tasks)
 
         return v
 
+    def encode_blocks(self, blocks_v:np.ndarray, out:np.ndarray=None) -> np.ndarray:
+        '''
+        Perform the encoding of a list of blocks, e.g. the blocks of an image that changed since the previous frame.
+
+        Parameters:
+        @param blocks_v: The (count, F, F) or (channels, count, F, F) blocks of uint8.
+        @param out: The (count, n) or (channels, count, n) array where the encoded blocks are written. Default is None (a new array is allocated).
+
+        @return: The encoded blocks, with the kept coefficients of each block on the last axis.
+        '''
+
+        assert not self.is_fixed(), 'The lists of blocks are not supported by the fixed point coefficients.'
+
+        return self._encode_blocks(blocks_v, out)
+
+    def _encode_blocks(self, blocks_v:np.ndarray, out:np.ndarray=None) -> np.ndarray:
+        '''
+        Perform the encoding of a list of blocks (see encode_blocks), in FIXED_WORK_DTYPE with an integer dtype.
+        '''
+
+        assert blocks_v.ndim in (3, 4) and blocks_v.shape[-2:] == (self._F, self._F), f'The blocks must be a (count, {self._F}, {self._F}) or (channels, count, {self._F}, {self._F}) array.'
+        assert blocks_v.dtype == np.uint8, 'The blocks must be of type uint8.'
+
+        # The list is encoded as a grid with a single column, so that it is split in bands of rows as usual
+        compressed_v, tasks = self._encode_blocks_tasks(blocks_v[..., np.newaxis, :, :], None if out is None else out[..., np.newaxis, :])
+        self._run_tasks(tasks)
+
+        return compressed_v[..., 0, :]
+
+    def decode_blocks(self, compressed_v:np.ndarray, out:np.ndarray=None) -> np.ndarray:
+        '''
+        Perform the decoding of a list of encoded blocks.
+
+        Parameters:
+        @param compressed_v: The (count, n) or (channels, count, n) encoded blocks.
+        @param out: The (count, F, F) or (channels, count, F, F) array of uint8 where the blocks are written. Default is None (a new array is allocated).
+
+        @return: The decoded blocks of uint8.
+        '''
+
+        assert compressed_v.ndim in (2, 3), 'The encoded blocks must be a (count, n) or (channels, count, n) array.'
+        assert compressed_v.dtype == self.get_float_dtype(), f'The encoded blocks must be of type {self.get_float_dtype()}.'
+        assert not self.is_fixed(), 'The lists of blocks are not supported by the fixed point coefficients.'
+
+        F = self._F
+        blocks_out = np.empty(compressed_v.shape[:-1] + (F, F), dtype=np.uint8) if out is None else out
+
+        self._run_tasks(self._decode_blocks_tasks(compressed_v[..., np.newaxis, :], blocks_out[..., np.newaxis, :, :], F))
+
+        return blocks_out
+
+    def encode_batch(self, vs:list[np.ndarray]) -> list[np.ndarray]:
+        '''
+        Perform the encoding of several vectors together, e.g. the small images of concurrent requests: their blocks are gathered
+        in a single list and transformed at once, so the bands, the threads and the calls of the backend are shared by all of them.
+        The encoded vectors are the same of encode: with an integer dtype, each one is quantized with its own scales.
+
+        Parameters:
+        @param vs: The input vectors to encode, arrays of uint8 with the same number of dimensions and channels.
+
+        @return: The list of the encoded vectors (see encode).
+        '''
+
+        assert len(vs) > 0, 'There must be at least one vector.'
+        assert all(v.ndim == vs[0].ndim and v.shape[2:] == vs[0].shape[2:] for v in vs), 'The vectors must have the same channels.'
+        assert self._max_mse is None, 'The adaptive truncation is not supported by the batches.'
+
+        F = self._F
+        grids = [self._compute_planar_blocks(v) for v in vs]
+        blocks_v = np.concatenate([grid.reshape(grid.shape[:-4] + (-1, F, F)) for grid in grids], axis=-3)
+
+        compressed_blocks_v = self._encode_blocks(blocks_v)
+
+        compressed_vs, start = [], 0
+        for grid in grids:
+            blocks_x, blocks_y = grid.shape[-4:-2]
+            end = start + blocks_x * blocks_y
+            compressed_v = np.ascontiguousarray(compressed_blocks_v[..., start:end, :]).reshape(grid.shape[:-4] + (blocks_x, blocks_y, self._n))
+            compressed_vs.append(self._quantize(compressed_v) if self.is_fixed() else compressed_v)
+            start = end
+
+        return compressed_vs
+
+    def decode_batch(self, compressed_vs:list[np.ndarray]) -> list[np.ndarray]:
+        '''
+        Perform the decoding of several encoded vectors together, transforming their blocks at once (see encode_batch).
+        The Fixed_Plane vectors, with their own scales, are decoded one after the other.
+
+        Parameters:
+        @param compressed_vs: The input vectors to decode, with the same number of dimensions and channels (see decode).
+
+        @return: The list of the decoded vectors (see decode).
+        '''
+
+        assert len(compressed_vs) > 0, 'There must be at least one vector.'
+        assert all(v.ndim == compressed_vs[0].ndim and v.shape[:-3] == compressed_vs[0].shape[:-3] for v in compressed_vs), 'The vectors must have the same channels.'
+
+        if self.is_fixed():
+            return [self.decode(compressed_v) for compressed_v in compressed_vs]
+
+        F = self._F
+        blocks_v = self.decode_blocks(np.concatenate([v.reshape(v.shape[:-3] + (-1, v.shape[-1])) for v in compressed_vs], axis=-2))
+
+        vs, start = [], 0
+        for compressed_v in compressed_vs:
+            blocks_x, blocks_y = compressed_v.shape[-3:-1]
+            end = start + blocks_x * blocks_y
+
+            # The blocks of each vector are put back in their grid, with the channels on the last axis
+            grid = blocks_v[..., start:end, :, :].reshape(compressed_v.shape[:-3] + (blocks_x, blocks_y, F, F))
+            v = grid.swapaxes(-3, -2).reshape(compressed_v.shape[:-3] + (blocks_x * F, blocks_y * F))
+            vs.append(v if v.ndim == 2 else v.transpose(1, 2, 0))
+            start = end
+
+        return vs
+
+    def create_session(self, shape:tuple[int]) -> Encoder_Session:
+        '''
+        Create a session encoding and decoding vectors of the given shape with this encoder, reusing all the buffers (see Encoder_Session).
+
+        Parameters:
+        @param shape: The shape of the vectors, (height, width) or (height, width, channels).
+
+        @return: The Encoder_Session.
+        '''
+
+        return Encoder_Session(self, shape)
+
+    def _compute_region_blocks(self, blocks_shape:tuple[int], x:int, y:int, width:int, height:int) -> tuple:
+        '''
+        Compute the blocks intersecting a region of the image, clipping the region to the decodable area.
+
+        Parameters:
+        @param blocks_shape: The (blocks_x, blocks_y) shape of the block grid.
+        @param x: The column of the top-left pixel of the region.
+        @param y: The row of the top-left pixel of the region.
+        @param width: The width of the region.
+        @param height: The height of the region.
+
+        @return: A tuple (rows, cols, crop_rows, crop_cols): the slices of the rows and columns of blocks, and the slices cropping
+        the region from the decoded blocks.
+        '''
+
+        assert all(type(value) == int for value in (x, y, width, height)), 'The region must be given with integers.'
+        assert x >= 0 and y >= 0 and width > 0 and height > 0, 'The region must have a non negative origin and a positive size.'
+
+        F = self._F
+        image_height, image_width = blocks_shape[0] * F, blocks_shape[1] * F
+
+        assert y < image_height and x < image_width, f'The region must start inside the image ({image_width} x {image_height}).'
+
+        bottom, right = min(y + height, image_height), min(x + width, image_width)
+        rows = slice(y // F, -(-bottom // F))
+        cols = slice(x // F, -(-right // F))
+
+        return rows, cols, slice(y - rows.start * F, bottom - rows.start * F), slice(x - cols.start * F, right - cols.start * F)
+
+    def decode_region(self, compressed_v:np.ndarray, x:int, y:int, width:int, height:int) -> np.ndarray:
+        '''
+        Perform the decoding of a region of the input vector, transforming only the blocks intersecting it.
+        Only the coefficients of those blocks are read, so a memory-mapped vector is read only in the region.
+
+        Parameters:
+        @param compressed_v: The input vector to decode. It must be a three dimensional numpy array of float, or a four dimensional (channels, blocks_x, blocks_y, n) array.
+        @param x: The column of the top-left pixel of the region.
+        @param y: The row of the top-left pixel of the region.
+        @param width: The width of the region. It is clipped to the image.
+        @param height: The height of the region. It is clipped to the image.
+
+        @return: The decoded region. It is a two dimensional array of uint8, or three dimensional with the channels on the last axis.
+        '''
+
+        rows, cols, crop_rows, crop_cols = self._compute_region_blocks(compressed_v.shape[-3:-1], x, y, width, height)
+
+        if isinstance(compressed_v, Ragged_Plane):
+            compressed_v = compressed_v.to_dense(rows)[..., cols, :]
+        elif isinstance(compressed_v, Fixed_Plane):
+            compressed_v = compressed_v.crop(rows, cols)
+        else:
+            compressed_v = compressed_v[..., rows, cols, :]
+
+        v, tasks = self._decode_tasks(compressed_v)
+        self._run_tasks(tasks)
+
+        return v[crop_rows, crop_cols]
+
     def get_stats(self) -> float:
         '''
         Return the percentage of elements saved with the encoder parameters.
@@ -257,9 +990,12 @@ class Encoder():
             return 1 - (4 * self._F * self._d - self._d ** 2 - 2 * self._F ** 2 - self._d + 2 * self._F) / (2 * self._F ** 2)
 
     def __str__(self) -> str:
-        return f'Encoder(F={self._F}, d={self._d}, float_dtype={self._float_dtype})'
+        return f'Encoder(F={self._F}, d={self._d}, float_dtype={self._float_dtype}, dct_backend={self._dct_backend}, workers={self._workers}, max_mse={self._max_mse})'
     
     def __repr__(self) -> str:
         return self.__str__()
 
+for backend in [Fftpack_Backend(), Scipy_Fft_Backend(), Matmul_Backend(), Matmul_F32_Backend()]:
+    Encoder.register_dct_backend(backend)
+
     
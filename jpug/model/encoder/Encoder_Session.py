@@ -0,0 +1,110 @@
+import numpy as np
+
+from model.encoder.Workspace import Workspace
+
+class Encoder_Session():
+    '''
+    Encoding and decoding of vectors of a fixed shape (e.g. the frames of a video or the stripes of a streamed image) with an encoder,
+    reusing the same buffers at each call.
+
+    The encoded and the decoded vectors are allocated when the session is created, the intermediate buffers (the planar copy of the
+    channels, the transformed, gathered, decompressed and padded blocks, the products of the matmul backends) by the first encoding
+    and decoding: from then on, encode and decode do no large allocation. The vectors returned are the buffers of the session,
+    overwritten by the next call: they must be copied (or an out array given) to be kept.
+
+    The encoder can be shared, but a session is not thread safe: each thread needs its own session. The adaptive truncation, whose
+    packed coefficients depend on the vector, is not supported.
+    '''
+
+    def __init__(self, encoder:'Encoder', shape:tuple[int]) -> None:
+        '''
+        Constructor of the Encoder_Session class.
+
+        Parameters:
+        @param encoder: The encoder.
+        @param shape: The shape of the vectors, (height, width) or (height, width, channels).
+        '''
+
+        assert len(shape) in (2, 3) and all(type(x) == int and x > 0 for x in shape), 'The shape must be (height, width) or (height, width, channels).'
+        assert encoder.get_max_mse() is None, 'The adaptive truncation is not supported by the sessions.'
+        assert not encoder.is_fixed(), 'The fixed point coefficients are not supported by the sessions.'
+
+        F = encoder.get_F()
+
+        self._encoder = encoder
+        self._shape = tuple(shape)
+        self._workspace = Workspace()
+        self._calls = 0
+
+        compressed_shape = encoder.compute_compressed_shape(self._shape)
+        blocks_x, blocks_y = compressed_shape[-3:-1]
+
+        # As in Encoder.decode, the channels are decoded in a planar buffer and interleaved through a transposed view
+        self._compressed_v = np.empty(compressed_shape, dtype=encoder.get_float_dtype())
+        self._decoded_v = np.empty(self._shape[2:] + (blocks_x * F, blocks_y * F), dtype=np.uint8)
+        if self._decoded_v.ndim == 3:
+            self._decoded_v = self._decoded_v.transpose(1, 2, 0)
+
+    def get_encoder(self) -> 'Encoder':
+        return self._encoder
+
+    def get_shape(self) -> tuple[int]:
+        return self._shape
+
+    def encode(self, v:np.ndarray, out:np.ndarray=None) -> np.ndarray:
+        '''
+        Encode a vector of the shape of the session (see Encoder.encode).
+
+        Parameters:
+        @param v: The input vector to encode, an array of uint8.
+        @param out: The array where the encoded vector is written. Default is None (the buffer of the session).
+
+        @return: The encoded vector.
+        '''
+
+        assert v.shape == self._shape, f'The vector must have the shape {self._shape} of the session, not {v.shape}.'
+
+        compressed_v, tasks = self._encoder._encode_tasks(v, self._compressed_v if out is None else out, self._workspace)
+        self._encoder._run_tasks(tasks)
+        self._calls += 1
+
+        return compressed_v
+
+    def decode(self, compressed_v:np.ndarray, out:np.ndarray=None) -> np.ndarray:
+        '''
+        Decode a vector encoded with the parameters and the shape of the session (see Encoder.decode), at full size.
+
+        Parameters:
+        @param compressed_v: The input vector to decode.
+        @param out: The array where the decoded vector is written. Default is None (the buffer of the session).
+
+        @return: The decoded vector.
+        '''
+
+        assert compressed_v.shape == self._compressed_v.shape, f'The encoded vector must have the shape {self._compressed_v.shape} of the session, not {compressed_v.shape}.'
+
+        v, tasks = self._encoder._decode_tasks(compressed_v, out=self._decoded_v if out is None else out, workspace=self._workspace)
+        self._encoder._run_tasks(tasks)
+        self._calls += 1
+
+        return v
+
+    def get_stats(self) -> dict:
+        '''
+        Get the statistics of the session.
+
+        @return: A dictionary with the number of calls, the number of buffers allocated by the calls (which stops growing after the first
+        encoding and decoding) and the bytes of all the buffers, including the encoded and the decoded vectors.
+        '''
+
+        return {
+            'calls': self._calls,
+            'allocations': self._workspace.get_allocations(),
+            'nbytes': self._workspace.get_nbytes() + self._compressed_v.nbytes + self._decoded_v.nbytes
+        }
+
+    def __str__(self) -> str:
+        return f'Encoder_Session(encoder={self._encoder}, shape={self._shape})'
+
+    def __repr__(self) -> str:
+        return self.__str__()
@@ -3,22 +3,27 @@ import numpy as np
 
 from model.serialization.Jpug_L import Jpug_L
 from model.encoder.Encoder import Encoder
+from model.Parser import Parser
 
 class L_Encoder(Encoder):
     '''
     Encoder class for encoding and decoding gray-scaled images according to the format.
     '''
 
-    def __init__(self, F:int=8, d:int=8, float_dtype:np.dtype=Encoder.DEFAULT_FLOAT_DTYPE) -> None:
+    def __init__(self, F:int=8, d:int=8, float_dtype:np.dtype=Encoder.DEFAULT_FLOAT_DTYPE, dct_backend:str=Encoder.DEFAULT_DCT_BACKEND, workers:int=Encoder.DEFAULT_WORKERS,
+                 max_mse:float=None) -> None:
         ''' 
         Constructor of the L_Encoder class.
 
         Parameters:
         @param F: The size of the blocks.
         @param d: The first antidiagonal of the block to delete (0-indexed).
-        @param float_dtype: The float dtype of the encoder. Default is np.float32.
+        @param float_dtype: The float dtype of the encoder. Default is Encoder.DEFAULT_FLOAT_DTYPE.
+        @param dct_backend: The name of the DCT backend, or Encoder.AUTO_DCT_BACKEND to use the calibrated one. Default is Encoder.DEFAULT_DCT_BACKEND.
+        @param workers: The number of threads used to encode and decode. Default is 1.
+        @param max_mse: The error allowed to each block to keep fewer antidiagonals than d (see Encoder.set_max_mse). Default is None.
         '''
-        super().__init__(F, d, float_dtype=float_dtype)
+        super().__init__(F, d, float_dtype=float_dtype, dct_backend=dct_backend, workers=workers, max_mse=max_mse)
 
 
     def encode(self, image:Image.Image) -> Jpug_L:
@@ -26,39 +31,76 @@ class L_Encoder(Encoder):
         Encode a gray-scaled image.
 
         Parameters:
-        @param image: PIL Image object representation of the image. If the image is not gray-scaled, it will be converted to gray-scaled.
+        @param image: PIL Image object representation of the image, or its (height, width) or (height, width, 3) array of uint8
+        (e.g. memory-mapped, see Parser.map_bmp). If the image is not gray-scaled, it will be converted to gray-scaled.
 
         @return:  An object Jpug_L representing the compressed image.
         '''
         
-        assert isinstance(image, Image.Image), 'The image must be a PIL Image object.'
-        
-        if image.mode != 'L':
-            image = image.convert('L')
+        assert isinstance(image, (Image.Image, np.ndarray)), 'The image must be a PIL Image object or an array.'
+
+        if isinstance(image, np.ndarray):
+            # A gray-scaled array is transformed as it is, without a copy
+            with Encoder.PROFILER.stage('pixels', image.size):
+                image_array = image if image.ndim == 2 else Parser.convert_to_l(image)
+
+            return Jpug_L(self.get_F(), self.get_d(), super(L_Encoder, self).encode(image_array), shape=image_array.shape)
 
-        image_array = np.array(image)
+        # The pixels are read (and decoded by PIL) when the image is converted to an array
+        with Encoder.PROFILER.stage('pixels', image.width * image.height):
+            if image.mode != 'L':
+                image = image.convert('L')
+
+            image_array = np.array(image)
         
-        return Jpug_L(self.get_F(), self.get_d(), super(L_Encoder, self).encode(image_array))
+        return Jpug_L(self.get_F(), self.get_d(), super(L_Encoder, self).encode(image_array), shape=image_array.shape)
     
-    def decode(self, jpug:Jpug_L) -> Image.Image:
+    def decode(self, jpug:Jpug_L, scale:int=None) -> Image.Image:
         '''
         Decode an encoded image.
 
         Parameters:
         jpug: Jpug_L object representing the compressed image.
+        @param scale: The image is decoded at scale / F of its size, between 1 and F (see Encoder.decode). Default is None (full size).
 
         @return: PIL Image object representation of the image. It is a gray-scaled image.
         '''
-        F, d = self.get_params()
-
-        self._F = jpug.get_F()
-        self._d = jpug.get_d()
-        image_array = super(L_Encoder, self).decode(jpug.get_v())
-        
-        self.set_params(F, d)
+        # The parameters of the image are taken by a shared encoder, without modifying this one
+        image_array = self._get_decoder(jpug.get_F(), jpug.get_d(), jpug.get_v().dtype).decode(jpug.get_v(), scale)
 
         return Image.fromarray(image_array, mode='L')
+
+    def decode_into(self, jpug:Jpug_L, out:np.ndarray) -> np.ndarray:
+        '''
+        Decode an encoded image at full size into an array, e.g. the memory-mapped pixels of a BMP (see Parser.create_mapped_bmp).
+
+        Parameters:
+        @param jpug: Jpug_L object representing the compressed image.
+        @param out: The (height, width) array of uint8, of the size of the decoded image.
+
+        @return: The array out.
+        '''
+
+        return self._get_decoder(jpug.get_F(), jpug.get_d(), jpug.get_v().dtype).decode(jpug.get_v(), out=out)
     
+    def decode_region(self, jpug:Jpug_L, x:int, y:int, width:int, height:int) -> Image.Image:
+        '''
+        Decode a region of an encoded image, transforming only the blocks intersecting it.
+
+        Parameters:
+        @param jpug: Jpug_L object representing the compressed image. If it is memory-mapped, only the coefficients of the region are read.
+        @param x: The column of the top-left pixel of the region.
+        @param y: The row of the top-left pixel of the region.
+        @param width: The width of the region. It is clipped to the image.
+        @param height: The height of the region. It is clipped to the image.
+
+        @return: PIL Image object representation of the region.
+        '''
+
+        image_array = self._get_decoder(jpug.get_F(), jpug.get_d(), jpug.get_v().dtype).decode_region(jpug.get_v(), x, y, width, height)
+
+        return Image.fromarray(image_array, mode='L')
+
     def __str__(self) -> str:
         return f'L_Encoder({super().__str__()})'
     
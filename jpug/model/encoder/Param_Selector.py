@@ -0,0 +1,210 @@
+import numpy as np
+
+from model.serialization.Fixed_Plane import Fixed_Plane
+from model.encoder.Encoder import Encoder
+
+class Param_Selector():
+    '''
+    Selection of the parameters (F, d) of the encoding for a target quality or size, estimated from the statistics of the DCT
+    coefficients of the image instead of encoding and decoding it for each candidate.
+
+    Since the orthonormal DCT preserves the energy, the squared error of deleting the antidiagonals from d on is the energy of
+    those antidiagonals, while the size is the number of kept coefficients times the size of the dtype (see estimate_params).
+    '''
+
+    AUTO_F_CANDIDATES = (4, 8, 16, 32)
+    MAX_PIXEL_VALUE = 255
+
+    @staticmethod
+    def compute_frequency_statistics(encoder:Encoder, v:np.ndarray) -> tuple[np.ndarray]:
+        '''
+        Compute the energy (sum of the squares) and the largest magnitude of each DCT coefficient of the F x F blocks, over all the
+        blocks of each channel. The whole blocks are transformed once, whatever d is.
+
+        Parameters:
+        @param encoder: The encoder whose F, DCT backend and workers are used.
+        @param v: The input vector. It must be a numpy array of uint8, two dimensional or three dimensional with the channels on the last axis.
+
+        @return: A tuple (energy, magnitudes) of (channels, F, F) arrays of float64.
+        '''
+
+        F = encoder.get_F()
+        blocks_v = encoder._compute_planar_blocks(v)
+        blocks_x, blocks_y = blocks_v.shape[-4:-2]
+
+        backend = encoder._resolve_dct_backend(blocks_x * blocks_y)
+        channels = 1 if blocks_v.ndim == 4 else blocks_v.shape[0]
+        bands = encoder._compute_bands(blocks_x, blocks_y, channels)
+
+        # The statistics of each band are computed on their own, so that the result does not depend on the order of the threads
+        energies = np.zeros((len(bands), channels, F, F), dtype=np.float64)
+        magnitudes = np.zeros((len(bands), channels, F, F), dtype=np.float64)
+
+        def statistics_band(i:int, band:slice, workers:int) -> None:
+            with Encoder.PROFILER.stage('dct', blocks_v[..., band, :, :, :].nbytes):
+                coefficients = backend.forward(blocks_v[..., band, :, :, :], workers).reshape(channels, -1, F, F)
+
+            energies[i] = np.square(coefficients, dtype=np.float64).sum(axis=1)
+            magnitudes[i] = np.abs(coefficients).max(axis=1, initial=0)
+
+        encoder._run_tasks([lambda workers, i=i, band=band: statistics_band(i, band, workers) for i, band in enumerate(bands)])
+
+        return energies.sum(axis=0), magnitudes.max(axis=0)
+
+    @staticmethod
+    def compute_antidiagonal_energy(encoder:Encoder, v:np.ndarray) -> np.ndarray:
+        '''
+        Compute the energy (sum of the squares) of the DCT coefficients on each antidiagonal of the F x F blocks, over all the blocks.
+
+        Since the orthonormal DCT preserves the energy, the squared error of the image decoded keeping the first d antidiagonals
+        is the energy of the antidiagonals from d on (before the rounding of the pixels and of the coefficients to the float dtype).
+
+        Parameters:
+        @param encoder: The encoder whose F, DCT backend and workers are used.
+        @param v: The input vector. It must be a numpy array of uint8, two dimensional or three dimensional with the channels on the last axis.
+
+        @return: The energy of each of the 2F - 1 antidiagonals, as float64.
+        '''
+
+        energy, _ = Param_Selector.compute_frequency_statistics(encoder, v)
+
+        return Param_Selector._sum_antidiagonals(energy.sum(axis=0))
+
+    @staticmethod
+    def _sum_antidiagonals(values:np.ndarray) -> np.ndarray:
+        '''
+        Sum the values of each of the 2F - 1 antidiagonals of a F x F array.
+        '''
+
+        F = values.shape[-1]
+        antidiagonals = np.add.outer(np.arange(F), np.arange(F))
+
+        return np.bincount(antidiagonals.ravel(), weights=values.ravel(), minlength=2 * F - 1)
+
+    @staticmethod
+    def compute_psnr(mse:float) -> float:
+        '''
+        Compute the peak signal-to-noise ratio in dB of a mean squared error of 8 bits pixels (infinite for no error).
+        '''
+
+        if mse <= 0:
+            return float('inf')
+
+        return float(10 * np.log10(Param_Selector.MAX_PIXEL_VALUE ** 2 / mse))
+
+    @staticmethod
+    def estimate_params(F:int, energy:np.ndarray, n_blocks:int, float_dtype:np.dtype=Encoder.DEFAULT_FLOAT_DTYPE, magnitudes:np.ndarray=None) -> list[dict]:
+        '''
+        Estimate the error and the size of the encoded image for each d, from the statistics of the coefficients of its blocks
+        (see compute_frequency_statistics).
+
+        With a float dtype, the error is the energy of the coefficients deleted and each coefficient kept takes the size of the dtype.
+        With an integer dtype (fixed point, see Fixed_Plane), the steps of the frequencies are derived from their largest magnitudes
+        as in Fixed_Plane.from_dense: each kept coefficient adds the error of its rounding (step^2 / 12, or its own energy when it is
+        rounded to zero) and takes 1 byte, or 2 for the frequencies stored in int16, and each channel adds the map of the wide frequencies and their scales.
+
+        Parameters:
+        @param F: The size of the blocks.
+        @param energy: The (channels, F, F) energy of each coefficient over all the blocks of each channel.
+        @param n_blocks: The number of blocks, over all the channels.
+        @param float_dtype: The float dtype of the coefficients, or one of Encoder.FIXED_DTYPES. Default is Encoder.DEFAULT_FLOAT_DTYPE.
+        @param magnitudes: The (channels, F, F) largest magnitude of each coefficient in each channel, required by the fixed point. Default is None.
+
+        @return: A list with a dictionary for each 0 < d <= 2F - 1, with 'F', 'd', the estimated 'mse' and 'psnr', and the 'bytes'
+        of the coefficients.
+        '''
+
+        assert energy.shape[-2:] == (F, F), f'The energy must have the F x F = {F} x {F} coefficients.'
+
+        fixed = np.dtype(float_dtype).type in Encoder.FIXED_DTYPES
+        assert not fixed or magnitudes is not None, 'The magnitudes of the coefficients are required by the fixed point.'
+
+        channels = energy.shape[0] if energy.ndim == 3 else 1
+        energy = energy.reshape(channels, F, F)
+
+        # The energy discarded with d is the one of the antidiagonals from d on
+        discarded = np.cumsum(Param_Selector._sum_antidiagonals(energy.sum(axis=0))[::-1])[::-1]
+
+        if fixed:
+            magnitudes = magnitudes.reshape(channels, F, F)
+            narrow_limit = np.iinfo(Fixed_Plane.NARROW_DTYPE).max
+
+            # A frequency is wide if it is in any channel, as in Fixed_Plane.from_dense
+            if np.dtype(float_dtype) == Fixed_Plane.NARROW_DTYPE:
+                wide = np.zeros((F, F), dtype=bool)
+            else:
+                wide = magnitudes.max(axis=0) > Encoder.FIXED_MAX_STEP * narrow_limit
+
+            steps = magnitudes / np.where(wide, np.iinfo(Fixed_Plane.WIDE_DTYPE).max, narrow_limit)
+            rounding = np.minimum(np.square(steps) / 12 * (n_blocks // channels), energy).sum(axis=0)
+            itemsizes = np.where(wide, Fixed_Plane.WIDE_DTYPE.itemsize, Fixed_Plane.NARROW_DTYPE.itemsize)
+
+        estimates = []
+        for d in range(1, 2 * F):
+            rows, cols = Encoder._compute_kept_indices(F, d)
+            mse = float(discarded[d]) if d < 2 * F - 1 else 0.0
+
+            if fixed:
+                mse += float(rounding[rows, cols].sum())
+                n_bytes = int(itemsizes[rows, cols].sum()) * (n_blocks // channels) * channels + len(rows) * channels * (1 + Fixed_Plane.SCALES_DTYPE.itemsize)
+            else:
+                n_bytes = len(rows) * n_blocks * np.dtype(float_dtype).itemsize
+
+            mse /= n_blocks * F * F
+            estimates.append({
+                'F': F,
+                'd': d,
+                'mse': mse,
+                'psnr': Param_Selector.compute_psnr(mse),
+                'bytes': n_bytes
+            })
+
+        return estimates
+
+    @staticmethod
+    def select_params(v:np.ndarray, target_psnr:float=None, max_bytes:int=None, F_candidates:tuple[int]=AUTO_F_CANDIDATES,
+                      float_dtype:np.dtype=Encoder.DEFAULT_FLOAT_DTYPE, dct_backend:str=Encoder.DEFAULT_DCT_BACKEND, workers:int=Encoder.DEFAULT_WORKERS) -> dict:
+        '''
+        Select the parameters (F, d) for a target quality or size, without encoding and decoding the image for each of them:
+        the blocks are transformed once for each candidate F, and the error and the size of every d are estimated from the
+        coefficients (see compute_frequency_statistics and estimate_params).
+
+        With target_psnr, the smallest parameters reaching it are selected; with max_bytes, the parameters with the highest PSNR
+        fitting in it. If no parameters meet the target, the closest ones are selected (the highest PSNR, or the smallest size).
+
+        Parameters:
+        @param v: The input vector. It must be a numpy array of uint8, two dimensional or three dimensional with the channels on the last axis.
+        @param target_psnr: The minimum PSNR in dB. Default is None.
+        @param max_bytes: The maximum bytes of the coefficients. Default is None.
+        @param F_candidates: The sizes of the blocks to try. Default is AUTO_F_CANDIDATES.
+        @param float_dtype: The float dtype of the coefficients, or one of Encoder.FIXED_DTYPES. Default is Encoder.DEFAULT_FLOAT_DTYPE.
+        @param dct_backend: The name of the DCT backend. Default is Encoder.DEFAULT_DCT_BACKEND.
+        @param workers: The number of threads. Default is 1.
+
+        @return: The estimate of the selected parameters (see estimate_params), with 'met' True if they meet the target.
+        '''
+
+        assert (target_psnr is None) != (max_bytes is None), 'Exactly one of the target PSNR and the maximum bytes must be given.'
+
+        channels = 1 if v.ndim == 2 else v.shape[2]
+
+        estimates = []
+        for F in F_candidates:
+            blocks_x, blocks_y = v.shape[0] // F, v.shape[1] // F
+            if blocks_x == 0 or blocks_y == 0:
+                continue
+
+            encoder = Encoder.get_instance(F, 2 * F - 1, float_dtype, dct_backend, workers)
+            energy, magnitudes = Param_Selector.compute_frequency_statistics(encoder, v)
+            estimates += Param_Selector.estimate_params(F, energy, blocks_x * blocks_y * channels, float_dtype, magnitudes)
+
+        assert len(estimates) > 0, 'The image is smaller than the blocks of every candidate F.'
+
+        if target_psnr is not None:
+            met = [estimate for estimate in estimates if estimate['psnr'] >= target_psnr]
+            selected = min(met, key=lambda e: (e['bytes'], -e['psnr'])) if met else max(estimates, key=lambda e: (e['psnr'], -e['bytes']))
+        else:
+            met = [estimate for estimate in estimates if estimate['bytes'] <= max_bytes]
+            selected = max(met, key=lambda e: (e['psnr'], -e['bytes'])) if met else min(estimates, key=lambda e: (e['bytes'], -e['psnr']))
+
+        return dict(selected, met=len(met) > 0)
@@ -9,16 +9,20 @@ class RGB_Encoder(Encoder):
     Encoder class for encoding and decoding RGB images according to the format.
     '''
 
-    def __init__(self, F:int=8, d:int=8, float_dtype:np.dtype=Encoder.DEFAULT_FLOAT_DTYPE) -> None:
+    def __init__(self, F:int=8, d:int=8, float_dtype:np.dtype=Encoder.DEFAULT_FLOAT_DTYPE, dct_backend:str=Encoder.DEFAULT_DCT_BACKEND, workers:int=Encoder.DEFAULT_WORKERS,
+                 max_mse:float=None) -> None:
         ''' 
         Constructor of the RGB_Encoder class.
 
         Parameters:
         @param F: The size of the blocks.
         @param d: The first antidiagonal of the block to delete (0-indexed).
-        @param float_dtype: The float dtype of the encoder. Default is np.float32.
+        @param float_dtype: The float dtype of the encoder. Default is Encoder.DEFAULT_FLOAT_DTYPE.
+        @param dct_backend: The name of the DCT backend, or Encoder.AUTO_DCT_BACKEND to use the calibrated one. Default is Encoder.DEFAULT_DCT_BACKEND.
+        @param workers: The number of threads used to encode and decode. Default is 1.
+        @param max_mse: The error allowed to each block to keep fewer antidiagonals than d (see Encoder.set_max_mse). Default is None.
         '''
-        super().__init__(F, d, float_dtype=float_dtype)
+        super().__init__(F, d, float_dtype=float_dtype, dct_backend=dct_backend, workers=workers, max_mse=max_mse)
 
 
     def encode(self, image:Image.Image) -> Jpug_RGB:
@@ -26,44 +30,79 @@ class RGB_Encoder(Encoder):
         Encode an RGB image.
 
         Parameters:
-        @param image: PIL Image object representation of the image. It must be a RGB image (x * y * 3).
+        @param image: PIL Image object representation of the image. It must be a RGB image (x * y * 3), or its (height, width, 3)
+        array of uint8 (e.g. memory-mapped, see Parser.map_bmp).
 
         @return: An object Jpug_RGB representing the compressed image.
         '''
         
-        assert isinstance(image, Image.Image), 'The image must be a PIL Image object.'
-        assert image.mode == 'RGB', 'The image must be gray-scaled.'
+        assert isinstance(image, (Image.Image, np.ndarray)), 'The image must be a PIL Image object or an array.'
 
-        image_array_rgb = np.array(image)
-        image_array_list = [np.squeeze(x) for x in np.dsplit(image_array_rgb, 3)]
+        # The three channels are transformed together and stored in a single planar vector
+        if isinstance(image, np.ndarray):
+            assert image.ndim == 3 and image.shape[2] == 3, 'The image must be a RGB image.'
+            image_array_rgb = image
+        else:
+            assert image.mode == 'RGB', 'The image must be a RGB image.'
 
-        encoded_arrays_list = np.array([super(RGB_Encoder, self).encode(image_array) for image_array in image_array_list])
-        return Jpug_RGB(self.get_F(), self.get_d(), *encoded_arrays_list)
+            with Encoder.PROFILER.stage('pixels', image.width * image.height * 3):
+                image_array_rgb = np.asarray(image)
 
-    def decode(self, jpug:Jpug_RGB) -> Image.Image:
+        encoded_array = super(RGB_Encoder, self).encode(image_array_rgb)
+
+        return Jpug_RGB(self.get_F(), self.get_d(), v=encoded_array, shape=image_array_rgb.shape[:2])
+
+    def decode(self, jpug:Jpug_RGB, scale:int=None) -> Image.Image:
         '''
         Decode an encoded image.
 
         Parameters:
         @param jpug: Jpug_RGB object representing the compressed image.
+        @param scale: The image is decoded at scale / F of its size, between 1 and F (see Encoder.decode). Default is None (full size).
 
         @return: PIL Image object representation of the image. It is a RGB image.
         '''
 
         assert isinstance(jpug, Jpug_RGB), 'The image must be a Jpug_RGB object.'
 
-        F, d = self.get_params()
+        # The parameters of the image are taken by a shared encoder, without modifying this one
+        image_array_rgb = self._get_decoder(jpug.get_F(), jpug.get_d(), jpug.get_v().dtype).decode(jpug.get_v(), scale)
 
-        self._F = jpug.get_F()
-        self._d = jpug.get_d()
+        return Image.fromarray(image_array_rgb, mode='RGB')
 
-        image_array_list = [super(RGB_Encoder, self).decode(image_array) for image_array in jpug.get_RGB()]
-        self.set_params(F, d)
+    def decode_into(self, jpug:Jpug_RGB, out:np.ndarray) -> np.ndarray:
+        '''
+        Decode an encoded image at full size into an array, e.g. the memory-mapped pixels of a BMP (see Parser.create_mapped_bmp).
 
-        image_array_rgb = np.dstack(image_array_list)
-        
-        return Image.fromarray(image_array_rgb, mode='RGB')
+        Parameters:
+        @param jpug: Jpug_RGB object representing the compressed image.
+        @param out: The (height, width, 3) array of uint8, of the size of the decoded image.
+
+        @return: The array out.
+        '''
+
+        return self._get_decoder(jpug.get_F(), jpug.get_d(), jpug.get_v().dtype).decode(jpug.get_v(), out=out)
     
+    def decode_region(self, jpug:Jpug_RGB, x:int, y:int, width:int, height:int) -> Image.Image:
+        '''
+        Decode a region of an encoded image, transforming only the blocks intersecting it.
+
+        Parameters:
+        @param jpug: Jpug_RGB object representing the compressed image. If it is memory-mapped, only the coefficients of the region are read.
+        @param x: The column of the top-left pixel of the region.
+        @param y: The row of the top-left pixel of the region.
+        @param width: The width of the region. It is clipped to the image.
+        @param height: The height of the region. It is clipped to the image.
+
+        @return: PIL Image object representation of the region.
+        '''
+
+        assert isinstance(jpug, Jpug_RGB), 'The image must be a Jpug_RGB object.'
+
+        image_array_rgb = self._get_decoder(jpug.get_F(), jpug.get_d(), jpug.get_v().dtype).decode_region(jpug.get_v(), x, y, width, height)
+
+        return Image.fromarray(image_array_rgb, mode='RGB')
+
     def __str__(self) -> str:
         return f'RGB_Encoder({super().__str__()})'
     
@@ -0,0 +1,239 @@
+from PIL import Image
+import numpy as np
+
+from model.encoder.Encoder import Encoder
+from model.Parser import Parser
+
+class Sequence_Encoder():
+    '''
+    Encoder class for encoding and decoding sequences of frames of the same size (e.g. from a fixed camera) in a sequence file.
+
+    Every keyframe_interval frames a keyframe stores the coefficients of all the blocks, as an image does. The other frames are deltas
+    storing only the blocks changed since they were last stored, with the bitmap of the changed blocks. A block is changed when the mean
+    squared error between its pixels and the pixels it had when it was last stored is above max_mse (in any channel): since the
+    comparison is with the stored pixels and not with the previous frame, slow changes add up until the block is stored again instead
+    of drifting. The changes are found on the pixels, so only the changed blocks are transformed: the cost of a delta frame is the
+    comparison plus the DCT of its changed blocks. The decoder keeps the blocks of the previous frame and replaces the changed ones.
+
+    A frame is decoded from the keyframe before it, so the random access to a frame decodes at most keyframe_interval - 1 deltas.
+    '''
+
+    DEFAULT_KEYFRAME_INTERVAL = 30
+    DEFAULT_MAX_MSE = 0.0
+    MODES = ('L', 'RGB')
+
+    def __init__(self, keyframe_interval:int=DEFAULT_KEYFRAME_INTERVAL, max_mse:float=DEFAULT_MAX_MSE) -> None:
+        '''
+        Constructor of the Sequence_Encoder class.
+
+        Parameters:
+        @param keyframe_interval: The number of frames between two keyframes (1 stores only keyframes). Default is 30.
+        @param max_mse: The mean squared error of the pixels allowed to a block not stored again. Default is 0 (only the
+        blocks with the same pixels are skipped).
+        '''
+
+        assert type(keyframe_interval) == int and keyframe_interval > 0, 'The keyframe interval must be a positive integer.'
+        assert max_mse >= 0, 'The maximum error must be non negative.'
+
+        self._keyframe_interval = keyframe_interval
+        self._max_mse = max_mse
+
+    def get_keyframe_interval(self) -> int:
+        return self._keyframe_interval
+
+    def get_max_mse(self) -> float:
+        return self._max_mse
+
+    @staticmethod
+    def compute_changed_blocks(blocks_v:np.ndarray, reference_blocks_v:np.ndarray, max_mse:float) -> np.ndarray:
+        '''
+        Find the blocks whose pixels changed more than max_mse from the reference.
+
+        Parameters:
+        @param blocks_v: The (channels, blocks_x, blocks_y, F, F) blocks of uint8 of the frame.
+        @param reference_blocks_v: The blocks last stored, with the same shape.
+        @param max_mse: The mean squared error allowed.
+
+        @return: The (blocks_x, blocks_y) boolean map of the changed blocks.
+        '''
+
+        F = blocks_v.shape[-1]
+
+        difference = np.subtract(blocks_v, reference_blocks_v, dtype=np.int16)
+        squared_error = np.square(difference, dtype=np.int32).sum(axis=(-2, -1), dtype=np.int64).max(axis=0)
+
+        return squared_error > max_mse * F * F
+
+    @staticmethod
+    def _read_frame(path:str, mode:str) -> np.ndarray:
+        '''
+        Read the pixels of a frame as a (height, width, channels) array of uint8.
+        '''
+
+        image = Parser.load_image(path)
+        with Encoder.PROFILER.stage('pixels', image.width * image.height * len(mode)):
+            v = np.asarray(image.convert(mode))
+
+        return v if v.ndim == 3 else v[:, :, np.newaxis]
+
+    def encode(self, encoder:Encoder, mode:str, frame_paths:list[str], sequence_path:str) -> dict:
+        '''
+        Encode a sequence of frames in a sequence file.
+
+        Parameters:
+        @param encoder: The encoder whose parameters, float dtype, DCT backend and workers are used.
+        @param mode: The mode of the encoding, 'L' or 'RGB'. If the first frame is gray-scaled, the 'L' mode is used.
+        @param frame_paths: The paths of the frames, in order. They must have the same size.
+        @param sequence_path: The path of the sequence file to create.
+
+        @return: A dictionary with the number of frames, of keyframes, of blocks of all the frames and of blocks stored.
+        '''
+
+        if mode not in Sequence_Encoder.MODES:
+            raise ValueError(f'Unsupported sequence mode \'{mode}\'.')
+        if len(frame_paths) == 0:
+            raise ValueError('The sequence has no frames.')
+        if encoder.is_fixed():
+            raise ValueError('The fixed point coefficients are not supported by the sequences.')
+
+        if Parser.load_image(frame_paths[0]).mode == 'L':
+            mode = 'L'
+        channels = len(mode)
+
+        F, d = encoder.get_params()
+        frame_encoder = Encoder.get_instance(F, d, encoder.get_float_dtype(), encoder.get_dct_backend(), encoder.get_workers())
+
+        first = Sequence_Encoder._read_frame(frame_paths[0], mode)
+        shape = first.shape[:2]
+        blocks_x, blocks_y = shape[0] // F, shape[1] // F
+        if blocks_x == 0 or blocks_y == 0:
+            raise ValueError(f'The frames must have at least {F} x {F} pixels.')
+
+        # The frames and the pixels last stored for each block, in planar buffers reused for all the frames
+        planar_v = np.empty((channels, blocks_x * F, blocks_y * F), dtype=np.uint8)
+        reference_v = np.empty_like(planar_v)
+        blocks_v = frame_encoder._compute_blocks_vector(planar_v)
+        reference_blocks_v = frame_encoder._compute_blocks_vector(reference_v)
+
+        session = frame_encoder.create_session(planar_v.shape[1:] + ((channels,) if channels > 1 else ()))
+        stats = {'frames': 0, 'keyframes': 0, 'blocks': 0, 'stored_blocks': 0}
+
+        with Parser.open_atomic(sequence_path) as f:
+            header = Parser.create_sequence(f, mode, channels, F, d, shape, (blocks_x, blocks_y, frame_encoder._compute_compressed_n()),
+                                            encoder.get_float_dtype(), self._keyframe_interval, self._max_mse)
+
+            for i, path in enumerate(frame_paths):
+                v = first if i == 0 else Sequence_Encoder._read_frame(path, mode)
+                if v.shape[:2] != shape or v.shape[2] != channels:
+                    raise ValueError(f'The frame \'{path}\' does not have the size of the first frame.')
+
+                with Encoder.PROFILER.stage('rearrange', v.nbytes):
+                    np.copyto(planar_v, v[:blocks_x * F, :blocks_y * F].transpose(2, 0, 1))
+
+                if i % self._keyframe_interval == 0:
+                    coefficients = session.encode(planar_v.transpose(1, 2, 0) if channels > 1 else planar_v[0])
+                    Parser.write_sequence_frame(f, header, coefficients.reshape((channels,) + coefficients.shape[-3:]))
+
+                    np.copyto(reference_v, planar_v)
+                    stats['keyframes'] += 1
+                    stats['stored_blocks'] += blocks_x * blocks_y
+                else:
+                    with Encoder.PROFILER.stage('detect', planar_v.nbytes):
+                        changed = Sequence_Encoder.compute_changed_blocks(blocks_v, reference_blocks_v, self._max_mse)
+                        changed_blocks_v = blocks_v[:, changed]
+
+                    Parser.write_sequence_frame(f, header, frame_encoder.encode_blocks(changed_blocks_v), changed)
+
+                    reference_blocks_v[:, changed] = changed_blocks_v
+                    stats['stored_blocks'] += changed_blocks_v.shape[1]
+
+                stats['frames'] += 1
+                stats['blocks'] += blocks_x * blocks_y
+
+            Parser.finish_sequence(f, header)
+
+        return stats
+
+    def iterate_frames(self, sequence_path:str, start:int=0, end:int=None, dct_backend:str=Encoder.DEFAULT_DCT_BACKEND,
+                       workers:int=Encoder.DEFAULT_WORKERS):
+        '''
+        Decode the frames [start, end) of a sequence file, starting from the keyframe before start.
+        The file is memory-mapped, so only the frames decoded are read.
+
+        Parameters:
+        @param sequence_path: The path of the sequence file.
+        @param start: The index of the first frame. Default is 0.
+        @param end: The index after the last frame. Default is None (the end of the sequence).
+        @param dct_backend: The name of the DCT backend used. Default is Encoder.DEFAULT_DCT_BACKEND.
+        @param workers: The number of threads used to decode each frame. Default is Encoder.DEFAULT_WORKERS.
+
+        Yields:
+        A tuple (index, frame) for each frame, the frame being a (height, width) or (height, width, 3) array of uint8 cropped to
+        a multiple of F. The array is overwritten by the next frame: it must be copied to be kept.
+        '''
+
+        header = Parser.read_sequence_header(sequence_path)
+        index = header['index']
+
+        end = header['frames'] if end is None else min(end, header['frames'])
+        assert 0 <= start, 'The first frame must be non negative.'
+        if start >= end:
+            return
+
+        keyframes = np.flatnonzero(index['keyframe'][:start + 1])
+        if len(keyframes) == 0:
+            raise ValueError(f'No keyframe before the frame {start}.')
+
+        F, channels = header['F'], header['channels']
+        (blocks_x, blocks_y), dtype = header['blocks'], header['dtype']
+        frame_encoder = Encoder.get_instance(F, header['d'], dtype, dct_backend, workers)
+
+        buffer = np.memmap(sequence_path, dtype=np.uint8, mode='r')
+
+        # The frame is kept in a planar buffer whose blocks are replaced by the deltas, and interleaved through a transposed view
+        planar_v = np.empty((channels, blocks_x * F, blocks_y * F), dtype=np.uint8)
+        blocks_v = frame_encoder._compute_blocks_vector(planar_v)
+        frame_v = planar_v.transpose(1, 2, 0) if channels > 1 else planar_v[0]
+        session = frame_encoder.create_session(frame_v.shape)
+
+        for i in range(keyframes[-1], end):
+            with Parser.PROFILER.stage('read', int(index[i]['nbytes'])):
+                coefficients, changed = Parser.read_sequence_frame(buffer, header, i)
+
+            if changed is None:
+                session.decode(coefficients if channels > 1 else coefficients[0], out=frame_v)
+            else:
+                blocks_v[:, changed] = frame_encoder.decode_blocks(coefficients)
+
+            if i >= start:
+                yield i, frame_v
+
+    def decode(self, sequence_path:str, image_path_format:str, start:int=0, end:int=None, dct_backend:str=Encoder.DEFAULT_DCT_BACKEND,
+               workers:int=Encoder.DEFAULT_WORKERS) -> list[str]:
+        '''
+        Decode the frames [start, end) of a sequence file in images.
+
+        Parameters:
+        @param sequence_path: The path of the sequence file.
+        @param image_path_format: The format of the path of each image, formatted with the index of the frame.
+        @param start: The index of the first frame. Default is 0.
+        @param end: The index after the last frame. Default is None (the end of the sequence).
+        @param dct_backend: The name of the DCT backend used. Default is Encoder.DEFAULT_DCT_BACKEND.
+        @param workers: The number of threads used to decode each frame. Default is Encoder.DEFAULT_WORKERS.
+
+        @return: The paths of the images created.
+        '''
+
+        paths = []
+        for i, frame_v in self.iterate_frames(sequence_path, start, end, dct_backend, workers):
+            path = image_path_format.format(i)
+            Parser.save_image(Image.fromarray(frame_v, mode='RGB' if frame_v.ndim == 3 else 'L'), path)
+            paths.append(path)
+
+        return paths
+
+    def __str__(self) -> str:
+        return f'Sequence_Encoder(keyframe_interval={self._keyframe_interval}, max_mse={self._max_mse})'
+
+    def __repr__(self) -> str:
+        return self.__str__()
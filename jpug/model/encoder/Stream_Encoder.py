@@ -0,0 +1,224 @@
+import threading
+from queue import Queue, Full, Empty
+
+import numpy as np
+
+from model.encoder.Encoder import Encoder
+from model.serialization.Ragged_Plane import Ragged_Plane
+from model.serialization.Fixed_Plane import Fixed_Plane
+from model.Parser import Parser
+
+class Stream_Encoder():
+    '''
+    Encoder class for encoding and decoding BMP images stripe by stripe, with a bounded memory use.
+
+    Each stripe is made of some rows of blocks (F rows of pixels each): it is read from the BMP, transformed, truncated
+    and written in place in the jpug file (or the other way around when decoding). The number of rows of each stripe
+    is derived from the memory budget, while a reader thread loads the next stripe during the computation of the current one.
+    The stripes have the same shape (but the last one), so they are encoded and decoded by sessions reusing their buffers (see Encoder_Session).
+    '''
+
+    DEFAULT_MEMORY_BUDGET = 256 * 2 ** 20
+    BYTES_PER_PIXEL = 48
+    PREFETCHED_STRIPES = 1
+    PREFETCH_TIMEOUT = 0.1
+    MODES = ('L', 'RGB')
+    # The entropy coded and the compressed planes can only be decoded whole, so only the memory-mapped planes are streamed
+    CODECS = (Parser.RAW_CODEC, Parser.RAGGED_CODEC, Parser.FIXED_CODEC)
+
+    def __init__(self, memory_budget:int=DEFAULT_MEMORY_BUDGET) -> None:
+        '''
+        Constructor of the Stream_Encoder class.
+
+        Parameters:
+        @param memory_budget: The approximate number of bytes used by the stripes in memory. Default is 256 MB.
+        '''
+
+        assert type(memory_budget) == int and memory_budget > 0, 'The memory budget must be a positive integer.'
+
+        self._memory_budget = memory_budget
+
+    def get_memory_budget(self) -> int:
+        return self._memory_budget
+
+    def compute_stripe_rows(self, F:int, width:int, channels:int) -> int:
+        '''
+        Compute the number of rows of blocks of each stripe.
+        A pixel of a channel needs about BYTES_PER_PIXEL bytes while it is processed (input, transform and
+        temporaries), and the reader thread keeps up to PREFETCHED_STRIPES more stripes of input (one byte per pixel) in memory.
+
+        Parameters:
+        @param F: The size of the blocks.
+        @param width: The width of the image.
+        @param channels: The number of channels of the image.
+
+        @return: The number of rows of blocks of each stripe, at least 1.
+        '''
+
+        block_row_bytes = F * max(width, 1) * channels * (Stream_Encoder.BYTES_PER_PIXEL + Stream_Encoder.PREFETCHED_STRIPES)
+
+        return max(1, self._memory_budget // block_row_bytes)
+
+    @staticmethod
+    def _prefetch(function, items:list):
+        '''
+        Apply the function to the items on a reader thread, yielding the results in order.
+        At most PREFETCHED_STRIPES results wait in the queue, so that reading overlaps with the computation.
+        If the consumer raises or stops iterating, the reader thread is stopped before the generator is closed.
+        '''
+
+        queue = Queue(maxsize=Stream_Encoder.PREFETCHED_STRIPES)
+        stop = threading.Event()
+
+        def put(result:tuple) -> bool:
+            # Wait for a free slot, giving up as soon as the consumer is gone
+            while not stop.is_set():
+                try:
+                    queue.put(result, timeout=Stream_Encoder.PREFETCH_TIMEOUT)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def produce() -> None:
+            try:
+                for item in items:
+                    if stop.is_set() or not put((True, function(item))):
+                        return
+            except Exception as e:
+                put((False, e))
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+
+        try:
+            for _ in items:
+                ok, result = queue.get()
+                if not ok:
+                    raise result
+                yield result
+        finally:
+            stop.set()
+            while True:
+                try:
+                    queue.get_nowait()
+                except Empty:
+                    break
+            thread.join()
+
+    @staticmethod
+    def _get_session(sessions:dict, encoder:Encoder, shape:tuple[int]):
+        '''
+        Get the session of the encoder for the stripes of the given shape, creating it the first time.
+        '''
+
+        if shape not in sessions:
+            sessions[shape] = encoder.create_session(shape)
+
+        return sessions[shape]
+
+    @staticmethod
+    def _compute_stripes(blocks_x:int, stripe_rows:int) -> list[tuple[int]]:
+        return [(start, min(start + stripe_rows, blocks_x)) for start in range(0, blocks_x, stripe_rows)]
+
+    def encode(self, encoder:Encoder, mode:str, image_path:str, jpug_path:str) -> None:
+        '''
+        Encode a BMP image stripe by stripe.
+
+        Parameters:
+        @param encoder: The encoder whose parameters, float dtype, DCT backend and workers are used.
+        @param mode: The mode of the encoding, 'L' or 'RGB'. Gray-scaled images are always encoded in 'L' mode.
+        @param image_path: The path of the BMP image.
+        @param jpug_path: The path of the jpug file to create.
+        '''
+
+        if mode not in Stream_Encoder.MODES:
+            raise ValueError(f'Unsupported streaming mode \'{mode}\'.')
+
+        # The scales of the fixed point coefficients are derived from the whole image, so they cannot be written stripe by stripe
+        if encoder.is_fixed():
+            raise ValueError('The fixed point coefficients cannot be streamed.')
+
+        header = Parser.read_bmp_header(image_path)
+        if header['mode'] == 'L':
+            mode = 'L'
+
+        jpug_class = Parser.JPUG_CLASSES[mode]
+
+        F, d = encoder.get_params()
+        stripe_encoder = Encoder.get_instance(F, d, encoder.get_float_dtype(), encoder.get_dct_backend(), encoder.get_workers())
+
+        blocks_x, blocks_y = header['height'] // F, header['width'] // F
+        plane_shape = (blocks_x, blocks_y, stripe_encoder._compute_compressed_n())
+
+        stripe_rows = self.compute_stripe_rows(F, header['width'], len(jpug_class.PLANES))
+        stripes = Stream_Encoder._compute_stripes(blocks_x, stripe_rows)
+
+        with open(image_path, 'rb') as image_file, Parser.open_atomic(jpug_path) as jpug_file:
+            offsets = Parser.create_jpug(jpug_file, jpug_class, F, d, (header['height'], header['width']), plane_shape, encoder.get_float_dtype())
+
+            read = lambda stripe: Parser.read_bmp_rows(image_file, header, stripe[0] * F, (stripe[1] - stripe[0]) * F)
+            sessions = {}
+
+            for (start, _), pixels in zip(stripes, Stream_Encoder._prefetch(read, stripes)):
+                if mode == 'L' and pixels.ndim == 3:
+                    pixels = Parser.convert_to_l(pixels)
+
+                encoded_rows = Stream_Encoder._get_session(sessions, stripe_encoder, pixels.shape).encode(pixels)
+                planes = [encoded_rows] if encoded_rows.ndim == 3 else encoded_rows
+
+                for plane, offset in zip(planes, offsets):
+                    Parser.write_jpug_rows(jpug_file, offset, plane, start)
+
+    def decode(self, jpug_path:str, image_path:str, dct_backend:str=Encoder.DEFAULT_DCT_BACKEND, workers:int=Encoder.DEFAULT_WORKERS) -> None:
+        '''
+        Decode a jpug file stripe by stripe into a BMP image.
+        The raw, ragged and fixed point planes are memory-mapped, so only the rows of blocks of the current stripes are read.
+        The entropy coded and the compressed planes are not supported, as they would be decoded whole in memory.
+
+        Parameters:
+        @param jpug_path: The path of the jpug file.
+        @param image_path: The path of the BMP image to create.
+        @param dct_backend: The name of the DCT backend used. Default is Encoder.DEFAULT_DCT_BACKEND.
+        @param workers: The number of threads used to decode each stripe. Default is Encoder.DEFAULT_WORKERS.
+        '''
+
+        for plane in Parser.read_header(jpug_path)['planes']:
+            if plane['codec'] not in Stream_Encoder.CODECS:
+                raise ValueError(f'Unsupported streaming codec \'{plane["codec"]}\'.')
+
+        jpug = Parser.load_jpug(jpug_path)
+        if jpug.MODE not in Stream_Encoder.MODES:
+            raise ValueError(f'Unsupported streaming mode \'{jpug.MODE}\'.')
+
+        v = jpug.get_v()
+
+        F, d = jpug.get_F(), jpug.get_d()
+        # The fixed point coefficients of each stripe are dequantized before being decoded
+        stripe_encoder = Encoder.get_instance(F, d, Encoder.FIXED_WORK_DTYPE if isinstance(v, Fixed_Plane) else v.dtype, dct_backend, workers)
+
+        blocks_x, blocks_y, _ = v.shape[-3:]
+        stripe_rows = self.compute_stripe_rows(F, blocks_y * F, len(jpug.PLANES))
+        stripes = Stream_Encoder._compute_stripes(blocks_x, stripe_rows)
+
+        with Parser.open_atomic(image_path) as image_file:
+            header = Parser.create_bmp(image_file, blocks_y * F, blocks_x * F, jpug.MODE)
+
+            # The rows of blocks of the stripe, of all the planes
+            if isinstance(v, Ragged_Plane):
+                read = lambda stripe: v.to_dense(slice(*stripe))
+            elif isinstance(v, Fixed_Plane):
+                read = lambda stripe: v.slice_rows(*stripe).to_dense()
+            else:
+                read = lambda stripe: np.array(v[..., stripe[0] : stripe[1], :, :])
+
+            sessions = {}
+            for (start, end), rows in zip(stripes, Stream_Encoder._prefetch(read, stripes)):
+                session = Stream_Encoder._get_session(sessions, stripe_encoder, ((end - start) * F, blocks_y * F) + ((3,) if rows.ndim == 4 else ()))
+                Parser.write_bmp_rows(image_file, header, start * F, session.decode(rows))
+
+    def __str__(self) -> str:
+        return f'Stream_Encoder(memory_budget={self._memory_budget})'
+
+    def __repr__(self) -> str:
+        return self.__str__()
@@ -0,0 +1,76 @@
+import numpy as np
+
+class Workspace():
+    '''
+    Pool of named buffers reused by the repeated encodings and decodings of vectors of the same shape (see Encoder_Session).
+
+    A buffer is allocated the first time it is requested, and again only when it is requested with a different shape or dtype.
+    The stages running on different threads use different child workspaces (one for each band of rows of blocks), so
+    a workspace is never accessed by two threads at the same time. The child workspaces must be created before starting the threads.
+    '''
+
+    def __init__(self) -> None:
+        self._buffers = {}
+        self._children = {}
+        self._allocations = 0
+
+    def get(self, name:str, shape:tuple[int], dtype:np.dtype, zeros:bool=False) -> np.ndarray:
+        '''
+        Get a buffer, allocating it if it does not exist yet or if its shape or dtype is different.
+
+        Parameters:
+        @param name: The name of the buffer.
+        @param shape: The shape of the buffer.
+        @param dtype: The dtype of the buffer.
+        @param zeros: If True, a new buffer is filled with zeros. A reused buffer keeps its content. Default is False.
+
+        @return: The buffer, a C-contiguous array.
+        '''
+
+        shape, dtype = tuple(shape), np.dtype(dtype)
+
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.zeros(shape, dtype=dtype) if zeros else np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
+            self._allocations += 1
+
+        return buffer
+
+    def get_child(self, key) -> 'Workspace':
+        '''
+        Get the child workspace with the given key, creating it if it does not exist yet.
+        '''
+
+        if key not in self._children:
+            self._children[key] = Workspace()
+
+        return self._children[key]
+
+    def get_allocations(self) -> int:
+        '''
+        Get the number of buffers allocated so far, including the ones of the child workspaces.
+        '''
+
+        return self._allocations + sum(child.get_allocations() for child in self._children.values())
+
+    def get_nbytes(self) -> int:
+        '''
+        Get the bytes of the buffers, including the ones of the child workspaces.
+        '''
+
+        return sum(buffer.nbytes for buffer in self._buffers.values()) + sum(child.get_nbytes() for child in self._children.values())
+
+    def clear(self) -> None:
+        '''
+        Release all the buffers.
+        '''
+
+        self._buffers = {}
+        self._children = {}
+
+    def __str__(self) -> str:
+        return f'Workspace(buffers={len(self._buffers)}, children={len(self._children)}, nbytes={self.get_nbytes()})'
+
+    def __repr__(self) -> str:
+        return self.__str__()
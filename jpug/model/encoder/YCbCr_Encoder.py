@@ -0,0 +1,200 @@
+from PIL import Image
+import numpy as np
+
+from model.encoder.Encoder import Encoder
+from model.serialization.Jpug_YCbCr import Jpug_YCbCr
+
+class YCbCr_Encoder(Encoder):
+    '''
+    Encoder class for encoding and decoding RGB images in the YCbCr color space according to the format.
+
+    The luma is encoded with the parameters of the encoder, while the two chroma components are subsampled
+    (averaging the pixels of each subsampling cell) and encoded together with their own chroma_d.
+    The chroma planes are padded by replicating the borders, so that they cover the whole luma plane.
+    '''
+
+    DEFAULT_CHROMA_D = 4
+
+    def __init__(self, F:int=8, d:int=8, float_dtype:np.dtype=Encoder.DEFAULT_FLOAT_DTYPE, dct_backend:str=Encoder.DEFAULT_DCT_BACKEND,
+                 workers:int=Encoder.DEFAULT_WORKERS, chroma_d:int=DEFAULT_CHROMA_D, subsampling:str=Jpug_YCbCr.DEFAULT_SUBSAMPLING) -> None:
+        '''
+        Constructor of the YCbCr_Encoder class.
+
+        Parameters:
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal of the luma blocks to delete (0-indexed).
+        @param float_dtype: The float dtype of the encoder. Default is Encoder.DEFAULT_FLOAT_DTYPE.
+        @param dct_backend: The name of the DCT backend, or Encoder.AUTO_DCT_BACKEND to use the calibrated one. Default is Encoder.DEFAULT_DCT_BACKEND.
+        @param workers: The number of threads used to encode and decode. Default is 1.
+        @param chroma_d: The first antidiagonal of the chroma blocks to delete (0-indexed). Default is DEFAULT_CHROMA_D.
+        @param subsampling: The chroma subsampling, one of Jpug_YCbCr.SUBSAMPLINGS. Default is '4:2:0'.
+        '''
+        self._chroma_encoder = Encoder(F, min(chroma_d, 2 * F - 1), float_dtype, dct_backend, workers)
+
+        super().__init__(F, d, float_dtype=float_dtype, dct_backend=dct_backend, workers=workers)
+
+        self.set_chroma_params(chroma_d, subsampling)
+
+    def set_params(self, F:int, d:int) -> None:
+        super().set_params(F, d)
+        self._chroma_encoder.set_params(F, min(self._chroma_encoder.get_d(), 2 * F - 1))
+
+    def set_float_dtype(self, float_dtype:np.dtype) -> None:
+        super().set_float_dtype(float_dtype)
+        self._chroma_encoder.set_float_dtype(float_dtype)
+
+    def set_dct_backend(self, name:str) -> None:
+        super().set_dct_backend(name)
+        self._chroma_encoder.set_dct_backend(name)
+
+    def set_workers(self, workers:int) -> None:
+        super().set_workers(workers)
+        self._chroma_encoder.set_workers(workers)
+
+    def set_chroma_params(self, chroma_d:int, subsampling:str) -> None:
+        '''
+        Set the parameters of the chroma components.
+
+        Parameters:
+        @param chroma_d: The first antidiagonal of the chroma blocks to delete (0-indexed). It must be between 0 <= chroma_d <= 2F - 1.
+        @param subsampling: The chroma subsampling, one of Jpug_YCbCr.SUBSAMPLINGS.
+        '''
+
+        assert subsampling in Jpug_YCbCr.SUBSAMPLINGS, f'The subsampling must be one of {list(Jpug_YCbCr.SUBSAMPLINGS)}.'
+        self._assert_not_frozen()
+
+        self._chroma_encoder.set_params(self._F, chroma_d)
+        self._subsampling = subsampling
+
+    def get_chroma_params(self) -> tuple:
+        return (self._chroma_encoder.get_d(), self._subsampling)
+
+    def _subsample(self, chroma:np.ndarray, blocks_x:int, blocks_y:int) -> np.ndarray:
+        '''
+        Subsample the chroma components, padding them to a whole number of chroma blocks.
+
+        Parameters:
+        @param chroma: The (height, width, 2) chroma components, cropped to the luma plane.
+        @param blocks_x: The number of rows of chroma blocks.
+        @param blocks_y: The number of columns of chroma blocks.
+
+        @return: The (blocks_x * F, blocks_y * F, 2) subsampled chroma components, as uint8.
+        '''
+
+        scale_y, scale_x = Jpug_YCbCr.SUBSAMPLINGS[self._subsampling]
+        height, width = blocks_x * self._F * scale_y, blocks_y * self._F * scale_x
+
+        if chroma.shape[:2] != (height, width):
+            chroma = np.pad(chroma, ((0, height - chroma.shape[0]), (0, width - chroma.shape[1]), (0, 0)), mode='edge')
+
+        if scale_y == scale_x == 1:
+            return chroma
+
+        # Summing the strided pixels of the cells in uint16 is much faster than a mean over the reshaped axes
+        sums = np.zeros((height // scale_y, width // scale_x, 2), dtype=np.uint16)
+        for i in range(scale_y):
+            for j in range(scale_x):
+                sums += chroma[i::scale_y, j::scale_x]
+
+        cells = scale_y * scale_x
+        sums += cells // 2
+
+        return (sums // cells).astype(np.uint8)
+
+    def _upsample(self, chroma:np.ndarray, height:int, width:int, scale_y:int, scale_x:int) -> np.ndarray:
+        '''
+        Upsample the decoded chroma components replicating each pixel, and crop them to the luma plane.
+        '''
+
+        return np.repeat(np.repeat(chroma, scale_y, axis=0), scale_x, axis=1)[:height, :width]
+
+    def encode(self, image:Image.Image) -> Jpug_YCbCr:
+        '''
+        Encode an RGB image in the YCbCr color space.
+
+        Parameters:
+        @param image: PIL Image object representation of the image. If the image is not RGB, it will be converted to RGB.
+        It can also be the (height, width, 3) array of uint8 of a RGB image (e.g. memory-mapped, see Parser.map_bmp).
+
+        @return: An object Jpug_YCbCr representing the compressed image.
+        '''
+
+        assert isinstance(image, (Image.Image, np.ndarray)), 'The image must be a PIL Image object or an array.'
+
+        # The conversion to YCbCr is done by PIL, so the pixels of an array are copied in an image
+        if isinstance(image, np.ndarray):
+            assert image.ndim == 3 and image.shape[2] == 3 and image.dtype == np.uint8, 'The image must be a RGB image.'
+            image = Image.fromarray(np.ascontiguousarray(image))
+
+        with Encoder.PROFILER.stage('pixels', image.width * image.height * 3):
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+
+            image_array = np.asarray(image.convert('YCbCr'))
+        height, width = self._compute_rearranged_shape(image_array.shape[:2])
+
+        scale_y, scale_x = Jpug_YCbCr.SUBSAMPLINGS[self._subsampling]
+        chroma_blocks_x = -(-height // (self._F * scale_y))
+        chroma_blocks_y = -(-width // (self._F * scale_x))
+
+        luma = image_array[:height, :width, 0]
+        with Encoder.PROFILER.stage('subsample', height * width * 2):
+            chroma = self._subsample(image_array[:height, :width, 1:], chroma_blocks_x, chroma_blocks_y)
+
+        # The luma and the chroma bands are run on the same thread pool
+        Y, luma_tasks = self._encode_tasks(luma)
+        CbCr, chroma_tasks = self._chroma_encoder._encode_tasks(chroma)
+        self._run_tasks(luma_tasks + chroma_tasks)
+
+        if self.is_fixed():
+            Y, CbCr = self._quantize(Y), self._chroma_encoder._quantize(CbCr)
+
+        return Jpug_YCbCr(self.get_F(), self.get_d(), Y, chroma_d=self._chroma_encoder.get_d(), subsampling=self._subsampling,
+                          shape=image_array.shape[:2], CbCr=CbCr)
+
+    def decode(self, jpug:Jpug_YCbCr, scale:int=None) -> Image.Image:
+        '''
+        Decode an encoded image.
+
+        Parameters:
+        @param jpug: Jpug_YCbCr object representing the compressed image.
+        @param scale: The image is decoded at scale / F of its size, between 1 and F (see Encoder.decode). Default is None (full size).
+
+        @return: PIL Image object representation of the image. It is a RGB image.
+        '''
+
+        assert isinstance(jpug, Jpug_YCbCr), 'The image must be a Jpug_YCbCr object.'
+
+        # The parameters of the image are taken by shared encoders, without modifying this one
+        luma_decoder = self._get_decoder(jpug.get_F(), jpug.get_d(), jpug.get_Y().dtype)
+        chroma_decoder = self._get_decoder(jpug.get_F(), jpug.get_chroma_d(), jpug.get_CbCr().dtype)
+
+        luma, luma_tasks = luma_decoder._decode_tasks(jpug.get_Y(), scale)
+        chroma, chroma_tasks = chroma_decoder._decode_tasks(jpug.get_CbCr(), scale)
+        self._run_tasks(luma_tasks + chroma_tasks)
+
+        height, width = luma.shape
+        with Encoder.PROFILER.stage('upsample', height * width * 3):
+            image_array = np.empty((height, width, 3), dtype=np.uint8)
+            image_array[:, :, 0] = luma
+            image_array[:, :, 1:] = self._upsample(chroma, height, width, *Jpug_YCbCr.SUBSAMPLINGS[jpug.get_subsampling()])
+
+            return Image.fromarray(image_array, mode='YCbCr').convert('RGB')
+
+    def get_stats(self) -> float:
+        '''
+        Return the percentage of elements saved with the encoder parameters, over the three components.
+
+        @return: A float representing the percentage of elements saved. It does not take into account the size of the float dtype.
+        '''
+
+        scale_y, scale_x = Jpug_YCbCr.SUBSAMPLINGS[self._subsampling]
+        kept = (1 - super().get_stats()) + 2 * (1 - self._chroma_encoder.get_stats()) / (scale_y * scale_x)
+
+        return 1 - kept / 3
+
+    def __str__(self) -> str:
+        return f'YCbCr_Encoder({super().__str__()}, chroma_d={self._chroma_encoder.get_d()}, subsampling={self._subsampling})'
+
+    def __repr__(self) -> str:
+        return self.__str__()
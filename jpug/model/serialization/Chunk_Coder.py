@@ -0,0 +1,175 @@
+import importlib
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+class Chunk_Coder():
+    '''
+    Lossless compression of the coefficient planes with a general-purpose codec of the standard library (zlib, lzma or bz2).
+
+    Each plane of shape (blocks_x, blocks_y, n) is split in chunks of chunk_rows rows of blocks, compressed independently,
+    so that the chunks are compressed and decompressed in parallel (the codecs release the GIL) and a band of rows is loaded
+    decompressing only the chunks intersecting it. Before the compression the bytes of the coefficients are shuffled (the first
+    byte of every coefficient, then the second one, ...): the bytes with the sign and the exponent of the float coefficients are
+    very redundant and compress much better grouped together than interleaved with the mantissas.
+    The offsets of the chunks are stored in the chunk table of the coded plane.
+    '''
+
+    # The module, the default level and the valid levels of each codec
+    CODECS = {
+        'zlib': ('zlib', 6, range(0, 10)),
+        'lzma': ('lzma', 6, range(0, 10)),
+        'bz2': ('bz2', 9, range(1, 10))
+    }
+    DEFAULT_CODEC = 'zlib'
+    DEFAULT_CHUNK_BYTES = 2 ** 18
+
+    HEADER_FORMAT = '<8sIIIIIBB2x'
+    CHUNK_FORMAT = '<QQ'
+
+    def __init__(self, codec:str=DEFAULT_CODEC, level:int=None, chunk_rows:int=None, shuffle:bool=True, workers:int=1) -> None:
+        '''
+        Constructor of the Chunk_Coder class.
+
+        Parameters:
+        @param codec: The name of the codec, one of CODECS. Default is DEFAULT_CODEC.
+        @param level: The compression level (the preset of lzma). Default is None (the default level of the codec).
+        @param chunk_rows: The number of rows of blocks in each chunk. Default is None (about DEFAULT_CHUNK_BYTES bytes for each chunk).
+        @param shuffle: If True, the bytes of the coefficients are shuffled before the compression. Default is True.
+        @param workers: The number of threads used to compress and decompress the chunks. Default is 1.
+        '''
+
+        assert codec in Chunk_Coder.CODECS, f'The codec must be one of {", ".join(Chunk_Coder.CODECS)}.'
+        _, default_level, levels = Chunk_Coder.CODECS[codec]
+        level = default_level if level is None else level
+        assert type(level) == int and level in levels, f'The level of {codec} must be an integer between {levels[0]} and {levels[-1]}.'
+        assert chunk_rows is None or (type(chunk_rows) == int and chunk_rows > 0), 'The number of rows of a chunk must be a positive integer.'
+        assert type(workers) == int and workers > 0, 'The number of workers must be a positive integer.'
+
+        self._codec = codec
+        self._level = level
+        self._chunk_rows = chunk_rows
+        self._shuffle = shuffle
+        self._workers = workers
+
+    def get_codec(self) -> str:
+        return self._codec
+
+    def get_level(self) -> int:
+        return self._level
+
+    @staticmethod
+    def _compress(codec:str, level:int, data) -> bytes:
+        '''
+        Compress a buffer with a codec. The module of the codec is imported at its first use.
+        '''
+
+        module = importlib.import_module(Chunk_Coder.CODECS[codec][0])
+        if codec == 'lzma':
+            return module.compress(data, preset=level)
+
+        return module.compress(data, level)
+
+    @staticmethod
+    def _decompress(codec:str, data) -> bytes:
+        return importlib.import_module(Chunk_Coder.CODECS[codec][0]).decompress(data)
+
+    def _compute_chunk_rows(self, blocks_x:int, row_nbytes:int) -> int:
+        if self._chunk_rows is not None:
+            return self._chunk_rows
+
+        return max(1, min(blocks_x, Chunk_Coder.DEFAULT_CHUNK_BYTES // max(row_nbytes, 1)))
+
+    def _map(self, function, *iterables) -> list:
+        '''
+        Apply the function to the chunks, on a thread pool if more than one worker is used.
+        '''
+
+        if self._workers == 1:
+            return list(map(function, *iterables))
+
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            return list(executor.map(function, *iterables))
+
+    def encode(self, v:np.ndarray) -> bytes:
+        '''
+        Compress a plane.
+
+        Parameters:
+        @param v: The plane, a three dimensional (blocks_x, blocks_y, n) array.
+
+        @return: The coded plane: header, chunk table and chunks.
+        '''
+
+        assert v.ndim == 3, 'The input vector must be three dimensional.'
+
+        v = np.ascontiguousarray(v)
+        blocks_x, blocks_y, n = v.shape
+        itemsize = v.dtype.itemsize
+        chunk_rows = self._compute_chunk_rows(blocks_x, v[0].nbytes if blocks_x > 0 else 0)
+        shuffle = self._shuffle and itemsize > 1
+
+        def compress(start:int) -> bytes:
+            chunk = v[start : start + chunk_rows].reshape(-1).view(np.uint8)
+            if shuffle:
+                chunk = np.ascontiguousarray(chunk.reshape(-1, itemsize).T)
+            return Chunk_Coder._compress(self._codec, self._level, chunk.data)
+
+        chunks = self._map(compress, range(0, blocks_x, chunk_rows))
+
+        chunk_table = b''
+        offset = 0
+        for chunk in chunks:
+            chunk_table += struct.pack(Chunk_Coder.CHUNK_FORMAT, offset, len(chunk))
+            offset += len(chunk)
+
+        header = struct.pack(Chunk_Coder.HEADER_FORMAT, self._codec.encode('ascii'), blocks_x, blocks_y, n, chunk_rows, len(chunks), self._level, shuffle)
+
+        return b''.join([header, chunk_table] + chunks)
+
+    def decode(self, data:bytes, dtype:np.dtype, rows:tuple[int]=None) -> np.ndarray:
+        '''
+        Decompress a coded plane, with the codec stored in its header.
+
+        Parameters:
+        @param data: The coded plane.
+        @param dtype: The dtype of the plane.
+        @param rows: The rows of blocks [start, end) to decode: only the chunks intersecting them are decompressed. Default is None (all the rows).
+
+        @return: The plane, a three dimensional (blocks_x, blocks_y, n) array of dtype, or (end - start, blocks_y, n) if rows is given.
+        '''
+
+        data = memoryview(data)
+        codec, blocks_x, blocks_y, n, chunk_rows, n_chunks, _, shuffle = struct.unpack_from(Chunk_Coder.HEADER_FORMAT, data)
+        codec = codec.rstrip(b'\0').decode('ascii')
+        if codec not in Chunk_Coder.CODECS:
+            raise ValueError(f'Unsupported codec \'{codec}\'.')
+
+        offset = struct.calcsize(Chunk_Coder.HEADER_FORMAT)
+        chunks = [struct.unpack_from(Chunk_Coder.CHUNK_FORMAT, data, offset + k * struct.calcsize(Chunk_Coder.CHUNK_FORMAT)) for k in range(n_chunks)]
+        offset += n_chunks * struct.calcsize(Chunk_Coder.CHUNK_FORMAT)
+
+        first, last = (0, blocks_x) if rows is None else rows
+        assert 0 <= first <= last <= blocks_x, f'The rows must be between 0 and {blocks_x}.'
+
+        dtype = np.dtype(dtype)
+        v = np.empty((last - first, blocks_y, n), dtype=dtype)
+
+        # The chunks are independent, so only the ones intersecting the rows are decompressed, each one straight into its band
+        def decompress(k:int) -> None:
+            start, end = k * chunk_rows, min((k + 1) * chunk_rows, blocks_x)
+            chunk_offset, chunk_nbytes = chunks[k]
+            chunk = np.frombuffer(Chunk_Coder._decompress(codec, data[offset + chunk_offset : offset + chunk_offset + chunk_nbytes]), dtype=np.uint8)
+            if chunk.nbytes != (end - start) * blocks_y * n * dtype.itemsize:
+                raise ValueError('Corrupted compressed chunk.')
+
+            if shuffle:
+                chunk = chunk.reshape(dtype.itemsize, -1).T
+            band = np.ascontiguousarray(chunk).view(dtype).reshape(end - start, blocks_y, n)
+            v[max(start, first) - first : min(end, last) - first] = band[max(first - start, 0) : min(end, last) - start]
+
+        needed = [k for k in range(n_chunks) if k * chunk_rows < last and (k + 1) * chunk_rows > first]
+        self._map(decompress, needed)
+
+        return v
@@ -0,0 +1,550 @@
+import heapq
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+from model.encoder.Encoder import Encoder
+
+class Entropy_Coder():
+    '''
+    Entropy coding stage for the compressed coefficient planes, similar to the baseline JPEG one.
+
+    Each plane of shape (blocks_x, blocks_y, n) is:
+    - quantized with a per-frequency quantization table;
+    - reordered in zigzag order, which visits the kept coefficients antidiagonal by antidiagonal;
+    - converted in symbols: the DC coefficient is coded as a difference from the previous block,
+      the AC coefficients as (zero run, size) pairs. A run of 16 zeros is coded with the ZRL symbol,
+      while the trailing zeros of a block are implicit since every block starts with its DC symbol;
+    - coded with a canonical Huffman table (default or optimized per plane) limited to MAX_CODE_LENGTH bits.
+
+    Every restart_interval rows of blocks the DC prediction is reset and a new byte-aligned segment starts,
+    so that the segments can be encoded and decoded independently (and in parallel).
+    The offsets of the segments are stored in the segment table of the coded plane.
+    '''
+
+    DEFAULT_QUALITY = 50
+    DEFAULT_RESTART_INTERVAL = 8
+
+    MAX_CODE_LENGTH = 16
+    MAX_SIZE = 31
+    MAX_RUN = 15
+
+    ZRL = MAX_RUN << 5
+    DC_OFFSET = 512
+    N_SYMBOLS = DC_OFFSET + MAX_SIZE + 1
+    DECODE_CHUNK = 1 << 16
+
+    HEADER_FORMAT = '<IIIIIB3x'
+    SEGMENT_FORMAT = '<QQ'
+
+    JPEG_LUMINANCE_TABLE = np.array([
+        [16, 11, 10, 16, 24, 40, 51, 61],
+        [12, 12, 14, 19, 26, 58, 60, 55],
+        [14, 13, 16, 24, 40, 57, 69, 56],
+        [14, 17, 22, 29, 51, 87, 80, 62],
+        [18, 22, 37, 56, 68, 109, 103, 77],
+        [24, 35, 55, 64, 81, 104, 113, 92],
+        [49, 64, 78, 87, 103, 121, 120, 101],
+        [72, 92, 95, 98, 112, 100, 103, 99]
+    ], dtype=np.float64)
+
+    def __init__(self, quality:int=DEFAULT_QUALITY, restart_interval:int=DEFAULT_RESTART_INTERVAL, optimize:bool=True, workers:int=1) -> None:
+        '''
+        Constructor of the Entropy_Coder class.
+
+        Parameters:
+        @param quality: The quality used to scale the quantization tables, between 1 and 100. Default is 50.
+        @param restart_interval: The number of rows of blocks in each independent segment. Default is 8.
+        @param optimize: If True, the Huffman table is optimized for each plane, otherwise the default one is used. Default is True.
+        @param workers: The number of threads used to encode and decode the segments. Default is 1.
+        '''
+
+        assert type(quality) == int and 1 <= quality <= 100, 'The quality must be an integer between 1 and 100.'
+        assert type(restart_interval) == int and restart_interval > 0, 'The restart interval must be a positive integer.'
+        assert type(workers) == int and workers > 0, 'The number of workers must be a positive integer.'
+
+        self._quality = quality
+        self._restart_interval = restart_interval
+        self._optimize = optimize
+        self._workers = workers
+
+    def get_quality(self) -> int:
+        return self._quality
+
+    def get_restart_interval(self) -> int:
+        return self._restart_interval
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def compute_quantization_table(F:int, quality:int) -> np.ndarray:
+        '''
+        Compute the F x F quantization table for the given quality.
+        The JPEG luminance table is resampled to F x F and scaled as in the IJG implementation.
+        The coefficients are orthonormal, so the same table gives about the same error per pixel for every F.
+
+        Parameters:
+        @param F: The size of the blocks.
+        @param quality: The quality, between 1 and 100.
+
+        @return: The F x F quantization table.
+        '''
+
+        scale = 5000 / quality if quality < 50 else 200 - 2 * quality
+        idx = (2 * np.arange(F) + 1) * 8 // (2 * F)
+        table = Entropy_Coder.JPEG_LUMINANCE_TABLE[np.ix_(idx, idx)]
+        table = np.maximum(np.floor((table * scale + 50) / 100), 1)
+
+        table.setflags(write=False)
+
+        return table
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _compute_zigzag(F:int, d:int) -> np.ndarray:
+        '''
+        Compute the permutation from the order of the compressed vectors (row-major) to the zigzag order.
+        Since the kept coefficients are the first d antidiagonals, it is a prefix of the F x F zigzag.
+
+        @return: The permutation, such that v[..., zigzag] is in zigzag order.
+        '''
+
+        rows, cols = Encoder._compute_kept_indices(F, d)
+        antidiagonals = rows + cols
+        zigzag = np.lexsort((np.where(antidiagonals % 2 == 1, rows, -rows), antidiagonals))
+
+        zigzag.setflags(write=False)
+
+        return zigzag
+
+    @staticmethod
+    def _compute_code_lengths(frequencies:np.ndarray) -> np.ndarray:
+        '''
+        Compute the lengths of the Huffman codes, limited to MAX_CODE_LENGTH bits (JPEG Annex K.2 and K.3).
+        A code is reserved so that no code is made only of 1 bits.
+
+        Parameters:
+        @param frequencies: The frequency of each symbol.
+
+        @return: The length of the code of each symbol (0 if the symbol is not used).
+        '''
+
+        symbols = np.flatnonzero(frequencies)
+        lengths = np.zeros(len(frequencies), dtype=np.uint8)
+
+        if len(symbols) == 0:
+            return lengths
+
+        heap = [(int(frequencies[s]), int(s), [int(s)]) for s in symbols]
+        heap.append((1, len(frequencies), [len(frequencies)]))
+        heapq.heapify(heap)
+
+        depths = np.zeros(len(frequencies) + 1, dtype=np.int64)
+        while len(heap) > 1:
+            f1, k1, leaves1 = heapq.heappop(heap)
+            f2, k2, leaves2 = heapq.heappop(heap)
+            depths[leaves1] += 1
+            depths[leaves2] += 1
+            heapq.heappush(heap, (f1 + f2, min(k1, k2), leaves1 + leaves2))
+
+        bits = np.bincount(depths[np.append(symbols, len(frequencies))], minlength=Entropy_Coder.MAX_CODE_LENGTH + 1)
+
+        i = len(bits) - 1
+        while i > Entropy_Coder.MAX_CODE_LENGTH:
+            while bits[i] > 0:
+                j = i - 2
+                while bits[j] == 0:
+                    j -= 1
+                bits[i] -= 2
+                bits[i - 1] += 1
+                bits[j + 1] += 2
+                bits[j] -= 1
+            i -= 1
+
+        while bits[i] == 0:
+            i -= 1
+        bits[i] -= 1
+
+        by_frequency = symbols[np.argsort(-frequencies[symbols], kind='stable')]
+        lengths[by_frequency] = np.repeat(np.arange(len(bits)), bits)[:len(symbols)]
+
+        return lengths
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _compute_default_code_lengths() -> np.ndarray:
+        '''
+        Compute the default Huffman table, built from a fixed model where the frequency of a symbol decreases with its size and run.
+
+        @return: The length of the code of each symbol.
+        '''
+
+        frequencies = np.zeros(Entropy_Coder.N_SYMBOLS, dtype=np.int64)
+        sizes = np.arange(Entropy_Coder.MAX_SIZE + 1)
+
+        for run in range(Entropy_Coder.MAX_RUN + 1):
+            frequencies[(run << 5) | sizes[1:]] = 2 ** np.maximum(40 - 2 * sizes[1:] - 3 * run, 0)
+        frequencies[Entropy_Coder.ZRL] = 2 ** 20
+        frequencies[Entropy_Coder.DC_OFFSET + sizes] = 2 ** (40 - sizes)
+
+        lengths = Entropy_Coder._compute_code_lengths(frequencies)
+        lengths.setflags(write=False)
+
+        return lengths
+
+    @staticmethod
+    def _compute_codes(lengths:np.ndarray) -> np.ndarray:
+        '''
+        Compute the canonical Huffman codes from their lengths.
+
+        @return: The code of each symbol.
+        '''
+
+        codes = np.zeros(len(lengths), dtype=np.int64)
+        symbols = np.lexsort((np.arange(len(lengths)), lengths))
+        symbols = symbols[lengths[symbols] > 0]
+
+        code = 0
+        previous_length = 0
+        for s in symbols:
+            code <<= int(lengths[s]) - previous_length
+            previous_length = int(lengths[s])
+            codes[s] = code
+            code += 1
+
+        return codes
+
+    @staticmethod
+    def _compute_decoding_table(lengths:np.ndarray) -> tuple[np.ndarray]:
+        '''
+        Compute the lookup tables to decode a symbol from the next MAX_CODE_LENGTH bits.
+
+        @return: A tuple (symbols, lengths) indexed by the next MAX_CODE_LENGTH bits of the stream.
+        '''
+
+        codes = Entropy_Coder._compute_codes(lengths)
+        table_symbols = np.zeros(1 << Entropy_Coder.MAX_CODE_LENGTH, dtype=np.int16)
+        table_lengths = np.ones(1 << Entropy_Coder.MAX_CODE_LENGTH, dtype=np.uint8)
+
+        for s in np.flatnonzero(lengths):
+            shift = Entropy_Coder.MAX_CODE_LENGTH - int(lengths[s])
+            start = int(codes[s]) << shift
+            table_symbols[start : start + (1 << shift)] = s
+            table_lengths[start : start + (1 << shift)] = lengths[s]
+
+        return table_symbols, table_lengths
+
+    @staticmethod
+    def _compute_symbol_sizes() -> np.ndarray:
+        '''
+        Compute the number of amplitude bits following each symbol.
+        '''
+
+        symbols = np.arange(Entropy_Coder.N_SYMBOLS)
+
+        return np.where(symbols >= Entropy_Coder.DC_OFFSET, symbols - Entropy_Coder.DC_OFFSET, symbols & 31)
+
+    def _compute_segments(self, blocks_x:int) -> list[tuple[int]]:
+        '''
+        Compute the rows of blocks [start, end) of each segment.
+        '''
+
+        return [(start, min(start + self._restart_interval, blocks_x)) for start in range(0, blocks_x, self._restart_interval)]
+
+    @staticmethod
+    def _compute_symbols(qz:np.ndarray) -> tuple[np.ndarray]:
+        '''
+        Convert the quantized blocks of a segment in symbols.
+
+        Parameters:
+        @param qz: The quantized blocks, a two dimensional (blocks, n) integer array in zigzag order.
+
+        @return: A tuple (symbols, amplitudes, sizes) with one entry for each symbol.
+        '''
+
+        n_blocks = qz.shape[0]
+
+        dc_diff = np.diff(qz[:, 0], prepend=0)
+
+        nz_blocks, nz_cols = np.nonzero(qz[:, 1:])
+        nz_cols += 1
+        previous_cols = np.zeros_like(nz_cols)
+        previous_cols[1:] = nz_cols[:-1]
+        previous_cols[1:][nz_blocks[1:] != nz_blocks[:-1]] = 0
+
+        runs = nz_cols - previous_cols - 1
+        zrls = runs >> 4
+        runs &= Entropy_Coder.MAX_RUN
+        ac = qz[nz_blocks, nz_cols]
+
+        events = np.cumsum(zrls + 1)
+        ac_positions = nz_blocks + events
+        dc_positions = np.arange(n_blocks) + np.concatenate(([0], events))[np.searchsorted(nz_blocks, np.arange(n_blocks))]
+        n_events = n_blocks + (events[-1] if len(events) > 0 else 0)
+
+        dc_sizes = np.frexp(np.abs(dc_diff))[1].astype(np.int64)
+        ac_sizes = np.frexp(np.abs(ac))[1].astype(np.int64)
+        if max(dc_sizes.max(initial=0), ac_sizes.max(initial=0)) > Entropy_Coder.MAX_SIZE:
+            raise ValueError(f'Quantized coefficients larger than {Entropy_Coder.MAX_SIZE} bits cannot be entropy coded.')
+
+        symbols = np.full(n_events, Entropy_Coder.ZRL, dtype=np.int64)
+        amplitudes = np.zeros(n_events, dtype=np.int64)
+        sizes = np.zeros(n_events, dtype=np.int64)
+
+        symbols[dc_positions] = Entropy_Coder.DC_OFFSET + dc_sizes
+        amplitudes[dc_positions] = np.where(dc_diff < 0, dc_diff + (1 << dc_sizes) - 1, dc_diff)
+        sizes[dc_positions] = dc_sizes
+
+        symbols[ac_positions] = (runs << 5) | ac_sizes
+        amplitudes[ac_positions] = np.where(ac < 0, ac + (1 << ac_sizes) - 1, ac)
+        sizes[ac_positions] = ac_sizes
+
+        return symbols, amplitudes, sizes
+
+    @staticmethod
+    def _pack_bits(values:np.ndarray, lengths:np.ndarray) -> tuple:
+        '''
+        Concatenate the lengths[i] least significant bits of each values[i], most significant bit first.
+
+        @return: A tuple (payload, nbits) with the packed bytes and the number of valid bits.
+        '''
+
+        ends = np.cumsum(lengths)
+        nbits = int(ends[-1]) if len(ends) > 0 else 0
+
+        shifts = np.repeat(ends, lengths) - 1 - np.arange(nbits)
+        bits = (np.repeat(values, lengths) >> shifts) & 1
+
+        return np.packbits(bits.astype(np.uint8)).tobytes(), nbits
+
+    def _encode_segment(self, symbols:tuple[np.ndarray], codes:np.ndarray, lengths:np.ndarray) -> tuple:
+        '''
+        Code the symbols of a segment with the Huffman table.
+
+        @return: A tuple (payload, nbits) with the coded segment.
+        '''
+
+        symbols, amplitudes, sizes = symbols
+
+        values = np.empty(2 * len(symbols), dtype=np.int64)
+        values[0::2] = codes[symbols]
+        values[1::2] = amplitudes
+
+        value_lengths = np.empty(2 * len(symbols), dtype=np.int64)
+        value_lengths[0::2] = lengths[symbols]
+        value_lengths[1::2] = sizes
+
+        return Entropy_Coder._pack_bits(values, value_lengths)
+
+    @staticmethod
+    def _read_bits(data:np.ndarray, positions:np.ndarray, n_bytes:int) -> np.ndarray:
+        '''
+        Read the n_bytes * 8 bits starting at each position of the stream.
+        '''
+
+        q = positions >> 3
+        window = np.zeros(len(positions), dtype=np.int64)
+        for k in range(n_bytes):
+            window = (window << 8) | data[q + k]
+
+        return window, positions & 7
+
+    @staticmethod
+    def _read_symbols(data:np.ndarray, positions:np.ndarray, table:tuple[np.ndarray]) -> tuple[np.ndarray]:
+        '''
+        Decode the symbol starting at each position of the stream, looking up its next MAX_CODE_LENGTH bits in the table.
+
+        @return: A tuple (symbols, code_lengths) with one entry for each position.
+        '''
+
+        table_symbols, table_lengths = table
+
+        window, offsets = Entropy_Coder._read_bits(data, positions, 3)
+        prefixes = (window >> (8 - offsets)) & ((1 << Entropy_Coder.MAX_CODE_LENGTH) - 1)
+
+        return table_symbols[prefixes], table_lengths[prefixes]
+
+    @staticmethod
+    def _compute_jumps(data:np.ndarray, nbits:int, table:tuple[np.ndarray], symbol_sizes:np.ndarray) -> np.ndarray:
+        '''
+        Compute the position following the symbol (code and amplitude) starting at every bit position of the stream.
+        The positions are processed by chunks of DECODE_CHUNK bits, so that only the jumps are kept for the whole segment.
+
+        @return: The jumps, a (nbits + 1) array whose last entry is nbits.
+        '''
+
+        # The positions are stored on 32 bits, unless the segment is larger than 256 MB
+        index_dtype = np.int32 if nbits < np.iinfo(np.int32).max else np.int64
+
+        jumps = np.empty(nbits + 1, dtype=index_dtype)
+        for start in range(0, nbits, Entropy_Coder.DECODE_CHUNK):
+            positions = np.arange(start, min(start + Entropy_Coder.DECODE_CHUNK, nbits), dtype=index_dtype)
+            symbols, code_lengths = Entropy_Coder._read_symbols(data, positions, table)
+            jumps[start : start + len(positions)] = np.minimum(positions + code_lengths + symbol_sizes[symbols], nbits)
+        jumps[nbits] = nbits
+
+        return jumps
+
+    @staticmethod
+    def _decode_segment(payload:bytes, nbits:int, n_blocks:int, n:int, table:tuple[np.ndarray], symbol_sizes:np.ndarray) -> np.ndarray:
+        '''
+        Decode the quantized blocks of a segment.
+
+        The symbol starting at every bit position is decoded by chunks, keeping only a 32 bits jump for each position;
+        the positions where a symbol actually starts are then found following the chain from position 0 by pointer doubling.
+
+        @return: The quantized blocks, a two dimensional (blocks, n) integer array in zigzag order.
+        '''
+
+        data = np.concatenate((np.frombuffer(payload, dtype=np.uint8), np.zeros(8, dtype=np.uint8)))
+
+        jumps = Entropy_Coder._compute_jumps(data, nbits, table, symbol_sizes)
+
+        chain = np.zeros(1, dtype=jumps.dtype)
+        while chain[-1] < nbits:
+            chain = np.concatenate((chain, jumps[chain]))
+            jumps = jumps[jumps]
+        chain = chain[chain < nbits]
+        del jumps
+
+        # Only the symbols on the chain are decoded again
+        symbols, code_lengths = Entropy_Coder._read_symbols(data, chain, table)
+        sizes = symbol_sizes[symbols]
+        window, offsets = Entropy_Coder._read_bits(data, chain + code_lengths, 5)
+        amplitudes = (window >> (40 - offsets - sizes)) & ((1 << sizes) - 1)
+        del window, offsets
+        values = np.where(amplitudes >= (1 << sizes) >> 1, amplitudes, amplitudes - (1 << sizes) + 1)
+        del amplitudes, sizes, code_lengths
+
+        is_dc = symbols >= Entropy_Coder.DC_OFFSET
+        if np.count_nonzero(is_dc) != n_blocks or (len(symbols) > 0 and not is_dc[0]):
+            raise ValueError('Corrupted entropy coded segment.')
+
+        blocks = np.cumsum(is_dc, dtype=chain.dtype) - 1
+        advances = np.where(is_dc, 0, np.where(symbols == Entropy_Coder.ZRL, 16, (symbols >> 5) + 1))
+        cols = np.cumsum(advances, dtype=chain.dtype)
+        cols -= cols[is_dc][blocks]
+
+        is_ac = ~is_dc & (symbols != Entropy_Coder.ZRL)
+        if np.any(cols[is_ac] >= n):
+            raise ValueError('Corrupted entropy coded segment.')
+
+        qz = np.zeros((n_blocks, n), dtype=np.int64)
+        qz[:, 0] = np.cumsum(values[is_dc])
+        qz[blocks[is_ac], cols[is_ac]] = values[is_ac]
+
+        return qz
+
+    def _map(self, function, *iterables) -> list:
+        '''
+        Apply the function to the segments, on a thread pool if more than one worker is used.
+        '''
+
+        if self._workers == 1:
+            return list(map(function, *iterables))
+
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            return list(executor.map(function, *iterables))
+
+    def encode(self, v:np.ndarray, F:int, d:int) -> bytes:
+        '''
+        Entropy code a compressed plane.
+
+        Parameters:
+        @param v: The compressed plane, a three dimensional (blocks_x, blocks_y, n) array.
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal of the block deleted (0-indexed).
+
+        @return: The coded plane: header, quantization table, Huffman table, segment table and segments.
+        '''
+
+        assert v.ndim == 3, 'The input vector must be three dimensional.'
+
+        blocks_x, blocks_y, n = v.shape
+        rows, cols = Encoder._compute_kept_indices(F, d)
+        qtable = Entropy_Coder.compute_quantization_table(F, self._quality)[rows, cols].astype(np.float32)
+        zigzag = Entropy_Coder._compute_zigzag(F, d)
+
+        def quantize(segment:tuple[int]) -> tuple[np.ndarray]:
+            blocks = np.asarray(v[segment[0] : segment[1]], dtype=np.float32).reshape(-1, n)
+            qz = np.rint(blocks / qtable).astype(np.int64)[:, zigzag]
+            return Entropy_Coder._compute_symbols(qz)
+
+        segments = self._compute_segments(blocks_x)
+        symbols = self._map(quantize, segments)
+
+        if self._optimize:
+            frequencies = np.zeros(Entropy_Coder.N_SYMBOLS, dtype=np.int64)
+            for segment_symbols in symbols:
+                frequencies += np.bincount(segment_symbols[0], minlength=Entropy_Coder.N_SYMBOLS)
+            lengths = Entropy_Coder._compute_code_lengths(frequencies)
+        else:
+            lengths = Entropy_Coder._compute_default_code_lengths()
+        codes = Entropy_Coder._compute_codes(lengths)
+
+        coded = self._map(lambda s: self._encode_segment(s, codes, lengths.astype(np.int64)), symbols)
+
+        segment_table = b''
+        offset = 0
+        for payload, nbits in coded:
+            segment_table += struct.pack(Entropy_Coder.SEGMENT_FORMAT, offset, nbits)
+            offset += len(payload)
+
+        header = struct.pack(Entropy_Coder.HEADER_FORMAT, blocks_x, blocks_y, n, self._restart_interval, len(coded), self._quality)
+
+        return b''.join([header, qtable.astype('<f4').tobytes(), lengths.astype(np.uint8).tobytes(), segment_table] + [payload for payload, _ in coded])
+
+    def decode(self, data:bytes, F:int, d:int, dtype:np.dtype, rows:tuple[int]=None) -> np.ndarray:
+        '''
+        Decode an entropy coded plane.
+
+        Parameters:
+        @param data: The coded plane.
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal of the block deleted (0-indexed).
+        @param dtype: The dtype of the decoded plane.
+        @param rows: The rows of blocks [start, end) to decode: only the segments intersecting them are decoded. Default is None (all the rows).
+
+        @return: The compressed plane, a three dimensional (blocks_x, blocks_y, n) array of dtype, or (end - start, blocks_y, n) if rows is given.
+        '''
+
+        data = memoryview(data)
+        offset = struct.calcsize(Entropy_Coder.HEADER_FORMAT)
+        blocks_x, blocks_y, n, restart_interval, n_segments, _ = struct.unpack_from(Entropy_Coder.HEADER_FORMAT, data)
+
+        assert n == Encoder._compute_kept_indices(F, d)[0].shape[0], 'The coded plane does not match F and d.'
+
+        qtable = np.frombuffer(data, dtype='<f4', count=n, offset=offset)
+        offset += qtable.nbytes
+        lengths = np.frombuffer(data, dtype=np.uint8, count=Entropy_Coder.N_SYMBOLS, offset=offset)
+        offset += lengths.nbytes
+
+        segments = [struct.unpack_from(Entropy_Coder.SEGMENT_FORMAT, data, offset + k * struct.calcsize(Entropy_Coder.SEGMENT_FORMAT)) for k in range(n_segments)]
+        offset += n_segments * struct.calcsize(Entropy_Coder.SEGMENT_FORMAT)
+
+        ends = [segment_offset for segment_offset, _ in segments[1:]] + [len(data) - offset]
+        payloads = [data[offset + start : offset + end] for (start, _), end in zip(segments, ends)]
+
+        segment_rows = [(start, min(start + restart_interval, blocks_x)) for start in range(0, blocks_x, restart_interval)]
+        table = Entropy_Coder._compute_decoding_table(lengths)
+        symbol_sizes = Entropy_Coder._compute_symbol_sizes()
+
+        first, last = (0, blocks_x) if rows is None else rows
+        assert 0 <= first <= last <= blocks_x, f'The rows must be between 0 and {blocks_x}.'
+
+        # The segments are independent, so only the ones intersecting the rows are decoded
+        needed = [k for k, (start, end) in enumerate(segment_rows) if start < last and end > first]
+        segment_rows = [segment_rows[k] for k in needed]
+
+        decoded = self._map(
+            lambda payload, segment, rows: Entropy_Coder._decode_segment(payload, segment[1], (rows[1] - rows[0]) * blocks_y, n, table, symbol_sizes),
+            [payloads[k] for k in needed], [segments[k] for k in needed], segment_rows)
+
+        inverse_zigzag = np.argsort(Entropy_Coder._compute_zigzag(F, d))
+        v = np.empty((last - first, blocks_y, n), dtype=dtype)
+        for (start, end), qz in zip(segment_rows, decoded):
+            band = (qz[:, inverse_zigzag] * qtable).reshape(end - start, blocks_y, n)
+            v[max(start, first) - first : min(end, last) - first] = band[max(first - start, 0) : min(end, last) - start]
+
+        return v
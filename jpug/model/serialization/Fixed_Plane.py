@@ -0,0 +1,253 @@
+import numpy as np
+
+class Fixed_Plane():
+    '''
+    Coefficient plane stored in fixed point: each coefficient is an integer times the scale of its frequency.
+
+    The scale of each frequency (position of the kept coefficient in the block) is derived from the largest magnitude observed
+    over all the blocks, so that the range of the frequency fills its integer type. Each frequency is stored in int8 or int16,
+    the narrowest type giving a quantization step of at most max_step (with int8 as the widest type, every frequency is int8):
+    the DC coefficient, up to 255F, and the strong low frequencies are wide, while the many high frequencies are narrow.
+    The wide and the narrow frequencies are held in two (..., blocks_x, blocks_y, n_wide) and (..., blocks_x, blocks_y, n_narrow)
+    integer arrays, so that they are sliced by band and memory-mapped as the dense planes.
+
+    The plane behaves as the dense (..., blocks_x, blocks_y, n) vector it stands for (shape, ndim, and dtype, the widest integer type allowed):
+    get_parts returns the integers of each width with the positions and the scales of their frequencies, to dequantize them.
+    A leading axis holds the channels of a multi-channel plane: the widths are shared by the channels, the scales are not.
+    '''
+
+    WIDE_DTYPE = np.dtype(np.int16)
+    NARROW_DTYPE = np.dtype(np.int8)
+    SCALES_DTYPE = np.dtype('<f4')
+    ALIGNMENT = 8
+
+    def __init__(self, dtype:np.dtype, wide_map:np.ndarray, scales:np.ndarray, wide:np.ndarray, narrow:np.ndarray) -> None:
+        '''
+        Constructor of the Fixed_Plane class.
+
+        Parameters:
+        @param dtype: The widest integer type allowed, NARROW_DTYPE or WIDE_DTYPE.
+        @param wide_map: The (n,) boolean map of the frequencies stored in WIDE_DTYPE, the other ones being stored in NARROW_DTYPE.
+        @param scales: The (..., n) scale of each frequency of each channel.
+        @param wide: The (..., blocks_x, blocks_y, n_wide) integers of the wide frequencies.
+        @param narrow: The (..., blocks_x, blocks_y, n_narrow) integers of the narrow frequencies.
+        '''
+
+        dtype = np.dtype(dtype)
+        assert dtype in (Fixed_Plane.NARROW_DTYPE, Fixed_Plane.WIDE_DTYPE), 'The integer type must be int8 or int16.'
+        assert dtype == Fixed_Plane.WIDE_DTYPE or not wide_map.any(), 'The frequencies of an int8 plane cannot be wide.'
+        assert wide_map.ndim == 1 and wide_map.dtype == bool, 'The map of the wide frequencies must be a one dimensional boolean array.'
+        assert scales.shape == wide.shape[:-3] + wide_map.shape, 'There must be a scale for each frequency of each channel.'
+        assert wide.dtype == Fixed_Plane.WIDE_DTYPE and narrow.dtype == Fixed_Plane.NARROW_DTYPE, 'The integers must be of type int16 and int8.'
+        assert wide.shape[:-1] == narrow.shape[:-1] and wide.ndim in (3, 4), 'The integers must be (blocks_x, blocks_y, n) or (channels, blocks_x, blocks_y, n) arrays.'
+        assert wide.shape[-1] == np.count_nonzero(wide_map) and narrow.shape[-1] == len(wide_map) - wide.shape[-1], 'The integers must match the map of the wide frequencies.'
+
+        self._dtype = dtype
+        self._wide_map = wide_map
+        self._scales = scales
+        self._wide = wide
+        self._narrow = narrow
+
+    @classmethod
+    def from_dense(cls, dense:np.ndarray, dtype:np.dtype, max_step:float) -> 'Fixed_Plane':
+        '''
+        Quantize a dense plane, with the scale of each frequency of each channel derived from its largest magnitude.
+
+        Parameters:
+        @param dense: The (..., blocks_x, blocks_y, n) dense plane of float.
+        @param dtype: The widest integer type allowed, NARROW_DTYPE or WIDE_DTYPE.
+        @param max_step: The largest quantization step of the frequencies stored in NARROW_DTYPE when dtype is WIDE_DTYPE.
+
+        @return: The Fixed_Plane.
+        '''
+
+        dtype = np.dtype(dtype)
+        assert dtype in (Fixed_Plane.NARROW_DTYPE, Fixed_Plane.WIDE_DTYPE), 'The integer type must be int8 or int16.'
+        assert dense.ndim in (3, 4), 'The plane must be a (blocks_x, blocks_y, n) or (channels, blocks_x, blocks_y, n) array.'
+
+        magnitudes = np.abs(dense).max(axis=(-3, -2), initial=0).astype(np.float32)
+
+        # A frequency is narrow in all the channels if its step is small enough in all of them
+        narrow_limit = np.iinfo(Fixed_Plane.NARROW_DTYPE).max
+        if dtype == Fixed_Plane.NARROW_DTYPE:
+            wide_map = np.zeros(dense.shape[-1], dtype=bool)
+        else:
+            wide_map = magnitudes.reshape(-1, dense.shape[-1]).max(axis=0, initial=0) > max_step * narrow_limit
+
+        limits = np.where(wide_map, np.iinfo(Fixed_Plane.WIDE_DTYPE).max, narrow_limit).astype(np.float32)
+        scales = np.where(magnitudes > 0, magnitudes / limits, 1).astype(Fixed_Plane.SCALES_DTYPE)
+
+        def quantize(frequencies:np.ndarray, dtype:np.dtype) -> np.ndarray:
+            values = dense[..., frequencies] / scales[..., np.newaxis, np.newaxis, frequencies]
+            np.rint(values, out=values)
+            np.clip(values, -limits[frequencies], limits[frequencies], out=values)
+            return values.astype(dtype)
+
+        return cls(dtype, wide_map, scales, quantize(wide_map, Fixed_Plane.WIDE_DTYPE), quantize(~wide_map, Fixed_Plane.NARROW_DTYPE))
+
+    @staticmethod
+    def stack(planes:list['Fixed_Plane']) -> 'Fixed_Plane':
+        '''
+        Stack single-channel planes, with the same wide frequencies, in a multi-channel plane.
+        '''
+
+        wide_map = planes[0]._wide_map
+        assert all(plane.ndim == 3 and np.array_equal(plane._wide_map, wide_map) for plane in planes), 'The planes must be single-channel planes with the same wide frequencies.'
+
+        return Fixed_Plane(planes[0].dtype, wide_map, np.stack([plane._scales for plane in planes]),
+                           np.stack([plane._wide for plane in planes]), np.stack([plane._narrow for plane in planes]))
+
+    def get_wide_map(self) -> np.ndarray:
+        return self._wide_map
+
+    def get_scales(self) -> np.ndarray:
+        return self._scales
+
+    def get_wide(self) -> np.ndarray:
+        return self._wide
+
+    def get_narrow(self) -> np.ndarray:
+        return self._narrow
+
+    @property
+    def shape(self) -> tuple[int]:
+        return self._wide.shape[:-1] + self._wide_map.shape
+
+    @property
+    def ndim(self) -> int:
+        return self._wide.ndim
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+
+    @property
+    def nbytes(self) -> int:
+        return self._wide_map.nbytes + self._scales.nbytes + self._wide.nbytes + self._narrow.nbytes
+
+    def __getitem__(self, channel:int) -> 'Fixed_Plane':
+        '''
+        Get the plane of a channel of a multi-channel plane.
+        '''
+
+        assert self._wide.ndim == 4, 'Only the channels of a multi-channel plane can be indexed.'
+
+        return Fixed_Plane(self._dtype, self._wide_map, self._scales[channel], self._wide[channel], self._narrow[channel])
+
+    def __len__(self) -> int:
+        return len(self._wide)
+
+    def crop(self, rows:slice=slice(None), cols:slice=slice(None)) -> 'Fixed_Plane':
+        '''
+        Get the plane of the blocks in the given rows and columns, sharing the integers of this plane.
+        '''
+
+        return Fixed_Plane(self._dtype, self._wide_map, self._scales, self._wide[..., rows, cols, :], self._narrow[..., rows, cols, :])
+
+    def slice_rows(self, start:int, end:int) -> 'Fixed_Plane':
+        return self.crop(slice(start, end))
+
+    def get_parts(self, kept:np.ndarray=None) -> list[tuple[np.ndarray]]:
+        '''
+        Get the integers of each width, with the positions and the scales of their frequencies.
+
+        Parameters:
+        @param kept: The boolean map of the frequencies to get. Default is None (all of them).
+
+        @return: A (frequencies, integers, scales) tuple for the wide and the narrow frequencies: the indices of the frequencies in the
+        dense plane, the (..., blocks_x, blocks_y, frequencies) integers and the (..., 1, 1, frequencies) scales broadcasting to them.
+        '''
+
+        parts = []
+        for wide, values in ((True, self._wide), (False, self._narrow)):
+            frequencies = np.flatnonzero(self._wide_map == wide)
+            selected = slice(None) if kept is None else kept[frequencies]
+            scales = self._scales[..., frequencies][..., np.newaxis, np.newaxis, selected]
+            parts.append((frequencies[selected], values[..., selected], scales))
+
+        return parts
+
+    def to_dense(self, kept:np.ndarray=None) -> np.ndarray:
+        '''
+        Dequantize the plane.
+
+        Parameters:
+        @param kept: The boolean map of the frequencies to dequantize. Default is None (all of them).
+
+        @return: The (..., blocks_x, blocks_y, frequencies) dense plane of float32.
+        '''
+
+        kept = np.ones(len(self._wide_map), dtype=bool) if kept is None else kept
+        positions = np.cumsum(kept) - 1
+        dense = np.empty(self._wide.shape[:-1] + (int(np.count_nonzero(kept)),), dtype=np.float32)
+
+        for frequencies, values, scales in self.get_parts(kept):
+            dense[..., positions[frequencies]] = values * scales
+
+        return dense
+
+    def to_buffers(self) -> list[memoryview]:
+        '''
+        Serialize a single-channel plane: the map of the wide frequencies, the scales, the wide integers and the narrow ones,
+        each one padded to ALIGNMENT bytes, little endian.
+
+        @return: The list of the buffers to write one after the other.
+        '''
+
+        assert self._wide.ndim == 3, 'Only single-channel planes can be serialized.'
+
+        arrays = [
+            self._wide_map.astype(np.uint8),
+            np.ascontiguousarray(self._scales, dtype=Fixed_Plane.SCALES_DTYPE),
+            np.ascontiguousarray(self._wide, dtype=Fixed_Plane.WIDE_DTYPE.newbyteorder('<')),
+            np.ascontiguousarray(self._narrow)
+        ]
+
+        buffers = []
+        for array in arrays:
+            padding = np.zeros(-array.nbytes % Fixed_Plane.ALIGNMENT, dtype=np.uint8)
+            buffers += [memoryview(buffer).cast('B') for buffer in (array, padding) if buffer.nbytes > 0]
+
+        return buffers
+
+    @staticmethod
+    def from_buffer(buffer:np.ndarray, shape:tuple[int], dtype:np.dtype, rows:tuple[int]=None) -> 'Fixed_Plane':
+        '''
+        Deserialize a single-channel plane written with to_buffers. The integers are views of the buffer (e.g. memory-mapped).
+
+        Parameters:
+        @param buffer: The bytes of the plane, as an array of uint8.
+        @param shape: The (blocks_x, blocks_y, n) shape of the dense plane.
+        @param dtype: The widest integer type allowed, NARROW_DTYPE or WIDE_DTYPE.
+        @param rows: The rows of blocks [start, end) to load. Default is None (all the rows).
+
+        @return: The Fixed_Plane.
+        '''
+
+        blocks_x, blocks_y, n = shape
+        align = lambda offset: offset + (-offset % Fixed_Plane.ALIGNMENT)
+
+        wide_map = buffer[:n].astype(bool)
+        n_wide = int(np.count_nonzero(wide_map))
+
+        scales_start = align(n)
+        wide_start = align(scales_start + n * Fixed_Plane.SCALES_DTYPE.itemsize)
+        narrow_start = align(wide_start + blocks_x * blocks_y * n_wide * Fixed_Plane.WIDE_DTYPE.itemsize)
+        narrow_end = narrow_start + blocks_x * blocks_y * (n - n_wide)
+
+        assert len(buffer) >= narrow_end, 'The plane is truncated.'
+
+        scales = buffer[scales_start : scales_start + n * Fixed_Plane.SCALES_DTYPE.itemsize].view(Fixed_Plane.SCALES_DTYPE)
+        wide = buffer[wide_start : wide_start + blocks_x * blocks_y * n_wide * Fixed_Plane.WIDE_DTYPE.itemsize].view(Fixed_Plane.WIDE_DTYPE.newbyteorder('<'))
+        narrow = buffer[narrow_start:narrow_end].view(Fixed_Plane.NARROW_DTYPE)
+
+        plane = Fixed_Plane(dtype, wide_map, scales.astype(np.float32), wide.reshape(blocks_x, blocks_y, n_wide).astype(Fixed_Plane.WIDE_DTYPE, copy=False),
+                            narrow.reshape(blocks_x, blocks_y, n - n_wide))
+
+        return plane if rows is None else plane.slice_rows(*rows)
+
+    def __str__(self) -> str:
+        return f'Fixed_Plane(shape={self.shape}, dtype={self._dtype}, wide={self._wide.shape[-1]}, narrow={self._narrow.shape[-1]})'
+
+    def __repr__(self) -> str:
+        return self.__str__()
@@ -1,4 +1,5 @@
-from abc import ABC
+from abc import ABC, abstractmethod
+import numpy as np
 
 class Jpug(ABC):
     '''
@@ -18,16 +19,21 @@ class Jpug(ABC):
             return int(2 * F * d - 1/2 * d * d - F * F - 1/2 * d + F)
 
 
-    def __init__(self, F:int, d:int) -> None:
+    MODE = None
+    PLANES = ()
+
+    def __init__(self, F:int, d:int, shape:tuple[int]=None) -> None:
         '''
         Constructor of the class.
 
         Parameters:
         @param F: The size of the blocks.
         @param d: The first antidiagonal of the block to delete (0-indexed).
+        @param shape: The (height, width) of the original image. Default is None (unknown).
         '''
 
         self._set_params(F, d)
+        self._set_shape(shape)
 
     def _set_params(self, F:int, d:int) -> None:
         assert F > 0, 'The size of the blocks must be greater than 0.'
@@ -39,11 +45,59 @@ class Jpug(ABC):
         self._F = F
         self._d = d
 
+    def _set_shape(self, shape:tuple[int]) -> None:
+        assert shape is None or len(shape) == 2, 'The shape must be a (height, width) tuple.'
+
+        self._shape = None if shape is None else tuple(int(x) for x in shape)
+
     def get_F(self) -> int:
         return self._F
     
     def get_d(self) -> int:
         return self._d
+
+    def get_shape(self) -> tuple[int]:
+        '''
+        Get the (height, width) of the original image.
+
+        @return: The shape of the original image, or None if unknown.
+        '''
+        return self._shape
+
+    @abstractmethod
+    def get_planes(self) -> list[np.ndarray]:
+        '''
+        Get the coefficient planes, in the order given by PLANES.
+
+        @return: A list with the coefficient planes.
+        '''
+        pass
+
+    def get_plane_params(self) -> list[tuple[int]]:
+        '''
+        Get the parameters of each coefficient plane, in the order given by PLANES.
+
+        @return: A list with a (d, vertical subsampling, horizontal subsampling) tuple for each plane.
+        By default all the planes use d and are not subsampled.
+        '''
+        return [(self._d, 1, 1)] * len(self.PLANES)
+
+    @classmethod
+    def from_planes(cls, F:int, d:int, planes:list[np.ndarray], plane_params:list[tuple[int]], shape:tuple[int]=None, store:np.ndarray=None) -> 'Jpug':
+        '''
+        Build an object from its coefficient planes, as saved in a file.
+
+        Parameters:
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal of the block to delete (0-indexed).
+        @param planes: The coefficient planes, in the order given by PLANES.
+        @param plane_params: The parameters of each plane, as returned by get_plane_params.
+        @param shape: The (height, width) of the original image. Default is None (unknown).
+        @param store: The planes as a single planar array, if they are stored contiguously. Default is None.
+
+        @return: The Jpug object.
+        '''
+        return cls(F, d, *planes, shape=shape)
     
     def __str__(self) -> str:
         return f'Jpug(F={self._F}, d={self._d})'
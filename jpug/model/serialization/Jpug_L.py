@@ -1,22 +1,28 @@
 import numpy as np
 from model.serialization.Jpug import Jpug
+from model.serialization.Ragged_Plane import Ragged_Plane
+from model.serialization.Fixed_Plane import Fixed_Plane
 
 class Jpug_L(Jpug):
     '''
     Class to encode our version of the JPEG format for a gray-scaled image.
     '''
 
-    def __init__(self, F:int, d:int, v:np.array) -> None:
+    MODE = 'L'
+    PLANES = ('L',)
+
+    def __init__(self, F:int, d:int, v:np.array, shape:tuple[int]=None) -> None:
         '''
         Constructor of the class.
 
         Parameters:
         @param F: The size of the blocks.
         @param d: The first antidiagonal of the block to delete (0-indexed).
-        @param v: The vector to serialize.
+        @param v: The vector to serialize, or a Ragged_Plane with a different d for each block, or a Fixed_Plane stored in fixed point.
+        @param shape: The (height, width) of the original image. Default is None (unknown).
         '''
 
-        super().__init__(F, d)
+        super().__init__(F, d, shape)
         
         self.set_v(v)       
 
@@ -24,12 +30,15 @@ class Jpug_L(Jpug):
         return self._v
     
     def set_v(self, v:np.array) -> None:
-        assert type(v) == np.ndarray, 'The image must be a numpy array.'
+        assert isinstance(v, (np.ndarray, Ragged_Plane, Fixed_Plane)), 'The image must be a numpy array, a Ragged_Plane or a Fixed_Plane.'
         assert v.ndim == 3, 'The vector must be a three dimensional array.'
         assert v.shape[2] == self._compute_compressed_n(self._F, self._d), 'The third dimension of the image must be equal to d.'
 
         self._v = v
 
+    def get_planes(self) -> list[np.array]:
+        return [self.get_v()]
+
     def __str__(self) -> str:
         return f'Jpug_L({super().__str__()}, v_shape={self.get_v().shape}, v_type={self.get_v().dtype}'
     
@@ -1,67 +1,108 @@
 import numpy as np
 from model.serialization.Jpug import Jpug
+from model.serialization.Ragged_Plane import Ragged_Plane
+from model.serialization.Fixed_Plane import Fixed_Plane
 
 class Jpug_RGB(Jpug):
     '''
     Class to encode our version of the JPEG format for a RGB image.
     '''
 
-    def __init__(self, F:int, d:int, R:np.array, G:np.array, B:np.array) -> None:
+    MODE = 'RGB'
+    PLANES = ('R', 'G', 'B')
+
+    def __init__(self, F:int, d:int, R:np.array=None, G:np.array=None, B:np.array=None, shape:tuple[int]=None, v:np.array=None) -> None:
         '''
         Constructor of the class.
+        The three components are held in a single planar array v, of shape (3, blocks_x, blocks_y, n): R, G and B are views of it.
 
         Parameters:
         @param F: The size of the blocks.
         @param d: The first antidiagonal of the block to delete (0-indexed).
-        @param R: The red compoenent vector to serialize.
-        @param G: The green compoenent vector to serialize.
-        @param B: The blue compoenent vector to serialize.
+        @param R: The red compoenent vector to serialize. Default is None (v is given).
+        @param G: The green compoenent vector to serialize. Default is None (v is given).
+        @param B: The blue compoenent vector to serialize. Default is None (v is given).
+        @param shape: The (height, width) of the original image. Default is None (unknown).
+        @param v: The planar vector of the three components. Default is None (R, G and B are given and copied in a new planar vector).
+        The components can also be Ragged_Plane objects, with a different d for each block, or Fixed_Plane objects stored in fixed point.
         '''
 
-        assert R.shape == G.shape == B.shape, 'The three RGB components must have the same shape.'
+        assert (v is None) != (R is None and G is None and B is None), 'Either the three RGB components or the planar vector must be given.'
+
+        super().__init__(F, d, shape)
 
-        super().__init__(F, d)
+        if v is None:
+            assert R.shape == G.shape == B.shape, 'The three RGB components must have the same shape.'
+            if isinstance(R, (Ragged_Plane, Fixed_Plane)):
+                v = type(R).stack([R, G, B])
+            else:
+                v = np.stack([R, G, B])
         
-        self.set_R(R)
-        self.set_G(G)
-        self.set_B(B)
-               
+        self.set_v(v)
+
+    def __setstate__(self, state:dict) -> None:
+        '''
+        Restore a pickled object, converting the legacy state with three independent components to the planar vector.
+        '''
+
+        if '_v' not in state:
+            state['_v'] = np.stack([state.pop('_R'), state.pop('_G'), state.pop('_B')])
+
+        self.__dict__.update(state)
+
+    @classmethod
+    def from_planes(cls, F:int, d:int, planes:list[np.ndarray], plane_params:list[tuple[int]], shape:tuple[int]=None, store:np.ndarray=None) -> 'Jpug_RGB':
+        if store is not None:
+            return cls(F, d, v=store, shape=shape)
+
+        return cls(F, d, *planes, shape=shape)
+
+    def get_v(self) -> np.array:
+        return self._v
 
     def get_R(self) -> np.array:
-        return self._R
+        return self._v[0]
     
     def get_G(self) -> np.array:
-        return self._G
+        return self._v[1]
     
     def get_B(self) -> np.array:
-        return self._B
+        return self._v[2]
     
     def get_RGB(self) -> np.array:
         return [self.get_R(), self.get_G(), self.get_B()]
+
+    def get_planes(self) -> list[np.array]:
+        return self.get_RGB()
+
+    def set_v(self, v:np.array) -> None:
+        assert isinstance(v, (np.ndarray, Ragged_Plane, Fixed_Plane)), 'The image must be a numpy array, a Ragged_Plane or a Fixed_Plane.'
+        assert v.ndim == 4 and v.shape[0] == 3, 'The vector must be a (3, blocks_x, blocks_y, n) array.'
+        assert v.shape[3] == self._compute_compressed_n(self._F, self._d), 'The last dimension of the image must be equal to d.'
+
+        self._v = v
     
-    def set_R(self, R:np.array) -> None:
-        assert type(R) == np.ndarray, 'The image must be a numpy array.'
-        assert R.ndim == 3, 'The vector must be a three dimensional array.'
-        assert R.shape[2] == self._compute_compressed_n(self._F, self._d), 'The third dimension of the image must be equal to d.'
+    def _set_component(self, index:int, component:np.array) -> None:
+        assert isinstance(component, np.ndarray) and isinstance(self._v, np.ndarray), 'The image and the component must be numpy arrays.'
+        assert component.shape == self._v.shape[1:], 'The component must have the shape of the other components.'
 
-        self._R = R
+        # The planes of a loaded file are a read-only memory map: copy them before the first write
+        if not self._v.flags.writeable:
+            self._v = np.array(self._v)
 
-    def set_G(self, G:np.array) -> None:
-        assert type(G) == np.ndarray, 'The image must be a numpy array.'
-        assert G.ndim == 3, 'The vector must be a three dimensional array.'
-        assert G.shape[2] == self._compute_compressed_n(self._F, self._d), 'The third dimension of the image must be equal to d.'
+        self._v[index] = component
 
-        self._G = G
+    def set_R(self, R:np.array) -> None:
+        self._set_component(0, R)
 
-    def set_B(self, B:np.array) -> None:
-        assert type(B) == np.ndarray, 'The image must be a numpy array.'
-        assert B.ndim == 3, 'The vector must be a three dimensional array.'
-        assert B.shape[2] == self._compute_compressed_n(self._F, self._d), 'The third dimension of the image must be equal to d.'
+    def set_G(self, G:np.array) -> None:
+        self._set_component(1, G)
 
-        self._B = B
+    def set_B(self, B:np.array) -> None:
+        self._set_component(2, B)
 
     def __str__(self) -> str:
-        return f'Jpug_RGB({super().__str__()}, R_shape={self.get_R().shape}, G_shape={self.get_G().shape}, B_shape={self.get_B().shape}, v_type={self.get_R().dtype})'
+        return f'Jpug_RGB({super().__str__()}, v_shape={self.get_v().shape}, v_type={self.get_v().dtype})'
     
     def __repr__(self) -> str:
         return self.__str__()
\ No newline at end of file
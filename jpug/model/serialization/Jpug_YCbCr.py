@@ -0,0 +1,114 @@
+import numpy as np
+from model.serialization.Jpug import Jpug
+from model.serialization.Fixed_Plane import Fixed_Plane
+
+class Jpug_YCbCr(Jpug):
+    '''
+    Class to encode our version of the JPEG format for a RGB image converted in the YCbCr color space.
+    The luma (Y) keeps the first d antidiagonals of each block, while the chroma (Cb and Cr) is subsampled
+    and keeps the first chroma_d antidiagonals. The two chroma components are held in a single planar array.
+    '''
+
+    MODE = 'YCbCr'
+    PLANES = ('Y', 'Cb', 'Cr')
+
+    SUBSAMPLINGS = {'4:4:4': (1, 1), '4:2:2': (1, 2), '4:2:0': (2, 2)}
+    DEFAULT_SUBSAMPLING = '4:2:0'
+
+    def __init__(self, F:int, d:int, Y:np.array, Cb:np.array=None, Cr:np.array=None, chroma_d:int=None,
+                 subsampling:str=DEFAULT_SUBSAMPLING, shape:tuple[int]=None, CbCr:np.array=None) -> None:
+        '''
+        Constructor of the class.
+
+        Parameters:
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal of the luma blocks to delete (0-indexed).
+        @param Y: The luma vector to serialize.
+        @param Cb: The blue-difference chroma vector to serialize. Default is None (CbCr is given).
+        @param Cr: The red-difference chroma vector to serialize. Default is None (CbCr is given).
+        @param chroma_d: The first antidiagonal of the chroma blocks to delete (0-indexed). Default is None (d).
+        @param subsampling: The chroma subsampling, one of SUBSAMPLINGS. Default is '4:2:0'.
+        @param shape: The (height, width) of the original image. Default is None (unknown).
+        @param CbCr: The planar vector of the two chroma components. Default is None (Cb and Cr are given and copied in a new planar vector).
+        The vectors can also be Fixed_Plane objects, stored in fixed point.
+        '''
+
+        assert (CbCr is None) != (Cb is None and Cr is None), 'Either the two chroma components or the planar vector must be given.'
+        assert subsampling in Jpug_YCbCr.SUBSAMPLINGS, f'The subsampling must be one of {list(Jpug_YCbCr.SUBSAMPLINGS)}.'
+
+        super().__init__(F, d, shape)
+
+        self._set_chroma_d(d if chroma_d is None else chroma_d)
+        self._subsampling = subsampling
+
+        if CbCr is None:
+            assert Cb.shape == Cr.shape, 'The two chroma components must have the same shape.'
+            CbCr = Fixed_Plane.stack([Cb, Cr]) if isinstance(Cb, Fixed_Plane) else np.stack([Cb, Cr])
+
+        self.set_Y(Y)
+        self.set_CbCr(CbCr)
+
+    def _set_chroma_d(self, chroma_d:int) -> None:
+        assert type(chroma_d) == int, 'The first antidiagonal to delete must be an integer.'
+        assert 0 <= chroma_d <= 2 * self._F - 1, f'chroma_d must be between 0 and 2F - 1 = {2 * self._F - 1}.'
+
+        self._chroma_d = chroma_d
+
+    def get_chroma_d(self) -> int:
+        return self._chroma_d
+
+    def get_subsampling(self) -> str:
+        return self._subsampling
+
+    def get_Y(self) -> np.array:
+        return self._Y
+
+    def get_CbCr(self) -> np.array:
+        return self._CbCr
+
+    def get_Cb(self) -> np.array:
+        return self._CbCr[0]
+
+    def get_Cr(self) -> np.array:
+        return self._CbCr[1]
+
+    def get_planes(self) -> list[np.array]:
+        return [self.get_Y(), self.get_Cb(), self.get_Cr()]
+
+    def get_plane_params(self) -> list[tuple[int]]:
+        chroma_params = (self._chroma_d,) + Jpug_YCbCr.SUBSAMPLINGS[self._subsampling]
+
+        return [(self._d, 1, 1), chroma_params, chroma_params]
+
+    @classmethod
+    def from_planes(cls, F:int, d:int, planes:list[np.ndarray], plane_params:list[tuple[int]], shape:tuple[int]=None, store:np.ndarray=None) -> 'Jpug_YCbCr':
+        chroma_d, *scale = plane_params[1]
+        subsampling = {value: key for key, value in Jpug_YCbCr.SUBSAMPLINGS.items()}.get(tuple(scale))
+
+        if subsampling is None:
+            raise ValueError(f'Unsupported chroma subsampling {tuple(scale)}.')
+
+        if store is not None:
+            return cls(F, d, store[0], chroma_d=chroma_d, subsampling=subsampling, shape=shape, CbCr=store[1:])
+
+        return cls(F, d, planes[0], planes[1], planes[2], chroma_d=chroma_d, subsampling=subsampling, shape=shape)
+
+    def set_Y(self, Y:np.array) -> None:
+        assert isinstance(Y, (np.ndarray, Fixed_Plane)), 'The image must be a numpy array or a Fixed_Plane.'
+        assert Y.ndim == 3, 'The vector must be a three dimensional array.'
+        assert Y.shape[2] == self._compute_compressed_n(self._F, self._d), 'The third dimension of the image must be equal to d.'
+
+        self._Y = Y
+
+    def set_CbCr(self, CbCr:np.array) -> None:
+        assert isinstance(CbCr, (np.ndarray, Fixed_Plane)), 'The image must be a numpy array or a Fixed_Plane.'
+        assert CbCr.ndim == 4 and CbCr.shape[0] == 2, 'The vector must be a (2, blocks_x, blocks_y, n) array.'
+        assert CbCr.shape[3] == self._compute_compressed_n(self._F, self._chroma_d), 'The last dimension of the image must be equal to chroma_d.'
+
+        self._CbCr = CbCr
+
+    def __str__(self) -> str:
+        return f'Jpug_YCbCr({super().__str__()}, chroma_d={self._chroma_d}, subsampling={self._subsampling}, Y_shape={self.get_Y().shape}, CbCr_shape={self.get_CbCr().shape}, v_type={self.get_Y().dtype})'
+
+    def __repr__(self) -> str:
+        return self.__str__()
@@ -0,0 +1,255 @@
+from functools import lru_cache
+
+import numpy as np
+
+class Ragged_Plane():
+    '''
+    Coefficient plane keeping a different number of antidiagonals in each block.
+
+    Each block keeps its first d_map[block] antidiagonals (at most the d of the plane): its coefficients are ordered by antidiagonal,
+    so that they are a prefix of the coefficients of the plane, and the prefixes of all the blocks are packed, in row-major order,
+    in a single ragged buffer. The offset in the buffer of each row of blocks is indexed, so that a band of rows is unpacked without
+    reading the others.
+
+    The plane behaves as the dense (..., blocks_x, blocks_y, n) vector it stands for (shape, ndim, dtype): to_dense scatters a band
+    of rows back to it, with zeros in place of the coefficients not kept. A leading axis holds the channels of a multi-channel plane.
+    '''
+
+    D_MAP_DTYPE = np.uint8
+    OFFSETS_DTYPE = np.dtype('<u8')
+    ALIGNMENT = 8
+
+    def __init__(self, F:int, d:int, d_map:np.ndarray, row_offsets:np.ndarray, data:np.ndarray) -> None:
+        '''
+        Constructor of the Ragged_Plane class.
+
+        Parameters:
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal deleted from all the blocks (0-indexed): the blocks keep at most the first d antidiagonals.
+        @param d_map: The (..., blocks_x, blocks_y) first antidiagonal deleted from each block, between 0 and d.
+        @param row_offsets: The (..., blocks_x + 1) offsets in data of the rows of blocks of each channel, and the end of the last row.
+        @param data: The coefficients kept, as a one dimensional array.
+        '''
+
+        assert 0 <= d <= 2 * F - 1 and d <= np.iinfo(Ragged_Plane.D_MAP_DTYPE).max, f'd must be between 0 and 2F - 1 = {2 * F - 1}.'
+        assert d_map.ndim in (2, 3), 'The d map must be a (blocks_x, blocks_y) or (channels, blocks_x, blocks_y) array.'
+        assert row_offsets.shape == d_map.shape[:-2] + (d_map.shape[-2] + 1,), 'There must be an offset for each row of blocks and one for the end.'
+        assert data.ndim == 1, 'The coefficients must be a one dimensional array.'
+
+        self._F = F
+        self._d = d
+        self._d_map = d_map
+        self._row_offsets = row_offsets
+        self._data = data
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _compute_order(F:int, d:int) -> tuple[np.ndarray]:
+        '''
+        Compute the order of the kept coefficients by antidiagonal, and the number of coefficients in the first j antidiagonals.
+
+        @return: A tuple (order, counts): order sorts the kept coefficients (in the row-major order of the dense planes) by antidiagonal,
+        and counts[j] is the number of coefficients of the first j antidiagonals, for 0 <= j <= d.
+        '''
+
+        rows, cols = np.nonzero(np.add.outer(np.arange(F), np.arange(F)) < d)
+        antidiagonals = rows + cols
+
+        order = np.argsort(antidiagonals, kind='stable')
+        counts = np.searchsorted(antidiagonals[order], np.arange(d + 1))
+
+        order.setflags(write=False)
+        counts.setflags(write=False)
+
+        return order, counts
+
+    @staticmethod
+    def compute_n(F:int, d:int) -> int:
+        '''
+        Compute the number of coefficients in the first d antidiagonals of a block.
+        '''
+
+        return int(Ragged_Plane._compute_order(F, d)[1][d])
+
+    @classmethod
+    def from_dense(cls, F:int, d:int, dense:np.ndarray, d_map:np.ndarray) -> 'Ragged_Plane':
+        '''
+        Pack a dense plane keeping the first d_map[block] antidiagonals of each block.
+
+        Parameters:
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal deleted from the dense plane (0-indexed).
+        @param dense: The (..., blocks_x, blocks_y, n) dense plane, with the kept coefficients of each block in row-major order.
+        @param d_map: The (..., blocks_x, blocks_y) first antidiagonal to delete from each block, between 0 and d.
+
+        @return: The Ragged_Plane.
+        '''
+
+        order, counts = Ragged_Plane._compute_order(F, d)
+        assert dense.shape == d_map.shape + (len(order),), 'The d map must have a value for each block of the dense plane.'
+
+        block_counts = counts[d_map]
+
+        # The mask of the prefixes selects, in row-major order, the coefficients kept by each block
+        kept = np.arange(len(order)) < block_counts[..., np.newaxis]
+        data = dense[..., order][kept]
+
+        row_counts = block_counts.sum(axis=-1, dtype=np.int64)
+        row_offsets = np.concatenate([np.zeros(1, dtype=np.int64), np.cumsum(row_counts.ravel())])
+        if d_map.ndim == 3:
+            # The rows of the channels follow each other: the end of a channel is the start of the next one
+            channels, blocks_x = row_counts.shape
+            row_offsets = row_offsets[np.arange(channels)[:, np.newaxis] * blocks_x + np.arange(blocks_x + 1)]
+
+        return cls(F, d, d_map.astype(Ragged_Plane.D_MAP_DTYPE), row_offsets, data)
+
+    @staticmethod
+    def stack(planes:list['Ragged_Plane']) -> 'Ragged_Plane':
+        '''
+        Stack single-channel planes in a multi-channel plane.
+        '''
+
+        F, d = planes[0].get_F(), planes[0].get_d()
+        assert all(plane.get_params() == (F, d) and plane.ndim == 3 for plane in planes), 'The planes must be single-channel planes with the same F and d.'
+
+        starts = np.cumsum([0] + [plane._row_offsets[-1] - plane._row_offsets[0] for plane in planes[:-1]])
+        row_offsets = np.stack([plane._row_offsets.astype(np.int64) - plane._row_offsets[0] + start for plane, start in zip(planes, starts)])
+        data = np.concatenate([plane._data[plane._row_offsets[0] : plane._row_offsets[-1]] for plane in planes])
+
+        return Ragged_Plane(F, d, np.stack([plane._d_map for plane in planes]), row_offsets, data)
+
+    def get_F(self) -> int:
+        return self._F
+
+    def get_d(self) -> int:
+        return self._d
+
+    def get_params(self) -> tuple[int]:
+        return (self._F, self._d)
+
+    def get_d_map(self) -> np.ndarray:
+        return self._d_map
+
+    def get_row_offsets(self) -> np.ndarray:
+        return self._row_offsets
+
+    def get_data(self) -> np.ndarray:
+        return self._data
+
+    @property
+    def shape(self) -> tuple[int]:
+        return self._d_map.shape + (Ragged_Plane.compute_n(self._F, self._d),)
+
+    @property
+    def ndim(self) -> int:
+        return self._d_map.ndim + 1
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._data.dtype
+
+    @property
+    def nbytes(self) -> int:
+        return self._d_map.nbytes + self._row_offsets.nbytes + self._data.nbytes
+
+    def __getitem__(self, channel:int) -> 'Ragged_Plane':
+        '''
+        Get the plane of a channel of a multi-channel plane.
+        '''
+
+        assert self._d_map.ndim == 3, 'Only the channels of a multi-channel plane can be indexed.'
+
+        return Ragged_Plane(self._F, self._d, self._d_map[channel], self._row_offsets[channel], self._data)
+
+    def __len__(self) -> int:
+        return len(self._d_map)
+
+    def slice_rows(self, start:int, end:int) -> 'Ragged_Plane':
+        '''
+        Get the plane of the rows of blocks [start, end), sharing the coefficients of this plane.
+        '''
+
+        return Ragged_Plane(self._F, self._d, self._d_map[..., start:end, :], self._row_offsets[..., start : end + 1], self._data)
+
+    def to_dense(self, rows:slice=slice(None)) -> np.ndarray:
+        '''
+        Scatter the coefficients of a band of rows of blocks to the dense plane, filling the coefficients not kept with zeros.
+
+        Parameters:
+        @param rows: The slice of the rows of blocks, with step 1. Default is all the rows.
+
+        @return: The (..., rows, blocks_y, n) dense plane, with the kept coefficients of each block in row-major order.
+        '''
+
+        order, counts = Ragged_Plane._compute_order(self._F, self._d)
+        start, end, _ = rows.indices(self._d_map.shape[-2])
+        end = max(start, end)
+
+        d_map = self._d_map[..., start:end, :]
+        kept = np.arange(len(order)) < counts[d_map][..., np.newaxis]
+
+        by_antidiagonal = np.zeros(d_map.shape + (len(order),), dtype=self.dtype)
+        if self._d_map.ndim == 2:
+            by_antidiagonal[kept] = self._data[self._row_offsets[start] : self._row_offsets[end]]
+        else:
+            for channel in range(len(d_map)):
+                by_antidiagonal[channel][kept[channel]] = self._data[self._row_offsets[channel, start] : self._row_offsets[channel, end]]
+
+        dense = np.empty_like(by_antidiagonal)
+        dense[..., order] = by_antidiagonal
+
+        return dense
+
+    def to_buffers(self) -> list[memoryview]:
+        '''
+        Serialize a single-channel plane: the d map (padded to ALIGNMENT bytes), the row offsets relative to the first row and
+        the coefficients, little endian.
+
+        @return: The list of the buffers to write one after the other.
+        '''
+
+        assert self._d_map.ndim == 2, 'Only single-channel planes can be serialized.'
+
+        d_map = np.ascontiguousarray(self._d_map, dtype=Ragged_Plane.D_MAP_DTYPE)
+        padding = np.zeros(-d_map.nbytes % Ragged_Plane.ALIGNMENT, dtype=np.uint8)
+        row_offsets = (self._row_offsets - self._row_offsets[0]).astype(Ragged_Plane.OFFSETS_DTYPE)
+        data = np.ascontiguousarray(self._data[self._row_offsets[0] : self._row_offsets[-1]], dtype=self.dtype.newbyteorder('<'))
+
+        return [memoryview(array).cast('B') for array in (d_map, padding, row_offsets, data)]
+
+    @staticmethod
+    def from_buffer(buffer:np.ndarray, F:int, d:int, shape:tuple[int], dtype:np.dtype, rows:tuple[int]=None) -> 'Ragged_Plane':
+        '''
+        Deserialize a single-channel plane written with to_buffers. The coefficients are a view of the buffer (e.g. memory-mapped).
+
+        Parameters:
+        @param buffer: The bytes of the plane, as an array of uint8.
+        @param F: The size of the blocks.
+        @param d: The first antidiagonal deleted from all the blocks (0-indexed).
+        @param shape: The (blocks_x, blocks_y, n) shape of the dense plane.
+        @param dtype: The dtype of the coefficients.
+        @param rows: The rows of blocks [start, end) to load. Default is None (all the rows).
+
+        @return: The Ragged_Plane.
+        '''
+
+        blocks_x, blocks_y = shape[:2]
+        d_map_nbytes = blocks_x * blocks_y
+        offsets_start = d_map_nbytes + (-d_map_nbytes % Ragged_Plane.ALIGNMENT)
+        data_start = offsets_start + (blocks_x + 1) * Ragged_Plane.OFFSETS_DTYPE.itemsize
+
+        d_map = buffer[:d_map_nbytes].reshape(blocks_x, blocks_y)
+        row_offsets = buffer[offsets_start:data_start].view(Ragged_Plane.OFFSETS_DTYPE).astype(np.int64)
+        data = buffer[data_start:].view(np.dtype(dtype).newbyteorder('<'))
+
+        assert len(data) == row_offsets[-1], 'The coefficients do not match the row offsets.'
+
+        plane = Ragged_Plane(F, d, d_map, row_offsets, data)
+
+        return plane if rows is None else plane.slice_rows(*rows)
+
+    def __str__(self) -> str:
+        return f'Ragged_Plane(F={self._F}, d={self._d}, shape={self.shape}, coefficients={len(self._data)})'
+
+    def __repr__(self) -> str:
+        return self.__str__()
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# The modules of jpug are imported from its directory, as Main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from controller.Encoder_Controller import Encoder_Controller
+
+@pytest.fixture(autouse=True)
+def encoder_controller():
+    '''
+    Give each test a new Encoder_Controller, so that the settings of a test do not leak in the next ones.
+    '''
+
+    Encoder_Controller.instance = None
+    yield
+    Encoder_Controller.instance = None
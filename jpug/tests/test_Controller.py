@@ -0,0 +1,264 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import controller.Util as Util
+from controller.Controller import Controller
+import controller.Batch_Controller as Batch_Module
+from controller.Batch_Controller import Batch_Controller
+from controller.LRU_Cache import LRU_Cache
+from controller.Service_Controller import Service_Controller
+from model.Parser import Parser
+
+@pytest.fixture
+def large_bmp(tmp_path) -> str:
+    '''
+    A RGB BMP large enough to be memory-mapped by the encoding (see Parser.BMP_MAP_MIN_BYTES).
+    '''
+
+    path = str(tmp_path / 'large.bmp')
+    pixels = np.random.default_rng(0).integers(0, 256, (700, 700, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path)
+
+    assert os.path.getsize(path) >= Parser.BMP_MAP_MIN_BYTES
+
+    return path
+
+@pytest.mark.parametrize('mode', list(Util.Mode))
+def test_encode_mapped_bmp(large_bmp, mode):
+    controller = Controller()
+    controller.configure({'mode': mode, 'params': (8, 6)})
+
+    encoded_path = Util.compute_encoded_path(large_bmp, mode)
+    assert controller.execute(Util.Operation.ENCODE, [large_bmp]) == Util.ENCODE_MSG.format(encoded_path)
+
+    jpug = Parser.load_jpug(encoded_path)
+    assert jpug.MODE.upper() == mode.value
+    assert jpug.get_shape() == (700, 700)
+
+def test_decode_mapped_bmp_skips_cache(large_bmp):
+    controller = Controller()
+    controller.configure({'mode': Util.Mode.RGB, 'params': (8, 6)})
+    controller.execute(Util.Operation.ENCODE, [large_bmp])
+    encoded_path = Util.compute_encoded_path(large_bmp, Util.Mode.RGB)
+
+    stats = controller.get_cache().get_stats()
+    for _ in range(2):
+        assert controller.execute(Util.Operation.DECODE, [encoded_path]) == Util.DECODE_MSG.format(Util.compute_decoded_path(encoded_path))
+
+    # Only the loaded jpug is cached: the decoded image is written to the BMP, so no miss is counted for it
+    decoded_stats = controller.get_cache().get_stats()
+    assert (decoded_stats['hits'] - stats['hits'], decoded_stats['misses'] - stats['misses']) == (1, 1)
+    assert decoded_stats['entries'] == stats['entries'] + 1
+
+def test_encode_target_keeps_params(tmp_path):
+    path = str(tmp_path / 'gradient.bmp')
+    x = np.linspace(0, 255, 256)
+    Image.fromarray(np.dstack([np.add.outer(x, x) / 2, np.outer(x, x) / 255, x[::-1][:, None] + 0 * x]).astype(np.uint8)).save(path)
+
+    controller = Controller()
+    controller.configure({'mode': Util.Mode.RGB, 'params': (8, 6), 'target_psnr': 30})
+    controller.execute(Util.Operation.ENCODE, [path])
+
+    jpug = Parser.load_jpug(Util.compute_encoded_path(path, Util.Mode.RGB))
+    assert (jpug.get_F(), jpug.get_d()) != (8, 6)
+    assert controller._encoder_controller.get_active_params() == (8, 6)
+
+    # Without the target, the parameters of CHANGE_PARAMS are used again
+    controller.set_target()
+    controller.execute(Util.Operation.ENCODE, [path])
+
+    jpug = Parser.load_jpug(Util.compute_encoded_path(path, Util.Mode.RGB))
+    assert (jpug.get_F(), jpug.get_d()) == (8, 6)
+
+def test_cached_invalidated_by_changes(tmp_path):
+    path = tmp_path / 'image.bmp'
+    path.write_bytes(bytes(10))
+
+    controller = Controller()
+    controller.set_cache(LRU_Cache(2 ** 20))
+    computed = []
+    compute = lambda: computed.append(path.stat().st_size) or np.zeros(100, dtype=np.uint8)
+
+    controller._cached('image', str(path), (1,), compute)
+    controller._cached('image', str(path), (1,), compute)
+    assert len(computed) == 1
+
+    # A new modification time, a new size (with the old modification time) or new parameters miss the cache
+    mtime = path.stat().st_mtime_ns
+    os.utime(path, ns=(mtime, mtime + 10 ** 9))
+    controller._cached('image', str(path), (1,), compute)
+    path.write_bytes(bytes(20))
+    os.utime(path, ns=(mtime, mtime))
+    controller._cached('image', str(path), (1,), compute)
+    controller._cached('image', str(path), (2,), compute)
+    assert computed == [10, 10, 20, 20]
+
+    msg = controller.execute(Util.Operation.STATS, [])
+    assert Util.CACHE_STATS_MSG.format(hits=1, misses=4, evictions=0, entries=4, bytes=400, max_bytes=2 ** 20) in msg.split('\n')
+
+def test_collect_files_skips_removed(tmp_path, monkeypatch):
+    for name, size in [('small.bmp', 10), ('large.bmp', 100)]:
+        (tmp_path / name).write_bytes(bytes(size))
+
+    # A file removed between the listing of the directory and its stat is skipped
+    walk = os.walk
+    monkeypatch.setattr(os, 'walk', lambda top: [(root, dirs, files + ['removed.bmp']) for root, dirs, files in walk(top)])
+
+    paths = Batch_Controller.collect_files([str(tmp_path)], '.bmp')
+
+    assert paths == [str(tmp_path / 'large.bmp'), str(tmp_path / 'small.bmp')]
+
+def test_split_sources(tmp_path):
+    (tmp_path / 'image.bmp').write_bytes(bytes(10))
+
+    assert Batch_Controller.split_sources([str(tmp_path), '*.bmp', '8', '6']) == ([str(tmp_path), '*.bmp'], ['8', '6'])
+    with pytest.raises(ValueError, match=Util.NO_SOURCES_MSG):
+        Batch_Controller.split_sources(['8', '6'])
+
+@pytest.mark.parametrize('jobs, queue_depth', [(2, 1), (2, 2), (3, 2)])
+def test_run_completion_order(monkeypatch, jobs, queue_depth):
+    submitted, yielded, outstanding = [], [], []
+
+    # The files are converted on threads sleeping for the seconds in their path, so the completion order is known
+    class Executor(ThreadPoolExecutor):
+        def submit(self, function, operation, path):
+            submitted.append(path)
+            outstanding.append(len(submitted) - len(yielded))
+            return super().submit(function, operation, path)
+
+    monkeypatch.setattr(Batch_Module, 'ProcessPoolExecutor', Executor)
+    monkeypatch.setattr(Batch_Module, '_initialize', lambda settings: None)
+    monkeypatch.setattr(Batch_Module, '_convert', lambda operation, path: time.sleep(float(path)) or {'path': path, 'error': None})
+
+    paths = ['0.3'] + ['0.01'] * 8
+    for result in Batch_Controller({}, jobs, queue_depth).run(Util.Operation.ENCODE, paths):
+        yielded.append(result['path'])
+
+    # The largest file is submitted first and completed last, while the other processes keep taking the small ones
+    assert submitted == paths
+    assert sorted(yielded) == sorted(paths) and yielded[-1] == '0.3'
+    assert max(outstanding) == jobs * queue_depth
+
+def test_compute_summary_throughput():
+    results = [{'path': f'{k}.bmp', 'output': None, 'error': None if k < 3 else 'OSError', 'bytes_in': 1, 'bytes_out': 1, 'seconds': 1.0} for k in range(4)]
+
+    # The failed files do not count in the throughput
+    assert Batch_Controller.compute_summary(results, 2.0).startswith(Util.BATCH_SUMMARY_MSG.format(3, 4, 2.0, 1.5, 1 / 2 ** 21, 3, 3))
+
+@pytest.fixture
+def small_bmps(tmp_path) -> list[str]:
+    '''
+    16 small RGB BMPs, coalesced in the batches of the service.
+    '''
+
+    paths = []
+    rng = np.random.default_rng(0)
+    for i in range(16):
+        paths.append(str(tmp_path / f'small_{i}.bmp'))
+        Image.fromarray(rng.integers(0, 256, (32, 40, 3), dtype=np.uint8)).save(paths[-1])
+
+    return paths
+
+def request_service(service:Service_Controller, address:str, requests:list) -> dict:
+    '''
+    Start the service on a Unix socket, send the requests (JSON objects or raw lines) on one connection at once and return
+    the responses by id.
+    '''
+
+    async def run() -> dict:
+        started = asyncio.Event()
+        server = asyncio.create_task(service.serve(address, lambda address: started.set()))
+        await asyncio.wait_for(started.wait(), 10)
+
+        try:
+            reader, writer = await asyncio.open_unix_connection(address)
+            writer.write(b''.join((request if isinstance(request, bytes) else json.dumps(request).encode()) + b'\n' for request in requests))
+            await writer.drain()
+
+            responses = [json.loads(await asyncio.wait_for(reader.readline(), 30)) for _ in requests]
+            writer.close()
+        finally:
+            server.cancel()
+            await asyncio.gather(server, return_exceptions=True)
+
+        return {response['id']: response for response in responses}
+
+    return asyncio.run(run())
+
+def test_service_coalesces_requests(tmp_path, small_bmps):
+    service = Service_Controller({'mode': Util.Mode.RGB, 'params': (8, 6)}, batch_window=0.05)
+    requests = [{'id': i, 'operation': 'encode', 'path': path} for i, path in enumerate(small_bmps)]
+    responses = request_service(service, str(tmp_path / 'service.sock'), requests)
+
+    assert all(responses[i]['ok'] for i in range(16))
+    assert [responses[i]['output'] for i in range(16)] == [Util.compute_encoded_path(path, Util.Mode.RGB) for path in small_bmps]
+
+    # The concurrent small encodings are transformed in fewer batches than requests
+    metrics = service.get_metrics()
+    assert metrics['requests'] == metrics['completed'] == 16
+    assert metrics['batches'] < metrics['requests'] and metrics['mean_batch'] > 1
+
+@pytest.mark.parametrize('max_pending', [1, 3])
+def test_service_backpressure(tmp_path, small_bmps, max_pending):
+    service = Service_Controller({'mode': Util.Mode.RGB, 'params': (8, 6)}, max_pending=max_pending, batch_window=0)
+    pending = []
+
+    # The batches are slowed down, so that the connection could send all its requests meanwhile
+    run_batch = service._run_batch
+    def slow_run_batch(key, requests):
+        pending.append(service.get_metrics()['pending'])
+        time.sleep(0.02)
+        return run_batch(key, requests)
+    service._run_batch = slow_run_batch
+
+    responses = request_service(service, str(tmp_path / 'service.sock'), [{'id': i, 'operation': 'decode' if i % 2 else 'encode',
+                                                                           'path': path} for i, path in enumerate(small_bmps[:8])])
+
+    # The decodings of files not encoded yet fail, but the requests are never more than max_pending
+    assert len(responses) == 8 and all(responses[i]['ok'] for i in range(0, 8, 2))
+    assert max(pending) <= max_pending and service.get_metrics()['max_queued'] <= max_pending
+    assert service.get_metrics()['pending'] == 0
+
+def test_service_errors(tmp_path, small_bmps):
+    service = Service_Controller({'mode': Util.Mode.RGB, 'params': (8, 6)})
+    missing = str(tmp_path / 'missing.bmp')
+    requests = [
+        b'{"id": 0, "operation": "encode", "path": ',
+        {'id': 1, 'operation': 'resize', 'path': small_bmps[0]},
+        {'id': 2, 'operation': 'encode', 'path': missing},
+        {'id': 3, 'operation': 'encode', 'path': small_bmps[0], 'F': 8, 'd': 99},
+        {'id': 4, 'operation': 'encode', 'path': small_bmps[0]}
+    ]
+    responses = request_service(service, str(tmp_path / 'service.sock'), requests)
+
+    # The invalid JSON has no id, and each failed request gets its own error
+    assert {id: response['ok'] for id, response in responses.items()} == {None: False, 1: False, 2: False, 3: False, 4: True}
+    errors = {id: response['error'] for id, response in responses.items()}
+    assert errors[None].startswith('JSONDecodeError')
+    assert errors[1] == 'ValueError: Invalid operation: resize'
+    assert errors[2] == Util.FILE_NOT_FOUND_MSG.format(missing)
+    assert errors[3] == 'ValueError: ' + Util.INVALID_PARAMS_MSG.format(8, 99)
+    assert errors[4] is None and service.get_metrics()['failed'] == 4
+
+def test_service_stats(tmp_path, small_bmps):
+    service = Service_Controller({'mode': Util.Mode.RGB, 'params': (8, 6)})
+    requests = [{'id': i, 'operation': 'encode', 'path': path} for i, path in enumerate(small_bmps[:4])]
+    request_service(service, str(tmp_path / 'service.sock'), requests)
+
+    # The stats of the second connection count the requests of the first one, with their latencies
+    stats = request_service(service, str(tmp_path / 'service.sock'), [{'id': 'stats', 'operation': 'stats'}])['stats']
+    assert stats['ok']
+
+    metrics = stats['output']
+    assert {'queued', 'running', 'pending', 'max_queued', 'batches', 'mean_batch', 'p50_ms', 'p90_ms', 'p99_ms'} <= set(metrics)
+    assert metrics['requests'] == 5 and metrics['completed'] == 4
+    assert 0 < metrics['p50_ms'] <= metrics['p90_ms'] <= metrics['p99_ms']
+    assert stats['message'].split('\n')[-1] == Util.SERVICE_STATS_MSG.format(**metrics)
+    assert any(line.startswith('Cache: ') for line in stats['message'].split('\n'))
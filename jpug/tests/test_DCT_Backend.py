@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+import pytest
+
+from model.encoder.DCT_Backend import DCT_Calibration
+from model.encoder.Encoder import Encoder
+
+@pytest.fixture
+def calibration(tmp_path, monkeypatch) -> DCT_Calibration:
+    '''
+    An empty calibration persisted in a temporary file, used by the encoders instead of the one of the home.
+    '''
+
+    calibration = DCT_Calibration(str(tmp_path / 'dct_calibration.json'))
+    monkeypatch.setattr(Encoder, 'DCT_CALIBRATION', calibration)
+
+    return calibration
+
+def test_calibration_buckets():
+    largest = 1 << DCT_Calibration.MAX_BUCKET
+
+    assert DCT_Calibration.compute_bucket(largest - 1) == DCT_Calibration.MAX_BUCKET - 1
+    assert DCT_Calibration.compute_key(8, 8, np.float16, largest) == DCT_Calibration.compute_key(8, 8, np.float16, 64 * largest)
+
+def test_auto_backend_not_calibrated(calibration):
+    encoder = Encoder(8, 8, dct_backend=Encoder.AUTO_DCT_BACKEND)
+    encoder.encode(np.zeros((64, 64), dtype=np.uint8))
+
+    assert encoder._resolve_dct_backend(64).NAME == Encoder.DEFAULT_DCT_BACKEND
+    assert calibration.get_table() == {}
+    assert not os.path.exists(calibration.get_file())
+
+def test_auto_backend_calibrated_on_first_use(calibration, monkeypatch):
+    monkeypatch.setattr(Encoder, 'CALIBRATE_ON_FIRST_USE', True)
+
+    encoder = Encoder(8, 8, dct_backend=Encoder.AUTO_DCT_BACKEND)
+    encoder.encode(np.zeros((64, 64), dtype=np.uint8))
+
+    assert calibration.lookup(8, 8, np.float16, 64) in Encoder.DCT_BACKENDS
+    assert not os.path.exists(calibration.get_file())
@@ -0,0 +1,200 @@
+import threading
+import tracemalloc
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from model.Parser import Parser
+from model.encoder.Encoder import Encoder
+from model.encoder.L_Encoder import L_Encoder
+from model.encoder.Param_Selector import Param_Selector
+from model.encoder.RGB_Encoder import RGB_Encoder
+from model.encoder.Stream_Encoder import Stream_Encoder
+from model.encoder.Sequence_Encoder import Sequence_Encoder
+from model.encoder.YCbCr_Encoder import YCbCr_Encoder
+from model.serialization.Entropy_Coder import Entropy_Coder
+
+@pytest.fixture
+def image() -> np.ndarray:
+    '''
+    A smooth RGB image with some noise, of 256 x 256 pixels.
+    '''
+
+    x = np.linspace(0, 1, 256)
+    gradient = np.dstack([np.add.outer(x, x) * 127, np.outer(x, x) * 255, np.sin(8 * np.add.outer(x, x)) * 127 + 128])
+    noise = np.random.default_rng(0).normal(0, 8, gradient.shape)
+
+    return np.clip(gradient + noise, 0, 255).astype(np.uint8)
+
+def compute_payload_psnr(encoder:Encoder, image:np.ndarray) -> tuple:
+    '''
+    The bytes of the coefficients of the encoded image and the PSNR of its decoding.
+    '''
+
+    jpug = encoder.encode(Image.fromarray(image))
+    mse = np.mean(np.square(np.asarray(encoder.decode(jpug), dtype=np.float64) - image))
+
+    return sum(plane.nbytes for plane in jpug.get_planes()), Param_Selector.compute_psnr(mse)
+
+@pytest.mark.parametrize('d', [4, 6, 8])
+def test_ycbcr_against_rgb(image, d):
+    rgb_bytes, rgb_psnr = compute_payload_psnr(RGB_Encoder(8, d), image)
+    ycbcr_bytes, ycbcr_psnr = compute_payload_psnr(YCbCr_Encoder(8, d), image)
+
+    # The subsampled chroma with a smaller d saves at least half of the payload, for a moderate loss of quality
+    assert ycbcr_bytes <= rgb_bytes / 2
+    assert rgb_psnr - 3.5 < ycbcr_psnr < rgb_psnr
+
+    # Without subsampling and with the same d the payloads match, and the color conversion costs little
+    full_bytes, full_psnr = compute_payload_psnr(YCbCr_Encoder(8, d, chroma_d=d, subsampling='4:4:4'), image)
+    assert full_bytes == rgb_bytes
+    assert abs(full_psnr - rgb_psnr) < 0.5
+
+@pytest.mark.parametrize('float_dtype, tolerance', [(np.float32, 0.5), (np.float16, 0.6), (np.int16, 0.5), (np.int8, 1.5)])
+def test_decode_scale(image, float_dtype, tolerance):
+    encoder = Encoder(8, 6, float_dtype)
+    encoded = encoder.encode(image)
+    decoded = encoder.decode(encoded)
+
+    assert np.array_equal(encoder.decode(encoded, scale=8), decoded)
+    assert encoder.decode(encoded, scale=4).shape == (128, 128, 3)
+
+    # At scale 1 each pixel is the mean of its block, up to the rounding of the DC coefficient and of the pixel
+    means = image.reshape(32, 8, 32, 8, 3).mean(axis=(1, 3))
+    assert np.abs(encoder.decode(encoded, scale=1) - means).max() <= tolerance
+
+@pytest.mark.parametrize('float_dtype', [np.float16, np.int16])
+@pytest.mark.parametrize('channels', [1, 3])
+@pytest.mark.parametrize('x, y, width, height', [(0, 0, 256, 256), (3, 5, 17, 9), (8, 16, 8, 8), (7, 9, 2, 2), (250, 60, 20, 20), (0, 255, 256, 1)])
+def test_decode_region(image, float_dtype, channels, x, y, width, height):
+    pixels = image if channels == 3 else image[..., 0]
+    encoder = Encoder(8, 6, float_dtype)
+    encoded = encoder.encode(pixels)
+
+    # The windows straddling the edges of the blocks and the ones clipped to the image match the crop of the whole image
+    assert np.array_equal(encoder.decode_region(encoded, x, y, width, height), encoder.decode(encoded)[y : y + height, x : x + width])
+
+@pytest.mark.parametrize('dct_backend', sorted(Encoder.DCT_BACKENDS))
+@pytest.mark.parametrize('workers', [1, 4])
+def test_session_steady_state_allocations(image, dct_backend, workers):
+    session = Encoder(8, 6, np.float16, dct_backend, workers).create_session(image.shape)
+    session.decode(session.encode(image))
+
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        for _ in range(3):
+            session.decode(session.encode(image))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    # After the first call only small objects are allocated (tasks, views), far less than the image or any buffer of the session
+    assert peak - start < 64 * 2 ** 10 < image.nbytes / 2
+
+@pytest.mark.parametrize('stop_after', [0, 1, 3])
+def test_prefetch_stops_reader(stop_after):
+    threads = threading.active_count()
+    read = []
+    stripes = Stream_Encoder._prefetch(lambda item: read.append(item) or item, list(range(100)))
+
+    for i, stripe in enumerate(stripes):
+        assert stripe == i
+        if i == stop_after:
+            break
+    stripes.close()
+
+    # The reader thread is joined when the generator is closed, having read at most the prefetched stripes more
+    assert len(read) <= stop_after + 2 + Stream_Encoder.PREFETCHED_STRIPES
+    assert threading.active_count() == threads
+
+@pytest.mark.parametrize('encoder_class, mode', [(L_Encoder, 'L'), (RGB_Encoder, 'RGB')])
+@pytest.mark.parametrize('float_dtype', [np.float16, np.float32])
+def test_stream_matches_in_memory(tmp_path, image, encoder_class, mode, float_dtype):
+    # Not divisible in blocks, and a memory budget of a few rows of blocks for each stripe
+    pixels = image[:250, :236] if mode == 'RGB' else Parser.convert_to_l(image[:250, :236])
+    image_path = str(tmp_path / 'image.bmp')
+    Image.fromarray(pixels).save(image_path)
+    stream_encoder = Stream_Encoder(memory_budget=3 * 8 * 236 * 3 * (Stream_Encoder.BYTES_PER_PIXEL + Stream_Encoder.PREFETCHED_STRIPES))
+    assert stream_encoder.compute_stripe_rows(8, 236, 3) == 3
+
+    encoder = encoder_class(8, 6, float_dtype)
+    jpug = encoder.encode(Image.fromarray(pixels))
+    memory_path = str(tmp_path / 'memory.jpug')
+    Parser.save_jpug(jpug, memory_path)
+
+    stream_path = str(tmp_path / 'stream.jpug')
+    stream_encoder.encode(encoder, mode, image_path, stream_path)
+
+    with open(memory_path, 'rb') as memory_file, open(stream_path, 'rb') as stream_file:
+        assert memory_file.read() == stream_file.read()
+
+    decoded_path = str(tmp_path / 'decoded.bmp')
+    stream_encoder.decode(stream_path, decoded_path)
+    assert np.array_equal(np.asarray(Parser.load_image(decoded_path)), np.asarray(encoder.decode(jpug)))
+
+def test_stream_rejects_entropy_coded(tmp_path, image):
+    encoder = RGB_Encoder(8, 6)
+    jpug_path = str(tmp_path / 'image.jpug')
+    Parser.save_jpug(encoder.encode(Image.fromarray(image)), jpug_path, entropy_coder=Entropy_Coder())
+
+    # The entropy coded planes would be decoded whole in memory
+    with pytest.raises(ValueError):
+        Stream_Encoder().decode(jpug_path, str(tmp_path / 'decoded.bmp'))
+
+@pytest.fixture
+def frames(tmp_path, image) -> list[str]:
+    '''
+    7 RGB frames of 68 x 84 pixels (not divisible in blocks): each one changes a different block of the previous one.
+    '''
+
+    paths = []
+    frame = image[:68, :84].copy()
+    for i in range(7):
+        if i > 0:
+            frame[8 * i : 8 * i + 8, 8 * i + 3 : 8 * i + 11] ^= 0x55
+        paths.append(str(tmp_path / f'frame_{i}.bmp'))
+        Image.fromarray(frame).save(paths[-1])
+
+    return paths
+
+def test_sequence_changed_blocks(tmp_path, frames):
+    sequence_path = str(tmp_path / 'frames.jpugs')
+    stats = Sequence_Encoder(keyframe_interval=4).encode(Encoder(8, 6), 'RGB', frames, sequence_path)
+    assert stats == {'frames': 7, 'keyframes': 2, 'blocks': 7 * 80, 'stored_blocks': 2 * 80 + 5 * 2}
+
+    header = Parser.read_sequence_header(sequence_path)
+    assert list(header['index']['keyframe']) == [1, 0, 0, 0, 1, 0, 0]
+    assert list(header['index']['blocks']) == [80, 2, 2, 2, 80, 2, 2]
+
+    # The change of the frame i straddles the blocks (i, i) and (i, i + 1), the only ones stored by the delta frames
+    buffer = np.fromfile(sequence_path, dtype=np.uint8)
+    for i in [1, 2, 3, 5, 6]:
+        coefficients, changed = Parser.read_sequence_frame(buffer, header, i)
+        expected = np.zeros((8, 10), dtype=bool)
+        expected[i, i : i + 2] = True
+        assert np.array_equal(changed, expected) and coefficients.shape == (3, 2, header['n'])
+
+@pytest.mark.parametrize('start', [0, 2, 4, 6])
+def test_sequence_random_access(tmp_path, monkeypatch, frames, start):
+    sequence_path = str(tmp_path / 'frames.jpugs')
+    sequence_encoder = Sequence_Encoder(keyframe_interval=4)
+    encoder = Encoder(8, 6)
+    sequence_encoder.encode(encoder, 'RGB', frames, sequence_path)
+
+    # Without error allowed, each frame decodes as the frame encoded on its own
+    decoded = [frame.copy() for _, frame in sequence_encoder.iterate_frames(sequence_path)]
+    for path, frame in zip(frames, decoded):
+        assert np.array_equal(frame, encoder.decode(encoder.encode(np.asarray(Parser.load_image(path))[:64, :80])))
+
+    read = []
+    read_sequence_frame = Parser.read_sequence_frame
+    monkeypatch.setattr(Parser, 'read_sequence_frame', lambda buffer, header, frame: read.append(frame) or read_sequence_frame(buffer, header, frame))
+
+    paths = sequence_encoder.decode(sequence_path, str(tmp_path / 'decoded_{}.bmp'), start, start + 1)
+
+    # The frame is decoded from the keyframe before it, reading only the frames in between
+    assert read == list(range(start // 4 * 4, start + 1))
+    assert paths == [str(tmp_path / f'decoded_{start}.bmp')]
+    assert np.array_equal(np.asarray(Parser.load_image(paths[0])), decoded[start])
@@ -0,0 +1,106 @@
+import struct
+
+import numpy as np
+import pytest
+
+from model.encoder.Encoder import Encoder
+from model.serialization.Entropy_Coder import Entropy_Coder
+
+F = 8
+
+def make_plane(blocks_x:int, blocks_y:int, d:int, seed:int=0) -> np.ndarray:
+    '''
+    A compressed plane with coefficients decaying with the frequency, as the ones of a natural image.
+    '''
+
+    n = Encoder._compute_kept_indices(F, d)[0].shape[0]
+    v = np.random.default_rng(seed).normal(0, 40, (blocks_x, blocks_y, n)) * np.exp(-np.arange(n) / 6)
+    v[..., 0] += 500
+
+    return v.astype(np.float32)
+
+def compute_qtable(d:int) -> np.ndarray:
+    '''
+    The quantization table of the kept coefficients, at the default quality.
+    '''
+
+    rows, cols = Encoder._compute_kept_indices(F, d)
+
+    return Entropy_Coder.compute_quantization_table(F, Entropy_Coder.DEFAULT_QUALITY)[rows, cols].astype(np.float32)
+
+def quantize(v:np.ndarray, d:int) -> np.ndarray:
+    '''
+    The plane expected after decoding: the coefficients rounded to multiples of the quantization table.
+    '''
+
+    return np.rint(v / compute_qtable(d)) * compute_qtable(d)
+
+@pytest.mark.parametrize('blocks_x, restart_interval', [(13, 4), (7, 8), (9, 1), (16, 8)])
+def test_round_trip_restart_segments(blocks_x, restart_interval):
+    v = make_plane(blocks_x, 5, 6)
+    coder = Entropy_Coder(restart_interval=restart_interval)
+    data = coder.encode(v, F, 6)
+
+    # The last segment is shorter when blocks_x is not a multiple of the restart interval
+    assert [end - start for start, end in coder._compute_segments(blocks_x)][-1] == (blocks_x - 1) % restart_interval + 1
+    assert np.array_equal(coder.decode(data, F, 6, np.float32), quantize(v, 6))
+
+@pytest.mark.parametrize('optimize', [True, False])
+def test_workers_match_single_worker(optimize):
+    v = make_plane(21, 6, 6, seed=1)
+    single = Entropy_Coder(restart_interval=4, optimize=optimize, workers=1)
+    parallel = Entropy_Coder(restart_interval=4, optimize=optimize, workers=4)
+
+    data = single.encode(v, F, 6)
+    assert parallel.encode(v, F, 6) == data
+    assert np.array_equal(parallel.decode(data, F, 6, np.float32), single.decode(data, F, 6, np.float32))
+
+def test_zero_runs_longer_than_max_run():
+    d = 2 * F - 1
+    n = Encoder._compute_kept_indices(F, d)[0].shape[0]
+    zigzag = Entropy_Coder._compute_zigzag(F, d)
+    v = np.zeros((6, 4, n), dtype=np.float32)
+    v[..., zigzag[0]] = 800
+    v[..., zigzag[-1]] = 100
+    v[::2, :, zigzag[n // 2]] = -60
+
+    # A run of r zeros needs r // 16 ZRL symbols: 3 rows of 4 blocks with a run of n - 2 zeros, 3 rows with two shorter runs
+    qz = np.rint(v.reshape(-1, n) / compute_qtable(d))[:, zigzag].astype(np.int64)
+    symbols = Entropy_Coder._compute_symbols(qz)[0]
+    zrls = ((n - 2) // 16 * 3 + ((n // 2 - 1) // 16 + (n - n // 2 - 2) // 16) * 3) * 4
+    assert np.count_nonzero(symbols == Entropy_Coder.ZRL) == zrls
+
+    coder = Entropy_Coder(restart_interval=4)
+    assert np.array_equal(coder.decode(coder.encode(v, F, d), F, d, np.float32), quantize(v, d))
+
+@pytest.mark.parametrize('rows', [(0, 3), (3, 9), (5, 6), (12, 13), (0, 13), (4, 4)])
+def test_decode_rows(monkeypatch, rows):
+    v = make_plane(13, 5, 6, seed=2)
+    coder = Entropy_Coder(restart_interval=4)
+    data = coder.encode(v, F, 6)
+    full = coder.decode(data, F, 6, np.float32)
+
+    decoded_segments = []
+    decode_segment = Entropy_Coder._decode_segment
+    monkeypatch.setattr(Entropy_Coder, '_decode_segment', staticmethod(lambda *args: decoded_segments.append(args[2]) or decode_segment(*args)))
+
+    assert np.array_equal(coder.decode(data, F, 6, np.float32, rows=rows), full[rows[0] : rows[1]])
+
+    # Only the segments of 4 rows intersecting the rows are decoded
+    needed = [start for start in range(0, 13, 4) if start < rows[1] and start + 4 > rows[0]]
+    assert len(decoded_segments) == len(needed)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_corrupted_payload(seed):
+    v = make_plane(11, 7, 6)
+    coder = Entropy_Coder(restart_interval=4)
+    data = bytearray(coder.encode(v, F, 6))
+
+    # The payload follows the header, the quantization table, the Huffman table and the segment table
+    offset = struct.calcsize(Entropy_Coder.HEADER_FORMAT) + compute_qtable(6).nbytes + Entropy_Coder.N_SYMBOLS
+    offset += len(coder._compute_segments(11)) * struct.calcsize(Entropy_Coder.SEGMENT_FORMAT)
+    for i in np.random.default_rng(seed).integers(offset, len(data), 5):
+        data[i] ^= 0xFF
+
+    with pytest.raises(ValueError):
+        coder.decode(bytes(data), F, 6, np.float32)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from controller.LRU_Cache import LRU_Cache
+
+def test_evicts_least_recently_used_bytes():
+    cache = LRU_Cache(300)
+    for key in 'abc':
+        cache.put((key,), np.zeros(100, dtype=np.uint8))
+
+    # Reading 'a' makes 'b' the least recently used entry, evicted by the fourth one
+    assert cache.get(('a',)) is not None
+    cache.put(('d',), np.zeros(100, dtype=np.uint8))
+
+    assert cache.get(('b',)) is None
+    assert all(cache.get((key,)) is not None for key in 'acd')
+    assert cache.get_stats() == {'hits': 4, 'misses': 1, 'evictions': 1, 'entries': 3, 'bytes': 300}
+
+    # A larger value evicts as many entries as needed, while a value larger than the whole budget is not cached
+    cache.put(('e',), np.zeros(250, dtype=np.uint8))
+    assert cache.get_stats()['entries'] == 1 and cache.get_stats()['bytes'] == 250
+    cache.put(('f',), np.zeros(301, dtype=np.uint8))
+    assert cache.get(('f',)) is None and cache.get(('e',)) is not None
+
+def test_contains_keeps_counters():
+    cache = LRU_Cache(200)
+    cache.put(('a',), np.zeros(100, dtype=np.uint8))
+    cache.put(('b',), np.zeros(100, dtype=np.uint8))
+
+    # Neither a hit, nor a miss, nor a use of 'a', which is still the first evicted
+    assert cache.contains(('a',)) and not cache.contains(('c',))
+    cache.put(('c',), np.zeros(100, dtype=np.uint8))
+    assert not cache.contains(('a',))
+    assert cache.get_stats() == {'hits': 0, 'misses': 0, 'evictions': 1, 'entries': 2, 'bytes': 200}
+
+def test_replaced_and_invalidated_entries():
+    cache = LRU_Cache(1000, max_entries=2)
+    cache.put(('image', '/a.bmp', 1), np.zeros(100, dtype=np.uint8))
+    cache.put(('image', '/a.bmp', 1), np.zeros(200, dtype=np.uint8))
+    assert cache.get_stats()['bytes'] == 200
+
+    cache.put(('jpug', '/a.bmp', 2), np.zeros(10, dtype=np.uint8))
+    cache.put(('jpug', '/b.bmp', 1), np.zeros(10, dtype=np.uint8))
+    assert cache.get_stats()['entries'] == 2 and cache.get_stats()['evictions'] == 1
+
+    # Only the entries of the path are removed
+    cache.invalidate('/a.bmp')
+    assert cache.get_stats()['bytes'] == 10 and cache.get(('jpug', '/b.bmp', 1)) is not None
+
+@pytest.mark.parametrize('max_bytes', [0, 100])
+def test_memory_maps_not_counted(tmp_path, max_bytes):
+    path = tmp_path / 'plane.bin'
+    path.write_bytes(bytes(1000))
+    mapped = np.memmap(path, dtype=np.uint8, mode='r')
+
+    cache = LRU_Cache(max_bytes)
+    cache.put(('jpug', str(path)), (mapped, np.zeros(50, dtype=np.uint8)))
+
+    # The pages of the memory map belong to the page cache, so only the array in memory is counted
+    assert cache.get_stats()['bytes'] == (0 if max_bytes == 0 else 50)
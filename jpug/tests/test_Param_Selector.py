@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from model.encoder.Encoder import Encoder
+from model.encoder.Param_Selector import Param_Selector
+
+@pytest.fixture
+def image() -> np.ndarray:
+    '''
+    A smooth RGB image with some noise, of 256 x 256 pixels.
+    '''
+
+    x = np.linspace(0, 1, 256)
+    gradient = np.dstack([np.add.outer(x, x) * 127, np.outer(x, x) * 255, np.sin(8 * np.add.outer(x, x)) * 127 + 128])
+    noise = np.random.default_rng(0).normal(0, 8, gradient.shape)
+
+    return np.clip(gradient + noise, 0, 255).astype(np.uint8)
+
+@pytest.mark.parametrize('float_dtype', [np.float16, np.int16, np.int8])
+def test_select_params_estimate(image, float_dtype):
+    selection = Param_Selector.select_params(image, max_bytes=40000, float_dtype=float_dtype)
+    assert selection['met']
+
+    encoder = Encoder(selection['F'], selection['d'], float_dtype)
+    encoded = encoder.encode(image)
+    decoded = encoder.decode(encoded)
+
+    mse = np.mean(np.square(decoded.astype(np.float64) - image[:decoded.shape[0], :decoded.shape[1]]))
+    assert abs(Param_Selector.compute_psnr(mse) - selection['psnr']) < 0.2
+    assert abs(selection['bytes'] - encoded.nbytes) <= 0.02 * encoded.nbytes
+
+
+def test_antidiagonal_energy_preserved(image):
+    # The orthonormal DCT preserves the energy of the blocks
+    energy = Param_Selector.compute_antidiagonal_energy(Encoder(8, 15, np.float32), image)
+
+    assert energy.shape == (15,)
+    assert np.isclose(energy.sum(), np.square(image, dtype=np.float64).sum(), rtol=1e-5)
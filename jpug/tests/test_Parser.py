@@ -0,0 +1,183 @@
+import os
+import stat
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from model.Parser import Parser
+from model.encoder.L_Encoder import L_Encoder
+from model.encoder.RGB_Encoder import RGB_Encoder
+from model.encoder.YCbCr_Encoder import YCbCr_Encoder
+from model.serialization.Jpug import Jpug
+from model.serialization.Entropy_Coder import Entropy_Coder
+from model.serialization.Chunk_Coder import Chunk_Coder
+from model.serialization.Ragged_Plane import Ragged_Plane
+from model.serialization.Fixed_Plane import Fixed_Plane
+
+ENCODER_CLASSES = [L_Encoder, RGB_Encoder, YCbCr_Encoder]
+
+@pytest.fixture
+def image() -> Image.Image:
+    '''
+    A RGB image of 100 x 84 pixels, not divisible in blocks, with smooth and noisy areas.
+    '''
+
+    x = np.linspace(0, 1, 84)
+    y = np.linspace(0, 1, 100)
+    gradient = np.dstack([np.add.outer(y, x) * 127, np.outer(y, x) * 255, np.sin(6 * np.add.outer(y, x)) * 127 + 128])
+    noise = np.random.default_rng(0).normal(0, 12, gradient.shape)
+
+    return Image.fromarray(np.clip(gradient + noise, 0, 255).astype(np.uint8))
+
+def encode(encoder_class:type, image:Image.Image, **params) -> Jpug:
+    encoder = encoder_class(8, 6, **params)
+    return encoder.encode(image.convert('L') if encoder_class == L_Encoder else image)
+
+def assert_same_jpug(loaded:Jpug, jpug:Jpug) -> None:
+    assert type(loaded) == type(jpug)
+    assert (loaded.get_F(), loaded.get_d(), loaded.get_shape()) == (jpug.get_F(), jpug.get_d(), jpug.get_shape())
+    assert loaded.get_plane_params() == jpug.get_plane_params()
+    assert len(loaded.get_planes()) == len(jpug.get_planes())
+
+def assert_same_planes(loaded:Jpug, jpug:Jpug) -> None:
+    assert_same_jpug(loaded, jpug)
+
+    for loaded_plane, plane in zip(loaded.get_planes(), jpug.get_planes()):
+        # The raw planes are loaded as memory maps, a subclass of np.ndarray
+        assert isinstance(loaded_plane, type(plane)) and loaded_plane.dtype == plane.dtype and loaded_plane.shape == plane.shape
+
+        if isinstance(plane, Ragged_Plane):
+            assert np.array_equal(loaded_plane.get_d_map(), plane.get_d_map())
+            assert np.array_equal(loaded_plane.to_dense(), plane.to_dense())
+        elif isinstance(plane, Fixed_Plane):
+            assert np.array_equal(loaded_plane.get_wide_map(), plane.get_wide_map())
+            assert np.array_equal(loaded_plane.get_scales(), plane.get_scales())
+            assert np.array_equal(loaded_plane.get_wide(), plane.get_wide())
+            assert np.array_equal(loaded_plane.get_narrow(), plane.get_narrow())
+        else:
+            assert np.array_equal(loaded_plane, plane)
+
+def test_get_planes_abstract():
+    class Jpug_Incomplete(Jpug):
+        MODE = 'incomplete'
+
+    with pytest.raises(TypeError):
+        Jpug_Incomplete(8, 8)
+
+@pytest.mark.parametrize('encoder_class', ENCODER_CLASSES)
+@pytest.mark.parametrize('float_dtype', [np.float16, np.float32])
+@pytest.mark.parametrize('mmap', [True, False])
+def test_raw_round_trip(tmp_path, image, encoder_class, float_dtype, mmap):
+    jpug = encode(encoder_class, image, float_dtype=float_dtype)
+
+    file = str(tmp_path / 'image.jpug')
+    Parser.save_jpug(jpug, file)
+
+    assert Parser.read_header(file)['version'] == Parser.VERSION
+    assert_same_planes(Parser.load_jpug(file, mmap=mmap), jpug)
+
+@pytest.mark.parametrize('encoder_class', ENCODER_CLASSES)
+def test_huffman_round_trip(tmp_path, image, encoder_class):
+    jpug = encode(encoder_class, image)
+
+    file = str(tmp_path / 'image.jpug')
+    Parser.save_jpug(jpug, file, entropy_coder=Entropy_Coder(75, restart_interval=4))
+    loaded = Parser.load_jpug(file)
+
+    # The coefficients are quantized with the table of the quality, then coded losslessly
+    assert_same_jpug(loaded, jpug)
+    for loaded_plane, plane, (d, _, _) in zip(loaded.get_planes(), jpug.get_planes(), jpug.get_plane_params()):
+        rows, cols = np.nonzero(np.add.outer(np.arange(8), np.arange(8)) < d)
+        qtable = Entropy_Coder.compute_quantization_table(8, 75)[rows, cols].astype(np.float32)
+
+        expected = (np.rint(np.asarray(plane, dtype=np.float32) / qtable) * qtable).astype(plane.dtype)
+        assert loaded_plane.dtype == plane.dtype and np.array_equal(loaded_plane, expected)
+
+@pytest.mark.parametrize('encoder_class', ENCODER_CLASSES)
+@pytest.mark.parametrize('codec', list(Chunk_Coder.CODECS))
+def test_chunk_round_trip(tmp_path, image, encoder_class, codec):
+    jpug = encode(encoder_class, image)
+
+    file = str(tmp_path / 'image.jpug')
+    Parser.save_jpug(jpug, file, chunk_coder=Chunk_Coder(codec, chunk_rows=3, workers=2))
+
+    assert {plane['codec'] for plane in Parser.read_header(file)['planes']} == {codec}
+    assert_same_planes(Parser.load_jpug(file, workers=2), jpug)
+
+@pytest.mark.parametrize('encoder_class', [L_Encoder, RGB_Encoder])
+def test_ragged_round_trip(tmp_path, image, encoder_class):
+    jpug = encode(encoder_class, image, max_mse=4.0)
+    assert isinstance(jpug.get_planes()[0], Ragged_Plane)
+
+    file = str(tmp_path / 'image.jpug')
+    Parser.save_jpug(jpug, file)
+
+    assert_same_planes(Parser.load_jpug(file), jpug)
+
+@pytest.mark.parametrize('encoder_class', ENCODER_CLASSES)
+@pytest.mark.parametrize('float_dtype', [np.int8, np.int16])
+def test_fixed_round_trip(tmp_path, image, encoder_class, float_dtype):
+    jpug = encode(encoder_class, image, float_dtype=float_dtype)
+    assert isinstance(jpug.get_planes()[0], Fixed_Plane)
+
+    file = str(tmp_path / 'image.jpug')
+    Parser.save_jpug(jpug, file)
+
+    assert_same_planes(Parser.load_jpug(file), jpug)
+    assert_same_planes(Parser.load_jpug(file, mmap=False), jpug)
+
+@pytest.mark.parametrize('coder', [None, Entropy_Coder(), Chunk_Coder('zlib', chunk_rows=2)])
+def test_rows_round_trip(tmp_path, image, coder):
+    jpug = encode(RGB_Encoder, image)
+
+    file = str(tmp_path / 'image.jpug')
+    if isinstance(coder, Entropy_Coder):
+        Parser.save_jpug(jpug, file, entropy_coder=coder)
+    else:
+        Parser.save_jpug(jpug, file, chunk_coder=coder)
+
+    full = Parser.load_jpug(file)
+    part = Parser.load_jpug(file, rows=(3, 9))
+
+    for part_plane, plane in zip(part.get_planes(), full.get_planes()):
+        assert np.array_equal(part_plane, plane[3:9])
+
+def test_set_component_loaded(tmp_path, image):
+    jpug = encode(RGB_Encoder, image)
+
+    file = str(tmp_path / 'image.jpug')
+    Parser.save_jpug(jpug, file)
+    loaded = Parser.load_jpug(file)
+
+    # The memory map of the file is copied on the first write, the file is left unchanged
+    R = np.zeros_like(loaded.get_R())
+    loaded.set_R(R)
+
+    assert np.array_equal(loaded.get_R(), R) and np.array_equal(loaded.get_G(), jpug.get_G())
+    assert_same_planes(Parser.load_jpug(file), jpug)
+
+@pytest.mark.parametrize('umask', [0o022, 0o077])
+def test_open_atomic_permissions(tmp_path, umask):
+    file = tmp_path / 'image.jpug'
+    file.write_bytes(b'previous')
+
+    previous_umask = os.umask(umask)
+    try:
+        with Parser.open_atomic(str(file), 'w+b') as f:
+            f.write(b'content')
+    finally:
+        os.umask(previous_umask)
+
+    # The file has the permissions of a file created by open, with the umask applied
+    assert file.read_bytes() == b'content'
+    assert stat.S_IMODE(file.stat().st_mode) == 0o666 & ~umask
+
+    # On errors the previous content is kept and the temporary file is removed
+    with pytest.raises(RuntimeError):
+        with Parser.open_atomic(str(file)) as f:
+            f.write(b'partial')
+            raise RuntimeError()
+
+    assert file.read_bytes() == b'content'
+    assert os.listdir(tmp_path) == ['image.jpug']
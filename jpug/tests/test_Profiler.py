@@ -0,0 +1,96 @@
+import json
+import threading
+
+import numpy as np
+import pytest
+
+from model.Profiler import Profiler
+from model.encoder.Encoder import Encoder
+
+@pytest.fixture
+def profiler() -> Profiler:
+    '''
+    The profiler of the encoders, enabled without the memory profiling and disabled and emptied after the test.
+    '''
+
+    profiler = Profiler.get_instance()
+    profiler.reset()
+    profiler.enable(memory=False)
+    yield profiler
+    profiler.disable()
+    profiler.reset()
+
+def test_disabled_records_nothing():
+    profiler = Profiler()
+
+    # The disabled profiler gives the same no-op context to all the stages
+    assert profiler.stage('dct', 100) is profiler.stage('idct')
+    with profiler.stage('dct', 100):
+        pass
+
+    assert profiler.get_events() == [] and profiler.get_summary() == {}
+
+def test_stage_records():
+    profiler = Profiler()
+    profiler.enable()
+
+    try:
+        with profiler.stage('decode', 300):
+            with profiler.stage('read', 100):
+                buffer = np.ones(2 ** 20, dtype=np.uint8)
+            del buffer
+            with profiler.stage('read', 200):
+                pass
+    finally:
+        profiler.disable()
+
+    events = profiler.get_events()
+    assert [(event['name'], event['depth'], event['bytes']) for event in events] == [('read', 1, 100), ('read', 1, 200), ('decode', 0, 300)]
+
+    # The peak of a stage includes the peaks of the stages nested in it
+    assert events[0]['peak'] >= 2 ** 20 and events[1]['peak'] < 2 ** 20 and events[2]['peak'] >= 2 ** 20
+    assert events[2]['start'] <= events[0]['start'] and events[2]['duration'] >= events[0]['duration'] + events[1]['duration']
+
+    summary = profiler.get_summary()
+    assert list(summary) == ['read', 'decode']
+    assert (summary['read']['count'], summary['read']['bytes'], summary['read']['peak']) == (2, 300, events[0]['peak'])
+
+def test_export_chrome_trace(tmp_path):
+    profiler = Profiler()
+    profiler.enable(memory=False)
+
+    # The threads wait for each other in the stage, so that their ids are not reused
+    barrier = threading.Barrier(4, timeout=10)
+
+    def work() -> None:
+        with profiler.stage('idct', 64):
+            barrier.wait()
+
+    threads = [threading.Thread(target=work) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    work()
+    for thread in threads:
+        thread.join()
+    profiler.disable()
+
+    file = str(tmp_path / 'trace.json')
+    profiler.export(file)
+    with open(file) as f:
+        trace = json.load(f)
+
+    # A complete event for each stage, with a thread id for each thread, and the summary of the stages
+    events = trace['traceEvents']
+    assert len(events) == 4 and all(event['ph'] == 'X' and event['name'] == 'idct' for event in events)
+    assert sorted(event['tid'] for event in events) == [0, 1, 2, 3]
+    assert all(event['args'] == {'bytes': 64, 'peak': None} for event in events)
+    assert trace['stages']['idct']['count'] == 4 and trace['stages']['idct']['bytes'] == 256
+
+def test_encoder_stages(profiler):
+    image = np.random.default_rng(0).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    encoder = Encoder(8, 6)
+    encoder.decode(encoder.encode(image))
+
+    summary = profiler.get_summary()
+    assert {'dct', 'compress', 'decompress', 'idct'} <= set(summary)
+    assert summary['dct']['bytes'] > 0 and summary['idct']['bytes'] > 0
@@ -2,7 +2,6 @@ import controller.Util as Util
 from controller.Controller import Controller
 
 from PIL import Image
-import matplotlib.pyplot as plt
 import numpy as np
 
 class UI:
@@ -29,6 +28,9 @@ class UI:
             if width * height <= self._image_size_threshold:
                 result.show(title=path if path is not None else 'Image')
             else:
+                # matplotlib is slow to import, so it is imported by the first large image shown
+                import matplotlib.pyplot as plt
+
                 fig, ax = plt.subplots(figsize=(10, 5)) 
 
                 image_array = np.array(result)
@@ -76,6 +78,10 @@ class UI:
                 path = input('< Enter path: ')
                 params.append(path)
 
+                # The large jpug files are previewed at a reduced resolution, decoded straight from the coefficients
+                if operation == Util.Operation.SHOW:
+                    params.append(self._image_size_threshold)
+
             elif operation == Util.Operation.CHANGE_PARAMS:
                 try:
                     F = int(input('< Enter F: '))